@@ -0,0 +1,198 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+
+from . import common
+from . import log
+
+
+def scale_rate_limit(rate_limit, factor):
+    """
+    Scale the max. number of requests of a rate limit, e.g. '100r/m' scaled by 0.5 is '50r/m'.
+
+    :param rate_limit: the rate limit, e.g. '100r/m', or a list of rate limits
+    :param factor: the factor between 0 and 1
+    :return: the scaled rate limit. at least 1 request per window
+    """
+    if factor >= 1:
+        return rate_limit
+    scaled = []
+    for rl in common.to_rate_limit_list(rate_limit):
+        try:
+            value, unit = str(rl).split('r/')
+            scaled.append('{0}r/{1}'.format(max(1, int(float(value) * factor)), unit))
+        except ValueError:
+            scaled.append(rl)
+    if isinstance(rate_limit, (list, tuple)):
+        return scaled
+    return scaled[0]
+
+
+def scale_concurrency_limit(max_concurrency, factor):
+    """
+    Scale the max. number of in-flight requests.
+
+    :param max_concurrency: the max. number of in-flight requests
+    :param factor: the factor between 0 and 1
+    :return: the scaled number of in-flight requests. at least 1
+    """
+    if factor >= 1:
+        return max_concurrency
+    return max(1, int(max_concurrency * factor))
+
+
+class LocalLimitFactors(object):
+    """
+    In-process factors of adaptive limits adjusted via additive-increase/multiplicative-decrease (AIMD).
+
+    The factor is decreased at most once per interval, so that the overload reported by multiple
+    sources within an interval is not compounded, and increased only if it wasn't adjusted within the interval.
+    A recovered factor is dropped once the interval passed.
+    """
+
+    def __init__(self):
+        self.__factors = {}
+
+    def __len__(self):
+        """Number of tracked factors."""
+        return len(self.__factors)
+
+    def adjust(self, key, overloaded, increase, decrease, min_factor, interval_seconds, now=None):
+        """
+        Adjust the factor of the key.
+
+        :param key: the key of the factor
+        :param overloaded: True to decrease, False to increase or None to only read the factor
+        :param increase: the additive increase
+        :param decrease: the multiplicative decrease
+        :param min_factor: the lower bound of the factor
+        :param interval_seconds: the min. time between two adjustments
+        :param now: the current timestamp. defaults to time.time()
+        :return: the adjusted factor between min_factor and 1
+        """
+        now = time.time() if now is None else now
+        factor, adjusted_at, decreased_at = self.__factors.get(key, (1.0, None, None))
+        if overloaded is None:
+            return factor
+
+        if overloaded:
+            if decreased_at is None or now - decreased_at >= interval_seconds:
+                factor = max(min_factor, factor * decrease)
+                adjusted_at = decreased_at = now
+        elif factor < 1.0 and (adjusted_at is None or now - adjusted_at >= interval_seconds):
+            factor = min(1.0, factor + increase)
+            adjusted_at = now
+
+        # The timestamps are kept until the interval passed, so that the guards above still apply.
+        if factor >= 1.0 and (adjusted_at is None or now - adjusted_at >= interval_seconds):
+            self.__factors.pop(key, None)
+        else:
+            self.__factors[key] = (factor, adjusted_at, decreased_at)
+        return factor
+
+
+class AdaptiveLimiter(object):
+    """
+    Tightens and relaxes the global limits depending on the latency and error rate of the wrapped app.
+
+    Responses are observed per interval. If the average latency or the rate of errors exceeds the threshold,
+    the factor applied to the global limits is decreased multiplicatively. Otherwise it's increased additively
+    until the configured limits apply again. The factor is shared via the backend, so that all replicas converge.
+    """
+
+    def __init__(self, backend, key, latency_threshold_seconds=1.0, error_rate_threshold=0.1, interval_seconds=10,
+                 increase=0.05, decrease=0.5, min_factor=0.1, min_samples=10, logger=log.Logger(__name__)):
+        """
+        Create a new AdaptiveLimiter.
+
+        :param backend: the backend sharing the factor
+        :param key: the key of the factor in the backend
+        :param latency_threshold_seconds: the max. average latency of the app
+        :param error_rate_threshold: the max. ratio of failed requests
+        :param interval_seconds: the interval in which the factor is adjusted
+        :param increase: the additive increase of the factor per interval
+        :param decrease: the multiplier of the factor per interval if overloaded, e.g. 0.5 to halve it
+        :param min_factor: the lower bound of the factor
+        :param min_samples: the min. number of responses per interval before the factor is adjusted
+        :param logger: the logger
+        """
+        self.__backend = backend
+        # The key may change once the service type was discovered.
+        self.key = key
+        self.__latency_threshold_seconds = float(latency_threshold_seconds)
+        self.__error_rate_threshold = float(error_rate_threshold)
+        self.__interval_seconds = max(1, interval_seconds)
+        self.__increase = float(increase)
+        self.__decrease = float(decrease)
+        self.__min_factor = float(min_factor)
+        self.__min_samples = max(1, min_samples)
+        self.logger = logger
+        self.factor = 1.0
+        self.__reset(time.time())
+
+    def __reset(self, now):
+        self.__interval_start = now
+        self.__count = 0
+        self.__errors = 0
+        self.__latency_sum = 0.0
+
+    def observe(self, latency_seconds, is_error, now=None):
+        """
+        Record a response of the app and adjust the factor once the interval passed.
+
+        :param latency_seconds: the time the app took to respond
+        :param is_error: whether the app failed
+        :param now: the current timestamp. defaults to time.time()
+        """
+        now = time.time() if now is None else now
+        self.__count += 1
+        self.__latency_sum += latency_seconds
+        if is_error:
+            self.__errors += 1
+        if now - self.__interval_start >= self.__interval_seconds:
+            self.__adjust(now)
+
+    def __adjust(self, now):
+        # Too few responses to judge the health of the app. Only pick up the factor of the other replicas.
+        overloaded = None
+        if self.__count >= self.__min_samples:
+            latency_seconds = self.__latency_sum / self.__count
+            error_rate = float(self.__errors) / self.__count
+            overloaded = latency_seconds > self.__latency_threshold_seconds or error_rate > self.__error_rate_threshold
+            if overloaded:
+                self.logger.debug(
+                    "app overloaded: average latency {0:.3f}s, error rate {1:.2f}",
+                    latency_seconds, error_rate
+                )
+        self.__reset(now)
+
+        try:
+            factor = self.__backend.adjust_limit_factor(
+                self.key, overloaded, self.__increase, self.__decrease, self.__min_factor, self.__interval_seconds
+            )
+        except Exception as e:
+            self.logger.debug("failed to adjust the factor of the adaptive limits: {0}", e)
+            return
+        if factor != self.factor:
+            self.logger.info("adaptive limits scaled by {0:.2f}", factor)
+        self.factor = factor
+
+    def scale_rate_limit(self, rate_limit):
+        """Scale the global rate limit by the current factor."""
+        return scale_rate_limit(rate_limit, self.factor)
+
+    def scale_concurrency_limit(self, max_concurrency):
+        """Scale the global concurrency limit by the current factor."""
+        return scale_concurrency_limit(max_concurrency, self.factor)
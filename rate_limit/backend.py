@@ -12,15 +12,31 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
 import eventlet
 import hashlib
+import itertools
+import math
+import os
 import pyredis
+import random
+import socket
 import time
 
-from distutils.version import StrictVersion
+from eventlet import pools
 
+from . import adaptive
+from . import bandwidth
+from . import batch
+from . import circuit
 from . import common
+from . import concurrency
+from . import errors
+from . import fallback
 from . import log
+from . import peer
+from . import pool
+from . import shm
 from .units import Units
 from . import utils
 
@@ -31,10 +47,42 @@ class Backend(object):
     def __init__(self, host, port, rate_limit_response, logger=log.Logger(__name__), **kwargs):
         self.__host = host
         self.__port = port
-        self.__rate_limit_response = rate_limit_response
+        self._rate_limit_response = rate_limit_response
+        self._max_sleep_time_seconds = kwargs.get('max_sleep_time_seconds', 20)
+        self._log_sleep_time_seconds = kwargs.get('log_sleep_time_seconds', 10)
+        # Logs of suspended requests are sampled per key.
+        self.__log_sampler = log.LogSampler(interval_seconds=kwargs.get('log_sample_interval_seconds', 60))
+        # Compact keys save memory in the backend.
+        self._key_func = common.compact_key_func if kwargs.get('compact_encoding', False) else common.key_func
         self.logger = logger
+        self.__health_check = None
+        # Result of the last health check. None until the first check completed.
+        self.__is_healthy = None
+        # Token buckets and slots of in-flight requests of backends that don't share them across processes.
+        self.__token_buckets = bandwidth.LocalTokenBucket()
+        self.__slots = concurrency.LocalSlots()
+        self.__limit_factors = adaptive.LocalLimitFactors()
 
-    def rate_limit(self, scope, action, target_type_uri, max_rate_string):
+    def set_rate_limit_response(self, rate_limit_response):
+        """
+        Replace the response returned if a request exceeds the rate limit, e.g. after the configuration was reloaded.
+
+        :param rate_limit_response: the RateLimitResponse
+        """
+        self._rate_limit_response = rate_limit_response
+
+    def key(self, scope, action, target_type_uri):
+        """
+        Create the key of the scope, action and target type URI in the encoding of the backend.
+
+        :param scope: the scope or None for the global scope
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :return: the key
+        """
+        return self._key_func(scope=scope, action=action, target_type_uri=target_type_uri)
+
+    def rate_limit(self, scope, action, target_type_uri, max_rate_string, cost=1):
         """
         Handle the rate limit for the given scope, action, target_type_uri and max_rate_string.
         If scope is not given (scope=None) the global (non-project specific) rate limit is checked.
@@ -43,10 +91,73 @@ class Backend(object):
         :param action: the CADF action
         :param target_type_uri: the CADF target type URI
         :param max_rate_string: the max. rate limit per sliding window
+        :param cost: the number of units the request consumes
+        :return: the configured RateLimitResponse or None
+        """
+        return self.rate_limit_levels([(None, scope, max_rate_string)], action, target_type_uri, cost=cost)
+
+    def rate_limit_levels(self, levels, action, target_type_uri, cost=1):
+        """
+        Handle the rate limits of multiple scope levels, e.g. domain, project and user, for the given action
+        and target_type_uri. The request is only admitted if it fits the rate limits of all levels.
+
+        :param levels: list of tuples (scope level, scope, max. rate limit per sliding window)
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :param cost: the number of units the request consumes
         :return: the configured RateLimitResponse or None
         """
         return None
 
+    def reserve_tokens(self, key, amount, rate, burst):
+        """
+        Reserve tokens of the token bucket of the key, e.g. bytes of the bandwidth of an account.
+        Token buckets are kept per process unless the backend shares them.
+
+        :param key: the key of the token bucket
+        :param amount: the number of tokens
+        :param rate: the number of tokens added per second
+        :param burst: the capacity of the token bucket
+        :return: the time in seconds until the tokens are available
+        """
+        return self.__token_buckets.reserve(key, amount, rate, burst)
+
+    def acquire_slot(self, key, max_concurrency, lease_seconds):
+        """
+        Acquire a slot of the in-flight requests of the key.
+        Slots are kept per process unless the backend shares them.
+
+        :param key: the key of the slots
+        :param max_concurrency: the max. number of in-flight requests
+        :param lease_seconds: the time after which the slot is freed if it was not released
+        :return: the id of the slot or None if all slots are taken
+        """
+        return self.__slots.acquire(key, max_concurrency, lease_seconds)
+
+    def release_slot(self, key, slot_id):
+        """
+        Release a slot of the in-flight requests of the key.
+
+        :param key: the key of the slots
+        :param slot_id: the id of the slot as returned by acquire_slot
+        """
+        self.__slots.release(key, slot_id)
+
+    def adjust_limit_factor(self, key, overloaded, increase, decrease, min_factor, interval_seconds):
+        """
+        Adjust the factor of adaptive limits via additive-increase/multiplicative-decrease.
+        Factors are kept per process unless the backend shares them.
+
+        :param key: the key of the factor
+        :param overloaded: True to decrease, False to increase or None to only read the factor
+        :param increase: the additive increase
+        :param decrease: the multiplicative decrease
+        :param min_factor: the lower bound of the factor
+        :param interval_seconds: the min. time between two adjustments
+        :return: the adjusted factor between min_factor and 1
+        """
+        return self.__limit_factors.adjust(key, overloaded, increase, decrease, min_factor, interval_seconds)
+
     def is_available(self):
         """
         Check whether the backend is available and the version supported.
@@ -55,6 +166,170 @@ class Backend(object):
         """
         return True, ""
 
+    @property
+    def is_healthy(self):
+        """Result of the last health check. None until the first check completed."""
+        return self.__is_healthy
+
+    def start_health_check(self, interval_seconds=30):
+        """
+        Periodically check whether the backend is available in a background greenthread.
+        Returns immediately, so the worker doesn't block on a slow backend at startup.
+
+        :param interval_seconds: the time between two checks
+        """
+        if self.__health_check is None:
+            self.__health_check = eventlet.spawn(self.__health_check_loop, interval_seconds)
+
+    def stop_health_check(self):
+        """Stop the periodic health check."""
+        if self.__health_check is not None:
+            self.__health_check.kill()
+            self.__health_check = None
+
+    def check_health(self):
+        """
+        Check whether the backend is available and record the result.
+
+        :return: bool whether it's available, string describing the error (if any)
+        """
+        try:
+            is_available, msg = self.is_available()
+        except Exception as e:
+            is_available, msg = False, str(e)
+
+        if is_available != self.__is_healthy:
+            if is_available:
+                self.logger.info("the backend is available")
+            else:
+                self.logger.warning("rate limit not possible. the backend is not available: {0}", msg)
+        self.__is_healthy = is_available
+        self._on_health_check(is_available)
+        return is_available, msg
+
+    def _on_health_check(self, is_available):
+        """
+        Invoked with the result of every health check.
+
+        :param is_available: bool whether the backend is available
+        """
+        pass
+
+    def __health_check_loop(self, interval_seconds):
+        while True:
+            self.check_health()
+            eventlet.sleep(interval_seconds)
+
+    def _build_checks(self, levels, action, target_type_uri):
+        """
+        Build the checks of a request. Multiple rate limits, e.g. ['10r/s', '1000r/h'], are counted in a key per window.
+
+        :param levels: list of tuples (scope level, scope, max. rate limit per sliding window or a list of those)
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :return: list of tuples (key, max. calls, window in seconds, max. rate string, scope level)
+        """
+        checks = []
+        for scope_level, scope, max_rate_string in levels:
+            checks.extend(
+                self.__build_level_checks(scope_level, scope, action, target_type_uri, max_rate_string)
+            )
+        return checks
+
+    def __build_level_checks(self, scope_level, scope, action, target_type_uri, max_rate_string):
+        key = self._key_func(scope=scope, action=action, target_type_uri=target_type_uri)
+        max_rate_strings = common.to_rate_limit_list(max_rate_string)
+        checks = []
+        for rate_string in max_rate_strings:
+            max_calls, window_seconds = Units.parse_sliding_window_rate_limit(rate_string)
+            window_key = key if len(max_rate_strings) == 1 else '{0}_{1:g}'.format(key, window_seconds)
+            checks.append((window_key, max_calls, window_seconds, rate_string, scope_level))
+        return checks
+
+    def _check_sequentially(self, checks, check_func):
+        """
+        Evaluate the checks one after another for backends that cannot evaluate multiple windows atomically.
+        Multiple windows are peeked at first and only counted if all of them admit the request,
+        so that a request rejected by one window doesn't use up the others, e.g. of sibling scopes.
+
+        :param checks: list of checks as returned by _build_checks
+        :param check_func: callable(key, window_seconds, max_calls, count) returning tuple of remaining,
+            retry after seconds. Only counts the request if count is True.
+        :return: tuple of the tightest check, remaining requests and retry after in seconds
+        """
+        if len(checks) > 1:
+            results = self.__evaluate_checks(checks, check_func, False)
+            if self.__is_rejected(*results[-1][1:]):
+                return common.tightest_result(results)
+        return common.tightest_result(self.__evaluate_checks(checks, check_func, True))
+
+    def __evaluate_checks(self, checks, check_func, count):
+        # Stops at the first window rejecting the request.
+        results = []
+        for check in checks:
+            key, max_calls, window_seconds = check[:3]
+            remaining, retry_after_seconds = check_func(key, window_seconds, max_calls, count)
+            results.append((check, remaining, retry_after_seconds))
+            if self.__is_rejected(remaining, retry_after_seconds):
+                break
+        return results
+
+    def __is_rejected(self, remaining, retry_after_seconds):
+        return remaining <= 0 and retry_after_seconds >= self._max_sleep_time_seconds
+
+    def _handle_check_result(self, check, remaining, retry_after_seconds):
+        """
+        Admit, suspend or reject the request based on the result of the tightest check.
+
+        :param check: the tightest check as returned by _build_checks
+        :param remaining: the number of remaining requests
+        :param retry_after_seconds: the time the request has to wait to fit the rate limit
+        :return: the configured RateLimitResponse or None
+        """
+        key, _, _, max_rate_string, scope_level = check
+        return self._handle_rate_limit_result(
+            key, remaining, retry_after_seconds, max_rate_string, scope_level=scope_level
+        )
+
+    def _handle_rate_limit_result(self, key, remaining, retry_after_seconds, max_rate_string, scope_level=None):
+        """
+        Admit, suspend or reject the request based on the result of the rate limit check.
+
+        :param key: the key of the request
+        :param remaining: the number of remaining requests
+        :param retry_after_seconds: the time the request has to wait to fit the rate limit
+        :param max_rate_string: the max. rate limit per sliding window
+        :param scope_level: the scope level of the rate limit or None
+        :return: the configured RateLimitResponse or None
+        """
+        # Return here if we still have remaining requests.
+        if remaining > 0:
+            return None
+
+        # Suspend the current request if its it has to wait no longer than max_sleep_time_seconds.
+        elif retry_after_seconds < self._max_sleep_time_seconds:
+            # Log the current request if it has to be suspended for at least log_sleep_time_seconds.
+            # Sampled per key, so that a key suspending many requests doesn't flood the logs.
+            if retry_after_seconds >= self._log_sleep_time_seconds and self.logger.is_debug_enabled:
+                suppressed = self.__log_sampler.sample(key)
+                if suppressed is not None:
+                    self.logger.debug(
+                        "suspending request '{0}' for '{1}' seconds to fit rate limit '{2}' ({3} similar logs suppressed)",
+                        key, retry_after_seconds, max_rate_string, suppressed
+                    )
+            eventlet.sleep(retry_after_seconds)
+            return None
+
+        # If rate limit exceeded and the request cannot be suspended return the rate limit response.
+        # Set headers for rate limit response.
+        self._rate_limit_response.set_headers(
+            ratelimit=max_rate_string,
+            remaining=remaining,
+            retry_after=retry_after_seconds,
+            scope_level=scope_level
+        )
+        return self._rate_limit_response
+
 
 class RedisBackend(Backend):
     """Stable Redis backend for storing rate limits."""
@@ -68,172 +343,895 @@ class RedisBackend(Backend):
             max_sleep_time_seconds=max_sleep_time_seconds,
             log_sleep_time_seconds=log_sleep_time_seconds,
             logger=logger,
+            compact_encoding=kwargs.get('compact_encoding', False),
+            log_sample_interval_seconds=kwargs.get('log_sample_interval_seconds', 60),
             kwargs=kwargs
         )
         self.__host = host
         self.__port = port
         self.__max_sleep_time_seconds = max_sleep_time_seconds
-        self.__log_sleep_time_seconds = log_sleep_time_seconds
-        self.__rate_limit_response = rate_limit_response
         self.__timeout = kwargs.get('timeout_seconds', 20)
         self.__max_connections = kwargs.get('max_connections', 100)
         # Default to nanosecond accuracy.
         self.__clock_accuracy = int(kwargs.get('clock_accuracy', 1e6))
+        # Optionally use the clock of the redis server instead of the local one.
+        self.__server_time_enabled = kwargs.get('server_time_enabled', False)
+        self.__member_counter = itertools.count()
+        self.__member_pid = None
+        self.__member_prefix = None
+        self.__compact_members = kwargs.get('compact_encoding', False)
+        self.__metrics_client = kwargs.get('metrics_client', None)
 
-        self.__redis = pyredis.Pool(
-            host=host,
-            port=port,
+        # Fail fast if the backend is stalled or failing.
+        # No check waits longer than the latency budget and the circuit opens on consecutive failures or slow calls.
+        self.__circuit_breaker = None
+        self.__latency_budget_seconds = None
+        if kwargs.get('circuit_breaker_enabled', False):
+            latency_budget_seconds = self.__latency_budget_seconds = kwargs.get('latency_budget_seconds', 0.1)
+            self.__timeout = min(self.__timeout, latency_budget_seconds)
+            self.__circuit_breaker = circuit.CircuitBreaker(
+                failure_threshold=kwargs.get('circuit_failure_threshold', 5),
+                slow_call_threshold=kwargs.get('circuit_slow_call_threshold', 10),
+                slow_call_seconds=kwargs.get('slow_call_seconds', latency_budget_seconds / 2.0),
+                open_seconds=kwargs.get('circuit_open_seconds', 10),
+                on_state_change=self.__on_circuit_state_change,
+                logger=logger,
+            )
+
+        # Hosts prefixed with unix:// refer to a unix domain socket, e.g. of a local redis proxy.
+        redis_host, redis_port, unix_sock = pool.parse_address(host, port)
+        self.__redis = pool.ConnectionPool(
+            host=redis_host,
+            port=redis_port,
+            unix_sock=unix_sock,
             conn_timeout=self.__timeout,
             read_timeout=self.__timeout,
             pool_size=self.__max_connections,
             encoding='utf-8',
+            tcp_nodelay=kwargs.get('tcp_nodelay', True),
+            tcp_keepalive=kwargs.get('tcp_keepalive', True),
+            tcp_keepalive_idle_seconds=kwargs.get('tcp_keepalive_idle_seconds', 60),
+            warm_up_connections=kwargs.get('pool_warm_up_connections', 0),
+            metrics_client=self.__metrics_client,
+            logger=logger,
         )
+        if kwargs.get('pool_warm_up_connections', 0):
+            eventlet.spawn_n(self.__redis.warm_up)
         script_name = "redis_sliding_window.lua"
+        if self.__server_time_enabled:
+            script_name = "redis_sliding_window_server_time.lua"
         script = common.load_lua_script(script_name)
         if not script:
             self.logger.error(
-                "error loading rate limit script: '{0}'".format(script_name)
+                "error loading rate limit script: '{0}'", script_name
             )
             return
         self.__rate_limit_script = script
         self.__rate_limit_script_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
 
+        # Evaluates multiple windows, e.g. 10r/s and 1000r/h, atomically.
+        script_name = "redis_sliding_window_multi.lua"
+        script = common.load_lua_script(script_name)
+        if not script:
+            self.logger.error(
+                "error loading rate limit script: '{0}'", script_name
+            )
+            return
+        self.__multi_window_script = script
+        self.__multi_window_script_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+        # Token buckets used to shape the bandwidth.
+        script_name = "redis_token_bucket.lua"
+        script = common.load_lua_script(script_name)
+        if not script:
+            self.logger.error(
+                "error loading rate limit script: '{0}'", script_name
+            )
+            return
+        self.__token_bucket_script = script
+        self.__token_bucket_script_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+        # Slots of in-flight requests.
+        script_name = "redis_concurrency.lua"
+        script = common.load_lua_script(script_name)
+        if not script:
+            self.logger.error(
+                "error loading rate limit script: '{0}'", script_name
+            )
+            return
+        self.__concurrency_script = script
+        self.__concurrency_script_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+        # Factors of adaptive limits shared by all replicas.
+        script_name = "redis_adaptive_limit.lua"
+        script = common.load_lua_script(script_name)
+        if not script:
+            self.logger.error(
+                "error loading rate limit script: '{0}'", script_name
+            )
+            return
+        self.__adaptive_limit_script = script
+        self.__adaptive_limit_script_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+
+        # Optionally pipeline rate limit checks issued concurrently by multiple greenthreads.
+        self.__batcher = None
+        if kwargs.get('batch_enabled', False):
+            self.__batcher = batch.CommandBatcher(
+                pool=self.__redis,
+                window_seconds=kwargs.get('batch_window_seconds', 0.0002),
+                max_size=kwargs.get('batch_max_size', 50),
+                logger=logger,
+            )
+
+        # Optionally limit requests in-process while redis is unavailable.
+        # Each limit is divided by the configured or discovered number of processes across all replicas.
+        self.__fallback = None
+        self.__recovered_at = 0
+        self.__recovery_seconds = kwargs.get('fallback_recovery_seconds', 30)
+        self.__replica_count = kwargs.get('fallback_replica_count', 0)
+        self.__replica_discovered_at = 0
+        self.__replica_discovery_interval_seconds = kwargs.get('fallback_replica_discovery_interval_seconds', 30)
+        self.__replica_id = '{0}:{1}:{2}'.format(socket.gethostname(), os.getpid(), id(self))
+        # Replicas of different services sharing a redis count separately.
+        self.replica_registry_key = kwargs.get('replica_registry_key', common.Constants.replica_registry_key)
+        if kwargs.get('fallback_enabled', False):
+            self.__fallback = fallback.LocalRateLimiter(
+                max_keys=kwargs.get('fallback_max_keys', 10000),
+                replica_count=self.__replica_count or 1,
+            )
+
     def is_available(self):
-        """Check whether the redis is available and supported."""
-        if not self.__is_redis_available():
-            return False, "rate limit failed. redis not available. host='{0}', port='{1}'".format(self.__host, str(self.__port))
-        if not self.__is_redis_version_supported():
-            return False, "redis version not supported. need at least redis 3.0.0"
+        """
+        Check whether redis is available and the version supported.
+        Only fetches the server section of INFO.
+
+        :return: bool whether it's available, string describing the error (if any)
+        """
+        try:
+            info_result = self.__redis.execute('INFO', 'server')
+        except pyredis.PyRedisError as e:
+            return False, "redis not available. host='{0}', port='{1}': {2}".format(self.__host, str(self.__port), str(e))
+
+        version = utils.parse_info(info_result).get('redis_version', None)
+        if not version or utils.parse_version(version) < (5, 0, 0):
+            return False, "redis version '{0}' not supported. need at least redis 5.0.0".format(version)
         return True, ""
 
-    def __is_redis_available(self):
+    def _on_health_check(self, is_available):
+        """Share the result of the health check with the circuit breaker."""
+        if self.__circuit_breaker:
+            self.__circuit_breaker.record_health_check(is_available)
+
+    def rate_limit_levels(self, levels, action, target_type_uri, cost=1):
         """
-        Test whether redis backend is available.
+        Handle the rate limits of multiple scope levels, e.g. domain, project and user, for the given action
+        and target_type_uri. The request is only admitted if it fits the rate limits of all levels.
 
-        :return: bool
+        :param levels: list of tuples (scope level, scope, max. rate limit per sliding window)
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :param cost: the number of units the request consumes
+        :return: the configured RateLimitResponse or None
         """
         try:
-            # Invoke get to test redis connection.
-            # Will return None or one of the following exceptions.
-            self.__redis.execute('GET', '')
-        except pyredis.PyRedisError:
-            return False
-        return True
+            checks = self._build_checks(levels, action, target_type_uri)
+            if self.logger.is_debug_enabled:
+                self.logger.debug(
+                    "checking rate limit for request '{0} {1}' in scopes {2}",
+                    action, target_type_uri, [scope for _, scope, _ in levels]
+                )
+            return self.__rate_limit(checks, cost)
+        except Exception as e:
+            self.logger.debug("failed to rate limit: {0}", e)
 
-    def __is_redis_version_supported(self):
+    def reserve_tokens(self, key, amount, rate, burst):
         """
-        Check whether the redis version is supported by this middleware.
-        We require at least redis version 5.0.0 .
+        Reserve tokens of the token bucket of the key, e.g. bytes of the bandwidth of an account.
+        Falls back to a token bucket per process while redis is unavailable.
 
-        :return: bool
+        :param key: the key of the token bucket
+        :param amount: the number of tokens
+        :param rate: the number of tokens added per second
+        :param burst: the capacity of the token bucket
+        :return: the time in seconds until the tokens are available
         """
-        info_result = self.__redis.execute('INFO')
-        version = utils.parse_info(info_result).get('redis_version', None)
-        if not version:
-            return False
-        return bool(StrictVersion(version) >= StrictVersion('5.0.0'))
+        # Empty timestamp: The script uses the clock of the redis server.
+        now = '' if self.__server_time_enabled else int(time.time() * 1e6)
+        try:
+            wait_microseconds = self.__call_guarded(
+                self.__execute_script,
+                self.__token_bucket_script, self.__token_bucket_script_sha, (key, int(amount), rate, burst, now)
+            )
+        except errors.CircuitOpenError:
+            return super(RedisBackend, self).reserve_tokens(key, amount, rate, burst)
+        except Exception as e:
+            self.logger.debug("Error executing redis script: {0}", e)
+            return super(RedisBackend, self).reserve_tokens(key, amount, rate, burst)
+        return common.to_int(wait_microseconds, 0) / 1e6
 
-    def rate_limit(self, scope, action, target_type_uri, max_rate_string):
+    def acquire_slot(self, key, max_concurrency, lease_seconds):
         """
-        Handle the rate limit for the given scope, action, target_type_uri and max_rate_string.
-        If scope is not given (scope=None) the global (non-project specific) rate limit is checked.
+        Acquire a slot of the in-flight requests of the key.
+        Admits the request while redis is unavailable.
 
-        :param scope: the scope (project uuid, host ip, etc., ..) or None for global rate limits
-        :param action: the CADF action
-        :param target_type_uri: the CADF target type URI
-        :param max_rate_string: the max. rate limit per sliding window
-        :return: the configured RateLimitResponse or None
+        :param key: the key of the slots
+        :param max_concurrency: the max. number of in-flight requests
+        :param lease_seconds: the time after which the slot is freed if it was not released
+        :return: the id of the slot or None if all slots are taken
         """
+        slot_id = self.__next_member_id()
+        # Empty timestamp: The script uses the clock of the redis server.
+        now = '' if self.__server_time_enabled else int(time.time() * 1e6)
         try:
-            key = common.key_func(scope=scope, action=action, target_type_uri=target_type_uri)
-            max_rate, sliding_window_seconds = Units.parse_sliding_window_rate_limit(max_rate_string)
-            self.logger.debug(
-                "checking rate limit for request '{0} {1}' in scope {2}".format(action, target_type_uri, scope)
+            acquired = self.__call_guarded(
+                self.__execute_script,
+                self.__concurrency_script, self.__concurrency_script_sha,
+                (key, int(max_concurrency), int(lease_seconds * 1e6), slot_id, now)
             )
-            return self.__rate_limit(key, sliding_window_seconds, max_rate, max_rate_string)
+        except errors.CircuitOpenError:
+            return slot_id
         except Exception as e:
-            self.logger.debug("failed to rate limit: {0}".format(str(e)))
+            self.logger.debug("Error executing redis script: {0}", e)
+            return slot_id
+        return slot_id if common.to_int(acquired, 1) else None
+
+    def release_slot(self, key, slot_id):
+        """
+        Release a slot of the in-flight requests of the key.
+        Slots not released due to an error are freed once their lease expired.
 
-    def __check_rate_limit_script(self, script_sha):
-        script_exist = False
+        :param key: the key of the slots
+        :param slot_id: the id of the slot as returned by acquire_slot
+        """
         try:
-            script_exist = bool(self.__redis.script_exists(script_sha)[0])
-        except pyredis.PyRedisError as e:
-            self.logger.debug(
-                "Error during checking script existence: {0}".format(str(e))
+            if self.__batcher:
+                self.__call_guarded(self.__batcher.execute, 'ZREM', key, slot_id)
+            else:
+                self.__call_guarded(self.__redis.zrem, key, slot_id)
+        except errors.CircuitOpenError:
+            return
+        except Exception as e:
+            self.logger.debug("failed to release slot {0} of {1}: {2}", slot_id, key, e)
+
+    def adjust_limit_factor(self, key, overloaded, increase, decrease, min_factor, interval_seconds):
+        """
+        Adjust the factor of adaptive limits via additive-increase/multiplicative-decrease.
+        The factor is shared by all replicas. Falls back to a factor per process while redis is unavailable.
+
+        :param key: the key of the factor
+        :param overloaded: True to decrease, False to increase or None to only read the factor
+        :param increase: the additive increase
+        :param decrease: the multiplicative decrease
+        :param min_factor: the lower bound of the factor
+        :param interval_seconds: the min. time between two adjustments
+        :return: the adjusted factor between min_factor and 1
+        """
+        # Empty timestamp: The script uses the clock of the redis server.
+        now = '' if self.__server_time_enabled else int(time.time() * 1e6)
+        direction = -1 if overloaded is None else int(bool(overloaded))
+        try:
+            factor = self.__call_guarded(
+                self.__execute_script,
+                self.__adaptive_limit_script, self.__adaptive_limit_script_sha,
+                (key, direction, increase, decrease, min_factor, int(interval_seconds * 1e6), now)
+            )
+        except errors.CircuitOpenError:
+            return super(RedisBackend, self).adjust_limit_factor(
+                key, overloaded, increase, decrease, min_factor, interval_seconds
             )
-        return script_exist
+        except Exception as e:
+            self.logger.debug("Error executing redis script: {0}", e)
+            return super(RedisBackend, self).adjust_limit_factor(
+                key, overloaded, increase, decrease, min_factor, interval_seconds
+            )
+        if isinstance(factor, bytes):
+            factor = factor.decode('utf-8')
+        try:
+            return min(1.0, max(min_factor, float(factor)))
+        except (TypeError, ValueError):
+            return 1.0
 
-    def __rate_limit(self, key, window_seconds, max_calls, max_rate_string):
-        # Timestamp with given accuracy as integer.
-        now_int = int(time.time() * self.__clock_accuracy)
-        # Sliding window in seconds with given accuracy.
-        window_seconds_int = int(window_seconds * self.__clock_accuracy)
-        # Max. lookback as timestamp.
-        lookback_time_max = int(now_int - window_seconds_int)
-        # Make sure it's an int.
-        max_calls_int = int(max_calls)
+    def __on_circuit_state_change(self, state):
+        if state == circuit.CircuitBreaker.CLOSED and self.__fallback is not None:
+            self.__recovered_at = time.time()
+        if state == circuit.CircuitBreaker.OPEN:
+            self.logger.warning(
+                "circuit open. admitting requests without rate limit. redis host='{0}', port='{1}'",
+                self.__host, self.__port
+            )
+        self.__increment_metric(common.Constants.metric_backend_circuit_state_changes_total, tags=['state:{0}'.format(state)])
 
-        # Check if rate limit script exists in Redis
-        script_exist = self.__check_rate_limit_script(
-            self.__rate_limit_script_sha
-        )
+    def __increment_metric(self, metric, tags=None):
+        if not self.__metrics_client:
+            return
+        try:
+            self.__metrics_client.increment(metric, tags=tags)
+        except Exception as e:
+            self.logger.debug("failed to emit metric '{0}': {1}", metric, e)
 
-        # Execute command
-        try:
-            if script_exist:
-                result = self.__redis.evalsha(
-                    self.__rate_limit_script_sha,
-                    7,
-                    key,
-                    lookback_time_max,
-                    now_int,
-                    max_calls_int,
-                    window_seconds_int,
-                    self.__max_sleep_time_seconds,
-                    self.__clock_accuracy,
-                )
+    def __call_guarded(self, func, *args):
+        """
+        Call redis guarded by the circuit breaker.
+        The outcome of every call let through is recorded, so that the probe of a half open circuit is always released.
+        The whole call, including waiting for a connection, must complete within the latency budget.
+
+        :param func: the function calling redis
+        :param args: the arguments passed to the function
+        :return: the result of the function
+        :raises errors.CircuitOpenError: if the circuit is open
+        :raises errors.LatencyBudgetExceededError: if the call exceeded the latency budget
+        """
+        if not self.__circuit_breaker:
+            return func(*args)
+        if not self.__circuit_breaker.allow_request():
+            raise errors.CircuitOpenError("circuit open. redis host='{0}', port='{1}'".format(self.__host, str(self.__port)))
+
+        start = time.time()
+        succeeded = False
+        timeout_error = errors.LatencyBudgetExceededError(
+            "call exceeded the latency budget of {0}s".format(self.__latency_budget_seconds)
+        )
+        try:
+            with eventlet.Timeout(self.__latency_budget_seconds, timeout_error):
+                result = func(*args)
+            succeeded = True
+            return result
+        finally:
+            if succeeded:
+                self.__circuit_breaker.record_success(time.time() - start)
             else:
-                result = self.__redis.eval(
-                    self.__rate_limit_script,
-                    7,
-                    key,
-                    lookback_time_max,
-                    now_int,
-                    max_calls_int,
-                    window_seconds_int,
-                    self.__max_sleep_time_seconds,
-                    self.__clock_accuracy,
-                )
-        except pyredis.PyRedisError as e:
+                self.__circuit_breaker.record_failure()
+
+    def __execute_script(self, script, script_sha, keys, args=()):
+        """
+        Execute the script with the given keys and arguments.
+        Uses the pipeline if batching is enabled, otherwise a dedicated connection.
+
+        :param script: the script
+        :param script_sha: the sha1 of the script
+        :param keys: the keys passed to the script
+        :param args: the arguments passed to the script
+        :return: the result of the script
+        """
+        call = (len(keys),) + tuple(keys) + tuple(args)
+        try:
+            if self.__batcher:
+                return self.__batcher.execute('EVALSHA', script_sha, *call)
+            return self.__redis.evalsha(script_sha, *call)
+        except pyredis.ReplyError as e:
+            if not str(e).startswith('NOSCRIPT'):
+                raise
+        # The script is not cached yet. EVAL loads it for subsequent EVALSHA calls.
+        return self.__redis.eval(script, *call)
+
+    def __multi_window_script_call(self, checks, cost):
+        """
+        Build the call of the script evaluating multiple windows atomically.
+
+        :param checks: list of checks as returned by _build_checks
+        :param cost: the number of units the request consumes
+        :return: tuple of keys and arguments
+        """
+        if self.__server_time_enabled:
+            # Empty timestamp: The script uses the clock of the redis server with microsecond accuracy.
+            args = [
+                '', 1000000, self.__max_sleep_time_seconds, int(self.__compact_members), self.__next_member_id(), cost
+            ]
+            accuracy = 1e6
+        else:
+            now_int = int(time.time() * self.__clock_accuracy)
+            args = [now_int, self.__clock_accuracy, self.__max_sleep_time_seconds, int(self.__compact_members), '', cost]
+            accuracy = self.__clock_accuracy
+        for _, max_calls, window_seconds, _, _ in checks:
+            args.extend([int(max_calls), int(window_seconds * accuracy)])
+        return [check[0] for check in checks], args
+
+    def __rate_limit(self, checks, cost):
+        if len(checks) > 1:
+            script, script_sha = self.__multi_window_script, self.__multi_window_script_sha
+            keys, args = self.__multi_window_script_call(checks, cost)
+        else:
+            script, script_sha = self.__rate_limit_script, self.__rate_limit_script_sha
+            keys, args = self.__single_window_script_call(checks[0], cost), ()
+
+        # Hand back control from the fallback gradually after redis recovered.
+        # Checked before the circuit breaker, so that the probe of a half open circuit is not taken in vain.
+        if self.__fallback is not None and self.__is_recovering():
+            return self.__fallback_rate_limit(checks, cost)
+
+        # Execute command. The request is admitted immediately if the circuit is open.
+        try:
+            result = self.__call_guarded(self.__execute_script, script, script_sha, keys, args)
+        except errors.CircuitOpenError:
+            self.__increment_metric(common.Constants.metric_requests_backend_circuit_open_total)
+            return self.__fallback_rate_limit(checks, cost)
+        except Exception as e:
             self.logger.debug(
-                "Error executing redis script: {0}".format(str(e))
+                "Error executing redis script: {0}", e
             )
+            return self.__fallback_rate_limit(checks, cost)
+
+        if self.__fallback is not None and self.__replica_count <= 0:
+            self.__discover_replica_count()
 
         # Parse result list safely.
         remaining = common.listitem_to_int(result, idx=0)
         retry_after_seconds = common.listitem_to_int(result, idx=1)
+        # The (1-based) index of the tightest window. Only returned for multiple windows.
+        tightest = min(max(common.listitem_to_int(result, idx=2, default=1), 1), len(checks))
+        return self._handle_check_result(checks[tightest - 1], remaining, retry_after_seconds)
 
-        # Return here if we still have remaining requests.
-        if remaining > 0:
+    def __single_window_script_call(self, check, cost):
+        """
+        Build the keys passed to the script evaluating a single window.
+
+        :param check: the check as returned by _build_checks
+        :param cost: the number of units the request consumes
+        :return: the keys
+        """
+        key, max_calls, window_seconds = check[:3]
+        # Make sure it's an int.
+        max_calls_int = int(max_calls)
+        if self.__server_time_enabled:
+            # The script uses the clock of the redis server with microsecond accuracy.
+            keys = (
+                key,
+                max_calls_int,
+                int(window_seconds * 1e6),
+                self.__max_sleep_time_seconds,
+                self.__next_member_id(),
+                int(self.__compact_members),
+                cost,
+            )
+        else:
+            # Timestamp with given accuracy as integer.
+            now_int = int(time.time() * self.__clock_accuracy)
+            # Sliding window in seconds with given accuracy.
+            window_seconds_int = int(window_seconds * self.__clock_accuracy)
+            # Max. lookback as timestamp.
+            lookback_time_max = int(now_int - window_seconds_int)
+            keys = (
+                key,
+                lookback_time_max,
+                now_int,
+                max_calls_int,
+                window_seconds_int,
+                self.__max_sleep_time_seconds,
+                self.__clock_accuracy,
+                int(self.__compact_members),
+                cost,
+            )
+        return keys
+
+    def __next_member_id(self):
+        """
+        Get an identifier unique across all processes of all replicas.
+        Distinguishes requests counted within the same microsecond.
+
+        :return: the identifier
+        """
+        pid = os.getpid()
+        if pid != self.__member_pid:
+            # Regenerate after a fork.
+            self.__member_pid = pid
+            if self.__compact_members:
+                self.__member_prefix = common.base62_encode((pid << 32) | random.getrandbits(32))
+            else:
+                self.__member_prefix = '{0:x}.{1:x}'.format(pid, random.getrandbits(32))
+        if self.__compact_members:
+            return '{0}.{1}'.format(self.__member_prefix, common.base62_encode(next(self.__member_counter)))
+        return '{0}.{1:x}'.format(self.__member_prefix, next(self.__member_counter))
+
+    def __fallback_rate_limit(self, checks, cost):
+        """
+        Rate limit using the in-process fallback limiter. Admits the request if no fallback is configured.
+
+        :param checks: list of checks as returned by _build_checks
+        :param cost: the number of units the request consumes
+        :return: the configured RateLimitResponse or None
+        """
+        if self.__fallback is None:
             return None
+        self.__increment_metric(common.Constants.metric_requests_backend_fallback_total)
+        check, remaining, retry_after_seconds = self._check_sequentially(
+            checks,
+            lambda key, window_seconds, max_calls, count: self.__fallback.rate_limit(
+                key, window_seconds, max_calls, self.__max_sleep_time_seconds, cost=cost, count=count
+            )
+        )
+        return self._handle_check_result(check, remaining, retry_after_seconds)
 
-        # Suspend the current request if its it has to wait no longer than max_sleep_time_seconds.
-        elif retry_after_seconds < self.__max_sleep_time_seconds:
-            # Log the current request if it has to be suspended for at least log_sleep_time_seconds.
-            if retry_after_seconds >= self.__log_sleep_time_seconds:
-                self.logger.debug(
-                    "suspending request '{0}' for '{1}' seconds to fit rate limit '{2}'"
-                    .format(key, retry_after_seconds, max_rate_string)
+    def __is_recovering(self):
+        """
+        Check whether the current request should still be handled by the fallback after redis recovered.
+        The share of requests sent to redis increases linearly during the recovery period.
+        This avoids all processes hitting redis at once.
+
+        :return: bool whether to use the fallback
+        """
+        if not self.__recovered_at:
+            return False
+        elapsed = time.time() - self.__recovered_at
+        if elapsed >= self.__recovery_seconds:
+            self.__recovered_at = 0
+            return False
+        return random.random() >= elapsed / float(self.__recovery_seconds)
+
+    def __discover_replica_count(self):
+        """Periodically register this process and count the processes using the same redis in the background."""
+        now = time.time()
+        if now - self.__replica_discovered_at < self.__replica_discovery_interval_seconds:
+            return
+        self.__replica_discovered_at = now
+        eventlet.spawn_n(self.__refresh_replica_count, now)
+
+    def __refresh_replica_count(self, now):
+        key = self.replica_registry_key
+        try:
+            ttl = 2 * self.__replica_discovery_interval_seconds
+            self.__redis.execute('ZADD', key, now, self.__replica_id)
+            self.__redis.execute('ZREMRANGEBYSCORE', key, '-inf', now - ttl)
+            self.__redis.execute('EXPIRE', key, int(ttl))
+            count = common.to_int(self.__redis.execute('ZCARD', key), 1)
+            self.__fallback.replica_count = count
+        except Exception as e:
+            self.logger.debug("failed to discover replica count: {0}", e)
+
+
+class SharedMemoryBackend(Backend):
+    """
+    Backend storing rate limits in a memory-mapped file shared by all processes on a host.
+    Suitable for single host deployments without redis.
+    The sliding window is approximated by the counters of the current and previous fixed window.
+    """
+
+    def __init__(self, rate_limit_response, max_sleep_time_seconds, log_sleep_time_seconds,
+                 logger=log.Logger(__name__), **kwargs):
+        super(SharedMemoryBackend, self).__init__(
+            host=None,
+            port=None,
+            rate_limit_response=rate_limit_response,
+            max_sleep_time_seconds=max_sleep_time_seconds,
+            log_sleep_time_seconds=log_sleep_time_seconds,
+            logger=logger,
+            compact_encoding=kwargs.get('compact_encoding', False),
+            log_sample_interval_seconds=kwargs.get('log_sample_interval_seconds', 60),
+        )
+        self.__path = kwargs.get('path', common.Constants.shm_default_path)
+        self.__table = shm.SharedCounterTable(
+            path=self.__path,
+            slots=kwargs.get('slots', 65536),
+            stripes=kwargs.get('stripes', 64),
+        )
+
+    def rate_limit_levels(self, levels, action, target_type_uri, cost=1):
+        """
+        Handle the rate limits of multiple scope levels, e.g. domain, project and user, for the given action
+        and target_type_uri. The request is only admitted if it fits the rate limits of all levels.
+
+        :param levels: list of tuples (scope level, scope, max. rate limit per sliding window)
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :param cost: the number of units the request consumes
+        :return: the configured RateLimitResponse or None
+        """
+        try:
+            checks = self._build_checks(levels, action, target_type_uri)
+            now = time.time()
+            check, remaining, retry_after_seconds = self._check_sequentially(
+                checks,
+                lambda key, window_seconds, max_calls, count: self.__table.rate_limit(
+                    key, window_seconds, max_calls, self._max_sleep_time_seconds, now, cost=cost, count=count
                 )
-            eventlet.sleep(retry_after_seconds)
-            return None
+            )
+            return self._handle_check_result(check, remaining, retry_after_seconds)
+        except Exception as e:
+            self.logger.debug("failed to rate limit: {0}", e)
 
-        # If rate limit exceeded and the request cannot be suspended return the rate limit response.
-        # Set headers for rate limit response.
-        self.__rate_limit_response.set_headers(
-            ratelimit=max_rate_string,
-            remaining=remaining,
-            retry_after=retry_after_seconds
+
+class MemcachedBackend(Backend):
+    """
+    Backend storing rate limits in memcached.
+
+    Requests are counted per fixed window using incr with expiry.
+    Strategies:
+      fixed_window:   Only the counter of the current window is considered.
+      sliding_window: The sliding window is approximated by the counters of the current and previous window.
+    """
+
+    def __init__(self, host, port, rate_limit_response, max_sleep_time_seconds, log_sleep_time_seconds,
+                 logger=log.Logger(__name__), **kwargs):
+        super(MemcachedBackend, self).__init__(
+            host=host,
+            port=port,
+            rate_limit_response=rate_limit_response,
+            max_sleep_time_seconds=max_sleep_time_seconds,
+            log_sleep_time_seconds=log_sleep_time_seconds,
+            logger=logger,
+            compact_encoding=kwargs.get('compact_encoding', False),
+            log_sample_interval_seconds=kwargs.get('log_sample_interval_seconds', 60),
+        )
+        self.__host = host
+        self.__port = port
+        self.__strategy = kwargs.get('strategy', common.Constants.strategy_sliding_window)
+        if self.__strategy not in (common.Constants.strategy_sliding_window, common.Constants.strategy_fixed_window):
+            raise errors.ConfigError("unknown memcached strategy '{0}'".format(self.__strategy))
+
+        # For testing purposes.
+        client = kwargs.get('memcache_client', None)
+        if client:
+            create = lambda: client  # noqa: E731
+        else:
+            try:
+                import memcache
+            except ImportError:
+                raise errors.ConfigError("the memcached backend requires the python-memcached package")
+            server = '{0}:{1}'.format(host, port)
+            timeout = kwargs.get('timeout_seconds', 20)
+            create = lambda: memcache.Client([server], socket_timeout=timeout, dead_retry=timeout)  # noqa: E731
+
+        self.__pool = pools.Pool(max_size=kwargs.get('max_connections', 100), create=create)
+
+    def is_available(self):
+        """Check whether memcached is available."""
+        try:
+            with self.__pool.item() as client:
+                if client.get_stats():
+                    return True, ""
+        except Exception as e:
+            self.logger.debug("failed to get memcached stats: {0}", e)
+        return False, "rate limit failed. memcached not available. host='{0}', port='{1}'".format(self.__host, str(self.__port))
+
+    def rate_limit_levels(self, levels, action, target_type_uri, cost=1):
+        """
+        Handle the rate limits of multiple scope levels, e.g. domain, project and user, for the given action
+        and target_type_uri. The request is only admitted if it fits the rate limits of all levels.
+
+        :param levels: list of tuples (scope level, scope, max. rate limit per sliding window)
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :param cost: the number of units the request consumes
+        :return: the configured RateLimitResponse or None
+        """
+        try:
+            checks = self._build_checks(levels, action, target_type_uri)
+            with self.__pool.item() as client:
+                check, remaining, retry_after_seconds = self._check_sequentially(
+                    checks,
+                    lambda key, window_seconds, max_calls, count: self.__check(
+                        client, key, window_seconds, max_calls, cost, count
+                    )
+                )
+            return self._handle_check_result(check, remaining, retry_after_seconds)
+        except Exception as e:
+            self.logger.debug("failed to rate limit: {0}", e)
+
+    def __check(self, client, key, window_seconds, max_calls, cost, count=True):
+        if window_seconds <= 0 or max_calls < 0:
+            return 1, -1
+        cost = common.window_cost(cost, max_calls)
+        if self.__strategy == common.Constants.strategy_fixed_window:
+            return self.__fixed_window(client, key, window_seconds, int(max_calls), cost, count)
+        return self.__sliding_window(client, key, window_seconds, int(max_calls), cost, count)
+
+    def __fixed_window(self, client, key, window_seconds, max_calls, cost, count=True):
+        now = time.time()
+        window_id = int(now // window_seconds)
+        current_key = '{0}_{1}'.format(key, window_id)
+        if count:
+            counter = self.__incr(client, current_key, window_seconds, cost)
+        else:
+            counter = common.to_int(client.get(current_key), 0) + cost
+        if counter <= max_calls:
+            return max_calls - counter + 1, -1
+
+        # Not counted in the current window.
+        if count:
+            client.decr(current_key, cost)
+
+        # Suspend the request until the next window if it still fits there.
+        retry_after_seconds = int(math.ceil((window_id + 1) * window_seconds - now))
+        if retry_after_seconds < self._max_sleep_time_seconds:
+            next_key = '{0}_{1}'.format(key, window_id + 1)
+            if count:
+                next_counter = self.__incr(client, next_key, window_seconds, cost)
+            else:
+                next_counter = common.to_int(client.get(next_key), 0) + cost
+            if next_counter <= max_calls:
+                return max_calls - counter, retry_after_seconds
+            if count:
+                client.decr(next_key, cost)
+            # The window after the next one is empty.
+            retry_after_seconds = int(math.ceil((window_id + 2) * window_seconds - now))
+        return 0, self.__rejected_retry_after(retry_after_seconds)
+
+    def __sliding_window(self, client, key, window_seconds, max_calls, cost, count=True):
+        now = time.time()
+        window_id = int(now // window_seconds)
+        current_key = '{0}_{1}'.format(key, window_id)
+        previous_key = '{0}_{1}'.format(key, window_id - 1)
+
+        counters = client.get_multi([current_key, previous_key]) or {}
+        previous = common.to_int(counters.get(previous_key), 0)
+        current = common.to_int(counters.get(current_key), 0)
+        elapsed_seconds = now - window_id * window_seconds
+        is_counted, remaining, retry_after_seconds = common.sliding_window_counter(
+            previous=previous,
+            current=current,
+            window_seconds=window_seconds,
+            elapsed_seconds=elapsed_seconds,
+            max_calls=max_calls,
+            max_sleep_time_seconds=self._max_sleep_time_seconds,
+            cost=cost,
         )
-        return self.__rate_limit_response
+        if is_counted and count:
+            self.__incr(client, current_key, window_seconds, cost)
+        else:
+            retry_after_seconds = self.__rejected_retry_after(common.sliding_window_retry_after(
+                previous, current, window_seconds, elapsed_seconds, max_calls, cost
+            ))
+        return remaining, retry_after_seconds
+
+    def __rejected_retry_after(self, retry_after_seconds):
+        """
+        Get the Retry-After of a rejected request derived from the expiry of the counters.
+        Never below max_sleep_time_seconds, so that the request is rejected rather than suspended.
+
+        :param retry_after_seconds: the time until the request fits the window
+        :return: the time in seconds
+        """
+        return max(int(retry_after_seconds), int(math.ceil(self._max_sleep_time_seconds)))
+
+    @staticmethod
+    def __incr(client, key, window_seconds, delta=1):
+        """
+        Increment the counter. The counter is created with an expiry of 2 windows if it doesn't exist.
+
+        :return: the new value
+        """
+        value = client.incr(key, delta)
+        if value is None:
+            # The counter must outlive the window as it's the previous window afterwards.
+            if client.add(key, delta, time=int(math.ceil(2 * window_seconds))):
+                return delta
+            # Counter was created concurrently.
+            value = client.incr(key, delta)
+        return common.to_int(value, delta)
+
+
+class PeerBackend(Backend):
+    """
+    Backend without a central store. The replicas themselves own the rate limit keys.
+
+    Each key is assigned to one peer via consistent hashing. The owner counts requests in-process.
+    Other peers forward their checks in batches to the owner and cache rejections until they expire.
+    If the owner cannot be reached, the check falls back to an in-process limit divided by the number of peers.
+    """
+
+    def __init__(self, rate_limit_response, max_sleep_time_seconds, log_sleep_time_seconds,
+                 logger=log.Logger(__name__), **kwargs):
+        super(PeerBackend, self).__init__(
+            host=None,
+            port=None,
+            rate_limit_response=rate_limit_response,
+            max_sleep_time_seconds=max_sleep_time_seconds,
+            log_sleep_time_seconds=log_sleep_time_seconds,
+            logger=logger,
+            compact_encoding=kwargs.get('compact_encoding', False),
+            log_sample_interval_seconds=kwargs.get('log_sample_interval_seconds', 60),
+        )
+        self.__peers = peer.load_peers(kwargs.get('peers'), kwargs.get('peers_file'))
+        self.__self_address = kwargs.get('self_address')
+        if not self.__peers or self.__self_address not in self.__peers:
+            raise errors.ConfigError(
+                "the peer backend requires a list of peers including this peer '{0}'".format(self.__self_address)
+            )
+        self.__ring = peer.HashRing(self.__peers)
+        self.__timeout_seconds = kwargs.get('timeout_seconds', 1)
+        self.__batch_window_seconds = kwargs.get('batch_window_seconds', 0.0002)
+        self.__batch_max_size = kwargs.get('batch_max_size', 50)
+        self.__secret = kwargs.get('secret')
+        self.__clients = {}
+
+        # Counts requests for the keys owned by this peer.
+        max_keys = kwargs.get('max_keys', 100000)
+        self.__limiter = fallback.LocalRateLimiter(max_keys=max_keys)
+        # Used if the owner of a key is unreachable.
+        self.__fallback = fallback.LocalRateLimiter(max_keys=max_keys, replica_count=len(self.__peers))
+        # Cached rejections by key. Value is the timestamp until which requests are rejected.
+        self.__limited_until = collections.OrderedDict()
+        self.__max_limited_keys = max_keys
+
+        # The port is bound exclusively, so only one process per host serves the peer address.
+        # Other processes on the same host forward their checks to it.
+        self.__server = None
+        try:
+            host, port = peer.split_address(self.__self_address)
+            self.__server = peer.PeerServer(
+                kwargs.get('bind_host') or host, port, self.__limiter.rate_limit, secret=self.__secret, logger=logger
+            )
+        except (socket.error, OSError) as e:
+            self.logger.debug("not serving peer address {0}: {1}", self.__self_address, e)
+
+    def rate_limit_levels(self, levels, action, target_type_uri, cost=1):
+        """
+        Handle the rate limits of multiple scope levels, e.g. domain, project and user, for the given action
+        and target_type_uri. The request is only admitted if it fits the rate limits of all levels.
+
+        :param levels: list of tuples (scope level, scope, max. rate limit per sliding window)
+        :param action: the CADF action
+        :param target_type_uri: the CADF target type URI
+        :param cost: the number of units the request consumes
+        :return: the configured RateLimitResponse or None
+        """
+        try:
+            checks = self._build_checks(levels, action, target_type_uri)
+            check, remaining, retry_after_seconds = self._check_sequentially(
+                checks,
+                lambda key, window_seconds, max_calls, count: self.__check_cached(
+                    key, window_seconds, max_calls, cost, count
+                )
+            )
+            return self._handle_check_result(check, remaining, retry_after_seconds)
+        except Exception as e:
+            self.logger.debug("failed to rate limit: {0}", e)
+
+    def __check_cached(self, key, window_seconds, max_calls, cost, count=True):
+        # Reject right away if the owner rejected a request for this key recently.
+        now = time.time()
+        limited_until = self.__limited_until.get(key)
+        if limited_until:
+            if limited_until > now:
+                return 0, int(math.ceil(limited_until - now)) + self._max_sleep_time_seconds
+            del self.__limited_until[key]
+
+        remaining, retry_after_seconds = self.__check(key, window_seconds, max_calls, cost, count)
+        # A rejected expensive request doesn't imply cheaper requests are rejected as well.
+        if cost == 1 and remaining <= 0 and retry_after_seconds >= self._max_sleep_time_seconds:
+            self.__cache_rejection(key, now + retry_after_seconds - self._max_sleep_time_seconds)
+        return remaining, retry_after_seconds
+
+    def __check(self, key, window_seconds, max_calls, cost, count=True):
+        owner = self.__ring.get_node(key)
+        if owner == self.__self_address and self.__server:
+            return self.__limiter.rate_limit(
+                key, window_seconds, max_calls, self._max_sleep_time_seconds, cost=cost, count=count
+            )
+
+        try:
+            return self.__get_client(owner).rate_limit(
+                key, window_seconds, max_calls, self._max_sleep_time_seconds, cost=cost, count=count
+            )
+        except Exception as e:
+            self.logger.debug("failed to forward check to peer {0}: {1}", owner, e)
+            return self.__fallback.rate_limit(
+                key, window_seconds, max_calls, self._max_sleep_time_seconds, cost=cost, count=count
+            )
+
+    def __get_client(self, address):
+        client = self.__clients.get(address)
+        if not client:
+            client = self.__clients[address] = peer.PeerClient(
+                address,
+                timeout_seconds=self.__timeout_seconds,
+                window_seconds=self.__batch_window_seconds,
+                max_size=self.__batch_max_size,
+                secret=self.__secret,
+                logger=self.logger,
+            )
+        return client
+
+    def __cache_rejection(self, key, until):
+        """Cache the rejection until the request could be suspended to fit the rate limit again."""
+        if until <= time.time():
+            return
+        if key not in self.__limited_until and len(self.__limited_until) >= self.__max_limited_keys:
+            self.__limited_until.popitem(last=False)
+        self.__limited_until[key] = until
+
+    def stop(self):
+        """Stop serving and close connections to other peers."""
+        if self.__server:
+            self.__server.stop()
+        for client in self.__clients.values():
+            client.close()
@@ -0,0 +1,167 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import eventlet
+import time
+
+from . import log
+
+
+class LocalTokenBucket(object):
+    """
+    In-process token buckets implemented as generic cell rate algorithm (GCRA).
+
+    Tokens are reserved rather than taken: A reservation always succeeds and returns the time the caller
+    has to wait until the tokens are available. Per key only the theoretical arrival time is stored.
+    The number of tracked keys is bounded. The least recently used key is evicted first.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.__max_keys = max(1, int(max_keys))
+        self.__tats = collections.OrderedDict()
+
+    def reserve(self, key, amount, rate, burst, now=None):
+        """
+        Reserve tokens of the bucket.
+
+        :param key: the key of the bucket
+        :param amount: the number of tokens
+        :param rate: the number of tokens added per second
+        :param burst: the capacity of the bucket
+        :param now: the current timestamp. defaults to time.time()
+        :return: the time in seconds until the tokens are available
+        """
+        now = time.time() if now is None else now
+        tat = max(self.__tats.pop(key, now), now)
+        if len(self.__tats) >= self.__max_keys:
+            self.__tats.popitem(last=False)
+        new_tat = tat + float(amount) / rate
+        self.__tats[key] = new_tat
+        return max(0.0, new_tat - float(burst) / rate - now)
+
+
+class BandwidthShaper(object):
+    """
+    Shapes the bandwidth per key, e.g. the bytes uploaded per account, using a token bucket in the backend.
+
+    Bytes are leased from the backend in blocks of lease_bytes, so that not every chunk needs a round trip.
+    A lease never exceeds the burst, so that small transfers don't wait for bytes they never use.
+    A greenthread sleeps between chunks until the consumed bytes are available. Data is never buffered.
+    """
+
+    def __init__(self, backend, rate_bytes_per_second, burst_bytes=None, lease_bytes=1048576,
+                 max_keys=10000, logger=log.Logger(__name__)):
+        """
+        Create a new BandwidthShaper.
+
+        :param backend: the backend holding the token buckets
+        :param rate_bytes_per_second: the max. bandwidth per key
+        :param burst_bytes: the capacity of the token bucket. defaults to one second worth of bytes
+        :param lease_bytes: the number of bytes leased from the backend at once. at most burst_bytes
+        :param max_keys: max. number of keys with leased bytes tracked per process
+        :param logger: the logger
+        """
+        self.__backend = backend
+        self.__rate = max(1, int(rate_bytes_per_second))
+        self.__burst = max(1, int(burst_bytes or self.__rate))
+        self.__lease_bytes = max(1, min(int(lease_bytes), self.__burst))
+        self.__max_keys = max(1, int(max_keys))
+        # Bytes leased from the backend but not yet consumed and the time all of them are available per key.
+        self.__leases = collections.OrderedDict()
+        self.logger = logger
+
+    def consume(self, key, nbytes):
+        """
+        Account the bytes against the bandwidth of the key and sleep until they fit.
+
+        :param key: the key, e.g. as returned by Backend.key
+        :param nbytes: the number of transferred bytes
+        :return: the time slept in seconds
+        """
+        if nbytes <= 0:
+            return 0
+        now = time.time()
+        leased, available_at = self.__leases.pop(key, (0, now))
+        if leased < nbytes:
+            amount = max(self.__lease_bytes, nbytes - leased)
+            available_at = now + self.__backend.reserve_tokens(key, amount, self.__rate, self.__burst)
+            leased += amount
+        leased -= nbytes
+        if len(self.__leases) >= self.__max_keys:
+            self.__leases.popitem(last=False)
+        self.__leases[key] = (leased, available_at)
+
+        # The bytes still leased are available last. Only wait until the consumed ones are.
+        wait_seconds = max(0, available_at - float(leased) / self.__rate - now)
+
+        if wait_seconds > 0:
+            eventlet.sleep(wait_seconds)
+        return wait_seconds
+
+    def wrap_input(self, wsgi_input, key):
+        """Wrap the wsgi.input of an upload."""
+        return ShapedInput(wsgi_input, self, key)
+
+    def wrap_iterable(self, app_iter, key):
+        """Wrap the response iterator of a download."""
+        return ShapedIterable(app_iter, self, key)
+
+
+class ShapedInput(object):
+    """File-like wsgi.input accounting every chunk read against the bandwidth of the key."""
+
+    def __init__(self, wsgi_input, shaper, key):
+        self.__input = wsgi_input
+        self.__shaper = shaper
+        self.__key = key
+
+    def read(self, *args, **kwargs):
+        return self.__consume(self.__input.read(*args, **kwargs))
+
+    def readline(self, *args, **kwargs):
+        return self.__consume(self.__input.readline(*args, **kwargs))
+
+    def readlines(self, *args, **kwargs):
+        return [self.__consume(line) for line in self.__input.readlines(*args, **kwargs)]
+
+    def __iter__(self):
+        for chunk in self.__input:
+            yield self.__consume(chunk)
+
+    def __getattr__(self, name):
+        return getattr(self.__input, name)
+
+    def __consume(self, chunk):
+        self.__shaper.consume(self.__key, len(chunk))
+        return chunk
+
+
+class ShapedIterable(object):
+    """Response iterator accounting every chunk against the bandwidth of the key before passing it on."""
+
+    def __init__(self, app_iter, shaper, key):
+        self.__app_iter = app_iter
+        self.__shaper = shaper
+        self.__key = key
+
+    def __iter__(self):
+        for chunk in self.__app_iter:
+            self.__shaper.consume(self.__key, len(chunk))
+            yield chunk
+
+    def close(self):
+        # See PEP 3333: close() of the wrapped iterator must be called.
+        if hasattr(self.__app_iter, 'close'):
+            self.__app_iter.close()
@@ -0,0 +1,118 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+
+from eventlet import event
+
+from . import log
+
+
+class Batcher(object):
+    """
+    Collects calls issued by concurrent greenthreads and executes them as one batch.
+
+    Calls issued within window_seconds or until max_size calls are pending are executed together
+    via execute_batch. The results are handed back to the waiting greenthreads.
+    """
+
+    def __init__(self, window_seconds=0.0002, max_size=50, logger=log.Logger(__name__)):
+        self.__window_seconds = window_seconds
+        self.__max_size = max(1, int(max_size))
+        self.logger = logger
+        # List of pending tuples (call arguments, event).
+        self.__pending = []
+        self.__flush_timer = None
+
+    def execute(self, *args):
+        """
+        Queue a call and wait until the batch containing it was executed.
+
+        :param args: the arguments of the call
+        :return: the result of the call
+        :raises: the error returned for this call or the error of the batch
+        """
+        evt = event.Event()
+        self.__pending.append((args, evt))
+
+        if len(self.__pending) >= self.__max_size:
+            # Batch is full. Flush right away using the current greenthread.
+            self.__flush()
+        elif self.__flush_timer is None:
+            self.__flush_timer = eventlet.spawn_after(self.__window_seconds, self.__flush)
+
+        result = evt.wait()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def __flush(self):
+        """Execute all pending calls as one batch and notify the waiting greenthreads."""
+        # Take the pending calls first as cancelling the timer might yield to other greenthreads.
+        batch, self.__pending = self.__pending, []
+        flush_timer, self.__flush_timer = self.__flush_timer, None
+        if flush_timer is not None and flush_timer is not eventlet.getcurrent():
+            flush_timer.cancel()
+
+        if not batch:
+            return
+
+        try:
+            results = self.execute_batch([args for args, _ in batch])
+        except Exception as e:
+            self.logger.debug("failed to execute batch of {0} calls: {1}", len(batch), e)
+            results = [e] * len(batch)
+
+        for (_, evt), result in zip(batch, results):
+            evt.send(result)
+
+    def execute_batch(self, calls):
+        """
+        Execute a batch of calls.
+
+        :param calls: list of call arguments
+        :return: list of results in order of the calls. Failed calls are returned as exceptions.
+        """
+        raise NotImplementedError
+
+
+class CommandBatcher(Batcher):
+    """
+    Collects Redis commands issued by concurrent greenthreads and sends them as one pipeline.
+    The commands are written to a single connection in bulk mode.
+    """
+
+    def __init__(self, pool, window_seconds=0.0002, max_size=50, logger=log.Logger(__name__)):
+        super(CommandBatcher, self).__init__(window_seconds=window_seconds, max_size=max_size, logger=logger)
+        self.__pool = pool
+
+    def execute_batch(self, calls):
+        """
+        Write all commands using one connection and read the results afterwards.
+
+        :param calls: list of commands, e.g. ('EVALSHA', sha, numkeys, ..)
+        :return: list of results in order of the commands. Failed commands are returned as exceptions.
+        """
+        conn = self.__pool.acquire()
+        try:
+            conn.bulk_start(bulk_size=len(calls) + 1, keep_results=True)
+            for args in calls:
+                conn.execute(*args)
+            return conn.bulk_stop()
+        except BaseException:
+            # Don't return a connection in an undefined bulk state to the pool.
+            conn.close()
+            raise
+        finally:
+            self.__pool.release(conn)
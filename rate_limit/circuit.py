@@ -0,0 +1,173 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+
+from . import log
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker protecting the API from a stalled or failing backend.
+
+    closed:    Calls pass. Consecutive failures or slow calls open the circuit.
+    open:      Calls are rejected immediately until open_seconds have passed.
+    half_open: A single probe call is let through. Its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, slow_call_threshold=10, slow_call_seconds=0.05, open_seconds=10,
+                 on_state_change=None, logger=log.Logger(__name__)):
+        """
+        Create a new CircuitBreaker.
+
+        :param failure_threshold: number of consecutive failures opening the circuit
+        :param slow_call_threshold: number of consecutive calls slower than slow_call_seconds opening the circuit
+        :param slow_call_seconds: calls taking longer are considered slow
+        :param open_seconds: time the circuit stays open before a probe call is let through
+        :param on_state_change: optional callable invoked with the new state
+        :param logger: the logger
+        """
+        self.__failure_threshold = max(1, int(failure_threshold))
+        self.__slow_call_threshold = max(1, int(slow_call_threshold))
+        self.__slow_call_seconds = slow_call_seconds
+        self.__open_seconds = open_seconds
+        self.__on_state_change = on_state_change
+        self.logger = logger
+
+        self.__state = self.CLOSED
+        self.__opened_at = 0
+        self.__probe_in_flight = False
+        self.__consecutive_failures = 0
+        self.__consecutive_slow_calls = 0
+
+    @property
+    def state(self):
+        return self.__state
+
+    def allow_request(self):
+        """
+        Check whether a call to the backend may be attempted.
+
+        :return: bool whether the call is allowed
+        """
+        if self.__state == self.CLOSED:
+            return True
+
+        if self.__state == self.OPEN:
+            if time.time() - self.__opened_at < self.__open_seconds:
+                return False
+            self.__set_state(self.HALF_OPEN)
+
+        # Only a single probe is let through while half open.
+        if self.__probe_in_flight:
+            return False
+        self.__probe_in_flight = True
+        return True
+
+    def record_success(self, duration_seconds):
+        """
+        Record a successful call.
+
+        :param duration_seconds: how long the call took
+        """
+        # Ignore calls that were in flight when the circuit opened.
+        if self.__state == self.OPEN:
+            return
+
+        is_slow = duration_seconds > self.__slow_call_seconds
+        self.__consecutive_failures = 0
+
+        if self.__state == self.HALF_OPEN:
+            self.__probe_in_flight = False
+            if is_slow:
+                self.__open()
+            else:
+                self.__close()
+            return
+
+        if not is_slow:
+            self.__consecutive_slow_calls = 0
+            return
+
+        self.__consecutive_slow_calls += 1
+        if self.__consecutive_slow_calls >= self.__slow_call_threshold:
+            self.logger.warning(
+                "opening circuit after {0} consecutive calls slower than {1}s",
+                self.__consecutive_slow_calls, self.__slow_call_seconds
+            )
+            self.__open()
+
+    def record_failure(self):
+        """Record a failed call."""
+        if self.__state == self.OPEN:
+            return
+
+        if self.__state == self.HALF_OPEN:
+            self.__probe_in_flight = False
+            self.__open()
+            return
+
+        self.__consecutive_failures += 1
+        if self.__consecutive_failures >= self.__failure_threshold:
+            self.logger.warning(
+                "opening circuit after {0} consecutive failures", self.__consecutive_failures
+            )
+            self.__open()
+
+    def record_health_check(self, is_healthy):
+        """
+        Record the result of a health check running in the background.
+        A failed check opens the circuit right away. A successful check ends the open period early,
+        so the next call probes the backend. While half open, it lets another call probe the backend,
+        so that a probe whose outcome was never recorded cannot keep the circuit half open.
+
+        :param is_healthy: bool whether the backend is healthy
+        """
+        if not is_healthy:
+            if self.__state != self.OPEN:
+                self.logger.warning("opening circuit after failed health check")
+            # Calls in flight are ignored once the circuit is open.
+            self.__probe_in_flight = False
+            self.__open()
+            return
+
+        if self.__state == self.OPEN:
+            self.__opened_at = 0
+        elif self.__state == self.HALF_OPEN:
+            self.__probe_in_flight = False
+
+    def __open(self):
+        self.__opened_at = time.time()
+        self.__set_state(self.OPEN)
+
+    def __close(self):
+        self.__consecutive_failures = 0
+        self.__consecutive_slow_calls = 0
+        self.__set_state(self.CLOSED)
+
+    def __set_state(self, state):
+        if state == self.__state:
+            return
+        self.__state = state
+        if state == self.CLOSED:
+            self.logger.info("circuit closed. backend recovered")
+        if self.__on_state_change:
+            try:
+                self.__on_state_change(state)
+            except Exception as e:
+                self.logger.debug("error handling circuit state change: {0}", e)
@@ -12,6 +12,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import binascii
+import hashlib
+import math
 import os
 import time
 import yaml
@@ -47,6 +50,16 @@ class Constants(object):
     initiator_host_address = 'initiator_host_address'
     target_project_id = 'target_project_id'
 
+    # Additional scope levels checked together with the scope the middleware rate limits by.
+    # Ordered from the broadest to the narrowest level.
+    scope_level_domain = 'domain'
+    scope_level_user = 'user'
+
+    # Keys of the token buckets used to shape the bandwidth.
+    bandwidth = 'bandwidth'
+    bandwidth_upload = 'upload'
+    bandwidth_download = 'download'
+
     # Interval in which cached rate limits are refreshed in seconds.
     limes_refresh_interval_seconds = 'limes_refresh_interval_seconds'
 
@@ -69,6 +82,9 @@ class Constants(object):
     # For compatibility with OpenStack Swift. Same as 'header_ratelimit_reset'.
     header_ratelimit_retry_after = 'X-Retry-After'
 
+    # The scope level (domain, project, user, ..) of the rate limit that was exceeded.
+    header_ratelimit_scope = 'X-RateLimit-Scope'
+
     # Response content type.
     content_type_json = "application/json"
 
@@ -84,6 +100,40 @@ class Constants(object):
     metric_requests_ratelimit_total = 'requests_ratelimit_total'
     metric_requests_whitelisted_total = 'requests_whitelisted_total'
     metric_requests_blacklisted_total = 'requests_blacklisted_total'
+    metric_requests_backend_circuit_open_total = 'requests_backend_circuit_open_total'
+    metric_backend_circuit_state_changes_total = 'backend_circuit_state_changes_total'
+    metric_requests_backend_fallback_total = 'requests_backend_fallback_total'
+    metric_backend_pool_connections_in_use = 'backend_pool_connections_in_use'
+    metric_backend_pool_wait_seconds = 'backend_pool_wait_seconds'
+    metric_config_generation = 'config_generation'
+    metric_config_reload_seconds = 'config_reload_seconds'
+    metric_config_reload_errors_total = 'config_reload_errors_total'
+
+    # Prefix of backend hosts referring to a unix domain socket.
+    unix_socket_prefix = 'unix://'
+
+    # Default path of the memory-mapped file used by the shared memory backend.
+    shm_default_path = '/dev/shm/openstack-rate-limit'
+
+    # Supported backends.
+    backend_redis = 'redis'
+    backend_shared_memory = 'shared_memory'
+    backend_memcached = 'memcached'
+    backend_peer = 'peer'
+
+    # Strategies supported by the memcached backend.
+    strategy_fixed_window = 'fixed_window'
+    strategy_sliding_window = 'sliding_window'
+
+    # Prefix of the sorted set in which middleware processes register themselves to discover the replica count.
+    # The service type is appended, so that replicas of different services sharing a redis count separately.
+    replica_registry_key = 'ratelimit_replicas'
+
+    # Alphabet used to encode compact keys and members.
+    base62_alphabet = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+    # Maximum number of cached rule ids.
+    max_rule_ids = 10000
 
 
 def key_func(scope, action, target_type_uri):
@@ -99,6 +149,173 @@ def key_func(scope, action, target_type_uri):
     return 'ratelimit_{0}_{1}_{2}'.format('global' if scope is None else scope, action, target_type_uri)
 
 
+def base62_encode(number):
+    """
+    Encode a non-negative integer using the characters 0-9, A-Z, a-z.
+
+    :param number: the integer
+    :return: the encoded string
+    """
+    number = int(number)
+    if number <= 0:
+        return Constants.base62_alphabet[0]
+    digits = []
+    while number:
+        number, digit = divmod(number, 62)
+        digits.append(Constants.base62_alphabet[digit])
+    return ''.join(reversed(digits))
+
+
+def compact_scope(scope):
+    """
+    Encode the scope compactly. UUIDs are base62 encoded using 22 characters instead of 32.
+    Other scopes (ip addresses, names, ..) are prefixed by '=' to avoid collisions.
+
+    :param scope: the identifier of the scope or None for the global scope
+    :return: the encoded scope
+    """
+    if scope is None:
+        return '*'
+    hex_scope = scope.replace('-', '')
+    if len(hex_scope) == 32:
+        try:
+            return base62_encode(int(hex_scope, 16)).rjust(22, Constants.base62_alphabet[0])
+        except ValueError:
+            pass
+    return '={0}'.format(scope)
+
+
+# Cache of rule ids by tuple of action and target type URI.
+_rule_ids = {}
+
+
+def rule_id(action, target_type_uri):
+    """
+    Get the short id of the rule identified by action and target type URI.
+    The id is derived from a stable hash, so all replicas agree on it without coordination.
+
+    :param action: the cadf action
+    :param target_type_uri: the target type uri of the request
+    :return: the rule id
+    """
+    rule = (action, target_type_uri)
+    rid = _rule_ids.get(rule)
+    if rid is None:
+        digest = hashlib.sha1('{0}|{1}'.format(action, target_type_uri).encode('utf-8')).digest()
+        rid = base62_encode(int(binascii.hexlify(digest[:6]), 16))
+        if len(_rule_ids) >= Constants.max_rule_ids:
+            _rule_ids.clear()
+        _rule_ids[rule] = rid
+    return rid
+
+
+def compact_key_func(scope, action, target_type_uri):
+    """
+    Create a compact key based on scope, action, target_type_uri: 'rl:<rule id>:<compact scope>'.
+    Alternative to key_func using significantly less memory in the backend.
+
+    :param scope: the identifier of the scope (project uid, user uid, ip addr, ..) or None for the global scope
+    :param action: the cadf action
+    :param target_type_uri: the target type uri of the request
+    :return: the key 'rl:<rule id>:<compact scope>'
+    """
+    return 'rl:{0}:{1}'.format(rule_id(action, target_type_uri), compact_scope(scope))
+
+
+def to_rate_limit_list(rate_limit):
+    """
+    Get the list of rate limits from a single rate limit or a list of rate limits.
+
+    :param rate_limit: the rate limit, e.g. '10r/s', or a list of rate limits, e.g. ['10r/s', '1000r/h']
+    :return: the list of rate limits
+    """
+    if isinstance(rate_limit, (list, tuple)):
+        return [str(rl) for rl in rate_limit]
+    return [rate_limit]
+
+
+def tightest_result(results):
+    """
+    Pick the result of the tightest window of a request checked against multiple windows.
+    That's the exhausted window with the longest retry after or the window with the fewest remaining requests.
+
+    :param results: list of tuples (check, remaining requests, retry after seconds)
+    :return: tuple of the tightest check, the fewest remaining requests and the retry after in seconds
+    """
+    remaining = min(r for _, r, _ in results)
+    exhausted = [result for result in results if result[1] <= 0]
+    if exhausted:
+        check, _, retry_after_seconds = max(exhausted, key=lambda result: result[2])
+    else:
+        check, _, retry_after_seconds = min(results, key=lambda result: result[1])
+    return check, remaining, retry_after_seconds
+
+
+def sliding_window_counter(previous, current, window_seconds, elapsed_seconds, max_calls, max_sleep_time_seconds,
+                           cost=1):
+    """
+    Evaluate a request against a sliding window approximated by the counters of the previous and current fixed window.
+    Behaves like the sliding window script: Requests are admitted while there are remaining requests,
+    otherwise suspended if they fit the window within max_sleep_time_seconds or rejected.
+
+    :param previous: number of requests in the previous fixed window
+    :param current: number of requests in the current fixed window
+    :param window_seconds: the length of the window in seconds
+    :param elapsed_seconds: seconds elapsed since the start of the current fixed window
+    :param max_calls: max. number of requests per window
+    :param max_sleep_time_seconds: max. time a request can be suspended
+    :param cost: the number of units the request consumes. a request costing more than max_calls consumes the whole window
+    :return: tuple of (whether the request is counted, remaining requests, retry after in seconds)
+    """
+    cost = window_cost(cost, max_calls)
+    weight = max(0.0, 1.0 - float(elapsed_seconds) / window_seconds)
+    remaining = int(math.floor(max_calls - (previous * weight + current)))
+    if remaining >= cost:
+        return True, remaining - cost + 1, -1
+
+    retry_after_seconds = sliding_window_retry_after(previous, current, window_seconds, elapsed_seconds, max_calls, cost)
+    if retry_after_seconds < max_sleep_time_seconds and remaining - cost >= -max_calls:
+        return True, remaining - cost, retry_after_seconds
+    return False, 0, 2 * max_sleep_time_seconds
+
+
+def window_cost(cost, max_calls):
+    """
+    Get the number of units a request consumes of a window.
+    A request costing more than the limit consumes the whole window, so that it's not rejected forever.
+
+    :param cost: the cost of the request
+    :param max_calls: max. number of requests per window
+    :return: the cost. at least 1
+    """
+    return max(1, min(int(cost), int(max_calls)))
+
+
+def sliding_window_retry_after(previous, current, window_seconds, elapsed_seconds, max_calls, cost=1):
+    """
+    Estimate the time until a request fits a sliding window approximated by the counters of the previous
+    and current fixed window.
+
+    :param previous: number of requests in the previous fixed window
+    :param current: number of requests in the current fixed window
+    :param window_seconds: the length of the window in seconds
+    :param elapsed_seconds: seconds elapsed since the start of the current fixed window
+    :param max_calls: max. number of requests per window
+    :param cost: the number of units the request consumes
+    :return: the time in seconds
+    """
+    # Time until the estimated count dropped far enough to fit the request.
+    room = max_calls - cost - current
+    if previous > 0 and room >= 0:
+        retry_after = window_seconds * (1.0 - float(room) / previous) - elapsed_seconds
+    else:
+        # Once the current window became the previous one.
+        retry_after = window_seconds - elapsed_seconds
+        if current > 0:
+            retry_after += window_seconds * max(0.0, 1.0 - float(max_calls - cost) / current)
+    return int(math.ceil(max(0.0, retry_after)))
+
+
 def printable_timestamp(timestamp):
     gmtime = time.gmtime(timestamp)
     return str(gmtime.tm_hour) + ':' + str(gmtime.tm_min) + ':' + str(gmtime.tm_sec)
@@ -150,6 +367,18 @@ def find_item_by_key_in_list(item, key, list_to_search, empty_item={}):
     return empty_item
 
 
+def find_items_by_key_in_list(item, key, list_to_search):
+    """
+    Find all items in a list by their key.
+
+    :param item: the item we're looking for
+    :param key: the key by which the items can be identified
+    :param list_to_search: list of items
+    :return: list of matching items
+    """
+    return [list_item for list_item in list_to_search if list_item.get(key) == item]
+
+
 def load_config(cfg_file):
     """
     Load a yaml configuration as a dictionary.
@@ -182,6 +411,21 @@ def to_int(raw_value, default=0):
         return default
 
 
+def to_bool(raw_value, default=False):
+    """
+    Safely parse a raw value as found in the WSGI configuration and convert to a boolean.
+
+    :param raw_value: the raw value, e.g. 'true', 'False', '1', True
+    :param default: the fallback value if the value is not set
+    :return: the value as bool
+    """
+    if raw_value is None:
+        return default
+    if isinstance(raw_value, bool):
+        return raw_value
+    return str(raw_value).strip().lower() in ('true', 'yes', 'on', '1')
+
+
 def listitem_to_int(listthing, idx, default=0):
     """
     Safely get an item by index from a list.
@@ -0,0 +1,220 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import mmap
+import os
+import struct
+
+from . import common
+from . import errors
+from . import overrides
+
+# Identifies a compiled configuration.
+MAGIC = b'RLCFG001'
+HEADER = struct.Struct('<8sI')
+# Name, offset and length of a section.
+SECTION = struct.Struct('<16sQQ')
+UINT32 = struct.Struct('<I')
+
+# Lists of the configuration compiled into sorted string tables and whether their entries are case-insensitive.
+TABLES = {
+    'whitelist': False,
+    'blacklist': False,
+    'whitelist_users': True,
+    'blacklist_users': True,
+}
+
+
+class StringTable(object):
+    """
+    Sorted table of strings in a memory-mapped file.
+
+    Layout: number of strings (uint32), offsets of the strings (uint32, number of strings + 1), utf-8 encoded strings.
+    Lookups are a binary search on the mapped pages, so the table is never parsed into python objects.
+    Pages are shared by all processes mapping the file, including forked workers.
+    """
+
+    def __init__(self, buf, offset):
+        """
+        Create a new StringTable.
+
+        :param buf: the buffer, e.g. the mmap of the compiled configuration
+        :param offset: the offset of the table in the buffer
+        """
+        self.__buf = buf
+        self.__count = UINT32.unpack_from(buf, offset)[0]
+        self.__offsets_start = offset + UINT32.size
+        self.__strings_start = self.__offsets_start + (self.__count + 1) * UINT32.size
+
+    def __len__(self):
+        return self.__count
+
+    def __get(self, idx):
+        start, end = struct.unpack_from('<II', self.__buf, self.__offsets_start + idx * UINT32.size)
+        return self.__buf[self.__strings_start + start:self.__strings_start + end]
+
+    def __contains__(self, item):
+        if item is None:
+            return False
+        needle = str(item).encode('utf-8')
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.__get(mid)
+            if value == needle:
+                return True
+            if value < needle:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def __iter__(self):
+        for idx in range(self.__count):
+            yield self.__get(idx).decode('utf-8')
+
+    @staticmethod
+    def pack(values):
+        """
+        Pack the strings into a table.
+
+        :param values: iterable of strings
+        :return: the table as bytes
+        """
+        encoded = sorted(set(str(v).encode('utf-8') for v in values))
+        offsets = [0]
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        return b''.join(
+            [UINT32.pack(len(encoded)), struct.pack('<{0}I'.format(len(offsets)), *offsets)] + encoded
+        )
+
+
+def to_lookup(values, case_insensitive=False):
+    """
+    Get a set of the list of the configuration for constant time lookups.
+    Tables of a compiled configuration are returned as is.
+
+    :param values: the list or StringTable
+    :param case_insensitive: whether the entries are lowercased
+    :return: the set or StringTable
+    """
+    if isinstance(values, StringTable):
+        return values
+    if case_insensitive:
+        return frozenset(str(v).lower() for v in values or [])
+    return frozenset(str(v) for v in values or [])
+
+
+def compile_config(config, artifact_path):
+    """
+    Compile the configuration into an artifact.
+    The lists are written as sorted string tables and the overrides per scope as hash index.
+    Everything else is written as JSON, which loads much faster than YAML.
+    The artifact is replaced atomically, so that processes never map a partially written file.
+
+    :param config: the configuration as dictionary
+    :param artifact_path: the path of the artifact
+    :return: the size of the artifact in bytes
+    """
+    sections = []
+    remainder = dict(config)
+    # Overrides per scope are compiled into a hash index.
+    rates = dict(remainder.get('rates', None) or {})
+    sections.append(('projects', overrides.OverrideIndex.pack(rates.pop('projects', None))))
+    remainder['rates'] = rates
+    for name, case_insensitive in sorted(TABLES.items()):
+        values = remainder.pop(name, None) or []
+        if case_insensitive:
+            values = [str(v).lower() for v in values]
+        sections.append((name, StringTable.pack(values)))
+    sections.append(('config', json.dumps(remainder, sort_keys=True, default=str).encode('utf-8')))
+
+    offset = HEADER.size + len(sections) * SECTION.size
+    directory = []
+    for name, data in sections:
+        directory.append(SECTION.pack(name.encode('utf-8'), offset, len(data)))
+        offset += len(data)
+
+    tmp_path = '{0}.tmp.{1}'.format(artifact_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(sections)))
+        f.write(b''.join(directory))
+        for _, data in sections:
+            f.write(data)
+    os.rename(tmp_path, artifact_path)
+    return offset
+
+
+def is_compiled(cfg_file):
+    """
+    Check whether the file is a compiled configuration.
+
+    :param cfg_file: path to the file
+    :return: bool
+    """
+    try:
+        with open(cfg_file, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def load(artifact_path):
+    """
+    Memory-map a compiled configuration.
+
+    :param artifact_path: the path of the artifact
+    :return: the configuration as dictionary. The lists are StringTables
+    :raises errors.ConfigError: if the artifact cannot be loaded
+    """
+    try:
+        with open(artifact_path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, section_count = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("not a compiled configuration")
+
+        config = {}
+        tables = {}
+        project_ratelimits = None
+        for idx in range(section_count):
+            name, offset, length = SECTION.unpack_from(buf, HEADER.size + idx * SECTION.size)
+            name = name.rstrip(b'\0').decode('utf-8')
+            if name == 'config':
+                config = json.loads(buf[offset:offset + length].decode('utf-8'))
+            elif name == 'projects':
+                project_ratelimits = overrides.OverrideIndex(buf, offset)
+            else:
+                tables[name] = StringTable(buf, offset)
+    except (IOError, OSError, ValueError, struct.error) as e:
+        raise errors.ConfigError("failed to load compiled configuration from file {0}: {1}".format(artifact_path, str(e)))
+
+    config.update(tables)
+    if project_ratelimits is not None and len(project_ratelimits):
+        config.setdefault('rates', {})['projects'] = project_ratelimits
+    return config
+
+
+def load_config(cfg_file):
+    """
+    Load the configuration from a compiled artifact or a yaml file.
+
+    :param cfg_file: path to the configuration file or the compiled artifact
+    :return: the configuration as dictionary
+    """
+    if is_compiled(cfg_file):
+        return load(cfg_file)
+    return common.load_config(cfg_file)
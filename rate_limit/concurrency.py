@@ -0,0 +1,103 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import itertools
+import time
+
+from . import common
+
+
+def slot_key(scope, action, target_type_uri, key_func=common.key_func):
+    """
+    Create the key of the in-flight requests based on scope, action, target_type_uri.
+
+    :param scope: the scope or None for global concurrency limits
+    :param action: the cadf action
+    :param target_type_uri: the target type uri of the request
+    :param key_func: the function creating the rate limit key, e.g. the one of the backend
+    :return: the key '<rate limit key>_concurrency'
+    """
+    return '{0}_concurrency'.format(key_func(scope, action, target_type_uri))
+
+
+class LocalSlots(object):
+    """
+    In-process slots of in-flight requests.
+
+    Every slot is leased until it's released or the lease expires,
+    so that slots of requests that never completed are eventually freed.
+    """
+
+    def __init__(self):
+        self.__slots = {}
+        self.__counter = itertools.count()
+
+    def acquire(self, key, max_concurrency, lease_seconds, now=None):
+        """
+        Acquire a slot.
+
+        :param key: the key of the slots
+        :param max_concurrency: the max. number of slots
+        :param lease_seconds: the time after which the slot is freed if not released
+        :param now: the current timestamp. defaults to time.time()
+        :return: the id of the slot or None if all slots are taken
+        """
+        now = time.time() if now is None else now
+        slots = self.__slots.setdefault(key, {})
+        for slot_id in [s for s, expires in slots.items() if expires <= now]:
+            del slots[slot_id]
+        if len(slots) >= max_concurrency:
+            return None
+        slot_id = str(next(self.__counter))
+        slots[slot_id] = now + lease_seconds
+        return slot_id
+
+    def release(self, key, slot_id):
+        """
+        Release a slot.
+
+        :param key: the key of the slots
+        :param slot_id: the id of the slot as returned by acquire
+        """
+        slots = self.__slots.get(key, {})
+        slots.pop(slot_id, None)
+        if not slots:
+            self.__slots.pop(key, None)
+
+
+class SlotReleasingIterable(object):
+    """Response iterator releasing the slots of the request once the response was sent."""
+
+    def __init__(self, app_iter, release_func):
+        """
+        Create a new SlotReleasingIterable.
+
+        :param app_iter: the response iterator of the app
+        :param release_func: callable releasing the slots. called once.
+        """
+        self.__app_iter = app_iter
+        self.__release_func = release_func
+
+    def __iter__(self):
+        return iter(self.__app_iter)
+
+    def close(self):
+        # See PEP 3333: close() of the wrapped iterator must be called.
+        try:
+            if hasattr(self.__app_iter, 'close'):
+                self.__app_iter.close()
+        finally:
+            release_func, self.__release_func = self.__release_func, None
+            if release_func:
+                release_func()
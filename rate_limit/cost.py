@@ -0,0 +1,71 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import math
+
+from six.moves.urllib import parse
+
+from . import common
+from . import errors
+
+# Costs taken from the request are capped at this number of units unless the expression sets 'max'.
+DEFAULT_MAX_COST = 1000
+
+
+def request_cost(expression, environ):
+    """
+    Get the cost of a request, i.e. the number of units it consumes of a rate limit.
+
+    Supported expressions:
+      5                                       constant cost
+      {query: limit}                          value of the query parameter
+      {header: X-Object-Count}                value of the request header
+      {content_length: true}                  value of the Content-Length header
+    Optionally, the value is divided in buckets of size 'per' and capped at 'max' units,
+    e.g. {content_length: true, per: 1048576, max: 100} costs one unit per started MiB but no more than 100.
+    As the value is set by the client, it's capped at DEFAULT_MAX_COST units unless 'max' is given.
+
+    :param expression: the cost expression of the rule or None
+    :param environ: the WSGI environ of the request
+    :return: the cost of the request. at least 1
+    :raises errors.ConfigError: if the expression is invalid
+    """
+    if expression is None:
+        return 1
+
+    if not isinstance(expression, dict):
+        cost = common.to_int(expression, None)
+        if cost is None or cost < 1:
+            raise errors.ConfigError("invalid cost '{0}'".format(expression))
+        return cost
+
+    environ = environ or {}
+    if 'query' in expression:
+        values = parse.parse_qs(environ.get('QUERY_STRING', '')).get(expression['query'], [])
+        value = values[0] if values else None
+    elif 'header' in expression:
+        value = environ.get('HTTP_' + str(expression['header']).upper().replace('-', '_'))
+    elif expression.get('content_length'):
+        value = environ.get('CONTENT_LENGTH')
+    else:
+        raise errors.ConfigError("invalid cost expression '{0}'".format(expression))
+
+    per = common.to_int(expression.get('per'), 1)
+    if per < 1:
+        raise errors.ConfigError("invalid cost bucket size '{0}'".format(expression.get('per')))
+
+    # Requests without the parameter or with an invalid value cost one unit.
+    cost = max(1, int(math.ceil(common.to_int(value, 1) / float(per))))
+    max_cost = common.to_int(expression.get('max'), DEFAULT_MAX_COST)
+    return min(cost, max(1, max_cost))
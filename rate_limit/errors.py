@@ -29,3 +29,21 @@ class LimesError(Exception):
     """Raised when rate limits cannot be fetched from limes."""
 
     pass
+
+
+class PeerError(Exception):
+    """Raised when a rate limit check cannot be forwarded to a peer."""
+
+    pass
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call to the backend is not attempted because the circuit is open."""
+
+    pass
+
+
+class LatencyBudgetExceededError(Exception):
+    """Raised when a call to the backend exceeds the latency budget."""
+
+    pass
@@ -0,0 +1,106 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import time
+
+from . import common
+
+
+class WindowState(object):
+    """Counters of the current and previous fixed window of a key."""
+
+    __slots__ = ('window_id', 'current', 'previous')
+
+    def __init__(self, window_id):
+        self.window_id = window_id
+        self.current = 0
+        self.previous = 0
+
+
+class LocalRateLimiter(object):
+    """
+    In-process rate limiter used while the backend is unavailable.
+
+    Limits are enforced per process using a sliding window counter.
+    As every process of every replica counts on its own, each limit is divided by the replica count.
+    The number of tracked keys is bounded. The least recently used key is evicted first.
+    """
+
+    def __init__(self, max_keys=10000, replica_count=1):
+        self.__max_keys = max(1, int(max_keys))
+        self.replica_count = replica_count
+        self.__states = collections.OrderedDict()
+
+    @property
+    def replica_count(self):
+        return self.__replica_count
+
+    @replica_count.setter
+    def replica_count(self, count):
+        self.__replica_count = max(1, int(count))
+
+    def __len__(self):
+        return len(self.__states)
+
+    def rate_limit(self, key, window_seconds, max_calls, max_sleep_time_seconds, now=None, cost=1, count=True):
+        """
+        Check and count a request for the given key.
+
+        :param key: the key as returned by common.key_func
+        :param window_seconds: the sliding window in seconds
+        :param max_calls: the max. number of requests per window across all replicas
+        :param max_sleep_time_seconds: max. time a request can be suspended
+        :param now: the current timestamp. defaults to time.time()
+        :param cost: the number of units the request consumes
+        :param count: False to only check whether the request fits without counting it
+        :return: tuple of remaining requests and retry after in seconds like RedisBackend.rate_limit
+        """
+        if window_seconds <= 0 or max_calls < 0:
+            return 1, -1
+
+        now = time.time() if now is None else now
+        window_id = int(now // window_seconds)
+        state = self.__get_state(key, window_id)
+
+        max_calls_per_replica = max(1, int(max_calls) // self.__replica_count)
+        cost = common.window_cost(cost, max_calls_per_replica)
+        is_counted, remaining, retry_after_seconds = common.sliding_window_counter(
+            previous=state.previous,
+            current=state.current,
+            window_seconds=window_seconds,
+            elapsed_seconds=now - window_id * window_seconds,
+            max_calls=max_calls_per_replica,
+            max_sleep_time_seconds=max_sleep_time_seconds,
+            cost=cost,
+        )
+        if is_counted and count:
+            state.current += cost
+        return remaining, retry_after_seconds
+
+    def __get_state(self, key, window_id):
+        # Re-inserted to mark the key as recently used.
+        state = self.__states.pop(key, None)
+        if state is None:
+            if len(self.__states) >= self.__max_keys:
+                self.__states.popitem(last=False)
+            state = WindowState(window_id)
+        self.__states[key] = state
+
+        # Roll the fixed windows forward.
+        if state.window_id != window_id:
+            state.previous = state.current if state.window_id == window_id - 1 else 0
+            state.current = 0
+            state.window_id = window_id
+        return state
@@ -13,48 +13,154 @@
 # under the License.
 
 import os
+import time
 
-from oslo_config import cfg
-from oslo_log import log as logging
+# The oslo configuration. Set once logging is setup.
+CONF = None
+_is_setup = False
+# Whether debug logging is enabled. Resolved on first use and by refresh.
+_debug_enabled = None
 
-CONF = cfg.CONF
 
-
-class Logger(object):
+def _setup(product_name):
     """
-    Logger that attempts to log and ignores any error.
+    Register the options and setup oslo.log once per process.
+    oslo is imported on demand, so that importing this package doesn't pay for it.
 
+    :param product_name: the name of the product
+    :return: the oslo.log module
     """
-    def __init__(self, name, product_name='rate_limit'):
-        self.__logger = logging.getLogger(name)
+    global CONF, _is_setup
+    from oslo_config import cfg
+    from oslo_log import log as logging
+
+    if not _is_setup:
+        CONF = cfg.CONF
         try:
             logging.register_options(CONF)
             logging.setup(CONF, product_name)
         except cfg.ArgsAlreadyParsedError:
             # Ignore error if args are already registered.
             pass
+        _is_setup = True
+    return logging
+
+
+def is_debug_enabled():
+    """
+    Check whether debug logging is enabled via the oslo configuration or the DEBUG environment variable.
+    Resolved once, so that the check on the hot path is a global lookup.
+
+    :return: bool
+    """
+    global _debug_enabled
+    if _debug_enabled is None:
+        try:
+            _setup('rate_limit')
+            _debug_enabled = bool(CONF.debug or os.getenv("DEBUG", False))
+        except Exception:
+            _debug_enabled = bool(os.getenv("DEBUG", False))
+    return _debug_enabled
+
+
+def refresh():
+    """Resolve whether debug logging is enabled again, e.g. after the configuration was reloaded."""
+    global _debug_enabled
+    _debug_enabled = None
+    return is_debug_enabled()
+
+
+def _format(msg, args):
+    if not args:
+        return msg
+    return msg.format(*args)
+
+
+class LogSampler(object):
+    """
+    Limits logs per key to one per interval, so that e.g. logs of suspended requests don't flood under load.
+    The number of suppressed logs is reported with the next log of the key.
+    """
+
+    def __init__(self, interval_seconds=60, max_keys=10000):
+        """
+        Create a new LogSampler.
+
+        :param interval_seconds: the min. time between two logs of the same key. 0 disables sampling
+        :param max_keys: the max. number of tracked keys. all keys are forgotten once exceeded
+        """
+        self.__interval_seconds = interval_seconds
+        self.__max_keys = max(1, max_keys)
+        # Mapping of key to the time of its last log and the number of logs suppressed since.
+        self.__keys = {}
+
+    def sample(self, key, now=None):
+        """
+        Check whether a log of the key should be emitted.
+
+        :param key: the key, e.g. the rate limit key of the request
+        :param now: the current timestamp. defaults to time.time()
+        :return: the number of suppressed logs since the last log of the key or None if the log is suppressed
+        """
+        if self.__interval_seconds <= 0:
+            return 0
+        now = time.time() if now is None else now
+        logged_at, suppressed = self.__keys.get(key, (None, 0))
+        if logged_at is not None and now - logged_at < self.__interval_seconds:
+            self.__keys[key] = (logged_at, suppressed + 1)
+            return None
+        if logged_at is None and len(self.__keys) >= self.__max_keys:
+            self.__keys.clear()
+        self.__keys[key] = (now, 0)
+        return suppressed
+
+
+class Logger(object):
+    """
+    Logger that attempts to log and ignores any error.
+    The underlying logger is created on first use. Loggers created at import time, e.g. as default arguments, are cheap.
+
+    Arguments are passed to msg.format only if the message is logged, e.g. logger.debug("got {0}", value).
+    Thus, disabled debug logs on the hot path don't pay for formatting.
+    """
+    def __init__(self, name, product_name='rate_limit'):
+        self.__name = name
+        self.__product_name = product_name
+        self.__logger = None
+
+    @property
+    def _logger(self):
+        if self.__logger is None:
+            self.__logger = _setup(self.__product_name).getLogger(self.__name)
+        return self.__logger
+
+    @property
+    def is_debug_enabled(self):
+        """Whether debug logs are emitted. Guard expensive arguments of debug logs with this."""
+        return _debug_enabled if _debug_enabled is not None else is_debug_enabled()
 
-    def info(self, msg):
+    def info(self, msg, *args):
         try:
-            self.__logger.info(msg)
+            self._logger.info(_format(msg, args))
         except Exception:
             pass
 
-    def warning(self, msg):
+    def warning(self, msg, *args):
         try:
-            self.__logger.warning(msg)
+            self._logger.warning(_format(msg, args))
         except Exception:
             pass
 
-    def error(self, msg):
+    def error(self, msg, *args):
         try:
-            self.__logger.error(msg)
+            self._logger.error(_format(msg, args))
         except Exception:
             pass
 
-    def debug(self, msg):
+    def debug(self, msg, *args):
+        if not self.is_debug_enabled:
+            return
         try:
-            if CONF.debug or os.getenv("DEBUG", False):
-                self.__logger.debug(msg)
+            self._logger.debug(_format(msg, args))
         except Exception:
             pass
@@ -0,0 +1,56 @@
+-- Factor of the adaptive limits adjusted via additive-increase/multiplicative-decrease (AIMD).
+-- The factor is decreased at most once per interval, so that the overload reported by multiple
+-- replicas within an interval is not compounded, and increased only if it wasn't adjusted within the interval.
+local key, overloaded, increase, decrease, min_factor, interval_microseconds, now_int
+key = tostring(KEYS[1])
+-- 1 to decrease, 0 to increase, -1 to only read the factor.
+overloaded = tonumber(KEYS[2])
+increase = tonumber(KEYS[3])
+decrease = tonumber(KEYS[4])
+min_factor = tonumber(KEYS[5])
+interval_microseconds = tonumber(KEYS[6])
+-- Timestamp in microseconds. Empty to use the clock of the redis server.
+now_int = tonumber(KEYS[7])
+
+local state = redis.call('hmget', key, 'factor', 'adjusted_at', 'decreased_at')
+local factor = tonumber(state[1]) or 1
+-- Lua numbers are converted to integers in redis replies. Return the factor as string.
+if overloaded < 0 then
+    return tostring(factor)
+end
+
+if not now_int then
+    -- TIME is non-deterministic. Replicate the effects of the script instead of the script itself.
+    if redis.replicate_commands then
+        redis.replicate_commands()
+    end
+    local time = redis.call('TIME')
+    now_int = tonumber(time[1]) * 1000000 + tonumber(time[2])
+end
+
+local adjusted_at = tonumber(state[2])
+local decreased_at = tonumber(state[3])
+if overloaded == 1 then
+    if not decreased_at or now_int - decreased_at >= interval_microseconds then
+        factor = math.max(min_factor, factor * decrease)
+        adjusted_at = now_int
+        decreased_at = now_int
+    end
+elseif factor < 1 and (not adjusted_at or now_int - adjusted_at >= interval_microseconds) then
+    factor = math.min(1, factor + increase)
+    adjusted_at = now_int
+end
+
+-- The timestamps are kept until the interval passed, so that the guards above still apply.
+if factor >= 1 and (not adjusted_at or now_int - adjusted_at >= interval_microseconds) then
+    redis.call('del', key)
+    return '1'
+end
+
+redis.call(
+    'hmset', key, 'factor', tostring(factor),
+    'adjusted_at', string.format('%d', adjusted_at), 'decreased_at', string.format('%d', decreased_at or 0)
+)
+-- Without reports, e.g. if the adaptive limits were disabled, the configured limits apply again eventually.
+redis.call('pexpire', key, math.ceil(interval_microseconds / 1000) * 10)
+return tostring(factor)
@@ -0,0 +1,31 @@
+-- Acquire a slot of the in-flight requests of a key.
+-- Every slot is a member of a sorted set scored by the expiry of its lease,
+-- so that slots of requests that never completed are eventually freed.
+-- Released via ZREM.
+local key, max_concurrency, lease_microseconds, slot_id, now_int
+key = tostring(KEYS[1])
+max_concurrency = tonumber(KEYS[2])
+lease_microseconds = tonumber(KEYS[3])
+slot_id = tostring(KEYS[4])
+-- Timestamp in microseconds. Empty to use the clock of the redis server.
+now_int = tonumber(KEYS[5])
+
+if not now_int then
+    -- TIME is non-deterministic. Replicate the effects of the script instead of the script itself.
+    if redis.replicate_commands then
+        redis.replicate_commands()
+    end
+    local time = redis.call('TIME')
+    now_int = tonumber(time[1]) * 1000000 + tonumber(time[2])
+end
+
+-- Free the slots whose lease expired.
+redis.call('zremrangebyscore', key, '-inf', now_int)
+
+if redis.call('zcard', key) >= max_concurrency then
+    return 0
+end
+
+redis.call('zadd', key, now_int + lease_microseconds, slot_id)
+redis.call('pexpire', key, math.ceil(lease_microseconds / 1000))
+return 1
@@ -6,43 +6,133 @@ max_calls_int = tonumber(KEYS[4])
 window_seconds_int = tonumber(KEYS[5])
 max_sleep_time_seconds_int = tonumber(KEYS[6])
 clock_accuracy_int = tonumber(KEYS[7])
+-- Optional. Store members base62 encoded instead of as decimal timestamps.
+local compact_members = KEYS[8] == '1'
+-- Optional. Number of units the request consumes. A request costing more than the limit consumes the whole window.
+local cost = math.max(1, math.min(tonumber(KEYS[9]) or 1, max_calls_int))
+
+local function encode_member(timestamp)
+    if not compact_members then
+        return timestamp
+    end
+    local alphabet, digits, digit = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz', {}, 0
+    timestamp = math.floor(timestamp)
+    repeat
+        digit = timestamp % 62
+        table.insert(digits, 1, string.sub(alphabet, digit + 1, digit + 1))
+        timestamp = math.floor(timestamp / 62)
+    until timestamp <= 0
+    return table.concat(digits)
+end
+
+-- Requests costing more than 1 unit are stored as a single member suffixed with '#<cost>'.
+-- The units exceeding 1 per member are summed up in a separate key, so that the window is counted in constant time.
+local weight_key = key .. ':weight'
+-- Whether the key of the units exists.
+local is_weighted = false
+
+local function weight(member)
+    return tonumber(string.match(member, '#(%d+)$')) or 1
+end
+
+-- Remove the requests older than the window and return the number of units in the window.
+local function trim(max_score)
+    local extra = tonumber(redis.call('get', weight_key))
+    if extra then
+        local freed = 0
+        for _, member in ipairs(redis.call('zrangebyscore', key, '-inf', max_score)) do
+            freed = freed + weight(member) - 1
+        end
+        if freed >= extra then
+            redis.call('del', weight_key)
+            extra = 0
+        else
+            is_weighted = true
+            if freed > 0 then
+                extra = redis.call('decrby', weight_key, freed)
+            end
+        end
+    end
+    redis.call('zremrangebyscore', key, '-inf', max_score)
+    return redis.call('zcard', key) + (extra or 0)
+end
+
+-- Score of the oldest request after which the given number of units left the window.
+local function release_score(units)
+    local offset, released = 0, 0
+    while true do
+        local members = redis.call('zrange', key, offset, offset + 99, 'WITHSCORES')
+        if #members == 0 then
+            return nil
+        end
+        for i = 1, #members, 2 do
+            released = released + weight(members[i])
+            if released >= units then
+                return tonumber(members[i + 1])
+            end
+        end
+        offset = offset + 100
+    end
+end
+
+local function count(timestamp)
+    local member = encode_member(timestamp)
+    if cost > 1 then
+        -- Format explicitly as tostring would use the exponent notation.
+        member = (compact_members and member or string.format('%d', timestamp)) .. '#' .. cost
+        if redis.call('zadd', key, timestamp, member) == 1 then
+            redis.call('incrby', weight_key, cost - 1)
+            is_weighted = true
+        end
+    else
+        redis.call('zadd', key, timestamp, member)
+    end
+end
+
+local function expire(seconds)
+    redis.call('expire', key, seconds)
+    if is_weighted then
+        redis.call('expire', weight_key, seconds)
+    end
+end
 
 -- Rate limit algorithm inspired by https://engineering.classdojo.com/blog/2015/02/06/rolling-rate-limiter
 -- While this works well for rate limiting we need a slightly more advanced lua script for shaping the traffic,
 -- like allowing burst requests with delayed/not delayed execution.
 -- Remove all API calls that are older than the sliding window.
-redis.call('zremrangebyscore', key, '-inf', lookback_timestamp_max_int)
--- List of API calls for the key sorted by time.
-local reqs, remaining, timestamp0, retry_after_seconds
-reqs = redis.call('zrangebyscore', key, '-inf', 'inf')
 -- Get number of remaining requests.
-remaining = tonumber(max_calls_int - #reqs)
+local remaining, timestamp0, retry_after_seconds
+remaining = tonumber(max_calls_int - trim(lookback_timestamp_max_int))
 
 -- Add timestamp of current request if there are remaining requests (aka rate limit not reached).
-if remaining > 0 then
+if remaining >= cost then
     -- Add timestamp if we still have remaining requests.
-    redis.call('zadd', key, now_int, now_int)
+    count(now_int)
     -- Reset expiry time for key.
-    redis.call('expire', key, window_seconds_int)
+    expire(window_seconds_int)
     -- Return the number of remaining requests. Retry after not relevant.
-    return {remaining, -1}
+    return {remaining - cost + 1, -1}
 end
 
 -- Rate limit reached but check if the requests can be suspended.
--- Get timestamp of 1st requests in current window.
-timestamp0 = reqs[1]
+-- Get timestamp of the request that has to leave the window before this one fits. The 1st for a cost of 1.
+-- The score is the timestamp. The member might be encoded.
+timestamp0 = release_score(cost - math.max(remaining, 0))
+if not timestamp0 then
+    return {0, 2 * max_sleep_time_seconds_int}
+end
 -- Calculate how long the request would need to be suspended.
 retry_after_seconds = tonumber(math.ceil(timestamp0 + window_seconds_int - now_int) / clock_accuracy_int)
 -- Can the requests be suspended and processed later?
-if (retry_after_seconds < max_sleep_time_seconds_int) and (remaining - 1 >= -max_calls_int) then
+if (retry_after_seconds < max_sleep_time_seconds_int) and (remaining - cost >= -max_calls_int) then
     -- Time when requests will actually be executed.
     now_int = tonumber(now_int + (retry_after_seconds * clock_accuracy_int))
     -- Add timestamp to the list.
-    redis.call('zadd', key, now_int, now_int)
+    count(now_int)
     -- Reset expiry time for key.
-    redis.call('expire', key, window_seconds_int)
+    expire(window_seconds_int)
     -- Return if the request can be suspended.
-    return {remaining - 1 , retry_after_seconds}
+    return {remaining - cost, retry_after_seconds}
 end
 
 -- Return if no more remaining requests and suspending request not possible.
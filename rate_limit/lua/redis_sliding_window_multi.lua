@@ -0,0 +1,172 @@
+-- Sliding window rate limit across multiple windows, e.g. 10r/s and 1000r/h, in a single atomic call.
+-- KEYS: one sorted set per window.
+-- ARGV: now (empty to use the clock of the redis server), clock accuracy, max. sleep time in seconds,
+--       compact members ('1' or '0'), member id (optional), cost of the request,
+--       followed by max. calls and window per key.
+-- Returns the remaining requests of the tightest window, the retry after in seconds
+-- and the (1-based) index of the tightest window.
+local now_int, clock_accuracy_int, max_sleep_time_seconds_int, compact_members, member_id
+now_int = tonumber(ARGV[1])
+clock_accuracy_int = tonumber(ARGV[2])
+max_sleep_time_seconds_int = tonumber(ARGV[3])
+compact_members = ARGV[4] == '1'
+member_id = ARGV[5] or ''
+local cost = tonumber(ARGV[6]) or 1
+
+if not now_int then
+    -- TIME is non-deterministic. Replicate the effects of the script instead of the script itself.
+    if redis.replicate_commands then
+        redis.replicate_commands()
+    end
+    local time = redis.call('TIME')
+    now_int = tonumber(time[1]) * 1000000 + tonumber(time[2])
+    clock_accuracy_int = 1000000
+end
+
+local function encode_member(timestamp)
+    local member
+    if compact_members then
+        local alphabet, digits, digit = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz', {}, 0
+        timestamp = math.floor(timestamp)
+        repeat
+            digit = timestamp % 62
+            table.insert(digits, 1, string.sub(alphabet, digit + 1, digit + 1))
+            timestamp = math.floor(timestamp / 62)
+        until timestamp <= 0
+        member = table.concat(digits)
+    else
+        member = string.format('%d', timestamp)
+    end
+    if member_id ~= '' then
+        member = member .. ':' .. member_id
+    end
+    return member
+end
+
+-- Requests costing more than 1 unit are stored as a single member suffixed with '#<cost>'.
+-- The units exceeding 1 per member are summed up in a separate key per window,
+-- so that a window is counted in constant time.
+-- Keys of windows whose key of the units exists.
+local weighted_keys = {}
+
+local function weight(member)
+    return tonumber(string.match(member, '#(%d+)$')) or 1
+end
+
+-- Remove the requests older than the window and return the number of units in the window.
+local function trim(key, max_score)
+    local weight_key = key .. ':weight'
+    local extra = tonumber(redis.call('get', weight_key))
+    if extra then
+        local freed = 0
+        for _, member in ipairs(redis.call('zrangebyscore', key, '-inf', max_score)) do
+            freed = freed + weight(member) - 1
+        end
+        if freed >= extra then
+            redis.call('del', weight_key)
+            extra = 0
+        else
+            weighted_keys[key] = true
+            if freed > 0 then
+                extra = redis.call('decrby', weight_key, freed)
+            end
+        end
+    end
+    redis.call('zremrangebyscore', key, '-inf', max_score)
+    return redis.call('zcard', key) + (extra or 0)
+end
+
+-- Score of the oldest request after which the given number of units left the window.
+local function release_score(key, units)
+    local offset, released = 0, 0
+    while true do
+        local members = redis.call('zrange', key, offset, offset + 99, 'WITHSCORES')
+        if #members == 0 then
+            return nil
+        end
+        for i = 1, #members, 2 do
+            released = released + weight(members[i])
+            if released >= units then
+                return tonumber(members[i + 1])
+            end
+        end
+        offset = offset + 100
+    end
+end
+
+-- A request costing more than the limit of a window consumes the whole window.
+local function window_cost(max_calls_int)
+    return math.max(1, math.min(cost, max_calls_int))
+end
+
+-- Evaluate all windows before the request is counted in any of them.
+-- The tightest window is the exhausted one with the longest retry after or the one with the fewest remaining requests.
+local remaining_min, retry_after_seconds, tightest, is_exhausted = nil, -1, 1, false
+for i, key in ipairs(KEYS) do
+    local max_calls_int = tonumber(ARGV[5 + 2 * i])
+    local window_int = tonumber(ARGV[6 + 2 * i])
+    local cost_int = window_cost(max_calls_int)
+    -- Remaining requests after this one was counted, so that windows with a different cost are comparable.
+    local remaining = max_calls_int - trim(key, now_int - window_int) - cost_int + 1
+
+    if remaining >= 1 then
+        if not is_exhausted and (remaining_min == nil or remaining < remaining_min) then
+            tightest = i
+        end
+    else
+        local retry = 2 * max_sleep_time_seconds_int
+        -- The request cannot be suspended if the window is already exhausted by suspended requests.
+        if remaining - 1 >= -max_calls_int then
+            -- Time until enough requests left the window. The first one for a cost of 1.
+            local first = release_score(key, cost_int - math.max(remaining + cost_int - 1, 0))
+            if first then
+                retry = (first + window_int - now_int) / clock_accuracy_int
+            end
+        end
+        if not is_exhausted or retry > retry_after_seconds then
+            retry_after_seconds = retry
+            tightest = i
+        end
+        is_exhausted = true
+    end
+    if remaining_min == nil or remaining < remaining_min then
+        remaining_min = remaining
+    end
+end
+
+local function count(timestamp)
+    local member = encode_member(timestamp)
+    for i, key in ipairs(KEYS) do
+        local cost_int = window_cost(tonumber(ARGV[5 + 2 * i]))
+        local window_int = tonumber(ARGV[6 + 2 * i])
+        local weight_key = key .. ':weight'
+        if cost_int > 1 then
+            if redis.call('zadd', key, timestamp, member .. '#' .. cost_int) == 1 then
+                redis.call('incrby', weight_key, cost_int - 1)
+                weighted_keys[key] = true
+            end
+        else
+            redis.call('zadd', key, timestamp, member)
+        end
+        local ttl = math.ceil(window_int * 1000 / clock_accuracy_int) + max_sleep_time_seconds_int * 1000
+        redis.call('pexpire', key, ttl)
+        if weighted_keys[key] then
+            redis.call('pexpire', weight_key, ttl)
+        end
+    end
+end
+
+-- Count the request in all windows if none is exhausted.
+if not is_exhausted then
+    count(now_int)
+    return {remaining_min, -1, tightest}
+end
+
+-- Suspend the request until it fits all windows.
+if retry_after_seconds < max_sleep_time_seconds_int then
+    count(now_int + math.ceil(retry_after_seconds * clock_accuracy_int))
+    return {remaining_min - 1, math.ceil(retry_after_seconds), tightest}
+end
+
+-- Return if no more remaining requests and suspending request not possible.
+return {0, 2 * max_sleep_time_seconds_int, tightest}
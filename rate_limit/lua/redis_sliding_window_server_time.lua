@@ -0,0 +1,139 @@
+local key, max_calls_int, window_microseconds_int, max_sleep_time_seconds_int, member_id
+key = tostring(KEYS[1])
+max_calls_int = tonumber(KEYS[2])
+window_microseconds_int = tonumber(KEYS[3])
+max_sleep_time_seconds_int = tonumber(KEYS[4])
+member_id = tostring(KEYS[5])
+-- Optional. Encode the timestamp of members base62 instead of decimal.
+local compact_members = KEYS[6] == '1'
+-- Optional. Number of units the request consumes. A request costing more than the limit consumes the whole window.
+local cost = math.max(1, math.min(tonumber(KEYS[7]) or 1, max_calls_int))
+
+local function encode_member(timestamp)
+    if not compact_members then
+        return string.format('%d:%s', timestamp, member_id)
+    end
+    local alphabet, digits, digit = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz', {}, 0
+    repeat
+        digit = timestamp % 62
+        table.insert(digits, 1, string.sub(alphabet, digit + 1, digit + 1))
+        timestamp = math.floor(timestamp / 62)
+    until timestamp <= 0
+    return table.concat(digits) .. ':' .. member_id
+end
+
+-- Requests costing more than 1 unit are stored as a single member suffixed with '#<cost>'.
+-- The units exceeding 1 per member are summed up in a separate key, so that the window is counted in constant time.
+local weight_key = key .. ':weight'
+-- Whether the key of the units exists.
+local is_weighted = false
+
+local function weight(member)
+    return tonumber(string.match(member, '#(%d+)$')) or 1
+end
+
+-- Remove the requests older than the window and return the number of units in the window.
+local function trim(max_score)
+    local extra = tonumber(redis.call('get', weight_key))
+    if extra then
+        local freed = 0
+        for _, member in ipairs(redis.call('zrangebyscore', key, '-inf', max_score)) do
+            freed = freed + weight(member) - 1
+        end
+        if freed >= extra then
+            redis.call('del', weight_key)
+            extra = 0
+        else
+            is_weighted = true
+            if freed > 0 then
+                extra = redis.call('decrby', weight_key, freed)
+            end
+        end
+    end
+    redis.call('zremrangebyscore', key, '-inf', max_score)
+    return redis.call('zcard', key) + (extra or 0)
+end
+
+-- Score of the oldest request after which the given number of units left the window.
+local function release_score(units)
+    local offset, released = 0, 0
+    while true do
+        local members = redis.call('zrange', key, offset, offset + 99, 'WITHSCORES')
+        if #members == 0 then
+            return nil
+        end
+        for i = 1, #members, 2 do
+            released = released + weight(members[i])
+            if released >= units then
+                return tonumber(members[i + 1])
+            end
+        end
+        offset = offset + 100
+    end
+end
+
+local function count(timestamp)
+    local member = encode_member(timestamp)
+    if cost > 1 then
+        member = member .. '#' .. cost
+        if redis.call('zadd', key, timestamp, member) == 1 then
+            redis.call('incrby', weight_key, cost - 1)
+            is_weighted = true
+        end
+    else
+        redis.call('zadd', key, timestamp, member)
+    end
+end
+
+local function pexpire(milliseconds)
+    redis.call('pexpire', key, milliseconds)
+    if is_weighted then
+        redis.call('pexpire', weight_key, milliseconds)
+    end
+end
+
+-- Same algorithm as redis_sliding_window.lua but using the clock of the redis server.
+-- TIME is non-deterministic. Replicate the effects of the script instead of the script itself.
+-- Default since redis 5. The call is a no-op in later versions.
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+
+-- Timestamp in microseconds.
+local time, now_int
+time = redis.call('TIME')
+now_int = tonumber(time[1]) * 1000000 + tonumber(time[2])
+
+-- Remove all API calls that are older than the sliding window.
+-- Get number of remaining requests.
+local remaining, timestamp0, retry_after_seconds
+remaining = max_calls_int - trim(now_int - window_microseconds_int)
+
+-- Members are unique even if multiple requests are counted within the same microsecond.
+-- The score is the timestamp. Format explicitly as tostring would use the exponent notation.
+if remaining >= cost then
+    count(now_int)
+    pexpire(math.ceil(window_microseconds_int / 1000))
+    return {remaining - cost + 1, -1}
+end
+
+-- Rate limit reached but check if the requests can be suspended.
+-- Get timestamp of the request that has to leave the window before this one fits. The 1st for a cost of 1.
+timestamp0 = release_score(cost - math.max(remaining, 0))
+if not timestamp0 then
+    return {0, 2 * max_sleep_time_seconds_int}
+end
+-- Calculate how long the request would need to be suspended.
+retry_after_seconds = (timestamp0 + window_microseconds_int - now_int) / 1000000
+-- Can the requests be suspended and processed later?
+if (retry_after_seconds < max_sleep_time_seconds_int) and (remaining - cost >= -max_calls_int) then
+    -- Time when requests will actually be executed.
+    now_int = timestamp0 + window_microseconds_int
+    count(now_int)
+    pexpire(math.ceil(window_microseconds_int / 1000) + max_sleep_time_seconds_int * 1000)
+    return {remaining - cost, math.ceil(retry_after_seconds)}
+end
+
+-- Return if no more remaining requests and suspending request not possible.
+-- Ensure the 2nd argument (retry_after is greater than max_sleep_time_seconds_int)
+return {0, 2 * max_sleep_time_seconds_int}
@@ -0,0 +1,39 @@
+-- Token bucket implemented as generic cell rate algorithm (GCRA).
+-- Tokens are reserved: The reservation always succeeds and the time until the tokens are available is returned.
+-- Only the theoretical arrival time (tat) of the next token in microseconds is stored per key.
+local key, amount, rate, burst, now_int
+key = tostring(KEYS[1])
+amount = tonumber(KEYS[2])
+-- Tokens added per second.
+rate = tonumber(KEYS[3])
+-- Capacity of the bucket.
+burst = tonumber(KEYS[4])
+-- Timestamp in microseconds. Empty to use the clock of the redis server.
+now_int = tonumber(KEYS[5])
+
+if not now_int then
+    -- TIME is non-deterministic. Replicate the effects of the script instead of the script itself.
+    if redis.replicate_commands then
+        redis.replicate_commands()
+    end
+    local time = redis.call('TIME')
+    now_int = tonumber(time[1]) * 1000000 + tonumber(time[2])
+end
+
+-- Microseconds per token.
+local interval = 1000000 / rate
+local tat = tonumber(redis.call('get', key)) or now_int
+if tat < now_int then
+    tat = now_int
+end
+local new_tat = math.ceil(tat + amount * interval)
+
+-- The bucket is full again once the theoretical arrival time passed. Expire the key afterwards.
+redis.call('set', key, string.format('%d', new_tat), 'PX', math.ceil((new_tat - now_int) / 1000) + 1000)
+
+-- Time in microseconds until the reserved tokens are available.
+local wait = new_tat - burst * interval - now_int
+if wait < 0 then
+    return 0
+end
+return math.ceil(wait)
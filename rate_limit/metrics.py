@@ -0,0 +1,46 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+def new_statsd_client(host, port, namespace):
+    """
+    Create a StatsD client.
+    The datadog package is imported on demand, since it takes long to import.
+
+    :param host: the StatsD host
+    :param port: the StatsD port
+    :param namespace: the prefix of all metrics
+    :return: the DogStatsd client
+    """
+    from datadog.dogstatsd import DogStatsd
+    return DogStatsd(host=host, port=port, namespace=namespace)
+
+
+class NullMetricsClient(object):
+    """Metrics client discarding all metrics. Used if metrics are disabled."""
+
+    def increment(self, metric, value=1, tags=None, sample_rate=1):
+        pass
+
+    def gauge(self, metric, value, tags=None, sample_rate=1):
+        pass
+
+    def histogram(self, metric, value, tags=None, sample_rate=1):
+        pass
+
+    def open_buffer(self, max_buffer_size=50):
+        pass
+
+    def close_buffer(self):
+        pass
@@ -0,0 +1,162 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import struct
+
+
+def _hash(scope):
+    """Stable 64 bit hash of the scope. Zero marks an empty slot."""
+    digest = hashlib.sha1(str(scope).encode('utf-8')).digest()
+    return struct.unpack_from('<Q', digest)[0] or 1
+
+
+class OverrideIndex(object):
+    """
+    Compact hash index of the rate limit overrides per scope, e.g. per project.
+
+    Scopes are stored as 64 bit hashes in an open addressing table with linear probing, each pointing to a set of rules.
+    Identical sets of rules are stored once. Thus, an override costs 12 bytes per slot regardless of the length of
+    the scope and lookups remain O(1). Sets of rules are stored as JSON and parsed on first use.
+    The index is a flat buffer, so it can be embedded in a compiled configuration and memory-mapped.
+
+    Layout: capacity, number of scopes, number of rule sets (uint32 each), hashes (uint64 per slot),
+    rule set ids (uint32 per slot), offsets of the rule sets (uint32, number of rule sets + 1), JSON encoded rule sets.
+    """
+
+    HEADER = struct.Struct('<III')
+    HASH = struct.Struct('<Q')
+    UINT32 = struct.Struct('<I')
+
+    def __init__(self, buf, offset=0):
+        """
+        Create a new OverrideIndex.
+
+        :param buf: the buffer as returned by pack or the mmap of the compiled configuration
+        :param offset: the offset of the index in the buffer
+        """
+        self.__buf = buf
+        self.__capacity, self.__count, self.__set_count = self.HEADER.unpack_from(buf, offset)
+        self.__hashes_start = offset + self.HEADER.size
+        self.__ids_start = self.__hashes_start + self.__capacity * self.HASH.size
+        self.__set_offsets_start = self.__ids_start + self.__capacity * self.UINT32.size
+        self.__sets_start = self.__set_offsets_start + (self.__set_count + 1) * self.UINT32.size
+        # Parsed rule sets by id.
+        self.__rule_sets = {}
+
+    def __len__(self):
+        return self.__count
+
+    def get(self, scope):
+        """
+        Get the overrides of a scope.
+
+        :param scope: the scope, e.g. the project id
+        :return: the rules per target type URI or None if the scope has no overrides
+        """
+        if not self.__capacity or scope is None:
+            return None
+        key_hash = _hash(scope)
+        mask = self.__capacity - 1
+        idx = key_hash & mask
+        for _ in range(self.__capacity):
+            stored_hash = self.HASH.unpack_from(self.__buf, self.__hashes_start + idx * self.HASH.size)[0]
+            if stored_hash == 0:
+                return None
+            if stored_hash == key_hash:
+                set_id = self.UINT32.unpack_from(self.__buf, self.__ids_start + idx * self.UINT32.size)[0]
+                return self.__rule_set(set_id)
+            idx = (idx + 1) & mask
+        return None
+
+    def rule_sets(self):
+        """
+        Iterate over the distinct sets of rules, e.g. to inspect the configuration once after it was loaded.
+        The sets are parsed on every call and not kept.
+
+        :return: generator of the rules per target type URI
+        """
+        for set_id in range(self.__set_count):
+            rule_set = self.__rule_sets.get(set_id, None)
+            if rule_set is None:
+                rule_set = json.loads(self.__rule_set_bytes(set_id).decode('utf-8'))
+            yield rule_set
+
+    def __rule_set(self, set_id):
+        rule_set = self.__rule_sets.get(set_id, None)
+        if rule_set is None:
+            rule_set = json.loads(self.__rule_set_bytes(set_id).decode('utf-8'))
+            self.__rule_sets[set_id] = rule_set
+        return rule_set
+
+    def __rule_set_bytes(self, set_id):
+        start, end = struct.unpack_from('<II', self.__buf, self.__set_offsets_start + set_id * self.UINT32.size)
+        return bytes(self.__buf[self.__sets_start + start:self.__sets_start + end])
+
+    @classmethod
+    def pack(cls, overrides):
+        """
+        Pack the overrides into an index.
+
+        :param overrides: dictionary of scope and rules per target type URI
+        :return: the index as bytes
+        """
+        overrides = overrides or {}
+        # Power of 2 with a load factor of at most 0.5.
+        capacity = 0
+        if overrides:
+            capacity = 1
+            while capacity < 2 * len(overrides):
+                capacity *= 2
+
+        set_ids = {}
+        rule_sets = []
+        hashes = [0] * capacity
+        ids = [0] * capacity
+        for scope, rules in overrides.items():
+            encoded = json.dumps(rules, sort_keys=True, default=str).encode('utf-8')
+            set_id = set_ids.get(encoded, None)
+            if set_id is None:
+                set_id = set_ids[encoded] = len(rule_sets)
+                rule_sets.append(encoded)
+
+            key_hash = _hash(scope)
+            idx = key_hash & (capacity - 1)
+            while hashes[idx] not in (0, key_hash):
+                idx = (idx + 1) & (capacity - 1)
+            hashes[idx] = key_hash
+            ids[idx] = set_id
+
+        offsets = [0]
+        for encoded in rule_sets:
+            offsets.append(offsets[-1] + len(encoded))
+        return b''.join([
+            cls.HEADER.pack(capacity, len(overrides), len(rule_sets)),
+            struct.pack('<{0}Q'.format(capacity), *hashes),
+            struct.pack('<{0}I'.format(capacity), *ids),
+            struct.pack('<{0}I'.format(len(offsets)), *offsets),
+        ] + rule_sets)
+
+
+def to_index(overrides):
+    """
+    Get the index of the overrides. Indexes of a compiled configuration are returned as is.
+
+    :param overrides: dictionary of scope and rules per target type URI or an OverrideIndex
+    :return: the OverrideIndex
+    """
+    if isinstance(overrides, OverrideIndex):
+        return overrides
+    return OverrideIndex(OverrideIndex.pack(overrides))
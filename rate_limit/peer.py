@@ -0,0 +1,206 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import eventlet
+import hashlib
+import hmac
+import json
+import socket
+
+from eventlet import semaphore
+
+from . import batch
+from . import errors
+from . import log
+
+
+def load_peers(peers=None, peers_file=None):
+    """
+    Load the list of peers from a comma-separated string or a file containing one peer per line.
+
+    :param peers: comma-separated list of peers, e.g. '10.0.0.1:7946,10.0.0.2:7946'
+    :param peers_file: path to a file containing one peer per line. Lines starting with # are ignored.
+    :return: sorted list of peer addresses '<host>:<port>'
+    """
+    entries = []
+    if peers:
+        entries.extend(peers.split(','))
+    if peers_file:
+        try:
+            with open(peers_file, 'r') as f:
+                entries.extend(line for line in f if not line.strip().startswith('#'))
+        except IOError as e:
+            raise errors.ConfigError("failed to load peers from file {0}: {1}".format(peers_file, str(e)))
+    return sorted(set(e.strip() for e in entries if e.strip()))
+
+
+def split_address(address):
+    """
+    Split a peer address into host and port.
+
+    :param address: the address '<host>:<port>'
+    :return: tuple of host, port
+    """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def sign(secret, checks):
+    """
+    Sign the checks of a request with the secret shared by all peers.
+
+    :param secret: the shared secret
+    :param checks: the list of checks
+    :return: the hex encoded HMAC-SHA256 of the checks
+    """
+    return hmac.new(secret.encode('utf-8'), json.dumps(checks).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class HashRing(object):
+    """Consistent hash ring assigning each key to one of the peers."""
+
+    def __init__(self, peers, virtual_nodes=100):
+        self.__ring = []
+        for peer in peers:
+            for i in range(virtual_nodes):
+                self.__ring.append((self.__hash('{0}#{1}'.format(peer, i)), peer))
+        self.__ring.sort()
+        self.__hashes = [h for h, _ in self.__ring]
+
+    def get_node(self, key):
+        """
+        Get the peer owning the key.
+
+        :param key: the key
+        :return: the address of the peer or None if there are no peers
+        """
+        if not self.__ring:
+            return None
+        idx = bisect.bisect(self.__hashes, self.__hash(key)) % len(self.__ring)
+        return self.__ring[idx][1]
+
+    @staticmethod
+    def __hash(value):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class PeerServer(object):
+    """
+    Serves rate limit checks forwarded by other peers for the keys owned by this peer.
+
+    Protocol: Newline-delimited JSON over TCP.
+    Request:  {"checks": [[key, window_seconds, max_calls, max_sleep_time_seconds, cost, count], ..], "signature": hmac}
+    Response: {"results": [[remaining, retry_after_seconds], ..]}
+
+    The port is bound exclusively. Multiple processes serving the same address would each count the keys
+    in their own memory, while the kernel spreads the connections of the other peers across them.
+    """
+
+    def __init__(self, host, port, rate_limit_func, secret=None, logger=log.Logger(__name__)):
+        """
+        Create a new PeerServer and start listening.
+
+        :param host: the host to listen on
+        :param port: the port to listen on
+        :param rate_limit_func: callable(key, window_seconds, max_calls, max_sleep_time_seconds, cost=1, count=True)
+            returning tuple of remaining requests, retry after seconds
+        :param secret: optional secret shared by all peers. requests without a valid signature are rejected
+        :param logger: the logger
+        :raises socket.error: if the address is already served, e.g. by another worker process on the same host
+        """
+        self.__rate_limit_func = rate_limit_func
+        self.__secret = secret
+        self.logger = logger
+        # eventlet enables SO_REUSEPORT by default, which would let every worker process bind the port.
+        self.__sock = eventlet.listen((host, port), reuse_port=False)
+        self.__server = eventlet.spawn(eventlet.serve, self.__sock, self.__handle)
+
+    def __handle(self, sock, address):
+        reader = sock.makefile('r')
+        try:
+            for line in reader:
+                request = json.loads(line)
+                if self.__secret and not hmac.compare_digest(
+                        str(request.get('signature', '')), sign(self.__secret, request.get('checks', []))):
+                    raise errors.PeerError("invalid signature")
+                results = [self.__check(*check) for check in request.get('checks', [])]
+                sock.sendall((json.dumps({'results': results}) + '\n').encode('utf-8'))
+        except Exception as e:
+            self.logger.debug("closing connection from peer {0}: {1}", address, e)
+        finally:
+            reader.close()
+            sock.close()
+
+    def __check(self, key, window_seconds, max_calls, max_sleep_time_seconds, cost=1, count=True):
+        # The cost and count are omitted by peers running an older version.
+        return self.__rate_limit_func(key, window_seconds, max_calls, max_sleep_time_seconds, cost=cost, count=count)
+
+    def stop(self):
+        self.__server.kill()
+        self.__sock.close()
+
+
+class PeerClient(batch.Batcher):
+    """Forwards rate limit checks in batches to the peer owning the keys."""
+
+    def __init__(self, address, timeout_seconds=1, window_seconds=0.0002, max_size=50, secret=None,
+                 logger=log.Logger(__name__)):
+        super(PeerClient, self).__init__(window_seconds=window_seconds, max_size=max_size, logger=logger)
+        self.__address = split_address(address)
+        self.__secret = secret
+        self.__timeout_seconds = timeout_seconds
+        self.__sock = None
+        self.__reader = None
+        # Only one batch is in flight per connection.
+        self.__lock = semaphore.Semaphore()
+
+    def rate_limit(self, key, window_seconds, max_calls, max_sleep_time_seconds, cost=1, count=True):
+        """
+        Forward a rate limit check to the peer.
+
+        :return: tuple of remaining requests and retry after in seconds
+        """
+        remaining, retry_after_seconds = self.execute(
+            key, window_seconds, max_calls, max_sleep_time_seconds, cost, count
+        )
+        return remaining, retry_after_seconds
+
+    def execute_batch(self, calls):
+        with self.__lock:
+            try:
+                timeout_error = errors.PeerError("peer {0}:{1} timed out".format(*self.__address))
+                with eventlet.Timeout(self.__timeout_seconds, timeout_error):
+                    if self.__sock is None:
+                        self.__sock = eventlet.connect(self.__address)
+                        self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        self.__reader = self.__sock.makefile('r')
+                    request = {'checks': calls}
+                    if self.__secret:
+                        request['signature'] = sign(self.__secret, calls)
+                    self.__sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+                    response = json.loads(self.__reader.readline())
+            except Exception:
+                self.close()
+                raise
+        results = response.get('results', [])
+        if len(results) != len(calls):
+            raise errors.PeerError("peer returned {0} results for {1} checks".format(len(results), len(calls)))
+        return results
+
+    def close(self):
+        if self.__sock is not None:
+            self.__reader.close()
+            self.__sock.close()
+        self.__sock = self.__reader = None
@@ -0,0 +1,262 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import os
+import pyredis
+import socket
+import time
+import weakref
+
+from eventlet import semaphore
+from pyredis import connection
+
+from . import common
+from . import log
+
+
+def parse_address(host, port):
+    """
+    Parse the backend address. Hosts prefixed with unix:// are paths of a unix domain socket.
+
+    :param host: the host or unix:///path/to/redis.sock
+    :param port: the port. ignored for unix domain sockets
+    :return: tuple of host, port, unix socket path
+    """
+    if host and host.startswith(common.Constants.unix_socket_prefix):
+        return None, None, host[len(common.Constants.unix_socket_prefix):]
+    return host, port, None
+
+
+def _call_if_alive(ref):
+    """
+    Invoke the method referenced weakly unless its object was garbage collected.
+
+    :param ref: the weakref.WeakMethod
+    """
+    method = ref()
+    if method is not None:
+        method()
+
+
+class TunedConnection(connection.Connection):
+    """Redis connection applying socket options to its TCP socket."""
+
+    def __init__(self, tcp_nodelay=True, tcp_keepalive=True, tcp_keepalive_idle_seconds=60, **kwargs):
+        super(TunedConnection, self).__init__(**kwargs)
+        self.__tcp_nodelay = tcp_nodelay
+        self.__tcp_keepalive = tcp_keepalive
+        self.__tcp_keepalive_idle_seconds = tcp_keepalive_idle_seconds
+
+    def _connect_inet46(self):
+        sock = super(TunedConnection, self)._connect_inet46()
+        if self.__tcp_nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.__tcp_keepalive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # Not available on all platforms.
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.__tcp_keepalive_idle_seconds)
+        return sock
+
+
+class TunedClient(pyredis.Client):
+    """Redis client using a TunedConnection."""
+
+    def __init__(self, tcp_nodelay=True, tcp_keepalive=True, tcp_keepalive_idle_seconds=60, **kwargs):
+        super(TunedClient, self).__init__(**kwargs)
+        # The connection is established lazily. Replace it before the first command.
+        self._conn = TunedConnection(
+            tcp_nodelay=tcp_nodelay,
+            tcp_keepalive=tcp_keepalive,
+            tcp_keepalive_idle_seconds=tcp_keepalive_idle_seconds,
+            **kwargs
+        )
+
+
+class ConnectionPool(pyredis.Pool):
+    """
+    Pool of persistent connections to Redis via TCP or a unix domain socket.
+
+    Unlike pyredis.Pool, a greenthread waits up to the connection timeout for a free connection
+    instead of failing immediately if all connections are checked out.
+    Connections inherited from a parent process are discarded and the pool is warmed up again right after a fork.
+    Requests wait for the warm-up instead of establishing connections on their own.
+    """
+
+    def __init__(self, host=None, port=6379, unix_sock=None, tcp_nodelay=True, tcp_keepalive=True,
+                 tcp_keepalive_idle_seconds=60, warm_up_connections=0, metrics_client=None,
+                 logger=log.Logger(__name__), **kwargs):
+        """
+        Create a new ConnectionPool.
+
+        :param host: the host or None if connecting via unix domain socket
+        :param port: the port
+        :param unix_sock: path of the unix domain socket or None
+        :param tcp_nodelay: whether to disable Nagle's algorithm
+        :param tcp_keepalive: whether to enable TCP keepalive
+        :param tcp_keepalive_idle_seconds: idle time before keepalive probes are sent
+        :param warm_up_connections: number of connections established upfront in every process
+        :param metrics_client: optional client used to emit pool metrics
+        :param logger: the logger
+        :param kwargs: passed to pyredis.Pool
+        """
+        super(ConnectionPool, self).__init__(host=host, port=port, unix_sock=unix_sock, **kwargs)
+        self.__tcp_nodelay = tcp_nodelay
+        self.__tcp_keepalive = tcp_keepalive
+        self.__tcp_keepalive_idle_seconds = tcp_keepalive_idle_seconds
+        self.__warm_up_connections = min(max(0, int(warm_up_connections)), self.pool_size)
+        self.__metrics_client = metrics_client
+        self.logger = logger
+        self.__warming_up = None
+        self.__reset()
+        # Warm up eagerly in the child. The pid check in acquire covers platforms without fork hooks.
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda ref=weakref.WeakMethod(self.__after_fork): _call_if_alive(ref))
+
+    def __reset(self):
+        """(Re-)initialize the state of the pool for the current process."""
+        self.__pid = os.getpid()
+        self.__free_slots = semaphore.Semaphore(self.pool_size)
+        self._pool_free = set()
+        self._pool_used = set()
+
+    @property
+    def in_use(self):
+        """Number of connections currently checked out."""
+        return len(self._pool_used)
+
+    def _connect(self):
+        return TunedClient(
+            host=self.host,
+            port=self.port,
+            unix_sock=self.unix_sock,
+            database=self.database,
+            password=self.password,
+            encoding=self.encoding,
+            conn_timeout=self.conn_timeout,
+            read_timeout=self.read_timeout,
+            username=self.username,
+            tcp_nodelay=self.__tcp_nodelay,
+            tcp_keepalive=self.__tcp_keepalive,
+            tcp_keepalive_idle_seconds=self.__tcp_keepalive_idle_seconds,
+        )
+
+    def acquire(self):
+        """
+        Acquire a connection from the pool. Waits up to the connection timeout for a free connection.
+
+        :return: the client
+        :raises: pyredis.PyRedisError if no connection was freed in time
+        """
+        if os.getpid() != self.__pid:
+            self.__after_fork()
+        self.__wait_for_warm_up()
+
+        start = time.time()
+        if not self.__free_slots.acquire(timeout=self.conn_timeout):
+            raise pyredis.PyRedisError("no free connection within {0}s".format(self.conn_timeout))
+        self.__timing(common.Constants.metric_backend_pool_wait_seconds, time.time() - start)
+
+        try:
+            client = super(ConnectionPool, self).acquire()
+        except Exception:
+            self.__free_slots.release()
+            raise
+        self.__gauge(common.Constants.metric_backend_pool_connections_in_use, self.in_use)
+        return client
+
+    def execute(self, *args, **kwargs):
+        """
+        Execute a command using a connection of the pool.
+
+        :return: the result of the command
+        """
+        conn = self.acquire()
+        try:
+            return conn.execute(*args, **kwargs)
+        except pyredis.ReplyError:
+            raise
+        except BaseException:
+            # Interrupted, e.g. by the latency budget. The reply might still be pending on the connection.
+            conn.close()
+            raise
+        finally:
+            self.release(conn)
+
+    def release(self, conn):
+        """
+        Return a connection to the pool.
+
+        :param conn: the client acquired from this pool
+        """
+        # Connections acquired before a fork belong to the parent.
+        if conn not in self._pool_used:
+            conn.close()
+            return
+        super(ConnectionPool, self).release(conn)
+        self.__free_slots.release()
+        self.__gauge(common.Constants.metric_backend_pool_connections_in_use, self.in_use)
+
+    def warm_up(self):
+        """
+        Establish the configured number of connections upfront,
+        so that the first requests don't pay for the connection setup.
+        Invoked in the background after a fork.
+
+        :return: the number of established connections
+        """
+        clients = []
+        try:
+            for _ in range(self.__warm_up_connections):
+                client = self.acquire()
+                clients.append(client)
+                client.execute('PING')
+        except Exception as e:
+            self.logger.debug("failed to warm up connection pool: {0}", e)
+        finally:
+            for client in clients:
+                self.release(client)
+        return len([c for c in clients if not c.closed])
+
+    def __after_fork(self):
+        """Discard the connections inherited from the parent process and warm up the pool again."""
+        for client in self._pool_free | self._pool_used:
+            # Only closes the file descriptor of this process. The parent's connection is unaffected.
+            client.close()
+        self.__reset()
+        if self.__warm_up_connections:
+            self.__warming_up = eventlet.spawn(self.warm_up)
+
+    def __wait_for_warm_up(self):
+        """Wait until the warm-up after a fork completed, so that requests reuse the warmed up connections."""
+        warming_up = self.__warming_up
+        if warming_up is None or warming_up is eventlet.getcurrent():
+            return
+        warming_up.wait()
+        self.__warming_up = None
+
+    def __gauge(self, metric, value):
+        if self.__metrics_client:
+            try:
+                self.__metrics_client.gauge(metric, value)
+            except Exception as e:
+                self.logger.debug("failed to emit metric '{0}': {1}", metric, e)
+
+    def __timing(self, metric, seconds):
+        if self.__metrics_client:
+            try:
+                self.__metrics_client.histogram(metric, seconds)
+            except Exception as e:
+                self.logger.debug("failed to emit metric '{0}': {1}", metric, e)
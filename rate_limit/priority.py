@@ -0,0 +1,157 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from . import common
+from . import errors
+
+
+# Headers derived from the validated token by the keystonemiddleware auth_token, which strips them from the client request.
+# Other headers are set by the client and can't be trusted to grant a higher priority.
+TRUSTED_HEADERS = frozenset([
+    'X-Identity-Status', 'X-Service-Identity-Status', 'X-Is-Admin-Project',
+    'X-Domain-Id', 'X-Domain-Name',
+    'X-Project-Id', 'X-Project-Name', 'X-Project-Domain-Id', 'X-Project-Domain-Name',
+    'X-User-Id', 'X-User-Name', 'X-User-Domain-Id', 'X-User-Domain-Name', 'X-Roles',
+    'X-Service-User-Id', 'X-Service-User-Name', 'X-Service-User-Domain-Id', 'X-Service-User-Domain-Name',
+    'X-Service-Project-Id', 'X-Service-Project-Name', 'X-Service-Project-Domain-Id', 'X-Service-Project-Domain-Name',
+    'X-Service-Roles',
+])
+
+
+class PriorityClass(object):
+    """A class of requests sharing a reserved share of the global limits."""
+
+    def __init__(self, name, share):
+        """
+        Create a new PriorityClass.
+
+        :param name: the name of the class
+        :param share: the share of the global limits available to this class. between 0 and 1
+        """
+        self.name = name
+        self.share = share
+
+    def __repr__(self):
+        return "PriorityClass(name={0}, share={1})".format(self.name, self.share)
+
+
+class PriorityMatcher(object):
+    """
+    Assigns requests to priority classes by user, project, role, service role or header.
+    Only attributes derived from the validated token are matched, never headers set by the client.
+
+    Classes are ordered from the highest to the lowest priority. Each class reserves a share of the global limits
+    that lower classes can't use. Thus, if the global limits trip, requests of lower classes are shed first.
+    Requests matching no class belong to the lowest class, which gets the remainder of the global limits.
+    All classes are counted against the same global limit, so admission remains a single backend call.
+
+    The classes are compiled into one index per attribute. Matching a request is a few dict lookups
+    regardless of the number of classes.
+    """
+
+    def __init__(self, config):
+        """
+        Create a new PriorityMatcher.
+
+        :param config: list of classes, e.g. [{name: operator, reserved: 20, users: [Default/admin], roles: [cloud_admin]}].
+            Users are given as '$domainName/$userName' or user id, since user names are only unique within a domain.
+        :raises errors.ConfigError: if the classes are invalid or match a header not in TRUSTED_HEADERS
+        """
+        if not isinstance(config, list):
+            raise errors.ConfigError("priorities must be a list of classes")
+
+        self.classes = []
+        self.__users = {}
+        self.__projects = {}
+        self.__roles = {}
+        self.__service_roles = {}
+        # Mapping of WSGI environ keys to the header values per class.
+        self.__headers = {}
+
+        reserved_total = 0
+        for idx, item in enumerate(config):
+            if not isinstance(item, dict):
+                raise errors.ConfigError("invalid priority class '{0}'".format(item))
+            name = item.get('name')
+            reserved = common.to_int(item.get('reserved', 0), None)
+            if not name or reserved is None or reserved < 0:
+                raise errors.ConfigError("invalid priority class '{0}'".format(item))
+            for attribute in ('users', 'projects', 'roles', 'service_roles'):
+                if not isinstance(item.get(attribute, []), list):
+                    raise errors.ConfigError("{0} of priority class '{1}' must be a list".format(attribute, name))
+            if not isinstance(item.get('headers', None) or {}, dict):
+                raise errors.ConfigError("headers of priority class '{0}' must be a mapping".format(name))
+            # The higher classes reserve their share of the global limits.
+            self.classes.append(PriorityClass(name, (100 - reserved_total) / 100.0))
+            reserved_total += reserved
+
+            for user in item.get('users', []):
+                self.__users.setdefault(str(user), idx)
+            for project in item.get('projects', []):
+                self.__projects.setdefault(str(project), idx)
+            for role in item.get('roles', []):
+                self.__roles.setdefault(str(role).lower(), idx)
+            for role in item.get('service_roles', []):
+                self.__service_roles.setdefault(str(role).lower(), idx)
+            for header, values in (item.get('headers', None) or {}).items():
+                if str(header).title() not in TRUSTED_HEADERS:
+                    raise errors.ConfigError(
+                        "priority class '{0}' matches header '{1}', which is not set by the keystonemiddleware "
+                        "and can be spoofed by clients".format(name, header)
+                    )
+                environ_key = 'HTTP_' + str(header).upper().replace('-', '_')
+                for value in values if isinstance(values, list) else [values]:
+                    self.__headers.setdefault(environ_key, {}).setdefault(str(value), idx)
+
+        if reserved_total >= 100:
+            raise errors.ConfigError(
+                "priority classes reserve {0}% of the global limits. must be less than 100%".format(reserved_total)
+            )
+        self.default_class = PriorityClass('default', (100 - reserved_total) / 100.0)
+
+    def match(self, environ, scope=None, scope_name_key=None, username=None):
+        """
+        Get the priority class of a request. The highest matching class wins.
+
+        :param environ: the WSGI environ of the request
+        :param scope: the scope of the request, e.g. the project id
+        :param scope_name_key: the key of the scope in the format $domainName/$projectName
+        :param username: the name of the user
+        :return: the priority class
+        """
+        environ = environ or {}
+        candidates = [
+            self.__users.get(environ.get('HTTP_X_USER_ID')),
+            self.__projects.get(scope),
+            self.__projects.get(scope_name_key),
+        ]
+        # User names are only unique within the domain of the user as set by the keystonemiddleware.
+        username = username or environ.get('HTTP_X_USER_NAME')
+        user_domain_name = environ.get('HTTP_X_USER_DOMAIN_NAME')
+        if username and user_domain_name:
+            candidates.append(self.__users.get('{0}/{1}'.format(user_domain_name, username)))
+        # Roles as set by the keystonemiddleware.
+        for role in environ.get('HTTP_X_ROLES', '').split(','):
+            candidates.append(self.__roles.get(role.strip().lower()))
+        # Roles of the service token as set by the keystonemiddleware, e.g. if a service acts on behalf of a user.
+        for role in environ.get('HTTP_X_SERVICE_ROLES', '').split(','):
+            candidates.append(self.__service_roles.get(role.strip().lower()))
+        for environ_key, values in self.__headers.items():
+            if environ_key in environ:
+                candidates.append(values.get(environ[environ_key]))
+
+        matched = [idx for idx in candidates if idx is not None]
+        if not matched:
+            return self.default_class
+        return self.classes[min(matched)]
@@ -13,16 +13,26 @@
 # under the License.
 
 
-import keystoneclient.v3 as keystonev3
 import re
-import pyredis
-import requests
-
-from keystoneauth1.identity import v3
-from keystoneauth1 import session
 
 from . import common
 from . import log
+from . import overrides
+from . import pool
+
+
+def _has_attribute(ratelimits, attribute):
+    """
+    Check whether any rule of the rate limits has the attribute.
+
+    :param ratelimits: the rules per target type URI
+    :param attribute: the name of the attribute, e.g. 'concurrency'
+    :return: True if a rule has the attribute
+    """
+    return any(
+        rl.get(attribute, None) is not None
+        for rules in ratelimits.values() for rl in rules or [] if isinstance(rl, dict)
+    )
 
 
 class RateLimitProvider(object):
@@ -35,6 +45,8 @@ class RateLimitProvider(object):
         self.global_ratelimits = {}
         # Local rate limits counted per scope.
         self.local_ratelimits = {}
+        # Overrides of the local rate limits per scope.
+        self.project_ratelimits = overrides.to_index({})
 
     def get_global_rate_limits(self, action, target_type_uri, **kwargs):
         """
@@ -60,6 +72,70 @@ class RateLimitProvider(object):
         """
         return -1
 
+    def get_scope_level_rate_limits(self, action, target_type_uri, **kwargs):
+        """
+        Get the rate limits per additional scope level (domain, user) checked together with the local rate limit.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: dictionary of scope level and rate limit
+        """
+        return {}
+
+    def get_global_rate_limit_cost(self, action, target_type_uri, **kwargs):
+        """
+        Get the cost expression of the global rate limit per action and target type URI.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the cost expression or None if every request costs 1 unit
+        """
+        return None
+
+    def get_local_rate_limit_cost(self, action, target_type_uri, **kwargs):
+        """
+        Get the cost expression of the local rate limit per action and target type URI.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the cost expression or None if every request costs 1 unit
+        """
+        return None
+
+    def get_global_concurrency_limit(self, action, target_type_uri, **kwargs):
+        """
+        Get the max. number of in-flight requests per action and target type URI across all scopes.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the concurrency limit or -1 if not set
+        """
+        return -1
+
+    def get_local_concurrency_limit(self, scope, action, target_type_uri, **kwargs):
+        """
+        Get the max. number of in-flight requests per scope, action and target type URI.
+
+        :param scope: the UUID of the project, domain or the IP
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the concurrency limit or -1 if not set
+        """
+        return -1
+
+    def has_concurrency_limits(self):
+        """
+        Check whether any concurrency limit is configured, so that requests skip the lookups otherwise.
+
+        :return: True if concurrency limits may be configured
+        """
+        return False
+
 
 class ConfigurationRateLimitProvider(RateLimitProvider):
     """The provider to obtain rate limits from a configuration file."""
@@ -68,6 +144,7 @@ class ConfigurationRateLimitProvider(RateLimitProvider):
         super(ConfigurationRateLimitProvider, self).__init__(
             service_type=service_type, logger=logger, kwargs=kwargs
         )
+        self.__has_concurrency_limits = False
 
     def get_global_rate_limits(self, action, target_type_uri, **kwargs):
         """
@@ -101,6 +178,13 @@ class ConfigurationRateLimitProvider(RateLimitProvider):
         :param kwargs: optional, additional parameters
         :return: the local rate limit or -1 if not set
         """
+        # Overrides of the scope take precedence over the defaults.
+        project_ratelimits = self.project_ratelimits.get(scope)
+        if project_ratelimits:
+            ratelimit = self._get_rule_attribute(project_ratelimits, action, target_type_uri, 'limit')
+            if ratelimit:
+                return ratelimit
+
         ttu_ratelimits = self.local_ratelimits.get(target_type_uri, [])
         if not ttu_ratelimits:
             ttu_ratelimits = self._get_wildcard_ratelimits(
@@ -113,6 +197,102 @@ class ConfigurationRateLimitProvider(RateLimitProvider):
                 return ratelimit
         return -1
 
+    def get_scope_level_rate_limits(self, action, target_type_uri, **kwargs):
+        """
+        Get the rate limits per additional scope level (domain, user) checked together with the local rate limit.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: dictionary of scope level and rate limit
+        """
+        return self._get_rule_attribute(self.local_ratelimits, action, target_type_uri, 'scopes') or {}
+
+    def get_global_rate_limit_cost(self, action, target_type_uri, **kwargs):
+        """
+        Get the cost expression of the global rate limit per action and target type URI.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the cost expression or None if every request costs 1 unit
+        """
+        return self._get_rule_attribute(self.global_ratelimits, action, target_type_uri, 'cost')
+
+    def get_local_rate_limit_cost(self, action, target_type_uri, **kwargs):
+        """
+        Get the cost expression of the local rate limit per action and target type URI.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the cost expression or None if every request costs 1 unit
+        """
+        return self._get_rule_attribute(self.local_ratelimits, action, target_type_uri, 'cost')
+
+    def get_global_concurrency_limit(self, action, target_type_uri, **kwargs):
+        """
+        Get the max. number of in-flight requests per action and target type URI across all scopes.
+
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the concurrency limit or -1 if not set
+        """
+        return common.to_int(
+            self._get_rule_attribute(self.global_ratelimits, action, target_type_uri, 'concurrency'), -1
+        )
+
+    def get_local_concurrency_limit(self, scope, action, target_type_uri, **kwargs):
+        """
+        Get the max. number of in-flight requests per scope, action and target type URI.
+
+        :param scope: the UUID of the project, domain or the IP
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param kwargs: optional, additional parameters
+        :return: the concurrency limit or -1 if not set
+        """
+        project_ratelimits = self.project_ratelimits.get(scope)
+        if project_ratelimits:
+            concurrency = self._get_rule_attribute(project_ratelimits, action, target_type_uri, 'concurrency')
+            if concurrency is not None:
+                return common.to_int(concurrency, -1)
+
+        return common.to_int(
+            self._get_rule_attribute(self.local_ratelimits, action, target_type_uri, 'concurrency'), -1
+        )
+
+    def has_concurrency_limits(self):
+        """
+        Check whether any concurrency limit is configured, so that requests skip the lookups otherwise.
+
+        :return: True if a global, local or overridden rule has a concurrency limit
+        """
+        return self.__has_concurrency_limits
+
+    def _get_rule_attribute(self, ratelimits, action, target_type_uri, attribute):
+        """
+        Get an attribute of the rule matching the action and target type URI.
+
+        :param ratelimits: the global or local rate limits
+        :param action: the CADF action of the request
+        :param target_type_uri: the target type URI of the request
+        :param attribute: the name of the attribute, e.g. 'cost'
+        :return: the value of the attribute or None
+        """
+        ttu_ratelimits = ratelimits.get(target_type_uri, [])
+        if not ttu_ratelimits:
+            ttu_ratelimits = self._get_wildcard_ratelimits(
+                ratelimits,
+                target_type_uri,
+            )
+        for rl in ttu_ratelimits:
+            value = rl.get(attribute, None)
+            if action == rl.get('action') and value is not None:
+                return value
+        return None
+
     def _get_wildcard_ratelimits(self, ratelimits, target_type_uri):
         """
         Get the target type URI rate limits from wildcard pattern.
@@ -153,10 +333,26 @@ class ConfigurationRateLimitProvider(RateLimitProvider):
 
         :param config_path: path to the configuration file
         """
-        config = common.load_config(config_path)
+        self.load_rate_limits(common.load_config(config_path))
+
+    def load_rate_limits(self, config):
+        """
+        Load the rate limits from the configuration. Replaces the global and local rate limits at once.
+
+        :param config: the configuration as dictionary
+        """
         rates = config.get('rates', {})
-        self.global_ratelimits = rates.get('global', {})
-        self.local_ratelimits = rates.get('default', {})
+        project_ratelimits = overrides.to_index(rates.get('projects', {}))
+        global_ratelimits, local_ratelimits = rates.get('global', {}), rates.get('default', {})
+        self.__has_concurrency_limits = any(
+            _has_attribute(ratelimits, 'concurrency')
+            for ratelimits in [global_ratelimits, local_ratelimits] + list(project_ratelimits.rule_sets())
+        )
+        self.global_ratelimits, self.local_ratelimits, self.project_ratelimits = \
+            global_ratelimits, local_ratelimits, project_ratelimits
+        # Keep only the compact index, so that the parsed overrides can be garbage collected.
+        if 'projects' in rates:
+            rates['projects'] = project_ratelimits
 
 
 class LimesRateLimitProvider(RateLimitProvider):
@@ -169,9 +365,13 @@ class LimesRateLimitProvider(RateLimitProvider):
         self.__refresh_interval_seconds = kwargs.get('refresh_interval_seconds', 300)
 
         timeout = kwargs.get('redis_timeout', 2)
-        self.__redis = pyredis.Pool(
-            host=kwargs.get('redis_host', '127.0.0.1'),
-            port=kwargs.get('redis_port', 6379),
+        redis_host, redis_port, unix_sock = pool.parse_address(
+            kwargs.get('redis_host', '127.0.0.1'), kwargs.get('redis_port', 6379)
+        )
+        self.__redis = pool.ConnectionPool(
+            host=redis_host,
+            port=redis_port,
+            unix_sock=unix_sock,
             conn_timeout=timeout,
             read_timeout=timeout,
             pool_size=kwargs.get('max_connections', 100),
@@ -231,24 +431,33 @@ class LimesRateLimitProvider(RateLimitProvider):
         project = self.__find_project_by_id_in_list(scope, rate_limit_list.get('projects', []))
         # find the current service by type
         service = self.__find_service_by_type_in_list(self.service_type, project.get('services', []))
-        # find the rates by target type URI
-        rate = self.__find_rate_by_target_type_uri_and_action_in_list(target_type_uri, action, service.get('rates', []))
-        # finally find the limit
-        if 'limit' in rate and 'window' in rate:
-            # convert Limes' rate limit format into the string format used by this middleware,
-            # e.g. { 'limit': 10, 'window': '1m' } -> '10r/m'
-            # e.g. { 'limit': 2, 'window': '10s' } -> '2r/10s'
-            window = re.sub(r'^1([a-z])', r'\1', rate['window'])
-            return "{0}r/{1}".format(rate['limit'], window)
-        return -1
+        # find the rates by target type URI. Multiple windows may be configured per target type URI and action.
+        rates = self.__find_rates_by_target_type_uri_and_action_in_list(target_type_uri, action, service.get('rates', []))
+        # finally find the limits
+        limits = []
+        for rate in rates:
+            if 'limit' in rate and 'window' in rate:
+                # convert Limes' rate limit format into the string format used by this middleware,
+                # e.g. { 'limit': 10, 'window': '1m' } -> '10r/m'
+                # e.g. { 'limit': 2, 'window': '10s' } -> '2r/10s'
+                window = re.sub(r'^1([a-z])', r'\1', rate['window'])
+                limits.append("{0}r/{1}".format(rate['limit'], window))
+        if len(limits) == 1:
+            return limits[0]
+        return limits or -1
 
     def __authenticate(self, auth_url, username, user_domain_name, password, domain_name):
         keystone_client = None
         try:
+            # Imported on demand. Only required if Limes is enabled.
+            import keystoneclient.v3 as keystonev3
+            from keystoneauth1.identity import v3
+            from keystoneauth1 import session
+
             self.logger.debug(
                 'attempting authentication using with '
-                'auth URL: {0}, username: {1}, user domain name: {2}, password: {3}, domain name: {4}'
-                .format(auth_url, username, user_domain_name, '*' * len(password), domain_name)
+                'auth URL: {0}, username: {1}, user domain name: {2}, password: {3}, domain name: {4}',
+                auth_url, username, user_domain_name, '*' * len(password), domain_name
             )
 
             auth = v3.Password(
@@ -264,7 +473,7 @@ class LimesRateLimitProvider(RateLimitProvider):
             self.logger.debug('successfully created keystone client and obtained token')
 
         except Exception as e:
-            self.logger.error('failed to create keystone client: {0}'.format(str(e)))
+            self.logger.error('failed to create keystone client: {0}', e)
 
         finally:
             return keystone_client
@@ -304,7 +513,7 @@ class LimesRateLimitProvider(RateLimitProvider):
             self.logger.warning("could not find limes base url in endpoints")
 
         except Exception as e:
-            self.logger.error("error looking up limes base url: {0}".format(str(e)))
+            self.logger.error("error looking up limes base url: {0}", e)
 
         finally:
             return limes_base_url
@@ -338,9 +547,9 @@ class LimesRateLimitProvider(RateLimitProvider):
     def __find_service_by_type_in_list(self, service_type, service_list):
         return common.find_item_by_key_in_list(service_type, 'type', service_list)
 
-    def __find_rate_by_target_type_uri_and_action_in_list(self, target_type_uri, action, rate_list):
+    def __find_rates_by_target_type_uri_and_action_in_list(self, target_type_uri, action, rate_list):
         rate_name = "{0}:{1}".format(target_type_uri, action)
-        return common.find_item_by_key_in_list(rate_name, 'name', rate_list)
+        return common.find_items_by_key_in_list(rate_name, 'name', rate_list)
 
     def _get(self, path, params={}, headers={}):
         response_json = {}
@@ -359,6 +568,8 @@ class LimesRateLimitProvider(RateLimitProvider):
             # Set X-AUTH-TOKEN header.
             headers['X-AUTH-TOKEN'] = self.__keystone_client.session.get_token()
 
+            # Imported on demand. Only required if Limes is enabled.
+            import requests
             resp_raw = requests.get(
                 url=common.build_uri(self.__limes_base_url, path),
                 params=params,
@@ -366,7 +577,7 @@ class LimesRateLimitProvider(RateLimitProvider):
             )
             response_json = resp_raw.json()
         except Exception as e:
-            self.logger.error("error while getting rate limits from limes: {0}".format(str(e)))
+            self.logger.error("error while getting rate limits from limes: {0}", e)
 
         finally:
             return response_json
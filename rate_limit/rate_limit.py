@@ -13,13 +13,22 @@
 # under the License.
 
 import os
+import time
 
-from datadog.dogstatsd import DogStatsd
+from eventlet import tpool
 
+from . import adaptive
 from . import backend as rate_limit_backend
+from . import bandwidth
 from . import common
+from . import compiled
+from . import concurrency
+from . import cost
 from . import errors
+from . import metrics
+from . import priority
 from . import provider
+from . import reload
 from . import response
 from . import units
 from . import log
@@ -47,32 +56,37 @@ class OpenStackRateLimitMiddleware(object):
         statsd_port = common.to_int(self.__conf.get('statsd_port', 9125))
         statsd_prefix = self.__conf.get('statsd_prefix', common.Constants.metric_prefix)
 
-        # Init StatsD client.
-        self.metricsClient = DogStatsd(
-            host=os.getenv('STATSD_HOST', statsd_host),
-            port=int(os.getenv('STATSD_PORT', statsd_port)),
-            namespace=os.getenv('STATSD_PREFIX', statsd_prefix)
-        )
+        # Init StatsD client unless metrics are disabled.
+        self.metricsClient = metrics.NullMetricsClient()
+        if common.to_bool(self.__conf.get('metrics_enabled'), True):
+            self.metricsClient = metrics.new_statsd_client(
+                host=os.getenv('STATSD_HOST', statsd_host),
+                port=int(os.getenv('STATSD_PORT', statsd_port)),
+                namespace=os.getenv('STATSD_PREFIX', statsd_prefix)
+            )
 
         # Get backend configuration.
         # Backend is used to store count of requests.
+        self.backend_type = self.__conf.get('backend', common.Constants.backend_redis)
         self.backend_host = self.__conf.get('backend_host', '127.0.0.1')
-        self.backend_port = common.to_int(self.__conf.get('backend_port'), 6379)
+        default_backend_port = 11211 if self.backend_type == common.Constants.backend_memcached else 6379
+        self.backend_port = common.to_int(self.__conf.get('backend_port'), default_backend_port)
+        # Compact keys and members save memory in the backend.
+        self.backend_compact_encoding = common.to_bool(self.__conf.get('backend_compact_encoding_enabled'), False)
         self.logger.debug(
-            "using backend '{0}' on '{1}:{2}'".format('redis', self.backend_host, self.backend_port)
+            "using backend '{0}' on '{1}:{2}'", self.backend_type, self.backend_host, self.backend_port
         )
-        backend_timeout_seconds = common.to_int(self.__conf.get('backend_timeout_seconds'), 20)
-        backend_max_connections = common.to_int(self.__conf.get('backend_max_connections'), 100)
 
         # Load configuration file.
         self.config = {}
         config_file = self.__conf.get('config_file', None)
         if config_file:
             try:
-                self.config = common.load_config(config_file)
+                # Either the yaml file or the compiled artifact.
+                self.config = compiled.load_config(config_file)
             except errors.ConfigError as e:
                 self.logger.warning(
-                    "error loading configuration: {0}".format(str(e))
+                    "error loading configuration: {0}", e
                 )
 
         self.service_type = self.__conf.get('service_type', None)
@@ -89,22 +103,23 @@ class OpenStackRateLimitMiddleware(object):
         # Use configured parameters or ensure defaults.
         max_sleep_time_seconds = common.to_int(self.__conf.get(common.Constants.max_sleep_time_seconds), 20)
         log_sleep_time_seconds = common.to_int(self.__conf.get(common.Constants.log_sleep_time_seconds), 10)
+        # Logs of suspended requests are emitted at most once per interval and key.
+        self.log_sample_interval_seconds = common.to_int(self.__conf.get('log_sample_interval_seconds'), 60)
 
         # Setup ratelimit and blacklist response.
         self._setup_response()
 
-        # White-/blacklist can contain project, domain, user ids or the client ip address.
-        # Don't apply rate limits to localhost.
-        default_whitelist = ['127.0.0.1', 'localhost']
-        config_whitelist = self.config.get('whitelist', [])
-        self.whitelist = default_whitelist + config_whitelist
-        self.whitelist_users = self.config.get('whitelist_users', [])
+        # Black- & whitelists and groups.
+        self.__apply_config(self.config)
 
-        self.blacklist = self.config.get('blacklist', [])
-        self.blacklist_users = self.config.get('blacklist_users', [])
-
-        # Mapping of potentially multiple CADF actions to one action.
-        self.rate_limit_groups = self.config.get('groups', {})
+        # Priority classes reserving shares of the global limits, so that lower classes are shed first.
+        self.priority_matcher = None
+        try:
+            self.priority_matcher = self.__build_priority_matcher(self.config)
+        except errors.ConfigError as e:
+            self.logger.warning(
+                "error loading priority classes: {0}", e
+            )
 
         # Configurable scope in which a rate limit is applied. Defaults to initiator project id.
         # Rate limits are applied based on the tuple of (rate_limit_by, action, target_type_uri).
@@ -113,28 +128,73 @@ class OpenStackRateLimitMiddleware(object):
         # Accuracy of the request timestamps used. Defaults to nanosecond accuracy.
         clock_accuracy = int(1 / units.Units.parse(self.__conf.get('clock_accuracy', '1ns')))
 
-        self.backend = rate_limit_backend.RedisBackend(
-            host=self.backend_host,
-            port=self.backend_port,
-            rate_limit_response=self.ratelimit_response,
-            max_sleep_time_seconds=max_sleep_time_seconds,
-            log_sleep_time_seconds=log_sleep_time_seconds,
-            timeout_seconds=backend_timeout_seconds,
-            max_connections=backend_max_connections,
-            clock_accuracy=clock_accuracy,
-        )
+        if self.backend_type == common.Constants.backend_shared_memory:
+            self.backend = rate_limit_backend.SharedMemoryBackend(
+                rate_limit_response=self.ratelimit_response,
+                max_sleep_time_seconds=max_sleep_time_seconds,
+                log_sleep_time_seconds=log_sleep_time_seconds,
+                log_sample_interval_seconds=self.log_sample_interval_seconds,
+                compact_encoding=self.backend_compact_encoding,
+                path=self.__conf.get('backend_shm_path', common.Constants.shm_default_path),
+                slots=common.to_int(self.__conf.get('backend_shm_slots'), 65536),
+                stripes=common.to_int(self.__conf.get('backend_shm_stripes'), 64),
+            )
+        elif self.backend_type == common.Constants.backend_memcached:
+            self.backend = rate_limit_backend.MemcachedBackend(
+                host=self.backend_host,
+                port=self.backend_port,
+                rate_limit_response=self.ratelimit_response,
+                max_sleep_time_seconds=max_sleep_time_seconds,
+                log_sleep_time_seconds=log_sleep_time_seconds,
+                log_sample_interval_seconds=self.log_sample_interval_seconds,
+                compact_encoding=self.backend_compact_encoding,
+                timeout_seconds=common.to_int(self.__conf.get('backend_timeout_seconds'), 20),
+                max_connections=common.to_int(self.__conf.get('backend_max_connections'), 100),
+                strategy=self.__conf.get('backend_memcached_strategy', common.Constants.strategy_sliding_window),
+            )
+        elif self.backend_type == common.Constants.backend_peer:
+            self.backend = rate_limit_backend.PeerBackend(
+                rate_limit_response=self.ratelimit_response,
+                max_sleep_time_seconds=max_sleep_time_seconds,
+                log_sleep_time_seconds=log_sleep_time_seconds,
+                log_sample_interval_seconds=self.log_sample_interval_seconds,
+                compact_encoding=self.backend_compact_encoding,
+                peers=self.__conf.get('backend_peers'),
+                peers_file=self.__conf.get('backend_peers_file'),
+                self_address=self.__conf.get('backend_peer_self'),
+                bind_host=self.__conf.get('backend_peer_bind_host'),
+                secret=self.__conf.get('backend_peer_secret'),
+                timeout_seconds=common.to_int(self.__conf.get('backend_timeout_seconds'), 1),
+                batch_window_seconds=common.to_int(self.__conf.get('backend_batch_window_microseconds'), 200) / 1e6,
+                batch_max_size=common.to_int(self.__conf.get('backend_batch_max_size'), 50),
+            )
+        else:
+            self.backend = self.__setup_redis_backend(max_sleep_time_seconds, log_sleep_time_seconds, clock_accuracy)
+
+        # Slots of in-flight requests not released, e.g. by a crashed worker, are freed after the lease expired.
+        self.concurrency_lease_seconds = common.to_int(self.__conf.get('concurrency_lease_seconds'), 600)
 
-        # Test if the backend is ready.
-        is_available, msg = self.backend.is_available()
-        if not is_available:
-            self.logger.warning("rate limit not possible. the backend is not available: {0}".format(msg))
+        # Optionally shape the bandwidth of uploads and downloads per scope.
+        self.upload_shaper = self.download_shaper = None
+        if common.to_bool(self.__conf.get('bandwidth_shaping_enabled'), False):
+            self.__setup_bandwidth_shaping()
+
+        # Optionally tighten and relax the global limits depending on the latency and error rate of the app.
+        self.adaptive_limiter = None
+        if common.to_bool(self.__conf.get('adaptive_limits_enabled'), False):
+            self.__setup_adaptive_limits()
+
+        # Check whether the backend is available in the background without blocking the startup.
+        self.backend.start_health_check(
+            interval_seconds=common.to_int(self.__conf.get('backend_health_check_interval_seconds'), 30)
+        )
 
         # Provider for rate limits. Defaults to configuration file.
         # Also supports Limes.
         configuration_ratelimit_provider = provider.ConfigurationRateLimitProvider(service_type=self.service_type)
 
-        # Force load of rate limits from configuration file.
-        configuration_ratelimit_provider.read_rate_limits_from_config(config_file)
+        # Load rate limits from the configuration file without parsing it again.
+        configuration_ratelimit_provider.load_rate_limits(self.config)
         self.ratelimit_provider = configuration_ratelimit_provider
 
         # If limes is enabled and we want to rate limit by initiator|target project id,
@@ -143,17 +203,230 @@ class OpenStackRateLimitMiddleware(object):
         if limes_enabled:
             self.__setup_limes_ratelimit_provider()
 
+        # Optionally reload the configuration file once it changed without restarting the worker.
+        # Incremented with every configuration applied.
+        self.config_generation = 1
+        self.config_watcher = None
+        if config_file and common.to_bool(self.__conf.get('config_reload_enabled'), False):
+            self.config_watcher = reload.ConfigWatcher(
+                config_file, self.reload_config,
+                interval_seconds=common.to_int(self.__conf.get('config_reload_interval_seconds'), 10),
+                logger=self.logger,
+            )
+            self.config_watcher.start()
+
         self.logger.info("OpenStack Rate Limit Middleware ready for requests.")
 
+    def __apply_config(self, config):
+        """
+        Set the black- & whitelists and groups of the configuration.
+
+        :param config: the configuration as dictionary
+        """
+        # White-/blacklist can contain project, domain, user ids or the client ip address.
+        # Sets or, if compiled, tables in the memory-mapped artifact. Lookups don't depend on the number of entries.
+        self.whitelist = compiled.to_lookup(config.get('whitelist', []))
+        self.whitelist_users = compiled.to_lookup(config.get('whitelist_users', []), case_insensitive=True)
+
+        self.blacklist = compiled.to_lookup(config.get('blacklist', []))
+        self.blacklist_users = compiled.to_lookup(config.get('blacklist_users', []), case_insensitive=True)
+
+        # Mapping of potentially multiple CADF actions to one action.
+        self.rate_limit_groups = config.get('groups', {})
+
+    def __build_priority_matcher(self, config):
+        """
+        Compile the priority classes of the configuration.
+
+        :param config: the configuration as dictionary
+        :return: the PriorityMatcher or None if no classes are configured
+        :raises errors.ConfigError: if the priority classes are invalid
+        """
+        if not config.get('priorities', None):
+            return None
+        return priority.PriorityMatcher(config.get('priorities'))
+
+    def reload_config(self):
+        """
+        Reload the configuration file.
+        The new configuration is parsed and compiled before it replaces the rate limits, black- & whitelists,
+        groups, priority classes and responses at once. An invalid configuration keeps the current one in place.
+
+        :return: bool whether the configuration was applied
+        """
+        config_file = self.__conf.get('config_file', None)
+        start = time.time()
+        try:
+            # Parse and validate in a native thread, so that a large configuration doesn't stall in-flight requests.
+            config = tpool.execute(reload.load_and_validate_config, config_file)
+            priority_matcher = self.__build_priority_matcher(config)
+        except errors.ConfigError as e:
+            self.logger.warning(
+                "rejected configuration {0}. keeping generation {1}: {2}",
+                config_file, self.config_generation, e
+            )
+            self.metricsClient.increment(common.Constants.metric_config_reload_errors_total)
+            return False
+        ratelimit_response, blacklist_response = self._build_responses(config)
+
+        # Swap everything without yielding to other greenthreads in between,
+        # so that a request never sees a partially applied configuration.
+        self.config = config
+        self.__apply_config(config)
+        self.priority_matcher = priority_matcher
+        self.ratelimit_response, self.blacklist_response = ratelimit_response, blacklist_response
+        self.backend.set_rate_limit_response(ratelimit_response)
+        if isinstance(self.ratelimit_provider, provider.ConfigurationRateLimitProvider):
+            self.ratelimit_provider.load_rate_limits(config)
+        self.config_generation += 1
+        # Pick up a changed log level.
+        log.refresh()
+
+        reload_seconds = time.time() - start
+        self.logger.info(
+            "applied configuration {0} (generation {1}) in {2:.3f}s",
+            config_file, self.config_generation, reload_seconds
+        )
+        self.metricsClient.gauge(common.Constants.metric_config_generation, self.config_generation)
+        self.metricsClient.histogram(common.Constants.metric_config_reload_seconds, reload_seconds)
+        return True
+
+    def __setup_redis_backend(self, max_sleep_time_seconds, log_sleep_time_seconds, clock_accuracy):
+        """Setup the redis backend using the WSGI configuration."""
+        backend_timeout_seconds = common.to_int(self.__conf.get('backend_timeout_seconds'), 20)
+        backend_max_connections = common.to_int(self.__conf.get('backend_max_connections'), 100)
+
+        # Tuning of the persistent connections.
+        backend_tcp_nodelay = common.to_bool(self.__conf.get('backend_tcp_nodelay'), True)
+        backend_tcp_keepalive = common.to_bool(self.__conf.get('backend_tcp_keepalive'), True)
+        backend_tcp_keepalive_idle_seconds = common.to_int(self.__conf.get('backend_tcp_keepalive_idle_seconds'), 60)
+        backend_pool_warm_up_connections = common.to_int(self.__conf.get('backend_pool_warm_up_connections'), 0)
+
+        # Optionally pipeline concurrent rate limit checks to reduce connections and round trips.
+        backend_batch_enabled = common.to_bool(self.__conf.get('backend_batch_enabled'), False)
+        backend_batch_window_seconds = \
+            common.to_int(self.__conf.get('backend_batch_window_microseconds'), 200) / 1e6
+        backend_batch_max_size = common.to_int(self.__conf.get('backend_batch_max_size'), 50)
+
+        # Circuit breaker around the backend. Requests are admitted immediately while the circuit is open.
+        backend_circuit_breaker_enabled = common.to_bool(self.__conf.get('backend_circuit_breaker_enabled'), False)
+        backend_latency_budget_seconds = \
+            common.to_int(self.__conf.get('backend_latency_budget_milliseconds'), 100) / 1e3
+        backend_slow_call_seconds = \
+            common.to_int(self.__conf.get('backend_slow_call_milliseconds'), backend_latency_budget_seconds * 500) / 1e3
+        backend_circuit_failure_threshold = common.to_int(self.__conf.get('backend_circuit_failure_threshold'), 5)
+        backend_circuit_slow_call_threshold = common.to_int(self.__conf.get('backend_circuit_slow_call_threshold'), 10)
+        backend_circuit_open_seconds = common.to_int(self.__conf.get('backend_circuit_open_seconds'), 10)
+
+        # In-process rate limiting while the backend is unavailable.
+        backend_fallback_enabled = common.to_bool(self.__conf.get('backend_fallback_enabled'), False)
+        backend_fallback_replica_count = common.to_int(self.__conf.get('backend_fallback_replica_count'), 0)
+        backend_fallback_max_keys = common.to_int(self.__conf.get('backend_fallback_max_keys'), 10000)
+        backend_fallback_recovery_seconds = common.to_int(self.__conf.get('backend_fallback_recovery_seconds'), 30)
+
+        return rate_limit_backend.RedisBackend(
+            host=self.backend_host,
+            port=self.backend_port,
+            rate_limit_response=self.ratelimit_response,
+            max_sleep_time_seconds=max_sleep_time_seconds,
+            log_sleep_time_seconds=log_sleep_time_seconds,
+            log_sample_interval_seconds=self.log_sample_interval_seconds,
+            compact_encoding=self.backend_compact_encoding,
+            timeout_seconds=backend_timeout_seconds,
+            max_connections=backend_max_connections,
+            clock_accuracy=clock_accuracy,
+            server_time_enabled=common.to_bool(self.__conf.get('backend_server_time_enabled'), False),
+            tcp_nodelay=backend_tcp_nodelay,
+            tcp_keepalive=backend_tcp_keepalive,
+            tcp_keepalive_idle_seconds=backend_tcp_keepalive_idle_seconds,
+            pool_warm_up_connections=backend_pool_warm_up_connections,
+            batch_enabled=backend_batch_enabled,
+            batch_window_seconds=backend_batch_window_seconds,
+            batch_max_size=backend_batch_max_size,
+            circuit_breaker_enabled=backend_circuit_breaker_enabled,
+            latency_budget_seconds=backend_latency_budget_seconds,
+            slow_call_seconds=backend_slow_call_seconds,
+            circuit_failure_threshold=backend_circuit_failure_threshold,
+            circuit_slow_call_threshold=backend_circuit_slow_call_threshold,
+            circuit_open_seconds=backend_circuit_open_seconds,
+            fallback_enabled=backend_fallback_enabled,
+            fallback_replica_count=backend_fallback_replica_count,
+            fallback_max_keys=backend_fallback_max_keys,
+            fallback_recovery_seconds=backend_fallback_recovery_seconds,
+            replica_registry_key=self._get_replica_registry_key(),
+            metrics_client=self.metricsClient,
+        )
+
+    def __setup_bandwidth_shaping(self):
+        """Setup the shaping of the upload and download bandwidth using the WSGI configuration."""
+        burst_bytes = common.to_int(self.__conf.get('bandwidth_burst_bytes'), None)
+        lease_bytes = common.to_int(self.__conf.get('bandwidth_lease_bytes'), 1048576)
+
+        upload_bytes_per_second = common.to_int(self.__conf.get('bandwidth_upload_bytes_per_second'), 0)
+        if upload_bytes_per_second > 0:
+            self.upload_shaper = bandwidth.BandwidthShaper(
+                self.backend, upload_bytes_per_second, burst_bytes=burst_bytes, lease_bytes=lease_bytes,
+                logger=self.logger
+            )
+
+        download_bytes_per_second = common.to_int(self.__conf.get('bandwidth_download_bytes_per_second'), 0)
+        if download_bytes_per_second > 0:
+            self.download_shaper = bandwidth.BandwidthShaper(
+                self.backend, download_bytes_per_second, burst_bytes=burst_bytes, lease_bytes=lease_bytes,
+                logger=self.logger
+            )
+
+    def __setup_adaptive_limits(self):
+        """Setup the adaptive global limits using the WSGI configuration."""
+        self.adaptive_limiter = adaptive.AdaptiveLimiter(
+            self.backend,
+            key=self._get_adaptive_limits_key(),
+            latency_threshold_seconds=common.to_int(self.__conf.get('adaptive_latency_threshold_ms'), 1000) / 1000.0,
+            error_rate_threshold=common.to_int(self.__conf.get('adaptive_error_rate_threshold_percent'), 10) / 100.0,
+            interval_seconds=common.to_int(self.__conf.get('adaptive_interval_seconds'), 10),
+            increase=common.to_int(self.__conf.get('adaptive_increase_percent'), 5) / 100.0,
+            # The factor is decreased by the given percentage, e.g. 30 scales the limits to 70%.
+            decrease=1 - common.to_int(self.__conf.get('adaptive_decrease_percent'), 50) / 100.0,
+            min_factor=common.to_int(self.__conf.get('adaptive_min_percent'), 10) / 100.0,
+            min_samples=common.to_int(self.__conf.get('adaptive_min_samples'), 10),
+            logger=self.logger,
+        )
+
+    def _get_adaptive_limits_key(self):
+        """
+        Get the key of the factor of the adaptive limits, which is shared by all replicas of the service.
+
+        :return: the key 'ratelimit_adaptive_<service type>'
+        """
+        return 'ratelimit_adaptive_{0}'.format(self.service_type)
+
+    def _get_replica_registry_key(self):
+        """
+        Get the key in which the replicas of the service register themselves to discover the replica count.
+
+        :return: the key 'ratelimit_replicas_<service type>'
+        """
+        return '{0}_{1}'.format(common.Constants.replica_registry_key, self.service_type)
+
     def _setup_response(self):
         """Setup configurable RateLimitExceededResponse and BlacklistResponse."""
+        self.ratelimit_response, self.blacklist_response = self._build_responses(self.config)
+
+    def _build_responses(self, config):
+        """
+        Build the RateLimitExceededResponse and BlacklistResponse of the configuration.
+        Falls back to the default responses if no or invalid custom ones are configured.
+
+        :param config: the configuration as dictionary
+        :return: tuple of RateLimitExceededResponse, BlacklistResponse
+        """
         # Default responses.
         ratelimit_response = response.RateLimitExceededResponse()
         blacklist_response = response.BlacklistResponse()
 
         # Overwrite default responses if custom ones are configured.
         try:
-            ratelimit_response_config = self.config.get(common.Constants.ratelimit_response)
+            ratelimit_response_config = config.get(common.Constants.ratelimit_response)
             if ratelimit_response_config:
                 status, status_code, headers, body, json_body = \
                     response.response_parameters_from_config(ratelimit_response_config)
@@ -164,7 +437,7 @@ class OpenStackRateLimitMiddleware(object):
                         status=status, status_code=status_code, headerlist=headers, body=body, json_body=json_body
                     )
 
-            blacklist_response_config = self.config.get(common.Constants.blacklist_response)
+            blacklist_response_config = config.get(common.Constants.blacklist_response)
             if blacklist_response_config:
                 status, status_code, headers, body, json_body = \
                     response.response_parameters_from_config(blacklist_response_config)
@@ -177,12 +450,10 @@ class OpenStackRateLimitMiddleware(object):
 
         except Exception as e:
             self.logger.debug(
-                "error configuring custom responses. falling back to defaults: {0}".format(str(e))
+                "error configuring custom responses. falling back to defaults: {0}", e
             )
 
-        finally:
-            self.ratelimit_response = ratelimit_response
-            self.blacklist_response = blacklist_response
+        return ratelimit_response, blacklist_response
 
     def __setup_limes_ratelimit_provider(self):
         """Setup Limes as provider for rate limits. If not successful fallback to configuration file."""
@@ -202,7 +473,7 @@ class OpenStackRateLimitMiddleware(object):
             self.ratelimit_provider = limes_ratelimit_provider
 
         except Exception as e:
-            self.logger.debug("failed to setup limes rate limit provider: {0}".format(str(e)))
+            self.logger.debug("failed to setup limes rate limit provider: {0}", e)
 
     @classmethod
     def factory(cls, global_config, **local_config):
@@ -220,8 +491,12 @@ class OpenStackRateLimitMiddleware(object):
         :param scope: the scope of the request
         :param action: the action of the request
         :param target_type_uri: the target type URI of the response
+        :param slots: optional list collecting the acquired slots of concurrency limits.
+            Concurrency limits are only checked if given. The caller releases the slots after the response was sent.
         :return: None or BlacklistResponse or RateLimitResponse
         """
+        slots = kwargs.get('slots', None)
+
         # Labels used for all metrics.
         metric_labels = [
             'service:{0}'.format(self.service_type),
@@ -253,16 +528,12 @@ class OpenStackRateLimitMiddleware(object):
         if username:
             metric_labels.append('initiator_user_name:{}'.format(username))
             if self.is_user_whitelisted(username):
-                self.logger.debug(
-                    "user {0} is whitelisted. skipping rate limit".format(username)
-                )
+                self.logger.debug("user {0} is whitelisted. skipping rate limit", username)
                 self.metricsClient.increment(common.Constants.metric_requests_whitelisted_total, tags=metric_labels)
                 return None
 
             if self.is_user_blacklisted(username):
-                self.logger.debug(
-                    "user {0} is blacklisted. returning BlacklistResponse".format(username)
-                )
+                self.logger.debug("user {0} is blacklisted. returning BlacklistResponse", username)
                 self.metricsClient.increment(common.Constants.metric_requests_blacklisted_total, tags=metric_labels)
                 return self.blacklist_response
 
@@ -273,16 +544,14 @@ class OpenStackRateLimitMiddleware(object):
 
         # Check whitelist. If scope is whitelisted break here and don't apply any rate limits.
         if self.is_scope_whitelisted(scope) or self.is_scope_whitelisted(scope_name_key):
-            self.logger.debug(
-                "scope {0} (key: {1}) is whitelisted. skipping rate limit".format(scope, scope_name_key)
-            )
+            self.logger.debug("scope {0} (key: {1}) is whitelisted. skipping rate limit", scope, scope_name_key)
             self.metricsClient.increment(common.Constants.metric_requests_whitelisted_total, tags=metric_labels)
             return None
 
         # Check blacklist. If scope is blacklisted return BlacklistResponse.
         if self.is_scope_blacklisted(scope) or self.is_scope_blacklisted(scope_name_key):
             self.logger.debug(
-                "scope {0} (key: {1}) is blacklisted. returning BlacklistResponse".format(scope, scope_name_key)
+                "scope {0} (key: {1}) is blacklisted. returning BlacklistResponse", scope, scope_name_key
             )
             self.metricsClient.increment(common.Constants.metric_requests_blacklisted_total, tags=metric_labels)
             return self.blacklist_response
@@ -292,17 +561,33 @@ class OpenStackRateLimitMiddleware(object):
             action, trimmed_target_type_uri
         )
 
+        # Requests of lower priority classes only get a share of the global limits.
+        priority_class = None
+        if self.priority_matcher:
+            priority_class = self.priority_matcher.match(
+                kwargs.get('environ', None), scope=scope, scope_name_key=scope_name_key, username=username
+            )
+            global_metric_labels.append('priority:{0}'.format(priority_class.name))
+
         # Don't rate limit if limit=-1 or unknown.
         if not common.is_unlimited(global_rate_limit):
+            if self.adaptive_limiter:
+                global_rate_limit = self.adaptive_limiter.scale_rate_limit(global_rate_limit)
+            if priority_class:
+                global_rate_limit = adaptive.scale_rate_limit(global_rate_limit, priority_class.share)
             self.logger.debug(
-                "global rate limit configured for request with action '{0}', target type URI '{1}': '{2}'"
-                .format(action, target_type_uri, global_rate_limit)
+                "global rate limit configured for request with action '{0}', target type URI '{1}': '{2}'",
+                action, target_type_uri, global_rate_limit
             )
 
             # Check global rate limits.
             # Global rate limits enforce a backend protection by counting all requests independent of their scope.
             rate_limit_response = self.backend.rate_limit(
-                scope=None, action=action, target_type_uri=trimmed_target_type_uri, max_rate_string=global_rate_limit
+                scope=None, action=action, target_type_uri=trimmed_target_type_uri, max_rate_string=global_rate_limit,
+                cost=self._get_request_cost(
+                    self.ratelimit_provider.get_global_rate_limit_cost(action, trimmed_target_type_uri),
+                    kwargs.get('environ', None)
+                )
             )
             if rate_limit_response:
                 self.metricsClient.increment(
@@ -310,30 +595,171 @@ class OpenStackRateLimitMiddleware(object):
                 )
                 return rate_limit_response
 
+        # Check global concurrency limits. Limits the in-flight requests across all scopes.
+        if slots is not None and self.ratelimit_provider.has_concurrency_limits():
+            global_concurrency_limit = self.ratelimit_provider.get_global_concurrency_limit(
+                action, trimmed_target_type_uri
+            )
+            if not common.is_unlimited(global_concurrency_limit):
+                if self.adaptive_limiter:
+                    global_concurrency_limit = self.adaptive_limiter.scale_concurrency_limit(global_concurrency_limit)
+                if priority_class:
+                    global_concurrency_limit = adaptive.scale_concurrency_limit(
+                        global_concurrency_limit, priority_class.share
+                    )
+                rate_limit_response = self._acquire_slot(
+                    None, action, trimmed_target_type_uri, global_concurrency_limit, slots
+                )
+                if rate_limit_response:
+                    self.metricsClient.increment(
+                        common.Constants.metric_requests_ratelimit_total,
+                        tags=global_metric_labels + ['limit_type:concurrency']
+                    )
+                    return rate_limit_response
+
         # Get local (for a certain scope) rate limits from provider.
         local_rate_limit = self.ratelimit_provider.get_local_rate_limits(
             scope, action, trimmed_target_type_uri
         )
 
+        # Additional scope levels, e.g. domain and user, are checked together with the local rate limit.
+        levels = self._get_rate_limit_levels(
+            scope, local_rate_limit, action, trimmed_target_type_uri,
+            domain_name=kwargs.get('domain_name', None), username=username
+        )
+
         # Don't rate limit for rate_limit=-1 or if unknown.
-        if not common.is_unlimited(local_rate_limit):
+        if levels:
             self.logger.debug(
-                "local rate limit configured for request with action '{0}', target type URI '{1}', scope '{2}': '{3}'"
-                .format(action, target_type_uri, scope, local_rate_limit)
+                "local rate limits configured for request with action '{0}', target type URI '{1}', scope '{2}': '{3}'",
+                action, target_type_uri, scope, levels
             )
 
-            # Check local (for a specific scope) rate limits.
-            rate_limit_response = self.backend.rate_limit(
-                scope=scope, action=action, target_type_uri=trimmed_target_type_uri, max_rate_string=local_rate_limit
+            # Check local (for a specific scope) rate limits of all levels at once.
+            rate_limit_response = self.backend.rate_limit_levels(
+                levels=levels, action=action, target_type_uri=trimmed_target_type_uri,
+                cost=self._get_request_cost(
+                    self.ratelimit_provider.get_local_rate_limit_cost(action, trimmed_target_type_uri),
+                    kwargs.get('environ', None)
+                )
             )
             if rate_limit_response:
+                scope_level = rate_limit_response.headers.get(common.Constants.header_ratelimit_scope)
+                if scope_level:
+                    local_metric_labels.append('scope_level:{0}'.format(scope_level))
                 self.metricsClient.increment(
                     common.Constants.metric_requests_ratelimit_total, tags=local_metric_labels
                 )
+                self._release_slots(slots)
                 return rate_limit_response
 
+        # Check local concurrency limits. Limits the in-flight requests per scope.
+        if slots is not None and self.ratelimit_provider.has_concurrency_limits():
+            local_concurrency_limit = self.ratelimit_provider.get_local_concurrency_limit(
+                scope, action, trimmed_target_type_uri
+            )
+            if not common.is_unlimited(local_concurrency_limit):
+                rate_limit_response = self._acquire_slot(
+                    scope, action, trimmed_target_type_uri, local_concurrency_limit, slots
+                )
+                if rate_limit_response:
+                    self.metricsClient.increment(
+                        common.Constants.metric_requests_ratelimit_total,
+                        tags=local_metric_labels + ['limit_type:concurrency']
+                    )
+                    self._release_slots(slots)
+                    return rate_limit_response
+
         return None
 
+    def _acquire_slot(self, scope, action, target_type_uri, max_concurrency, slots):
+        """
+        Acquire a slot of the in-flight requests.
+
+        :param scope: the scope or None for global concurrency limits
+        :param action: the action of the request
+        :param target_type_uri: the trimmed target type URI of the request
+        :param max_concurrency: the max. number of in-flight requests
+        :param slots: list collecting the acquired slots
+        :return: None or RateLimitResponse if all slots are taken
+        """
+        key = concurrency.slot_key(scope, action, target_type_uri, key_func=self.backend.key)
+        slot_id = self.backend.acquire_slot(key, max_concurrency, self.concurrency_lease_seconds)
+        if slot_id is not None:
+            slots.append((key, slot_id))
+            return None
+
+        self.logger.debug("concurrency limit of {0} in-flight requests reached for '{1}'", max_concurrency, key)
+        self.ratelimit_response.set_headers(
+            ratelimit='{0} in-flight'.format(max_concurrency), remaining=0, retry_after=1
+        )
+        return self.ratelimit_response
+
+    def _release_slots(self, slots):
+        """
+        Release the acquired slots of in-flight requests.
+
+        :param slots: list of tuples (key, slot id)
+        """
+        while slots:
+            key, slot_id = slots.pop()
+            try:
+                self.backend.release_slot(key, slot_id)
+            except Exception as e:
+                self.logger.debug("failed to release slot {0} of {1}: {2}", slot_id, key, e)
+
+    def _get_request_cost(self, cost_expression, environ):
+        """
+        Get the number of units a request consumes as per the cost expression of the rule.
+
+        :param cost_expression: the cost expression or None
+        :param environ: the request environ or None
+        :return: the cost. 1 if the expression is invalid
+        """
+        try:
+            return cost.request_cost(cost_expression, environ)
+        except errors.ConfigError as e:
+            self.logger.warning("invalid cost expression. counting request once: {0}", e)
+            return 1
+
+    def _get_rate_limit_levels(self, scope, local_rate_limit, action, target_type_uri, domain_name=None, username=None):
+        """
+        Get the local rate limits per scope level ordered from the broadest to the narrowest level:
+        The domain, the scope as per rate_limit_by (e.g. the project) and the user.
+        The scope level is only reported if additional levels are configured for the action and target type URI.
+
+        :param scope: the scope of the request
+        :param local_rate_limit: the local rate limit of the scope
+        :param action: the action of the request
+        :param target_type_uri: the trimmed target type URI of the request
+        :param domain_name: the name of the domain or None
+        :param username: the name of the user or None
+        :return: list of tuples (scope level, scope, rate limit)
+        """
+        scope_level_rate_limits = self.ratelimit_provider.get_scope_level_rate_limits(action, target_type_uri)
+        levels = []
+
+        domain_rate_limit = scope_level_rate_limits.get(common.Constants.scope_level_domain)
+        if domain_name and not common.is_unlimited(domain_rate_limit):
+            levels.append((
+                common.Constants.scope_level_domain,
+                '{0}:{1}'.format(common.Constants.scope_level_domain, domain_name),
+                domain_rate_limit
+            ))
+
+        if not common.is_unlimited(local_rate_limit):
+            levels.append((self.rate_limit_by if scope_level_rate_limits else None, scope, local_rate_limit))
+
+        # User names are only unique within a domain.
+        user_rate_limit = scope_level_rate_limits.get(common.Constants.scope_level_user)
+        if username and not common.is_unlimited(user_rate_limit):
+            levels.append((
+                common.Constants.scope_level_user,
+                '{0}:{1}/{2}'.format(common.Constants.scope_level_user, domain_name or '', username),
+                user_rate_limit
+            ))
+        return levels
+
     def __call__(self, environ, start_response):
         """
         WSGI entry point. Wraps environ in webob.Request.
@@ -343,6 +769,10 @@ class OpenStackRateLimitMiddleware(object):
         """
         # Save the app's response so it can be returned easily.
         resp = self.app
+        # Key of the download bandwidth if the response is shaped.
+        download_key = None
+        # Slots of in-flight requests released once the response was sent.
+        slots = []
 
         try:
             self.metricsClient.open_buffer()
@@ -361,8 +791,8 @@ class OpenStackRateLimitMiddleware(object):
                 path = str(environ.get('PATH_INFO', common.Constants.unknown))
                 method = str(environ.get('REQUEST_METHOD', common.Constants.unknown))
                 self.logger.debug(
-                    "unknown request: action: {0}, target_type_uri: {1}, scope: {2}, method: {3}, path: {4}"
-                    .format(action, target_type_uri, scope, method, path)
+                    "unknown request: action: {0}, target_type_uri: {1}, scope: {2}, method: {3}, path: {4}",
+                    action, target_type_uri, scope, method, path
                 )
 
                 self.metricsClient.increment(
@@ -378,20 +808,86 @@ class OpenStackRateLimitMiddleware(object):
             rate_limit_response = self._rate_limit(
                 scope=scope, action=action, target_type_uri=target_type_uri,
                 scope_name_key=self._get_scope_name_key_from_environ(environ),
+                domain_name=self._get_domain_name_from_environ(environ),
                 username=self._get_username_from_environ(environ),
+                environ=environ,
+                slots=slots,
             )
             if rate_limit_response:
                 rate_limit_response.set_environ(environ)
                 resp = rate_limit_response
+            else:
+                download_key = self._shape_bandwidth(environ, scope)
 
         except Exception as e:
             self.metricsClient.increment(common.Constants.metric_errors_total)
-            self.logger.debug("checking rate limits failed with: {0}".format(str(e)))
+            self.logger.debug("checking rate limits failed with: {0}", e)
 
         finally:
             self.metricsClient.close_buffer()
+            if download_key or slots or (self.adaptive_limiter and resp is self.app):
+                return self._wrap_app_iter(resp, environ, start_response, download_key, slots)
             return resp(environ, start_response)
 
+    def _wrap_app_iter(self, resp, environ, start_response, download_key, slots):
+        """
+        Call the app and wrap its response iterator to shape the download bandwidth
+        and to release the slots of in-flight requests once the response was sent.
+        Observes the latency and status of the app if the global limits are adaptive.
+
+        :param resp: the app
+        :param environ: the request environ
+        :param start_response: WSGI callable
+        :param download_key: the key of the download bandwidth or None
+        :param slots: list of acquired slots
+        :return: the response iterator
+        """
+        observe = self.adaptive_limiter is not None and resp is self.app
+        if observe:
+            statuses = []
+
+            def _start_response(status, *args):
+                statuses.append(status)
+                return start_response(status, *args)
+
+        start = time.time()
+        try:
+            app_iter = resp(environ, _start_response if observe else start_response)
+        except Exception:
+            if observe:
+                self.adaptive_limiter.observe(time.time() - start, is_error=True)
+            self._release_slots(slots)
+            raise
+        if observe:
+            status_code = common.to_int(str(statuses[-1]).split(' ', 1)[0], 0) if statuses else 0
+            self.adaptive_limiter.observe(time.time() - start, is_error=status_code >= 500)
+        if download_key:
+            app_iter = self.download_shaper.wrap_iterable(app_iter, download_key)
+        if slots:
+            app_iter = concurrency.SlotReleasingIterable(app_iter, lambda: self._release_slots(slots))
+        return app_iter
+
+    def _shape_bandwidth(self, environ, scope):
+        """
+        Wrap the wsgi.input of the request to shape the upload bandwidth of the scope.
+
+        :param environ: the request environ
+        :param scope: the scope of the request
+        :return: the key of the download bandwidth if the response should be shaped or None
+        """
+        if self.is_scope_whitelisted(scope):
+            return None
+
+        if self.upload_shaper and environ.get('wsgi.input') is not None:
+            environ['wsgi.input'] = self.upload_shaper.wrap_input(
+                environ['wsgi.input'],
+                self.backend.key(scope, common.Constants.bandwidth_upload, common.Constants.bandwidth)
+            )
+
+        if self.download_shaper:
+            return self.backend.key(scope, common.Constants.bandwidth_download, common.Constants.bandwidth)
+        return None
+
     def is_scope_blacklisted(self, key_to_check):
         """
         Check whether a scope (user_id, project_id or client ip) is blacklisted.
@@ -399,10 +895,7 @@ class OpenStackRateLimitMiddleware(object):
         :param key_to_check: the user, project uid or client ip
         :return: bool whether the key is blacklisted
         """
-        for entry in self.blacklist:
-            if entry == key_to_check:
-                return True
-        return False
+        return key_to_check is not None and key_to_check in self.blacklist
 
     def is_user_blacklisted(self, user_to_check):
         """
@@ -411,10 +904,7 @@ class OpenStackRateLimitMiddleware(object):
         :param user_to_check: the name of the user to check
         :return: bool whether user is blacklisted
         """
-        for u in self.blacklist_users:
-            if str(u).lower() == str(user_to_check).lower():
-                return True
-        return False
+        return str(user_to_check).lower() in self.blacklist_users
 
     def is_scope_whitelisted(self, key_to_check):
         """
@@ -423,10 +913,10 @@ class OpenStackRateLimitMiddleware(object):
         :param key_to_check: the user, project uid or client ip
         :return: bool whether the key is whitelisted
         """
-        for entry in self.whitelist:
-            if entry == key_to_check:
-                return True
-        return False
+        # Don't apply rate limits to localhost.
+        if key_to_check in ('127.0.0.1', 'localhost'):
+            return True
+        return key_to_check is not None and key_to_check in self.whitelist
 
     def is_user_whitelisted(self, user_to_check):
         """
@@ -435,10 +925,7 @@ class OpenStackRateLimitMiddleware(object):
         :param user_to_check: the name of the user to check
         :return: bool whether user is whitelisted
         """
-        for u in self.whitelist_users:
-            if str(u).lower() == str(user_to_check).lower():
-                return True
-        return False
+        return str(user_to_check).lower() in self.whitelist_users
 
     def get_scope_action_target_type_uri_from_environ(self, environ):
         """
@@ -466,13 +953,14 @@ class OpenStackRateLimitMiddleware(object):
 
         except Exception as e:
             self.logger.debug(
-                "error while getting scope, action, target type URI from environ: {0}".format(str(e))
+                "error while getting scope, action, target type URI from environ: {0}", e
             )
 
         finally:
             self.logger.debug(
-                'got WATCHER.* attributes from environ: action: {0}, target_type_uri: {1}, scope: {2}'
-                .format(action, target_type_uri, scope))
+                'got WATCHER.* attributes from environ: action: {0}, target_type_uri: {1}, scope: {2}',
+                action, target_type_uri, scope
+            )
             return scope, action, target_type_uri
 
     def _get_scope_from_environ(self, environ):
@@ -504,15 +992,28 @@ class OpenStackRateLimitMiddleware(object):
         :param environ: the request environ
         :return: the key or None
         """
-        _domain_name = environ.get('WATCHER.INITIATOR_DOMAIN_NAME', None)
-        _project_domain_name = environ.get('WATCHER.INITIATOR_PROJECT_DOMAIN_NAME', None)
         project_name = environ.get('WATCHER.INITIATOR_PROJECT_NAME', None)
-        domain_name = _project_domain_name or _domain_name
+        domain_name = self._get_domain_name_from_environ(environ)
 
         if common.is_none_or_unknown(project_name) or common.is_none_or_unknown(domain_name):
             return None
         return '{0}/{1}'.format(domain_name, project_name)
 
+    def _get_domain_name_from_environ(self, environ):
+        """
+        Attempt to get the name of the (project) domain from WATCHER attributes found in the request environ.
+
+        :param environ: the request environ
+        :return: the domain name or None
+        """
+        _domain_name = environ.get('WATCHER.INITIATOR_DOMAIN_NAME', None)
+        _project_domain_name = environ.get('WATCHER.INITIATOR_PROJECT_DOMAIN_NAME', None)
+        domain_name = _project_domain_name or _domain_name
+
+        if common.is_none_or_unknown(domain_name):
+            return None
+        return domain_name
+
     def _get_username_from_environ(self, environ):
         """
         Attempt to get username from WATCHER attributes found in request environ.
@@ -538,6 +1039,10 @@ class OpenStackRateLimitMiddleware(object):
             if not common.is_none_or_unknown(svc_type):
                 self.service_type = svc_type
                 self.ratelimit_provider.service_type = self.service_type
+                if self.adaptive_limiter:
+                    self.adaptive_limiter.key = self._get_adaptive_limits_key()
+                if isinstance(self.backend, rate_limit_backend.RedisBackend):
+                    self.backend.replica_registry_key = self._get_replica_registry_key()
 
         # set service name from environ
         if common.is_none_or_unknown(self.cadf_service_name):
@@ -567,8 +1072,8 @@ class OpenStackRateLimitMiddleware(object):
             target_type_uri_without_prefix = without_prefix[-1].lstrip('/')
         except IndexError as e:
             self.logger.warning(
-                "rate limiting might not be possible. cannot trim prefix '{0}' from target_type_uri '{1}': {2}"
-                .format(prefix, target_type_uri, str(e))
+                "rate limiting might not be possible. cannot trim prefix '{0}' from target_type_uri '{1}': {2}",
+                prefix, target_type_uri, e
             )
         finally:
             return target_type_uri_without_prefix
@@ -0,0 +1,182 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import os
+import yaml
+
+from . import common
+from . import compiled
+from . import cost
+from . import errors
+from . import log
+from . import priority
+from . import units
+
+
+def load_and_validate_config(cfg_file):
+    """
+    Load the yaml configuration and validate the rate limits.
+    Unlike common.load_config, errors are raised, so that an invalid configuration can be rejected.
+    Compiled artifacts were validated when they were compiled.
+
+    :param cfg_file: path to the yaml configuration file
+    :return: the configuration as dictionary
+    :raises errors.ConfigError: if the configuration cannot be loaded or is invalid
+    """
+    if compiled.is_compiled(cfg_file):
+        return compiled.load(cfg_file)
+
+    try:
+        with open(cfg_file, 'r') as f:
+            config = yaml.safe_load(f) or {}
+    except (IOError, yaml.YAMLError) as e:
+        raise errors.ConfigError("failed to load configuration from file {0}: {1}".format(cfg_file, str(e)))
+
+    if not isinstance(config, dict):
+        raise errors.ConfigError("configuration must be a mapping")
+
+    rates = config.get('rates', None) or {}
+    if not isinstance(rates, dict):
+        raise errors.ConfigError("rates must be a mapping")
+    for level, target_type_uris in rates.items():
+        if level == 'projects':
+            # Overrides per scope.
+            if not isinstance(target_type_uris, dict):
+                raise errors.ConfigError("rates of 'projects' must be a mapping of scopes")
+            for scope_target_type_uris in target_type_uris.values():
+                _validate_rules(scope_target_type_uris)
+        else:
+            _validate_rules(target_type_uris)
+
+    # Validated by compiling them like the request path does.
+    if config.get('priorities', None):
+        priority.PriorityMatcher(config.get('priorities'))
+    return config
+
+
+def _validate_rules(target_type_uris):
+    if not isinstance(target_type_uris, dict):
+        raise errors.ConfigError("rates must be a mapping of target type URIs")
+    for target_type_uri, rules in target_type_uris.items():
+        if not isinstance(rules, list):
+            raise errors.ConfigError("rules of '{0}' must be a list".format(target_type_uri))
+        for rule in rules:
+            _validate_rule(target_type_uri, rule)
+
+
+def _validate_rule(target_type_uri, rule):
+    if not isinstance(rule, dict) or not rule.get('action'):
+        raise errors.ConfigError("invalid rule of '{0}': {1}".format(target_type_uri, rule))
+    _validate_limit(target_type_uri, rule.get('limit', None))
+
+    # Additional rate limits per scope level, e.g. domain and user.
+    scopes = rule.get('scopes', None)
+    if scopes is not None:
+        scope_levels = (common.Constants.scope_level_domain, common.Constants.scope_level_user)
+        if not isinstance(scopes, dict) or any(level not in scope_levels for level in scopes):
+            raise errors.ConfigError(
+                "scopes of '{0}' must be a mapping of {1} to rate limits: {2}".format(
+                    target_type_uri, ', '.join(scope_levels), scopes
+                )
+            )
+        for limit in scopes.values():
+            _validate_limit(target_type_uri, limit)
+
+    if rule.get('cost', None) is not None:
+        try:
+            # Evaluated for a request without any parameters. Invalid expressions fail regardless of the request.
+            cost.request_cost(rule.get('cost'), {})
+        except errors.ConfigError as e:
+            raise errors.ConfigError("invalid cost of '{0}': {1}".format(target_type_uri, str(e)))
+
+    concurrency = rule.get('concurrency', None)
+    if concurrency is not None:
+        max_concurrency = common.to_int(concurrency, None)
+        if max_concurrency is None or (max_concurrency < 1 and not common.is_unlimited(max_concurrency)):
+            raise errors.ConfigError("invalid concurrency of '{0}': {1}".format(target_type_uri, concurrency))
+
+
+def _validate_limit(target_type_uri, limit):
+    if limit is None or common.is_unlimited(limit):
+        return
+    for rate_limit in common.to_rate_limit_list(limit):
+        max_calls, window_seconds = units.Units.parse_sliding_window_rate_limit(str(rate_limit))
+        if max_calls < 0 or window_seconds <= 0:
+            raise errors.ConfigError("invalid limit of '{0}': {1}".format(target_type_uri, rate_limit))
+
+
+class ConfigWatcher(object):
+    """
+    Watches the configuration file in a background greenthread and invokes a callback once it changed.
+
+    Polls the modification time and size of the file. The path is resolved on every check,
+    so that a file replaced via a symlink, e.g. a Kubernetes ConfigMap, is noticed as well.
+    """
+
+    def __init__(self, cfg_file, on_change, interval_seconds=10, logger=log.Logger(__name__)):
+        """
+        Create a new ConfigWatcher.
+
+        :param cfg_file: path to the configuration file
+        :param on_change: callable invoked once the file changed
+        :param interval_seconds: the time between two checks
+        :param logger: the logger
+        """
+        self.__cfg_file = cfg_file
+        self.__on_change = on_change
+        self.__interval_seconds = max(1, interval_seconds)
+        self.logger = logger
+        self.__signature = self.__stat()
+        self.__watcher = None
+
+    def __stat(self):
+        try:
+            stat = os.stat(self.__cfg_file)
+            return stat.st_mtime, stat.st_size
+        except OSError:
+            return None
+
+    def start(self):
+        """Start watching the file. Returns immediately."""
+        if self.__watcher is None:
+            self.__watcher = eventlet.spawn(self.__watch_loop)
+
+    def stop(self):
+        """Stop watching the file."""
+        if self.__watcher is not None:
+            self.__watcher.kill()
+            self.__watcher = None
+
+    def check(self):
+        """
+        Check whether the file changed since the last check and invoke the callback if so.
+        A missing file is not considered a change.
+
+        :return: bool whether the file changed
+        """
+        signature = self.__stat()
+        if signature is None or signature == self.__signature:
+            return False
+        self.__signature = signature
+        try:
+            self.__on_change()
+        except Exception as e:
+            self.logger.warning("error reloading configuration {0}: {1}", self.__cfg_file, e)
+        return True
+
+    def __watch_loop(self):
+        while True:
+            eventlet.sleep(self.__interval_seconds)
+            self.check()
@@ -69,18 +69,23 @@ class RateLimitExceededResponse(Response):
         self.content_type = common.Constants.content_type_json
         self.json_body = json.dumps(json_body, sort_keys=True)
 
-    def set_headers(self, ratelimit, remaining, retry_after):
+    def set_headers(self, ratelimit, remaining, retry_after, scope_level=None):
         """
         Set response headers.
 
         :param ratelimit: the limit for the current request in the format <n>r/<m><t>
         :param remaining: the number of remaining requests within the current window
         :param retry_after: the remaining window before the rate limit resets in seconds
+        :param scope_level: the scope level of the exceeded rate limit or None
         """
         self.headers[common.Constants.header_ratelimit_retry_after] = str(retry_after)
         self.headers[common.Constants.header_ratelimit_reset] = str(retry_after)
         self.headers[common.Constants.header_ratelimit_limit] = str(ratelimit)
         self.headers[common.Constants.header_ratelimit_remaining] = str(max(0, int(remaining)))
+        if scope_level:
+            self.headers[common.Constants.header_ratelimit_scope] = str(scope_level)
+        elif common.Constants.header_ratelimit_scope in self.headers:
+            del self.headers[common.Constants.header_ratelimit_scope]
 
     def set_environ(self, environ):
         """Set the environ of the request triggering this response."""
@@ -0,0 +1,158 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+
+from . import common
+from . import errors
+
+
+class SharedCounterTable(object):
+    """
+    Fixed-size hash table of sliding window counters in a memory-mapped file.
+
+    The file is shared by all processes on a host. The table is split into stripes.
+    Keys are placed in a stripe by their hash and probed linearly within it (open addressing),
+    so a single byte-range lock per stripe serializes all updates of its records.
+
+    Record layout: key hash (uint64), window id (uint64), current count (uint32),
+    previous count (uint32), expiry timestamp (uint32), padding.
+    """
+
+    MAGIC = b'RLSHM001'
+    HEADER = struct.Struct('<8sQI')
+    HEADER_SIZE = 64
+    RECORD = struct.Struct('<QQIII4x')
+    MAX_PROBES = 16
+
+    def __init__(self, path, slots=65536, stripes=64):
+        self.__stripes = max(1, int(stripes))
+        self.__slots_per_stripe = max(1, int(slots) // self.__stripes)
+        self.__slots = self.__slots_per_stripe * self.__stripes
+        self.__size = self.HEADER_SIZE + self.__slots * self.RECORD.size
+        # fcntl locks are held per process. Serialize threads of the same process as well.
+        self.__lock = threading.Lock()
+
+        try:
+            self.__fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            self.__init_file()
+            self.__map = mmap.mmap(self.__fd, self.__size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except (IOError, OSError, ValueError) as e:
+            raise errors.ConfigError("failed to open shared memory table {0}: {1}".format(path, str(e)))
+
+    @property
+    def slots(self):
+        return self.__slots
+
+    def __init_file(self):
+        """Initialize the file unless it already contains a table of the expected size."""
+        fcntl.flock(self.__fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self.__fd, self.HEADER.size, 0)
+            expected = self.HEADER.pack(self.MAGIC, self.__slots, self.__stripes)
+            if header == expected and os.fstat(self.__fd).st_size == self.__size:
+                return
+            # Never truncate a table other processes might have mapped.
+            if header.startswith(self.MAGIC):
+                raise ValueError("existing table has a different number of slots or stripes")
+            os.ftruncate(self.__fd, 0)
+            os.ftruncate(self.__fd, self.__size)
+            os.pwrite(self.__fd, expected, 0)
+        finally:
+            fcntl.flock(self.__fd, fcntl.LOCK_UN)
+
+    def rate_limit(self, key, window_seconds, max_calls, max_sleep_time_seconds, now, cost=1, count=True):
+        """
+        Check and count a request for the given key.
+
+        :param key: the key as returned by common.key_func
+        :param window_seconds: the sliding window in seconds
+        :param max_calls: the max. number of requests per window
+        :param max_sleep_time_seconds: max. time a request can be suspended
+        :param now: the current timestamp
+        :param cost: the number of units the request consumes
+        :param count: False to only check whether the request fits without counting it
+        :return: tuple of remaining requests and retry after in seconds like RedisBackend.rate_limit
+        """
+        if window_seconds <= 0 or max_calls < 0:
+            return 1, -1
+
+        cost = common.window_cost(cost, max_calls)
+        key_hash = self.__hash('{0}|{1}'.format(key, window_seconds))
+        stripe = key_hash % self.__stripes
+        window_id = int(now // window_seconds)
+        expires = int((window_id + 2) * window_seconds) + 1
+
+        with self.__lock:
+            fcntl.lockf(self.__fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                offset = self.__find_slot(key_hash, stripe, int(now))
+                if offset is None:
+                    # Stripe is full. Don't rate limit rather than evicting active keys.
+                    return 1, -1
+
+                stored_hash, stored_window_id, current, previous, _ = self.RECORD.unpack_from(self.__map, offset)
+                if stored_hash != key_hash or stored_window_id < window_id - 1:
+                    current = previous = 0
+                elif stored_window_id == window_id - 1:
+                    current, previous = 0, current
+
+                is_counted, remaining, retry_after_seconds = common.sliding_window_counter(
+                    previous=previous,
+                    current=current,
+                    window_seconds=window_seconds,
+                    elapsed_seconds=now - window_id * window_seconds,
+                    max_calls=max_calls,
+                    max_sleep_time_seconds=max_sleep_time_seconds,
+                    cost=cost,
+                )
+                if is_counted and count:
+                    current += cost
+                self.RECORD.pack_into(self.__map, offset, key_hash, window_id, current, previous, expires)
+                return remaining, retry_after_seconds
+            finally:
+                fcntl.lockf(self.__fd, fcntl.LOCK_UN, 1, stripe)
+
+    def __find_slot(self, key_hash, stripe, now):
+        """
+        Find the slot of the key within its stripe. Must be called holding the stripe lock.
+
+        :return: the offset of the slot holding the key, an empty or an expired slot or None if the stripe is full
+        """
+        start = (key_hash // self.__stripes) % self.__slots_per_stripe
+        expired_offset = None
+        for i in range(min(self.MAX_PROBES, self.__slots_per_stripe)):
+            slot = stripe * self.__slots_per_stripe + (start + i) % self.__slots_per_stripe
+            offset = self.HEADER_SIZE + slot * self.RECORD.size
+            stored_hash, _, _, _, expires = self.RECORD.unpack_from(self.__map, offset)
+            if stored_hash == key_hash or stored_hash == 0:
+                return offset
+            if expired_offset is None and expires < now:
+                expired_offset = offset
+        return expired_offset
+
+    @staticmethod
+    def __hash(key):
+        """Stable 64 bit hash of the key. Zero marks an empty slot."""
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+        return struct.unpack_from('<Q', digest)[0] or 1
+
+    def close(self):
+        self.__map.close()
+        os.close(self.__fd)
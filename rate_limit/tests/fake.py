@@ -14,6 +14,8 @@
 
 from webob import Response
 
+from rate_limit.adaptive import LocalLimitFactors
+
 
 class FakeMemcache(object):
     def __init__(self):
@@ -26,8 +28,20 @@ class FakeMemcache(object):
         self.store[key] = value
         return True
 
+    def add(self, key, value, time=0):
+        if key in self.store:
+            return False
+        self.store[key] = value
+        return True
+
+    def get_multi(self, keys):
+        return dict((k, self.store[k]) for k in keys if k in self.store)
+
     def incr(self, key, delta=1, time=0):
-        value = int(self.store.setdefault(key, 0)) + int(delta)
+        # Like memcached, incrementing a missing key fails.
+        if key not in self.store:
+            return None
+        value = int(self.store[key]) + int(delta)
         if value < 0:
             value = 0
         self.store[key] = value
@@ -44,6 +58,71 @@ class FakeMemcache(object):
         return True
 
 
+class FakeRedisClient(object):
+    """Fake pyredis client supporting bulk mode. Each command returns its own arguments."""
+
+    def __init__(self, replies=None):
+        self.replies = replies or {}
+        self.closed = False
+        self.bulks = []
+        self.executed = []
+        self.__bulk = None
+
+    def bulk_start(self, bulk_size=5000, keep_results=True):
+        self.__bulk = []
+
+    def execute(self, *args):
+        self.executed.append(args)
+        result = self.replies.get(args[0], list(args))
+        if self.__bulk is None:
+            if isinstance(result, Exception):
+                raise result
+            return result
+        self.__bulk.append(result)
+
+    def bulk_stop(self):
+        results, self.__bulk = self.__bulk, None
+        self.bulks.append(results)
+        return results
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRedisPool(object):
+    def __init__(self, client=None):
+        self.client = client or FakeRedisClient()
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return self.client
+
+    def release(self, conn):
+        pass
+
+    def execute(self, *args):
+        return self.client.execute(*args)
+
+
+class FakeMetricsClient(object):
+    """Records emitted metrics as tuples of (type, metric, value, tags)."""
+    def __init__(self):
+        self.metrics = []
+
+    def increment(self, metric, value=1, tags=None):
+        self.metrics.append(('increment', metric, value, tags))
+
+    def gauge(self, metric, value, tags=None):
+        self.metrics.append(('gauge', metric, value, tags))
+
+    def histogram(self, metric, value, tags=None):
+        self.metrics.append(('histogram', metric, value, tags))
+
+    def get(self, metric):
+        return [value for _, name, value, _ in self.metrics if name == metric]
+
+
 class FakeApp(object):
     def __call__(self, environ, start_response):
         return Response(json_body='{"message":"fake app"}')(environ, start_response)
@@ -63,3 +142,41 @@ class FakeSession(object):
 class FakeServiceManager(object):
     def list(self):
         return []
+
+
+class FakeTokenBucketBackend(object):
+    """Fake backend recording the reserved tokens. Every reservation has to wait wait_seconds."""
+
+    def __init__(self, wait_seconds=0):
+        self.wait_seconds = wait_seconds
+        self.reserved = []
+
+    def reserve_tokens(self, key, amount, rate, burst):
+        self.reserved.append((key, amount, rate, burst))
+        return self.wait_seconds
+
+
+class ClosableIterable(object):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeLimitFactorBackend(object):
+    """Fake backend recording the reported overloads. Returns the factor of the local AIMD adjustment."""
+
+    def __init__(self):
+        self.factors = LocalLimitFactors()
+        self.reported = []
+        self.now = 0
+
+    def adjust_limit_factor(self, key, overloaded, increase, decrease, min_factor, interval_seconds):
+        self.reported.append(overloaded)
+        self.now += interval_seconds
+        return self.factors.adjust(key, overloaded, increase, decrease, min_factor, interval_seconds, now=self.now)
@@ -0,0 +1,967 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Pure-Python stand-in for Redis speaking RESP, so that the RedisBackend can be tested and benchmarked offline.
+
+Implements the subset of commands used by the middleware. By default, the scripts shipped in rate_limit/lua
+are emulated in Python and identified by their sha1, so EVAL/EVALSHA and SCRIPT behave like Redis for them.
+With lua=True, scripts run in Lua 5.1 like in Redis instead, so that the scripts themselves are tested.
+This requires the lupa package. Faults can be injected: latency per command, failing commands and stalls.
+
+Usage:
+    with FakeRedisServer() as server:
+        backend = RedisBackend(host=server.host, port=server.port, ...)
+        server.latency_seconds = 0.05
+        server.fail(count=3)
+        server.stall()
+        server.resume()
+
+    python -m rate_limit.tests.fake_redis --port 6379 --latency-ms 1 [--lua]
+"""
+
+import argparse
+import collections
+import hashlib
+import math
+import re
+import socket
+import socketserver
+import threading
+import time
+
+from rate_limit import common
+
+try:
+    from lupa import lua51
+except ImportError:
+    lua51 = None
+
+REDIS_VERSION = '7.0.0'
+BASE62_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+
+
+class ReplyError(Exception):
+    """An error replied to the client, e.g. 'ERR unknown command'."""
+
+
+class Status(str):
+    """A simple string reply, e.g. +OK."""
+
+
+OK = Status('OK')
+
+
+def encode(reply):
+    """
+    Encode a reply in RESP. Numbers are integer replies as Redis converts Lua numbers to integers.
+
+    :param reply: the reply
+    :return: the encoded reply as bytes
+    """
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, ReplyError):
+        return '-{0}\r\n'.format(str(reply)).encode('utf-8')
+    if isinstance(reply, Status):
+        return '+{0}\r\n'.format(reply).encode('utf-8')
+    if isinstance(reply, bool):
+        return ':{0}\r\n'.format(int(reply)).encode('utf-8')
+    if isinstance(reply, (int, float)):
+        return ':{0}\r\n'.format(int(reply)).encode('utf-8')
+    if isinstance(reply, (list, tuple)):
+        return b''.join(['*{0}\r\n'.format(len(reply)).encode('utf-8')] + [encode(item) for item in reply])
+    if not isinstance(reply, bytes):
+        reply = str(reply).encode('utf-8')
+    return b''.join(['${0}\r\n'.format(len(reply)).encode('utf-8'), reply, b'\r\n'])
+
+
+def format_score(score):
+    """Format a score like Redis."""
+    if score == int(score):
+        return str(int(score))
+    return '%.17g' % score
+
+
+def parse_score_bound(value):
+    """
+    Parse a bound of ZREMRANGEBYSCORE, e.g. '-inf', '10' or '(10' (exclusive).
+
+    :return: tuple of the bound and whether it's exclusive
+    """
+    value = str(value)
+    exclusive = value.startswith('(')
+    if exclusive:
+        value = value[1:]
+    try:
+        return float(value), exclusive
+    except ValueError:
+        raise ReplyError('ERR min or max is not a float')
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ReplyError('ERR value is not an integer or out of range')
+
+
+class FakeRedis(object):
+    """The keyspace and the commands. Commands are executed one at a time like in Redis."""
+
+    def __init__(self, clock=None, lua=False):
+        """
+        Create a new FakeRedis.
+
+        :param clock: callable returning the current time in seconds. defaults to time.time
+        :param lua: whether to run scripts in Lua instead of emulating them. requires the lupa package
+        """
+        self.clock = clock or time.time
+        self.lua = LuaRuntime(self) if lua else None
+        self.lock = threading.RLock()
+        self.data = {}
+        # Expiry per key in milliseconds.
+        self.expires = {}
+        # Cached scripts by sha1.
+        self.scripts = {}
+        # Number of executed commands per name.
+        self.commands = collections.Counter()
+
+    def execute(self, *args):
+        """
+        Execute a command.
+
+        :param args: the command and its arguments
+        :return: the reply
+        :raises ReplyError: if the command failed
+        """
+        if not args:
+            raise ReplyError('ERR empty command')
+        name = str(args[0]).lower()
+        func = getattr(self, 'cmd_' + name, None)
+        if func is None:
+            raise ReplyError("ERR unknown command '{0}'".format(args[0]))
+        with self.lock:
+            self.commands[name] += 1
+            return func(*[str(arg) for arg in args[1:]])
+
+    def now_ms(self):
+        return self.clock() * 1000.0
+
+    def get(self, key, expected_type=None):
+        """Get the value of the key if it's not expired."""
+        deadline = self.expires.get(key, None)
+        if deadline is not None and deadline <= self.now_ms():
+            self.delete(key)
+        value = self.data.get(key, None)
+        if value is not None and expected_type is not None and not isinstance(value, expected_type):
+            raise ReplyError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def delete(self, key):
+        self.expires.pop(key, None)
+        return self.data.pop(key, None) is not None
+
+    def cmd_ping(self, *args):
+        return args[0] if args else Status('PONG')
+
+    def cmd_select(self, database):
+        # A single database is enough for the middleware.
+        return OK
+
+    def cmd_info(self, *args):
+        return (
+            '# Server\r\nredis_version:{0}\r\nredis_mode:standalone\r\n'
+            '# Stats\r\ntotal_commands_processed:{1}\r\n'
+        ).format(REDIS_VERSION, sum(self.commands.values()))
+
+    def cmd_time(self):
+        now = self.clock()
+        return [str(int(now)), str(int(round((now - int(now)) * 1e6)))]
+
+    def cmd_flushall(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return OK
+
+    cmd_flushdb = cmd_flushall
+
+    def cmd_get(self, key):
+        value = self.get(key, str)
+        return value
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        exists = self.get(key) is not None
+        if ('NX' in options and exists) or ('XX' in options and not exists):
+            return None
+        self.delete(key)
+        self.data[key] = value
+        for unit, factor in (('EX', 1000), ('PX', 1)):
+            if unit in options:
+                self.expires[key] = self.now_ms() + to_int(options[options.index(unit) + 1]) * factor
+        return OK
+
+    def cmd_del(self, *keys):
+        return len([key for key in keys if self.get(key) is not None and self.delete(key)])
+
+    def cmd_exists(self, *keys):
+        return len([key for key in keys if self.get(key) is not None])
+
+    def cmd_incrby(self, key, increment):
+        value = to_int(self.get(key, str) or 0) + to_int(increment)
+        self.data[key] = str(value)
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, '1')
+
+    def cmd_decr(self, key):
+        return self.cmd_incrby(key, '-1')
+
+    def cmd_decrby(self, key, decrement):
+        return self.cmd_incrby(key, str(-to_int(decrement)))
+
+    def cmd_pexpire(self, key, milliseconds):
+        if self.get(key) is None:
+            return 0
+        self.expires[key] = self.now_ms() + to_int(float(milliseconds))
+        return 1
+
+    def cmd_expire(self, key, seconds):
+        return self.cmd_pexpire(key, str(to_int(float(seconds)) * 1000))
+
+    def cmd_pttl(self, key):
+        if self.get(key) is None:
+            return -2
+        deadline = self.expires.get(key, None)
+        if deadline is None:
+            return -1
+        return int(deadline - self.now_ms())
+
+    def cmd_ttl(self, key):
+        ttl = self.cmd_pttl(key)
+        return ttl if ttl < 0 else int(math.ceil(ttl / 1000.0))
+
+    def cmd_hmset(self, key, *fields):
+        if not fields or len(fields) % 2:
+            raise ReplyError("ERR wrong number of arguments for 'hmset' command")
+        value = self.get(key, dict)
+        if value is None:
+            value = self.data[key] = {}
+        for idx in range(0, len(fields), 2):
+            value[fields[idx]] = fields[idx + 1]
+        return OK
+
+    def cmd_hset(self, key, *fields):
+        value = self.get(key, dict) or {}
+        added = len([f for f in fields[::2] if f not in value])
+        self.cmd_hmset(key, *fields)
+        return added
+
+    def cmd_hmget(self, key, *fields):
+        value = self.get(key, dict) or {}
+        return [value.get(field, None) for field in fields]
+
+    def cmd_hgetall(self, key):
+        value = self.get(key, dict) or {}
+        return [item for pair in sorted(value.items()) for item in pair]
+
+    def cmd_zadd(self, key, *args):
+        if not args or len(args) % 2:
+            raise ReplyError('ERR syntax error')
+        value = self.get(key, dict)
+        if value is None:
+            value = self.data[key] = {}
+        added = 0
+        for idx in range(0, len(args), 2):
+            try:
+                score = float(args[idx])
+            except ValueError:
+                raise ReplyError('ERR value is not a valid float')
+            if args[idx + 1] not in value:
+                added += 1
+            value[args[idx + 1]] = score
+        return added
+
+    def cmd_zrem(self, key, *members):
+        value = self.get(key, dict) or {}
+        removed = len([m for m in members if value.pop(m, None) is not None])
+        if not value:
+            self.delete(key)
+        return removed
+
+    def cmd_zcard(self, key):
+        return len(self.get(key, dict) or {})
+
+    def cmd_zrange(self, key, start, stop, *options):
+        ordered = sorted((self.get(key, dict) or {}).items(), key=lambda item: (item[1], item[0]))
+        start, stop = to_int(start), to_int(stop)
+        if start < 0:
+            start = max(0, len(ordered) + start)
+        if stop < 0:
+            stop = len(ordered) + stop
+        selected = ordered[start:stop + 1]
+        if 'WITHSCORES' in [o.upper() for o in options]:
+            return [item for member, score in selected for item in (member, format_score(score))]
+        return [member for member, _ in selected]
+
+    def cmd_zrangebyscore(self, key, min_score, max_score):
+        (lo, lo_exclusive), (hi, hi_exclusive) = parse_score_bound(min_score), parse_score_bound(max_score)
+        ordered = sorted((self.get(key, dict) or {}).items(), key=lambda item: (item[1], item[0]))
+        return [
+            member for member, score in ordered
+            if (score > lo if lo_exclusive else score >= lo) and (score < hi if hi_exclusive else score <= hi)
+        ]
+
+    def cmd_zremrangebyscore(self, key, min_score, max_score):
+        value = self.get(key, dict) or {}
+        removed = self.cmd_zrangebyscore(key, min_score, max_score)
+        for member in removed:
+            del value[member]
+        if not value:
+            self.delete(key)
+        return len(removed)
+
+    def cmd_script(self, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == 'LOAD':
+            return self.load_script(args[0])
+        if subcommand == 'EXISTS':
+            return [int(sha in self.scripts) for sha in args]
+        if subcommand == 'FLUSH':
+            self.scripts.clear()
+            return OK
+        raise ReplyError("ERR unknown subcommand '{0}'".format(subcommand))
+
+    def load_script(self, script):
+        sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        if self.lua:
+            self.scripts[sha] = self.lua.compile(script)
+            return sha
+        if sha not in SCRIPTS:
+            raise ReplyError('ERR fake redis cannot run script {0}. only the scripts of rate_limit/lua'.format(sha))
+        self.scripts[sha] = SCRIPTS[sha]
+        return sha
+
+    def cmd_eval(self, script, numkeys, *args):
+        return self.cmd_evalsha(self.load_script(script), numkeys, *args)
+
+    def cmd_evalsha(self, sha, numkeys, *args):
+        func = self.scripts.get(sha, None)
+        if func is None:
+            raise ReplyError('NOSCRIPT No matching script. Please use EVAL.')
+        numkeys = to_int(numkeys)
+        try:
+            return script_reply(func(ScriptContext(self), list(args[:numkeys]), list(args[numkeys:])))
+        except ReplyError:
+            raise
+        except Exception as e:
+            raise ReplyError('ERR Error running script (call to f_{0}): {1}'.format(sha, str(e)))
+
+
+class ScriptContext(object):
+    """The redis object of the emulated Lua scripts."""
+
+    def __init__(self, redis):
+        self.__redis = redis
+
+    def call(self, *args):
+        """Call a command like redis.call. Numbers are converted to strings like Lua does."""
+        return self.__redis.execute(*[lua_tostring(arg) for arg in args])
+
+
+class LuaRuntime(object):
+    """
+    Runs scripts in Lua 5.1 like Redis. Requires the lupa package.
+
+    Replies and results are converted like Redis does: integers to numbers, bulk strings to strings,
+    nil to false, arrays to tables and status and error replies to tables with an ok or err field.
+    Numbers returned by a script are truncated to integers and arrays end at the first nil.
+    """
+
+    def __init__(self, redis):
+        """
+        Create a new LuaRuntime.
+
+        :param redis: the FakeRedis executing the commands called by scripts
+        """
+        if lua51 is None:
+            raise ImportError("running Lua scripts requires the lupa package")
+        self.__redis = redis
+        self.__lua = lua51.LuaRuntime(encoding='utf-8')
+        self.__lua.globals().redis = self.__lua.table_from({
+            'call': self.__call,
+            'pcall': self.__pcall,
+            'replicate_commands': lambda: True,
+            'error_reply': lambda msg: self.__lua.table_from({'err': msg}),
+            'status_reply': lambda msg: self.__lua.table_from({'ok': msg}),
+        })
+
+    def compile(self, script):
+        """
+        Compile the script.
+
+        :param script: the Lua source
+        :return: callable(redis, keys, argv) running the script like the emulations
+        :raises ReplyError: if the script cannot be compiled
+        """
+        try:
+            # Scripts access their arguments via the globals KEYS and ARGV.
+            func = self.__lua.execute('return function(KEYS, ARGV) ' + script + '\nend')
+        except lua51.LuaSyntaxError as e:
+            raise ReplyError('ERR Error compiling script: {0}'.format(str(e)))
+
+        def run(_, keys, argv):
+            return self.__to_reply(func(self.__lua.table_from(keys), self.__lua.table_from(argv)))
+        return run
+
+    def __call(self, *args):
+        return self.__to_lua(self.__redis.execute(*[lua_tostring(arg) for arg in args]))
+
+    def __pcall(self, *args):
+        try:
+            return self.__call(*args)
+        except ReplyError as e:
+            return self.__lua.table_from({'err': str(e)})
+
+    def __to_lua(self, reply):
+        if reply is None:
+            return False
+        if isinstance(reply, Status):
+            return self.__lua.table_from({'ok': str(reply)})
+        if isinstance(reply, list):
+            return self.__lua.table_from([self.__to_lua(item) for item in reply])
+        return reply
+
+    def __to_reply(self, value):
+        if value is None or value is False:
+            return None
+        if value is True:
+            return 1
+        if isinstance(value, float):
+            return int(value)
+        if lua51.lua_type(value) != 'table':
+            return value
+        if value['err'] is not None:
+            raise ReplyError(str(value['err']))
+        if value['ok'] is not None:
+            return Status(value['ok'])
+        items = []
+        while value[len(items) + 1] is not None:
+            items.append(self.__to_reply(value[len(items) + 1]))
+        return items
+
+
+# Emulations of the Lua scripts. Lua semantics are kept where they affect results:
+# numbers passed to redis.call are formatted with %.14g, missing numbers are nil and 0 is truthy.
+
+def script_reply(value):
+    """Truncate the numbers returned by a script to integers like Redis."""
+    if isinstance(value, list):
+        return [script_reply(item) for item in value]
+    if isinstance(value, float):
+        return int(value)
+    return value
+
+
+def lua_tostring(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value)
+    return '%.14g' % value
+
+
+def tonumber(value):
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def arg(values, idx):
+    return values[idx] if idx < len(values) else None
+
+
+def server_time_microseconds(redis):
+    sec, usec = redis.call('TIME')
+    return tonumber(sec) * 1000000 + tonumber(usec)
+
+
+def base62(timestamp):
+    timestamp = math.floor(timestamp)
+    digits = []
+    while True:
+        digits.insert(0, BASE62_ALPHABET[int(timestamp % 62)])
+        timestamp = math.floor(timestamp / 62)
+        if timestamp <= 0:
+            return ''.join(digits)
+
+
+def weight(member):
+    match = re.search(r'#(\d+)$', member)
+    return int(match.group(1)) if match else 1
+
+
+def window_cost(cost, max_calls):
+    return max(1, min(1 if cost is None else cost, max_calls))
+
+
+def trim(redis, key, max_score, weighted_keys):
+    weight_key = key + ':weight'
+    extra = tonumber(redis.call('get', weight_key))
+    if extra is not None:
+        freed = sum(weight(member) - 1 for member in redis.call('zrangebyscore', key, '-inf', max_score))
+        if freed >= extra:
+            redis.call('del', weight_key)
+            extra = 0
+        else:
+            weighted_keys.add(key)
+            if freed > 0:
+                extra = redis.call('decrby', weight_key, freed)
+    redis.call('zremrangebyscore', key, '-inf', max_score)
+    return redis.call('zcard', key) + (extra or 0)
+
+
+def release_score(redis, key, units):
+    released = 0
+    members = redis.call('zrange', key, 0, -1, 'WITHSCORES')
+    for idx in range(0, len(members), 2):
+        released += weight(members[idx])
+        if released >= units:
+            return tonumber(members[idx + 1])
+    return None
+
+
+def count_weighted(redis, key, timestamp, member, cost, weighted_keys):
+    if cost > 1:
+        if redis.call('zadd', key, timestamp, '{0}#{1}'.format(member, cost)) == 1:
+            redis.call('incrby', key + ':weight', cost - 1)
+            weighted_keys.add(key)
+    else:
+        redis.call('zadd', key, timestamp, member)
+
+
+def expire_weighted(redis, command, key, ttl, weighted_keys):
+    redis.call(command, key, ttl)
+    if key in weighted_keys:
+        redis.call(command, key + ':weight', ttl)
+
+
+def sliding_window(redis, keys, argv):
+    key = keys[0]
+    lookback_timestamp_max, now, max_calls, window, max_sleep_time_seconds, clock_accuracy = \
+        [tonumber(k) for k in keys[1:7]]
+    compact_members = arg(keys, 7) == '1'
+    cost = window_cost(tonumber(arg(keys, 8)), max_calls)
+    weighted_keys = set()
+
+    def count(timestamp):
+        if compact_members:
+            member = base62(timestamp)
+        else:
+            # Lua formats numbers passed to redis.call with %.14g, but the weighted member with %d.
+            member = lua_tostring(timestamp) if cost == 1 else '%d' % timestamp
+        count_weighted(redis, key, timestamp, member, cost, weighted_keys)
+
+    def expire():
+        expire_weighted(redis, 'expire', key, window, weighted_keys)
+
+    remaining = max_calls - trim(redis, key, lookback_timestamp_max, weighted_keys)
+    if remaining >= cost:
+        count(now)
+        expire()
+        return [remaining - cost + 1, -1]
+
+    timestamp0 = release_score(redis, key, cost - max(remaining, 0))
+    if timestamp0 is None:
+        return [0, 2 * max_sleep_time_seconds]
+    retry_after_seconds = math.ceil(timestamp0 + window - now) / float(clock_accuracy)
+    if retry_after_seconds < max_sleep_time_seconds and remaining - cost >= -max_calls:
+        count(now + retry_after_seconds * clock_accuracy)
+        expire()
+        return [remaining - cost, retry_after_seconds]
+    return [0, 2 * max_sleep_time_seconds]
+
+
+def sliding_window_server_time(redis, keys, argv):
+    key = keys[0]
+    max_calls, window_microseconds, max_sleep_time_seconds = [tonumber(k) for k in keys[1:4]]
+    member_id = keys[4]
+    compact_members = arg(keys, 5) == '1'
+    cost = window_cost(tonumber(arg(keys, 6)), max_calls)
+    weighted_keys = set()
+
+    def count(timestamp):
+        member = '{0}:{1}'.format(base62(timestamp) if compact_members else '%d' % timestamp, member_id)
+        count_weighted(redis, key, timestamp, member, cost, weighted_keys)
+
+    def pexpire(milliseconds):
+        expire_weighted(redis, 'pexpire', key, milliseconds, weighted_keys)
+
+    now = server_time_microseconds(redis)
+    remaining = max_calls - trim(redis, key, now - window_microseconds, weighted_keys)
+    if remaining >= cost:
+        count(now)
+        pexpire(math.ceil(window_microseconds / 1000.0))
+        return [remaining - cost + 1, -1]
+
+    timestamp0 = release_score(redis, key, cost - max(remaining, 0))
+    if timestamp0 is None:
+        return [0, 2 * max_sleep_time_seconds]
+    retry_after_seconds = (timestamp0 + window_microseconds - now) / 1000000.0
+    if retry_after_seconds < max_sleep_time_seconds and remaining - cost >= -max_calls:
+        count(timestamp0 + window_microseconds)
+        pexpire(math.ceil(window_microseconds / 1000.0) + max_sleep_time_seconds * 1000)
+        return [remaining - cost, math.ceil(retry_after_seconds)]
+    return [0, 2 * max_sleep_time_seconds]
+
+
+def sliding_window_multi(redis, keys, argv):
+    now, clock_accuracy, max_sleep_time_seconds = [tonumber(a) for a in argv[0:3]]
+    compact_members = argv[3] == '1'
+    member_id = arg(argv, 4) or ''
+    cost = tonumber(arg(argv, 5))
+    if now is None:
+        now = server_time_microseconds(redis)
+        clock_accuracy = 1000000
+    weighted_keys = set()
+
+    def limits(i):
+        return tonumber(argv[4 + 2 * i]), tonumber(argv[5 + 2 * i])
+
+    def count(timestamp):
+        member = base62(timestamp) if compact_members else '%d' % timestamp
+        if member_id != '':
+            member = '{0}:{1}'.format(member, member_id)
+        for i, key in enumerate(keys, 1):
+            max_calls, window = limits(i)
+            count_weighted(redis, key, timestamp, member, window_cost(cost, max_calls), weighted_keys)
+            ttl = math.ceil(window * 1000.0 / clock_accuracy) + max_sleep_time_seconds * 1000
+            expire_weighted(redis, 'pexpire', key, ttl, weighted_keys)
+
+    remaining_min, retry_after_seconds, tightest, is_exhausted = None, -1, 1, False
+    for i, key in enumerate(keys, 1):
+        max_calls, window = limits(i)
+        cost_int = window_cost(cost, max_calls)
+        remaining = max_calls - trim(redis, key, now - window, weighted_keys) - cost_int + 1
+        if remaining >= 1:
+            if not is_exhausted and (remaining_min is None or remaining < remaining_min):
+                tightest = i
+        else:
+            retry = 2 * max_sleep_time_seconds
+            if remaining - 1 >= -max_calls:
+                first = release_score(redis, key, cost_int - max(remaining + cost_int - 1, 0))
+                if first is not None:
+                    retry = (first + window - now) / float(clock_accuracy)
+            if not is_exhausted or retry > retry_after_seconds:
+                retry_after_seconds = retry
+                tightest = i
+            is_exhausted = True
+        if remaining_min is None or remaining < remaining_min:
+            remaining_min = remaining
+
+    if not is_exhausted:
+        count(now)
+        return [remaining_min, -1, tightest]
+    if retry_after_seconds < max_sleep_time_seconds:
+        count(now + math.ceil(retry_after_seconds * clock_accuracy))
+        return [remaining_min - 1, math.ceil(retry_after_seconds), tightest]
+    return [0, 2 * max_sleep_time_seconds, tightest]
+
+
+def token_bucket(redis, keys, argv):
+    key = keys[0]
+    amount, rate, burst, now = [tonumber(k) for k in keys[1:5]]
+    if now is None:
+        now = server_time_microseconds(redis)
+    interval = 1000000.0 / rate
+    tat = tonumber(redis.call('get', key))
+    tat = now if tat is None or tat < now else tat
+    new_tat = math.ceil(tat + amount * interval)
+    redis.call('set', key, '%d' % new_tat, 'PX', math.ceil((new_tat - now) / 1000.0) + 1000)
+    wait = new_tat - burst * interval - now
+    return 0 if wait < 0 else math.ceil(wait)
+
+
+def concurrency(redis, keys, argv):
+    key = keys[0]
+    max_concurrency, lease_microseconds = tonumber(keys[1]), tonumber(keys[2])
+    slot_id = keys[3]
+    now = tonumber(arg(keys, 4))
+    if now is None:
+        now = server_time_microseconds(redis)
+    redis.call('zremrangebyscore', key, '-inf', now)
+    if redis.call('zcard', key) >= max_concurrency:
+        return 0
+    redis.call('zadd', key, now + lease_microseconds, slot_id)
+    redis.call('pexpire', key, math.ceil(lease_microseconds / 1000.0))
+    return 1
+
+
+def adaptive_limit(redis, keys, argv):
+    key = keys[0]
+    overloaded, increase, decrease, min_factor, interval_microseconds = [tonumber(k) for k in keys[1:6]]
+    now = tonumber(arg(keys, 6))
+    state = redis.call('hmget', key, 'factor', 'adjusted_at', 'decreased_at')
+    factor = tonumber(state[0])
+    factor = 1 if factor is None else factor
+    if overloaded < 0:
+        return lua_tostring(factor)
+    if now is None:
+        now = server_time_microseconds(redis)
+
+    adjusted_at, decreased_at = tonumber(state[1]), tonumber(state[2])
+    if overloaded == 1:
+        if decreased_at is None or now - decreased_at >= interval_microseconds:
+            factor = max(min_factor, factor * decrease)
+            adjusted_at = decreased_at = now
+    elif factor < 1 and (adjusted_at is None or now - adjusted_at >= interval_microseconds):
+        factor = min(1, factor + increase)
+        adjusted_at = now
+
+    if factor >= 1 and (adjusted_at is None or now - adjusted_at >= interval_microseconds):
+        redis.call('del', key)
+        return '1'
+    redis.call(
+        'hmset', key, 'factor', lua_tostring(factor),
+        'adjusted_at', '%d' % adjusted_at, 'decreased_at', '%d' % (decreased_at or 0)
+    )
+    redis.call('pexpire', key, math.ceil(interval_microseconds / 1000.0) * 10)
+    return lua_tostring(factor)
+
+
+def _load_scripts():
+    emulations = {
+        'redis_sliding_window.lua': sliding_window,
+        'redis_sliding_window_server_time.lua': sliding_window_server_time,
+        'redis_sliding_window_multi.lua': sliding_window_multi,
+        'redis_token_bucket.lua': token_bucket,
+        'redis_concurrency.lua': concurrency,
+        'redis_adaptive_limit.lua': adaptive_limit,
+    }
+    scripts = {}
+    for name, func in emulations.items():
+        script = common.load_lua_script(name)
+        if script:
+            scripts[hashlib.sha1(script.encode('utf-8')).hexdigest()] = func
+    return scripts
+
+
+# Emulations by the sha1 of the script.
+SCRIPTS = _load_scripts()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        server = self.server.fake
+        server.track(self.connection)
+        try:
+            while True:
+                args = self.__read_command()
+                if args is None:
+                    return
+                self.wfile.write(encode(server.handle(args)))
+                self.wfile.flush()
+        except (IOError, OSError, ValueError):
+            return
+        finally:
+            server.untrack(self.connection)
+
+    def __read_line(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        return line.rstrip(b'\r\n')
+
+    def __read_command(self):
+        line = self.__read_line()
+        if line is None:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. sent via telnet.
+            return line.decode('utf-8').split()
+        args = []
+        for _ in range(int(line[1:])):
+            header = self.__read_line()
+            if header is None or not header.startswith(b'$'):
+                return None
+            length = int(header[1:])
+            args.append(self.rfile.read(length + 2)[:length].decode('utf-8'))
+        return args
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeRedisServer(object):
+    """
+    RESP server backed by FakeRedis. Each connection is served by a thread.
+
+    Faults apply to all subsequent commands:
+    latency_seconds delays every reply, fail makes commands reply with an error and stall holds all replies until resume.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, clock=None, lua=False):
+        """
+        Create a new FakeRedisServer.
+
+        :param host: the host to listen on
+        :param port: the port to listen on. 0 picks a free port
+        :param clock: callable returning the current time in seconds. defaults to time.time
+        :param lua: whether to run scripts in Lua instead of emulating them. requires the lupa package
+        """
+        self.redis = FakeRedis(clock=clock, lua=lua)
+        self.latency_seconds = 0.0
+        self.__failures = []
+        self.__running = threading.Event()
+        self.__running.set()
+        self.__connections = set()
+        self.__lock = threading.Lock()
+        self.__server = _ThreadingServer((host, port), _Handler)
+        self.__server.fake = self
+        self.host, self.port = self.__server.server_address[:2]
+        self.__thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def commands(self):
+        """Number of executed commands per name."""
+        return self.redis.commands
+
+    @property
+    def connections(self):
+        """Number of open client connections."""
+        return len(self.__connections)
+
+    def start(self):
+        """Serve in a background thread. Returns immediately."""
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__server.serve_forever, kwargs={'poll_interval': 0.05})
+            self.__thread.daemon = True
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close all client connections."""
+        self.resume()
+        if self.__thread is not None:
+            self.__server.shutdown()
+            self.__thread = None
+        self.__server.server_close()
+        self.close_connections()
+
+    def close_connections(self):
+        """Close all client connections, e.g. to simulate a restart of redis."""
+        with self.__lock:
+            connections = list(self.__connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+
+    def fail(self, count=1, error='ERR injected failure', commands=None):
+        """
+        Reply to the next commands with an error.
+
+        :param count: the number of failing commands
+        :param error: the error message
+        :param commands: only fail these commands, e.g. ['EVALSHA']. all if None
+        """
+        commands = set(c.lower() for c in commands) if commands else None
+        with self.__lock:
+            self.__failures.append([count, error, commands])
+
+    def stall(self):
+        """Hold all replies until resume is called."""
+        self.__running.clear()
+
+    def resume(self):
+        """Continue replying after a stall."""
+        self.__running.set()
+
+    def track(self, conn):
+        with self.__lock:
+            self.__connections.add(conn)
+
+    def untrack(self, conn):
+        with self.__lock:
+            self.__connections.discard(conn)
+
+    def __injected_failure(self, name):
+        with self.__lock:
+            for failure in self.__failures:
+                count, error, commands = failure
+                if commands is None or name in commands:
+                    failure[0] -= 1
+                    if failure[0] <= 0:
+                        self.__failures.remove(failure)
+                    return ReplyError(error)
+        return None
+
+    def handle(self, args):
+        """
+        Execute a command received from a client, applying the injected faults.
+
+        :param args: the command and its arguments
+        :return: the reply
+        """
+        self.__running.wait()
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        failure = self.__injected_failure(str(args[0]).lower() if args else '')
+        if failure is not None:
+            return failure
+        try:
+            return self.redis.execute(*args)
+        except ReplyError as e:
+            return e
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pure-Python stand-in for Redis running the rate limit scripts.')
+    parser.add_argument('--host', default='127.0.0.1', help='the host to listen on')
+    parser.add_argument('--port', type=int, default=6379, help='the port to listen on')
+    parser.add_argument('--latency-ms', type=float, default=0, help='latency added to every command')
+    parser.add_argument('--lua', action='store_true', help='run scripts in Lua. requires the lupa package')
+    args = parser.parse_args()
+
+    server = FakeRedisServer(host=args.host, port=args.port, lua=args.lua)
+    server.latency_seconds = args.latency_ms / 1000.0
+    print("serving on {0}:{1}".format(server.host, server.port))
+    try:
+        server.start()
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+import unittest
+
+from rate_limit import adaptive
+from rate_limit.adaptive import AdaptiveLimiter
+from rate_limit.adaptive import LocalLimitFactors
+from . import fake
+
+
+class TestAdaptive(unittest.TestCase):
+
+    def test_scale_rate_limit(self):
+        stimuli = [
+            {'rate_limit': '100r/m', 'factor': 1.0, 'expected': '100r/m', 'help': 'factor 1 should not scale'},
+            {'rate_limit': '100r/m', 'factor': 0.5, 'expected': '50r/m', 'help': 'the requests should be scaled'},
+            {'rate_limit': '100r/10m', 'factor': 0.25, 'expected': '25r/10m', 'help': 'the window should be kept'},
+            {'rate_limit': '1r/s', 'factor': 0.1, 'expected': '1r/s', 'help': 'at least 1 request should be admitted'},
+            {'rate_limit': ['10r/s', '1000r/h'], 'factor': 0.5, 'expected': ['5r/s', '500r/h'],
+             'help': 'all windows should be scaled'},
+        ]
+        for stim in stimuli:
+            self.assertEqual(adaptive.scale_rate_limit(stim['rate_limit'], stim['factor']), stim['expected'], stim['help'])
+
+    def test_local_limit_factors(self):
+        factors = LocalLimitFactors()
+        # Increase by 0.1, halve, not below 0.2, at most one adjustment per 10 seconds.
+        stimuli = [
+            {'overloaded': False, 'now': 0, 'expected': 1.0, 'help': 'the factor should not exceed 1'},
+            {'overloaded': True, 'now': 1, 'expected': 0.5, 'help': 'the factor should be halved'},
+            {'overloaded': True, 'now': 2, 'expected': 0.5, 'help': 'the factor should be decreased once per interval'},
+            {'overloaded': None, 'now': 3, 'expected': 0.5, 'help': 'reading should not adjust the factor'},
+            {'overloaded': True, 'now': 11, 'expected': 0.25, 'help': 'the factor should be halved again'},
+            {'overloaded': True, 'now': 21, 'expected': 0.2, 'help': 'the factor should not fall below the min.'},
+            {'overloaded': False, 'now': 25, 'expected': 0.2, 'help': 'the factor should be increased once per interval'},
+            {'overloaded': False, 'now': 31, 'expected': 0.3, 'help': 'the factor should be increased additively'},
+        ]
+        for stim in stimuli:
+            actual = factors.adjust('key', stim['overloaded'], 0.1, 0.5, 0.2, 10, now=stim['now'])
+            self.assertAlmostEqual(actual, stim['expected'], msg=stim['help'])
+
+    def test_local_limit_factors_recovered(self):
+        factors = LocalLimitFactors()
+        # Increase by 0.5, halve, not below 0.1, at most one adjustment per 10 seconds.
+        stimuli = [
+            {'overloaded': True, 'now': 0, 'expected': 0.5, 'tracked': 1, 'help': 'the factor should be halved'},
+            {'overloaded': False, 'now': 10, 'expected': 1.0, 'tracked': 1,
+             'help': 'the factor should be kept until the interval passed'},
+            {'overloaded': False, 'now': 15, 'expected': 1.0, 'tracked': 1,
+             'help': 'increasing a factor of 1 should not restart the interval'},
+            {'overloaded': False, 'now': 20, 'expected': 1.0, 'tracked': 0,
+             'help': 'the factor should be dropped once the interval passed'},
+        ]
+        for stim in stimuli:
+            actual = factors.adjust('key', stim['overloaded'], 0.5, 0.5, 0.1, 10, now=stim['now'])
+            self.assertAlmostEqual(actual, stim['expected'], msg=stim['help'])
+            self.assertEqual(len(factors), stim['tracked'], stim['help'])
+
+    def test_adaptive_limiter(self):
+        backend = fake.FakeLimitFactorBackend()
+        limiter = AdaptiveLimiter(
+            backend, 'ratelimit_adaptive_compute', latency_threshold_seconds=1.0, error_rate_threshold=0.1,
+            interval_seconds=10, increase=0.1, decrease=0.5, min_factor=0.1, min_samples=5
+        )
+
+        start = time.time()
+
+        # Slow responses within the first interval.
+        for now in range(10):
+            limiter.observe(2.0, False, now=start + now)
+        self.assertEqual(limiter.factor, 1.0, "the factor should only be adjusted once the interval passed")
+        limiter.observe(2.0, False, now=start + 10)
+        self.assertEqual(limiter.factor, 0.5, "slow responses should decrease the factor")
+        self.assertEqual(limiter.scale_rate_limit('100r/m'), '50r/m')
+        self.assertEqual(limiter.scale_concurrency_limit(10), 5)
+
+        # Too few responses to judge the health of the app.
+        limiter.observe(0.1, True, now=start + 20)
+        self.assertEqual(limiter.factor, 0.5, "the factor should not be adjusted without enough responses")
+        self.assertEqual(backend.reported, [True, None])
+
+        # Fast and successful responses.
+        for now in range(11):
+            limiter.observe(0.1, False, now=start + 20 + now)
+        self.assertAlmostEqual(limiter.factor, 0.6, msg="healthy responses should increase the factor")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+from rate_limit import common
+from rate_limit.backend import MemcachedBackend
+from rate_limit.backend import PeerBackend
+from rate_limit.backend import RedisBackend
+from rate_limit.backend import SharedMemoryBackend
+from rate_limit.response import RateLimitExceededResponse
+from . import fake
+
+
+def new_redis_backend(client, **kwargs):
+    backend = RedisBackend(
+        host='127.0.0.1',
+        port=6379,
+        rate_limit_response=RateLimitExceededResponse(),
+        max_sleep_time_seconds=5,
+        log_sleep_time_seconds=0,
+        batch_enabled=True,
+        **kwargs
+    )
+    pool = fake.FakeRedisPool(client)
+    backend._RedisBackend__redis = pool
+    backend._RedisBackend__batcher._CommandBatcher__pool = pool
+    return backend
+
+
+def _free_address():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return '127.0.0.1:{0}'.format(port)
+
+
+class TestSequentialBackends(unittest.TestCase):
+    """Backends evaluating the windows of multiple scope levels one after another."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def test_rejected_levels_are_not_counted(self):
+        kwargs = {'rate_limit_response': RateLimitExceededResponse(), 'max_sleep_time_seconds': 0,
+                  'log_sleep_time_seconds': 0}
+        address = _free_address()
+        stimuli = [
+            {'name': 'shared memory',
+             'new': lambda: SharedMemoryBackend(path=os.path.join(self.tmpdir, 'ratelimit'), slots=64, stripes=4, **kwargs)},
+            {'name': 'memcached fixed window', 'new': lambda: MemcachedBackend(
+                host='127.0.0.1', port=11211, memcache_client=fake.FakeMemcache(),
+                strategy=common.Constants.strategy_fixed_window, **kwargs)},
+            {'name': 'memcached sliding window', 'new': lambda: MemcachedBackend(
+                host='127.0.0.1', port=11211, memcache_client=fake.FakeMemcache(),
+                strategy=common.Constants.strategy_sliding_window, **kwargs)},
+            {'name': 'peer', 'new': lambda: PeerBackend(peers=address, self_address=address, **kwargs)},
+        ]
+        for stim in stimuli:
+            backend = stim['new']()
+            self.addCleanup(getattr(backend, 'stop', lambda: None))
+
+            def rate_limit(user):
+                levels = [('domain', 'domain:acme', '3r/m'), ('user', 'user:acme/{0}'.format(user), '1r/m')]
+                return backend.rate_limit_levels(levels, 'update', 'account/container')
+
+            admitted = [rate_limit('alice') is None for _ in range(4)]
+            self.assertEqual(admitted, [True, False, False, False], "{0}: alice exceeds her limit".format(stim['name']))
+            self.assertIsNone(
+                rate_limit('bob'), "{0}: requests rejected by the user limit should not count for the domain".format(stim['name'])
+            )
+            self.assertIsNone(rate_limit('carol'), "{0}: the domain should admit a 3rd request".format(stim['name']))
+            response = rate_limit('dave')
+            self.assertIsInstance(response, RateLimitExceededResponse, "{0}: the domain limit is reached".format(stim['name']))
+            self.assertEqual(response.headers.get('X-RateLimit-Scope'), 'domain')
+
+
+class TestRedisBackend(unittest.TestCase):
+
+    def test_server_time(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': [10, -1]})
+        backend = new_redis_backend(client, server_time_enabled=True)
+
+        for _ in range(3):
+            self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '100r/m'))
+
+        script = common.load_lua_script('redis_sliding_window_server_time.lua')
+        expected_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        member_ids = set()
+        for command in client.executed:
+            self.assertEqual(command[:3], ('EVALSHA', expected_sha, 7))
+            key, max_calls, window_microseconds, max_sleep_time_seconds, member_id, compact_members, cost = command[3:]
+            self.assertEqual(cost, 1)
+            self.assertEqual(compact_members, 0)
+            self.assertEqual(key, 'ratelimit_project_update_account/container')
+            self.assertEqual(max_calls, 100)
+            self.assertEqual(window_microseconds, 60 * 1000000)
+            self.assertEqual(max_sleep_time_seconds, 5)
+            member_ids.add(member_id)
+        self.assertEqual(len(member_ids), 3, "every request should get a unique member")
+
+        # The member ids are regenerated after a fork.
+        backend._RedisBackend__member_pid = -1
+        backend.rate_limit('project', 'update', 'account/container', '100r/m')
+        member_id = client.executed[-1][-3]
+        self.assertNotIn(member_id, member_ids)
+        self.assertNotEqual(member_id.rsplit('.', 1)[0], next(iter(member_ids)).rsplit('.', 1)[0])
+
+    def test_local_time(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': [0, 10]})
+        backend = new_redis_backend(client, clock_accuracy=1000)
+
+        self.assertIsInstance(
+            backend.rate_limit('project', 'update', 'account/container', '100r/m'), RateLimitExceededResponse
+        )
+        key, lookback_time_max, now_int, max_calls, window, _, clock_accuracy, _, _ = client.executed[0][3:]
+        self.assertEqual(now_int - lookback_time_max, 60 * 1000)
+        self.assertEqual((max_calls, window, clock_accuracy), (100, 60 * 1000, 1000))
+
+    def test_compact_encoding(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': [10, -1]})
+        backend = new_redis_backend(client, server_time_enabled=True, compact_encoding=True)
+
+        backend.rate_limit('3b5d5c3712955042212b173e8c5f4cd6', 'update', 'account/container', '100r/m')
+        key, _, _, _, member_id, compact_members, _ = client.executed[0][3:]
+        self.assertEqual(key, common.compact_key_func('3b5d5c3712955042212b173e8c5f4cd6', 'update', 'account/container'))
+        self.assertEqual(compact_members, 1)
+        self.assertTrue(all(c in common.Constants.base62_alphabet + '.' for c in member_id))
+
+    def test_multiple_windows(self):
+        # The 2nd window (1000r/h) is exhausted.
+        client = fake.FakeRedisClient(replies={'EVALSHA': [0, 120, 2]})
+        backend = new_redis_backend(client, clock_accuracy=1000)
+
+        result = backend.rate_limit('project', 'update', 'account/container', ['10r/s', '1000r/h'])
+        self.assertIsInstance(result, RateLimitExceededResponse)
+        self.assertEqual(result.headers.get('X-RateLimit-Limit'), '1000r/h')
+        self.assertEqual(result.headers.get('X-RateLimit-Retry-After'), '120')
+
+        script = common.load_lua_script('redis_sliding_window_multi.lua')
+        expected_sha = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        self.assertEqual(len(client.executed), 1, "all windows should be checked in a single call")
+        command = client.executed[0]
+        self.assertEqual(command[:3], ('EVALSHA', expected_sha, 2))
+        self.assertEqual(command[3:5], (
+            'ratelimit_project_update_account/container_1',
+            'ratelimit_project_update_account/container_3600',
+        ))
+        _, clock_accuracy, max_sleep_time_seconds, compact_members, member_id, cost = command[5:11]
+        self.assertEqual((clock_accuracy, max_sleep_time_seconds, compact_members, member_id, cost), (1000, 5, 0, '', 1))
+        self.assertEqual(command[11:], (10, 1000, 1000, 3600 * 1000))
+
+    def test_scope_levels(self):
+        # The 3rd level (user) is exhausted.
+        client = fake.FakeRedisClient(replies={'EVALSHA': [0, 30, 3]})
+        backend = new_redis_backend(client)
+
+        levels = [
+            ('domain', 'domain:Default', '100r/m'),
+            ('initiator_project_id', 'project', '10r/m'),
+            ('user', 'user:Default/alice', '3r/m'),
+        ]
+        result = backend.rate_limit_levels(levels, 'update', 'account/container')
+        self.assertIsInstance(result, RateLimitExceededResponse)
+        self.assertEqual(result.headers.get('X-RateLimit-Scope'), 'user')
+        self.assertEqual(result.headers.get('X-RateLimit-Limit'), '3r/m')
+
+        self.assertEqual(len(client.executed), 1, "all levels should be checked in a single call")
+        self.assertEqual(client.executed[0][2:6], (
+            3,
+            'ratelimit_domain:Default_update_account/container',
+            'ratelimit_project_update_account/container',
+            'ratelimit_user:Default/alice_update_account/container',
+        ))
+
+        # The scope level is not reported for a single rate limit.
+        client.replies['EVALSHA'] = [0, 30]
+        result = backend.rate_limit('project', 'update', 'account/container', '10r/m')
+        self.assertIsNone(result.headers.get('X-RateLimit-Scope'))
+
+    def test_cost(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': [10, -1]})
+        backend = new_redis_backend(client)
+
+        backend.rate_limit('project', 'update', 'account/container', '100r/m', cost=5)
+        self.assertEqual(client.executed[-1][-1], 5, "the cost should be passed to the script")
+
+        backend.rate_limit('project', 'update', 'account/container', ['10r/s', '100r/m'], cost=5)
+        self.assertEqual(client.executed[-1][10], 5, "the cost should be passed to the script")
+
+    def test_reserve_tokens(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': 250000})
+        backend = new_redis_backend(client)
+
+        self.assertEqual(backend.reserve_tokens('key', 1024, 512, 2048), 0.25)
+        key, amount, rate, burst, now = client.executed[0][3:]
+        self.assertEqual((key, amount, rate, burst), ('key', 1024, 512, 2048))
+        self.assertAlmostEqual(now / 1e6, time.time(), delta=5)
+
+    def test_acquire_slot(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': 1})
+        backend = new_redis_backend(client)
+
+        slot_id = backend.acquire_slot('key_concurrency', 10, 600)
+        self.assertIsNotNone(slot_id)
+        key, max_concurrency, lease_microseconds, member_id, now = client.executed[0][3:]
+        self.assertEqual((key, max_concurrency, lease_microseconds, member_id), ('key_concurrency', 10, 600000000, slot_id))
+        self.assertAlmostEqual(now / 1e6, time.time(), delta=5)
+
+        client.replies['EVALSHA'] = 0
+        self.assertIsNone(backend.acquire_slot('key_concurrency', 10, 600), "all slots are taken")
+
+        backend.release_slot('key_concurrency', slot_id)
+        self.assertEqual(client.executed[-1], ('ZREM', 'key_concurrency', slot_id))
+
+    def test_adjust_limit_factor(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': b'0.5'})
+        backend = new_redis_backend(client)
+
+        self.assertEqual(backend.adjust_limit_factor('ratelimit_adaptive_compute', True, 0.05, 0.5, 0.1, 10), 0.5)
+        key, overloaded, increase, decrease, min_factor, interval_microseconds, _ = client.executed[-1][3:]
+        self.assertEqual(
+            (key, overloaded, increase, decrease, min_factor, interval_microseconds),
+            ('ratelimit_adaptive_compute', 1, 0.05, 0.5, 0.1, 10000000)
+        )
+
+        backend.adjust_limit_factor('ratelimit_adaptive_compute', None, 0.05, 0.5, 0.1, 10)
+        self.assertEqual(client.executed[-1][4], -1, "the factor should only be read")
+
+    def test_tightest_result(self):
+        stimuli = [
+            {
+                'results': [('a', 5, -1), ('b', 2, -1)],
+                'expected': ('b', 2, -1),
+                'help': 'the window with the fewest remaining requests is the tightest',
+            },
+            {
+                'results': [('a', 0, 1), ('b', 3, -1)],
+                'expected': ('a', 0, 1),
+                'help': 'an exhausted window is the tightest',
+            },
+            {
+                'results': [('a', 0, 1), ('b', -1, 30)],
+                'expected': ('b', -1, 30),
+                'help': 'the exhausted window with the longest retry after is the tightest',
+            },
+        ]
+        for stim in stimuli:
+            self.assertEqual(common.tightest_result(stim['results']), stim['expected'], stim['help'])
+
+
+if __name__ == '__main__':
+    unittest.main()
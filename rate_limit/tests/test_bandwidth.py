@@ -0,0 +1,94 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import io
+import time
+import unittest
+
+from rate_limit.backend import Backend
+from rate_limit.bandwidth import BandwidthShaper
+from rate_limit.bandwidth import LocalTokenBucket
+from . import fake
+
+
+class TestBandwidth(unittest.TestCase):
+
+    def test_local_token_bucket(self):
+        bucket = LocalTokenBucket()
+        # 100 bytes/s with a burst of 200 bytes.
+        stimuli = [
+            {'amount': 200, 'now': 0, 'expected': 0, 'help': 'the burst should be available immediately'},
+            {'amount': 100, 'now': 0, 'expected': 1, 'help': 'the request should wait until the tokens are refilled'},
+            {'amount': 100, 'now': 0, 'expected': 2, 'help': 'reservations should queue up'},
+            {'amount': 100, 'now': 10, 'expected': 0, 'help': 'the bucket should be refilled after a while'},
+        ]
+        for stim in stimuli:
+            actual = bucket.reserve('key', stim['amount'], 100, 200, now=stim['now'])
+            self.assertAlmostEqual(actual, stim['expected'], msg=stim['help'])
+
+    def test_lease(self):
+        backend = fake.FakeTokenBucketBackend()
+        shaper = BandwidthShaper(backend, rate_bytes_per_second=1000, lease_bytes=100)
+
+        for _ in range(10):
+            shaper.consume('key', 30)
+        # 300 bytes in leases of 100 bytes.
+        self.assertEqual(len(backend.reserved), 3, "chunks should be accounted against the leased bytes")
+        self.assertEqual(backend.reserved[0], ('key', 100, 1000, 1000))
+
+        # Chunks larger than the lease are reserved at once.
+        shaper.consume('key', 250)
+        self.assertEqual(backend.reserved[-1][1], 250)
+
+    def test_wait_for_consumed_bytes(self):
+        # 100 kB/s with a burst of 1 second and the default lease of 1 MiB.
+        shaper = BandwidthShaper(Backend(None, None, None), rate_bytes_per_second=100000)
+        stimuli = [
+            {'nbytes': 4096, 'min': 0, 'max': 0, 'help': 'a small upload should not wait for the lease'},
+            {'nbytes': 95904, 'min': 0, 'max': 0, 'help': 'the burst should be available immediately'},
+            {'nbytes': 10000, 'min': 0.09, 'max': 0.11, 'help': 'only the consumed bytes should be waited for'},
+        ]
+        for stim in stimuli:
+            wait_seconds = shaper.consume('key', stim['nbytes'])
+            self.assertTrue(
+                stim['min'] <= wait_seconds <= stim['max'],
+                "{0}: expected to wait {1}-{2}s but waited {3}s".format(stim['help'], stim['min'], stim['max'], wait_seconds)
+            )
+
+    def test_shaped_input(self):
+        backend = fake.FakeTokenBucketBackend(wait_seconds=0.05)
+        shaper = BandwidthShaper(backend, rate_bytes_per_second=1000, lease_bytes=4)
+
+        wsgi_input = shaper.wrap_input(io.BytesIO(b'0123456789'), 'key')
+        start = time.time()
+        chunks = [wsgi_input.read(4), wsgi_input.read(4), wsgi_input.read(4)]
+        self.assertEqual(chunks, [b'0123', b'4567', b'89'])
+        self.assertGreaterEqual(time.time() - start, 0.1, "reading should be throttled between chunks")
+        self.assertEqual(sum(amount for _, amount, _, _ in backend.reserved), 12)
+
+    def test_shaped_iterable(self):
+        backend = fake.FakeTokenBucketBackend()
+        shaper = BandwidthShaper(backend, rate_bytes_per_second=1000, lease_bytes=1)
+
+        app_iter = fake.ClosableIterable([b'abc', b'de'])
+        shaped = shaper.wrap_iterable(app_iter, 'key')
+        self.assertEqual(list(shaped), [b'abc', b'de'])
+        self.assertEqual([amount for _, amount, _, _ in backend.reserved], [3, 2])
+
+        shaped.close()
+        self.assertTrue(app_iter.closed, "the wrapped iterator should be closed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import pyredis
+import unittest
+
+from rate_limit.batch import CommandBatcher
+from . import fake
+
+
+class TestCommandBatcher(unittest.TestCase):
+
+    def test_concurrent_commands_are_pipelined(self):
+        pool = fake.FakeRedisPool()
+        batcher = CommandBatcher(pool=pool, window_seconds=0.01, max_size=100)
+
+        greenthreads = [eventlet.spawn(batcher.execute, 'EVALSHA', 'sha', 1, 'key_{0}'.format(i)) for i in range(10)]
+        results = [gt.wait() for gt in greenthreads]
+
+        self.assertEqual(pool.acquired, 1, "all commands should be sent using one connection")
+        self.assertEqual(len(pool.client.bulks), 1, "expected exactly one pipeline but got {0}".format(len(pool.client.bulks)))
+        for i, result in enumerate(results):
+            self.assertEqual(
+                result,
+                ['EVALSHA', 'sha', 1, 'key_{0}'.format(i)],
+                "greenthread #{0} got the wrong result: {1}".format(i, result)
+            )
+
+    def test_full_batch_is_flushed_immediately(self):
+        pool = fake.FakeRedisPool()
+        batcher = CommandBatcher(pool=pool, window_seconds=10, max_size=5)
+
+        greenthreads = [eventlet.spawn(batcher.execute, 'GET', i) for i in range(10)]
+        with eventlet.Timeout(1):
+            results = [gt.wait() for gt in greenthreads]
+
+        self.assertEqual([r[1] for r in results], list(range(10)))
+        self.assertEqual([len(b) for b in pool.client.bulks], [5, 5])
+
+    def test_errors_are_raised_in_the_waiting_greenthread(self):
+        client = fake.FakeRedisClient(replies={'EVALSHA': pyredis.ReplyError('NOSCRIPT No matching script.')})
+        batcher = CommandBatcher(pool=fake.FakeRedisPool(client), window_seconds=0.001)
+
+        self.assertRaises(pyredis.ReplyError, batcher.execute, 'EVALSHA', 'sha', 1, 'key')
+        self.assertEqual(batcher.execute('GET', 'key'), ['GET', 'key'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+import unittest
+
+from rate_limit.circuit import CircuitBreaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_after_consecutive_failures(self):
+        states = []
+        cb = CircuitBreaker(failure_threshold=3, open_seconds=60, on_state_change=states.append)
+
+        for _ in range(2):
+            self.assertTrue(cb.allow_request())
+            cb.record_failure()
+        self.assertEqual(cb.state, CircuitBreaker.CLOSED)
+
+        # A success resets the number of consecutive failures.
+        cb.record_success(0)
+        for _ in range(3):
+            self.assertTrue(cb.allow_request())
+            cb.record_failure()
+
+        self.assertEqual(cb.state, CircuitBreaker.OPEN)
+        self.assertFalse(cb.allow_request(), "requests should not be sent to the backend while the circuit is open")
+        self.assertEqual(states, [CircuitBreaker.OPEN])
+
+    def test_open_after_consecutive_slow_calls(self):
+        cb = CircuitBreaker(slow_call_threshold=2, slow_call_seconds=0.01, open_seconds=60)
+
+        cb.record_success(0.02)
+        cb.record_success(0.001)
+        cb.record_success(0.02)
+        self.assertEqual(cb.state, CircuitBreaker.CLOSED)
+
+        cb.record_success(0.02)
+        self.assertEqual(cb.state, CircuitBreaker.OPEN)
+
+    def test_half_open_probe(self):
+        stimuli = [
+            {
+                'probe_duration': 0.001,
+                'probe_failed': False,
+                'expected': CircuitBreaker.CLOSED
+            },
+            {
+                'probe_duration': 0.5,
+                'probe_failed': False,
+                'expected': CircuitBreaker.OPEN
+            },
+            {
+                'probe_duration': 0,
+                'probe_failed': True,
+                'expected': CircuitBreaker.OPEN
+            },
+        ]
+
+        for stim in stimuli:
+            cb = CircuitBreaker(failure_threshold=1, slow_call_seconds=0.1, open_seconds=0.01)
+            cb.record_failure()
+            self.assertFalse(cb.allow_request())
+            time.sleep(0.02)
+
+            # Exactly one probe is let through.
+            self.assertTrue(cb.allow_request())
+            self.assertEqual(cb.state, CircuitBreaker.HALF_OPEN)
+            self.assertFalse(cb.allow_request())
+
+            if stim.get('probe_failed'):
+                cb.record_failure()
+            else:
+                cb.record_success(stim.get('probe_duration'))
+
+            self.assertEqual(
+                cb.state,
+                stim.get('expected'),
+                "expected state '{0}' after probe {1} but got '{2}'".format(stim.get('expected'), stim, cb.state)
+            )
+
+    def test_health_check(self):
+        cb = CircuitBreaker(open_seconds=60)
+
+        # A failed health check opens the circuit right away.
+        cb.record_health_check(False)
+        self.assertEqual(cb.state, CircuitBreaker.OPEN)
+        self.assertFalse(cb.allow_request())
+
+        # A successful health check lets the next call probe the backend before open_seconds have passed.
+        cb.record_health_check(True)
+        self.assertTrue(cb.allow_request())
+        self.assertEqual(cb.state, CircuitBreaker.HALF_OPEN)
+
+        # A failed health check while the probe is in flight re-opens the circuit.
+        cb.record_health_check(False)
+        cb.record_success(0)
+        self.assertEqual(cb.state, CircuitBreaker.OPEN)
+        cb.record_health_check(True)
+        self.assertTrue(cb.allow_request(), "the probe should not be blocked by the ignored call")
+        cb.record_success(0)
+        self.assertEqual(cb.state, CircuitBreaker.CLOSED)
+
+    def test_health_check_releases_probe(self):
+        cb = CircuitBreaker(open_seconds=60)
+        cb.record_health_check(False)
+        cb.record_health_check(True)
+        # The outcome of the probe is never recorded.
+        self.assertTrue(cb.allow_request())
+        self.assertFalse(cb.allow_request(), "only a single probe should be let through")
+
+        cb.record_health_check(True)
+        self.assertTrue(cb.allow_request(), "a successful health check should let another call probe the backend")
+        cb.record_success(0)
+        self.assertEqual(cb.state, CircuitBreaker.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rate_limit import common
+from rate_limit import compiled
+from rate_limit import errors
+from rate_limit.compiled import StringTable
+from rate_limit.rate_limit import OpenStackRateLimitMiddleware
+from . import fake
+
+WORKDIR = os.path.dirname(os.path.realpath(__file__))
+SWIFTCONFIGPATH = WORKDIR + '/fixtures/swift.yaml'
+
+
+class TestCompiled(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.artifact = os.path.join(self.tmpdir, 'swift.rlc')
+
+    def test_string_table(self):
+        stimuli = [
+            {'values': [], 'lookups': {'a': False, None: False}},
+            {'values': ['b', 'a', 'b'], 'lookups': {'a': True, 'b': True, 'c': False, '': False}},
+            {'values': ['projekt', 'Domäne/Projekt'], 'lookups': {'Domäne/Projekt': True, 'domäne/projekt': False}},
+        ]
+        for stim in stimuli:
+            table = StringTable(StringTable.pack(stim['values']), 0)
+            self.assertEqual(len(table), len(set(stim['values'])))
+            self.assertEqual(list(table), sorted(set(stim['values'])))
+            for item, expected in stim['lookups'].items():
+                self.assertEqual(item in table, expected, "lookup of '{0}' in {1}".format(item, stim['values']))
+
+    def test_compile_and_load(self):
+        config = common.load_config(SWIFTCONFIGPATH)
+        compiled.compile_config(config, self.artifact)
+        self.assertTrue(compiled.is_compiled(self.artifact))
+        self.assertFalse(compiled.is_compiled(SWIFTCONFIGPATH))
+
+        loaded = compiled.load(self.artifact)
+        self.assertEqual(loaded['rates'], config['rates'], "the rates should be kept")
+        self.assertEqual(loaded['ratelimit_response'], config['ratelimit_response'])
+        for entry in config['blacklist']:
+            self.assertIn(entry, loaded['blacklist'])
+        self.assertEqual(len(loaded['whitelist_users']), 0, "missing lists should be compiled as empty tables")
+
+        compiled.compile_config({'blacklist_users': ['Admin']}, self.artifact)
+        self.assertIn('admin', compiled.load(self.artifact)['blacklist_users'], "users should be compiled lowercase")
+
+        compiled.compile_config(
+            {'rates': {'projects': {'abcdef': {'account/container': [{'action': 'update', 'limit': '100r/m'}]}}}},
+            self.artifact
+        )
+        project_ratelimits = compiled.load(self.artifact)['rates']['projects']
+        self.assertEqual(project_ratelimits.get('abcdef'), {'account/container': [{'action': 'update', 'limit': '100r/m'}]})
+
+        self.write_file('not compiled')
+        self.assertRaises(errors.ConfigError, compiled.load, self.artifact)
+
+    def test_middleware(self):
+        compiled.compile_config(common.load_config(SWIFTCONFIGPATH), self.artifact)
+        app = OpenStackRateLimitMiddleware(app=fake.FakeApp(), config_file=self.artifact)
+        yaml_app = OpenStackRateLimitMiddleware(app=fake.FakeApp(), config_file=SWIFTCONFIGPATH)
+
+        for key in ['abcdef1233456789', 'myDomain/myProject', '1233456789abcdef', 'unknown', '127.0.0.1']:
+            self.assertEqual(app.is_scope_blacklisted(key), yaml_app.is_scope_blacklisted(key), key)
+            self.assertEqual(app.is_scope_whitelisted(key), yaml_app.is_scope_whitelisted(key), key)
+        self.assertEqual(
+            app.ratelimit_provider.get_local_rate_limits('project', 'update', 'account/container'),
+            yaml_app.ratelimit_provider.get_local_rate_limits('project', 'update', 'account/container'),
+        )
+        self.assertEqual(app.ratelimit_response.status, yaml_app.ratelimit_response.status)
+
+    def write_file(self, content):
+        with open(self.artifact, 'w') as f:
+            f.write(content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import common
+from rate_limit import concurrency
+from rate_limit.concurrency import LocalSlots
+from rate_limit.concurrency import SlotReleasingIterable
+from . import fake
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def test_slot_key(self):
+        self.assertEqual(
+            concurrency.slot_key('project', 'read', 'account/container/object'),
+            'ratelimit_project_read_account/container/object_concurrency'
+        )
+        self.assertEqual(
+            concurrency.slot_key('project', 'read', 'account/container/object', key_func=common.compact_key_func),
+            '{0}_concurrency'.format(common.compact_key_func('project', 'read', 'account/container/object')),
+            "the key should be encoded like the rate limit key"
+        )
+
+    def test_local_slots(self):
+        slots = LocalSlots()
+        # 2 slots leased for 10 seconds.
+        stimuli = [
+            {'now': 0, 'acquired': True, 'help': 'the first slot should be acquired'},
+            {'now': 1, 'acquired': True, 'help': 'the second slot should be acquired'},
+            {'now': 2, 'acquired': False, 'help': 'all slots should be taken'},
+            {'now': 10, 'acquired': True, 'help': 'the slot with the expired lease should be freed'},
+            {'now': 10, 'acquired': False, 'help': 'all slots should be taken again'},
+        ]
+        for stim in stimuli:
+            slot_id = slots.acquire('key', 2, 10, now=stim['now'])
+            self.assertEqual(slot_id is not None, stim['acquired'], stim['help'])
+
+        slots.release('key', slot_id)
+        slot_ids = [slots.acquire('key', 2, 10, now=11) for _ in range(2)]
+        self.assertIsNone(slot_ids[1], "releasing an unknown slot should not free a slot")
+
+    def test_release(self):
+        slots = LocalSlots()
+        slot_id = slots.acquire('key', 1, 10, now=0)
+        self.assertIsNone(slots.acquire('key', 1, 10, now=1))
+        slots.release('key', slot_id)
+        self.assertIsNotNone(slots.acquire('key', 1, 10, now=2), "the released slot should be available")
+
+    def test_slot_releasing_iterable(self):
+        released = []
+        app_iter = fake.ClosableIterable([b'abc', b'de'])
+        wrapped = SlotReleasingIterable(app_iter, lambda: released.append(True))
+
+        self.assertEqual(list(wrapped), [b'abc', b'de'])
+        self.assertEqual(released, [], "the slots should be held until the response was sent")
+
+        wrapped.close()
+        wrapped.close()
+        self.assertTrue(app_iter.closed, "the wrapped iterator should be closed")
+        self.assertEqual(released, [True], "the slots should be released once")
+
+
+if __name__ == '__main__':
+    unittest.main()
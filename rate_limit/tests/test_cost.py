@@ -0,0 +1,88 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import cost
+from rate_limit import errors
+
+
+class TestCost(unittest.TestCase):
+
+    def test_request_cost(self):
+        environ = {
+            'QUERY_STRING': 'limit=1000&marker=abc',
+            'HTTP_X_OBJECT_COUNT': '42',
+            'HTTP_X_HUGE_COUNT': '1000000000',
+            'CONTENT_LENGTH': '3145729',
+        }
+        stimuli = [
+            {
+                'expression': None,
+                'expected': 1,
+                'help': 'requests should cost 1 unit by default',
+            },
+            {
+                'expression': 5,
+                'expected': 5,
+                'help': 'constant cost',
+            },
+            {
+                'expression': {'query': 'limit'},
+                'expected': 1000,
+                'help': 'cost from query parameter',
+            },
+            {
+                'expression': {'query': 'limit', 'per': 100, 'max': 5},
+                'expected': 5,
+                'help': 'cost from query parameter per 100 capped at 5',
+            },
+            {
+                'expression': {'query': 'missing'},
+                'expected': 1,
+                'help': 'requests without the query parameter should cost 1 unit',
+            },
+            {
+                'expression': {'header': 'X-Object-Count'},
+                'expected': 42,
+                'help': 'cost from header',
+            },
+            {
+                'expression': {'header': 'X-Huge-Count'},
+                'expected': cost.DEFAULT_MAX_COST,
+                'help': 'costs set by the client should be capped by default',
+            },
+            {
+                'expression': {'header': 'X-Huge-Count', 'max': 5000},
+                'expected': 5000,
+                'help': 'the cap should be configurable',
+            },
+            {
+                'expression': {'content_length': True, 'per': 1048576},
+                'expected': 4,
+                'help': 'one unit per started MiB',
+            },
+        ]
+
+        for stim in stimuli:
+            actual = cost.request_cost(stim['expression'], environ)
+            self.assertEqual(actual, stim['expected'], stim['help'])
+
+    def test_invalid_expression(self):
+        for expression in (0, 'foo', {'foo': 'bar'}, {'query': 'limit', 'per': 0}):
+            self.assertRaises(errors.ConfigError, cost.request_cost, expression, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,457 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import eventlet.green.socket
+import mock
+import os
+import pyredis
+import time
+import unittest
+import uuid
+
+from rate_limit import circuit
+from rate_limit import common
+from rate_limit.backend import RedisBackend
+from rate_limit.response import RateLimitExceededResponse
+from .fake_redis import FakeRedis
+from .fake_redis import FakeRedisServer
+from .fake_redis import ReplyError
+from .fake_redis import lua51
+
+# Address of a real redis to run the tests against, e.g. 127.0.0.1:6379.
+REDIS_ADDRESS = os.environ.get('RATE_LIMIT_TEST_REDIS')
+
+
+def new_redis_backend(test, **kwargs):
+    return RedisBackend(
+        host=test.host,
+        port=test.port,
+        rate_limit_response=RateLimitExceededResponse(),
+        max_sleep_time_seconds=5,
+        log_sleep_time_seconds=0,
+        **kwargs
+    )
+
+
+class TestFakeRedis(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.redis = FakeRedis(clock=lambda: self.now)
+
+    def test_expire(self):
+        self.redis.execute('SET', 'key', 'value', 'PX', 1500)
+        self.assertEqual(self.redis.execute('INCR', 'counter'), 1)
+        self.assertEqual(self.redis.execute('EXPIRE', 'counter', 1), 1)
+
+        self.now += 1
+        self.assertEqual(self.redis.execute('GET', 'key'), 'value')
+        self.assertIsNone(self.redis.execute('GET', 'counter'), "the counter should have expired")
+
+        self.now += 1
+        self.assertIsNone(self.redis.execute('GET', 'key'), "the key should have expired")
+        self.assertEqual(self.redis.execute('TIME'), ['1002', '0'])
+
+    def test_sorted_set(self):
+        stimuli = [
+            {'command': ('ZADD', 'z', 3, 'c', 1, 'a', 2, 'b'), 'expected': 3},
+            {'command': ('ZCARD', 'z'), 'expected': 3},
+            {'command': ('ZRANGE', 'z', 0, 0, 'WITHSCORES'), 'expected': ['a', '1']},
+            {'command': ('ZRANGE', 'z', 0, -1), 'expected': ['a', 'b', 'c']},
+            {'command': ('ZREMRANGEBYSCORE', 'z', '-inf', '(2'), 'expected': 1},
+            {'command': ('ZREM', 'z', 'b', 'x'), 'expected': 1},
+            {'command': ('ZRANGE', 'z', 0, -1), 'expected': ['c']},
+        ]
+        for stim in stimuli:
+            self.assertEqual(
+                self.redis.execute(*stim['command']), stim['expected'],
+                "command {0} should return {1}".format(stim['command'], stim['expected'])
+            )
+
+    def test_unknown_script(self):
+        with self.assertRaises(ReplyError) as e:
+            self.redis.execute('EVALSHA', 'abc', 0)
+        self.assertTrue(str(e.exception).startswith('NOSCRIPT'))
+        with self.assertRaises(ReplyError):
+            self.redis.execute('EVAL', 'return 1', 0)
+
+
+@unittest.skipIf(lua51 is None, "running the Lua scripts requires the lupa package")
+class TestEmulations(unittest.TestCase):
+    """The emulations of the scripts should reply and change the keyspace like the scripts themselves."""
+
+    def setUp(self):
+        self.now = 1000.0
+        self.emulated = FakeRedis(clock=lambda: self.now)
+        self.scripted = FakeRedis(clock=lambda: self.now, lua=True)
+
+    def assertSameBehavior(self, script_name, calls):
+        script = common.load_lua_script(script_name)
+        for elapsed_seconds, keys, argv in calls:
+            self.now = 1000.0 + elapsed_seconds
+            command = ('EVAL', script, len(keys)) + tuple(keys) + tuple(argv)
+            help = "{0} after {1}s with keys {2} and args {3}".format(script_name, elapsed_seconds, keys, argv)
+            self.assertEqual(self.emulated.execute(*command), self.scripted.execute(*command), help)
+            self.assertEqual(self.emulated.data, self.scripted.data, help)
+            self.assertEqual(self.emulated.expires, self.scripted.expires, help)
+
+    def test_sliding_window(self):
+        def call(key, elapsed_seconds, cost=1, compact=0):
+            now = int((1000 + elapsed_seconds) * 1e6)
+            return elapsed_seconds, (key, now - 10000000, now, 3, 10000000, 20, 1000000, compact, cost), ()
+
+        for key, compact in (('decimal', 0), ('compact', 1)):
+            self.assertSameBehavior('redis_sliding_window.lua', [
+                call(key, 0, compact=compact),
+                call(key, 0.5, cost=2, compact=compact),
+                # Suspended.
+                call(key, 1, compact=compact),
+                call(key, 2, cost=2, compact=compact),
+                # Rejected.
+                call(key, 3, compact=compact),
+                call(key, 3, cost=5, compact=compact),
+                call(key, 30, compact=compact),
+            ])
+
+    def test_sliding_window_server_time(self):
+        def call(key, elapsed_seconds, cost=1, compact=0):
+            return elapsed_seconds, (key, 3, 10000000, 20, 'id{0}'.format(elapsed_seconds), compact, cost), ()
+
+        for key, compact in (('decimal', 0), ('compact', 1)):
+            self.assertSameBehavior('redis_sliding_window_server_time.lua', [
+                call(key, 0, compact=compact),
+                call(key, 0.5, cost=2, compact=compact),
+                call(key, 1, compact=compact),
+                call(key, 2, cost=2, compact=compact),
+                call(key, 3, compact=compact),
+                call(key, 3, cost=5, compact=compact),
+                call(key, 30, compact=compact),
+            ])
+
+    def test_sliding_window_multi(self):
+        def call(elapsed_seconds, cost=1, server_time=False):
+            now = '' if server_time else int((1000 + elapsed_seconds) * 1e6)
+            argv = (now, 1000000, 20, 0, 'id{0}'.format(elapsed_seconds) if server_time else '', cost,
+                    2, 10000000, 5, 60000000)
+            return elapsed_seconds, ('short', 'long'), argv
+
+        for server_time in (False, True):
+            self.assertSameBehavior('redis_sliding_window_multi.lua', [
+                call(0, server_time=server_time),
+                call(1, server_time=server_time),
+                call(2, cost=2, server_time=server_time),
+                call(3, server_time=server_time),
+                call(30, cost=3, server_time=server_time),
+                call(31, cost=9, server_time=server_time),
+            ])
+            self.emulated.execute('FLUSHALL')
+            self.scripted.execute('FLUSHALL')
+
+    def test_token_bucket(self):
+        self.assertSameBehavior('redis_token_bucket.lua', [
+            (0, ('bucket', 100, 100, 100, ''), ()),
+            (0, ('bucket', 150, 100, 100, ''), ()),
+            (1, ('bucket', 50, 100, 100, int(1001 * 1e6)), ()),
+        ])
+
+    def test_concurrency(self):
+        self.assertSameBehavior('redis_concurrency.lua', [
+            (0, ('slots', 2, 60000000, 'a', ''), ()),
+            (0, ('slots', 2, 60000000, 'b', ''), ()),
+            (1, ('slots', 2, 60000000, 'c', int(1001 * 1e6)), ()),
+            (61, ('slots', 2, 60000000, 'd', ''), ()),
+        ])
+
+    def test_adaptive_limit(self):
+        self.assertSameBehavior('redis_adaptive_limit.lua', [
+            (0, ('factor', -1, 0.1, 0.5, 0.1, 10000000, ''), ()),
+            (0, ('factor', 1, 0.1, 0.5, 0.1, 10000000, ''), ()),
+            (1, ('factor', 1, 0.1, 0.5, 0.1, 10000000, ''), ()),
+            (11, ('factor', 0, 0.1, 0.5, 0.1, 10000000, int(1011 * 1e6)), ()),
+            (30, ('factor', 0, 0.1, 0.5, 0.1, 10000000, ''), ()),
+            # The recovered factor is kept until the interval passed.
+            (40, ('recovered', 1, 0.5, 0.5, 0.1, 10000000, ''), ()),
+            (50, ('recovered', 0, 0.5, 0.5, 0.1, 10000000, ''), ()),
+            (55, ('recovered', 0, 0.5, 0.5, 0.1, 10000000, ''), ()),
+            (60, ('recovered', 0, 0.5, 0.5, 0.1, 10000000, ''), ()),
+        ])
+
+
+class RedisBackendTests(object):
+    """Tests of the RedisBackend not depending on injected faults. Keys are prefixed per test."""
+
+    host = None
+    port = None
+
+    def key(self, name):
+        return '{0}{1}'.format(self.prefix, name)
+
+    def execute(self, *args):
+        client = pyredis.Client(host=self.host, port=self.port)
+        try:
+            return client.execute(*args)
+        finally:
+            client.close()
+
+    def setUp(self):
+        self.prefix = '{0}_'.format(uuid.uuid4().hex)
+
+    def test_rate_limit(self):
+        stimuli = [
+            {'kwargs': {}, 'help': 'sliding window'},
+            {'kwargs': {'server_time_enabled': True}, 'help': 'sliding window using the clock of redis'},
+            {'kwargs': {'batch_enabled': True}, 'help': 'pipelined sliding window'},
+            {'kwargs': {'compact_encoding': True}, 'help': 'sliding window with compact members'},
+        ]
+        for idx, stim in enumerate(stimuli):
+            backend = new_redis_backend(self, **stim['kwargs'])
+            scope = self.key('project{0}'.format(idx))
+            for _ in range(2):
+                self.assertIsNone(
+                    backend.rate_limit(scope, 'update', 'account/container', '2r/m'),
+                    "{0}: the first 2 requests should be admitted".format(stim['help'])
+                )
+            response = backend.rate_limit(scope, 'update', 'account/container', '2r/m')
+            self.assertIsInstance(
+                response, RateLimitExceededResponse, "{0}: the 3rd request should be rejected".format(stim['help'])
+            )
+            self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+
+    def test_rate_limit_multiple_windows(self):
+        backend = new_redis_backend(self)
+        levels = [('domain', self.key('domain'), '3r/m'), ('project', self.key('project'), ['2r/m', '100r/h'])]
+        for _ in range(2):
+            self.assertIsNone(backend.rate_limit_levels(levels, 'update', 'account/container'))
+        response = backend.rate_limit_levels(levels, 'update', 'account/container')
+        self.assertIsInstance(response, RateLimitExceededResponse)
+        self.assertEqual(response.headers['X-RateLimit-Limit'], '2r/m', "the project limit should be exceeded")
+        self.assertEqual(self.execute('ZCARD', 'ratelimit_{0}_update_account/container'.format(self.key('domain'))), 2)
+
+    def test_cost(self):
+        stimuli = [
+            {'kwargs': {}, 'help': 'sliding window'},
+            {'kwargs': {'server_time_enabled': True}, 'help': 'sliding window using the clock of redis'},
+        ]
+        for idx, stim in enumerate(stimuli):
+            backend = new_redis_backend(self, **stim['kwargs'])
+            scope = self.key('project{0}'.format(idx))
+            key = 'ratelimit_{0}_update_account/container'.format(scope)
+            for _ in range(2):
+                self.assertIsNone(backend.rate_limit(scope, 'update', 'account/container', '10r/m', cost=4))
+            self.assertEqual(self.execute('ZCARD', key), 2, "{0}: a request should be stored once".format(stim['help']))
+            self.assertEqual(self.execute('GET', key + ':weight'), b'6', "{0}: the extra units should be summed up".format(stim['help']))
+            response = backend.rate_limit(scope, 'update', 'account/container', '10r/m', cost=4)
+            self.assertIsInstance(response, RateLimitExceededResponse, "{0}: only 2 units should remain".format(stim['help']))
+            self.assertEqual(response.headers['X-RateLimit-Remaining'], '0')
+            self.assertIsNone(backend.rate_limit(scope, 'update', 'account/container', '10r/m', cost=2))
+
+    def test_cost_exceeding_limit(self):
+        backend = new_redis_backend(self)
+        levels = [(None, self.key('project'), ['3r/m', '100r/h'])]
+        self.assertIsNone(
+            backend.rate_limit_levels(levels, 'update', 'account/container', cost=10),
+            "a request costing more than the limit should consume the whole window"
+        )
+        self.assertIsInstance(backend.rate_limit_levels(levels, 'update', 'account/container'), RateLimitExceededResponse)
+
+    def test_reserve_tokens(self):
+        backend = new_redis_backend(self)
+        self.assertEqual(backend.reserve_tokens(self.key('bucket'), 100, 100, 100), 0, "the burst should be available")
+        wait_seconds = backend.reserve_tokens(self.key('bucket'), 100, 100, 100)
+        self.assertTrue(0.9 < wait_seconds <= 1.0, "the tokens should be available in 1s, got {0}".format(wait_seconds))
+
+    def test_acquire_slot(self):
+        backend = new_redis_backend(self)
+        slot_ids = [backend.acquire_slot(self.key('slots'), 2, 60) for _ in range(3)]
+        self.assertIsNotNone(slot_ids[0])
+        self.assertIsNotNone(slot_ids[1])
+        self.assertIsNone(slot_ids[2], "all slots should be taken")
+        backend.release_slot(self.key('slots'), slot_ids[0])
+        self.assertIsNotNone(backend.acquire_slot(self.key('slots'), 2, 60), "the released slot should be available")
+
+    def test_adjust_limit_factor(self):
+        backend = new_redis_backend(self)
+        stimuli = [
+            {'overloaded': None, 'expected': 1.0},
+            {'overloaded': True, 'expected': 0.5},
+            # Decreased at most once per interval.
+            {'overloaded': True, 'expected': 0.5},
+            {'overloaded': None, 'expected': 0.5},
+        ]
+        for stim in stimuli:
+            self.assertEqual(
+                backend.adjust_limit_factor(self.key('factor'), stim['overloaded'], 0.1, 0.5, 0.1, 60), stim['expected']
+            )
+
+
+class TestRedisBackendWithFakeRedis(RedisBackendTests, unittest.TestCase):
+
+    lua = False
+
+    def setUp(self):
+        super(TestRedisBackendWithFakeRedis, self).setUp()
+        self.server = FakeRedisServer(lua=self.lua).start()
+        self.addCleanup(self.server.stop)
+        self.host, self.port = self.server.host, self.server.port
+
+    def test_discover_replica_count(self):
+        backends = [
+            new_redis_backend(self, fallback_enabled=True, replica_registry_key='ratelimit_replicas_object-store'),
+            new_redis_backend(self, fallback_enabled=True, replica_registry_key='ratelimit_replicas_object-store'),
+            new_redis_backend(self, fallback_enabled=True, replica_registry_key='ratelimit_replicas_compute'),
+        ]
+        for backend in backends:
+            backend.rate_limit('project', 'update', 'account/container', '10r/m')
+        eventlet.sleep(0.1)
+
+        self.assertEqual(self.server.redis.execute('ZCARD', 'ratelimit_replicas_object-store'), 2)
+        self.assertEqual(
+            self.server.redis.execute('ZCARD', 'ratelimit_replicas_compute'), 1,
+            "replicas of other services sharing the redis should not be counted"
+        )
+
+    def test_fallback_while_circuit_open(self):
+        backend = new_redis_backend(
+            self, circuit_breaker_enabled=True, circuit_failure_threshold=1, fallback_enabled=True,
+            fallback_replica_count=1
+        )
+        self.server.fail(count=100, commands=['SCRIPT', 'EVAL', 'EVALSHA'])
+        self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '2r/m'))
+        self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '2r/m'))
+        self.assertIsNotNone(
+            backend.rate_limit('project', 'update', 'account/container', '2r/m'),
+            "requests should be limited in-process while the circuit is open"
+        )
+
+    def test_failures_open_circuit(self):
+        backend = new_redis_backend(self, circuit_breaker_enabled=True, circuit_failure_threshold=2)
+        self.server.fail(count=100, commands=['SCRIPT', 'EVAL', 'EVALSHA'])
+        for _ in range(3):
+            self.assertIsNone(
+                backend.rate_limit('project', 'update', 'account/container', '1r/m'),
+                "requests should be admitted while redis fails"
+            )
+        self.assertEqual(backend._RedisBackend__circuit_breaker.state, circuit.CircuitBreaker.OPEN)
+
+        evaluated = self.server.commands['evalsha'] + self.server.commands['eval']
+        backend.rate_limit('project', 'update', 'account/container', '1r/m')
+        self.assertEqual(
+            self.server.commands['evalsha'] + self.server.commands['eval'], evaluated,
+            "redis should not be called while the circuit is open"
+        )
+
+    def test_probe_released_on_unexpected_error(self):
+        backend = new_redis_backend(
+            self.server, circuit_breaker_enabled=True, circuit_failure_threshold=1, circuit_open_seconds=0.05
+        )
+        circuit_breaker = backend._RedisBackend__circuit_breaker
+        circuit_breaker.record_failure()
+        time.sleep(0.06)
+
+        # The probe fails with an error that is not raised by redis itself.
+        with mock.patch.object(backend, '_RedisBackend__execute_script', side_effect=ValueError('garbled reply')):
+            self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '1r/m'))
+        self.assertEqual(circuit_breaker.state, circuit.CircuitBreaker.OPEN, "the failed probe should re-open the circuit")
+
+        time.sleep(0.06)
+        self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '1r/m'))
+        self.assertEqual(circuit_breaker.state, circuit.CircuitBreaker.CLOSED, "the next probe should close the circuit")
+
+    def test_probe_closes_circuit(self):
+        stimuli = [
+            {'call': lambda backend: backend.reserve_tokens('bucket', 100, 100, 100), 'help': 'reserving tokens'},
+            {'call': lambda backend: backend.acquire_slot('slots', 10, 600), 'help': 'acquiring a slot'},
+            {'call': lambda backend: backend.release_slot('slots', 'slot'), 'help': 'releasing a slot'},
+            {'call': lambda backend: backend.adjust_limit_factor('factor', True, 0.05, 0.5, 0.1, 10),
+             'help': 'adjusting the factor of adaptive limits'},
+        ]
+        for stim in stimuli:
+            backend = new_redis_backend(
+                self, circuit_breaker_enabled=True, circuit_failure_threshold=1, circuit_open_seconds=0.05
+            )
+            circuit_breaker = backend._RedisBackend__circuit_breaker
+            circuit_breaker.record_failure()
+            time.sleep(0.06)
+            stim['call'](backend)
+            self.assertEqual(
+                circuit_breaker.state, circuit.CircuitBreaker.CLOSED,
+                "{0}: the successful probe should close the circuit".format(stim['help'])
+            )
+
+    def test_stall_times_out(self):
+        # The middleware runs in an eventlet WSGI server using green sockets, which the deadline interrupts.
+        patcher = mock.patch('pyredis.connection.socket', eventlet.green.socket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        backend = new_redis_backend(self, circuit_breaker_enabled=True, latency_budget_seconds=0.2)
+        self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '1r/m'))
+
+        self.server.stall()
+        self.addCleanup(self.server.resume)
+        redis = backend._RedisBackend__redis
+        acquire = redis.acquire
+
+        def slow_acquire():
+            # Waiting for a free connection takes most of the budget. Reading the reply must not get a budget of its own.
+            eventlet.sleep(0.15)
+            return acquire()
+
+        with mock.patch.object(redis, 'acquire', side_effect=slow_acquire):
+            start = time.time()
+            self.assertIsNone(
+                backend.rate_limit('project', 'update', 'account/container', '1r/m'),
+                "the request should be admitted if redis stalls"
+            )
+        self.assertLess(time.time() - start, 0.2 + 0.05, "the check should not wait longer than the latency budget")
+
+        # The interrupted connection must not be reused, as the reply of the stalled check is still pending.
+        self.server.resume()
+        self.assertIsNone(backend.rate_limit('other', 'update', 'account/container', '1r/m'))
+        self.assertIsInstance(
+            backend.rate_limit('other', 'update', 'account/container', '1r/m'), RateLimitExceededResponse,
+            "replies should not be mixed up after a check was interrupted"
+        )
+
+    def test_latency(self):
+        backend = new_redis_backend(self)
+        backend.rate_limit('project', 'update', 'account/container', '10r/m')
+        self.server.latency_seconds = 0.05
+        start = time.time()
+        backend.rate_limit('project', 'update', 'account/container', '10r/m')
+        # The cached script is evaluated in a single round trip without checking whether it exists.
+        elapsed = time.time() - start
+        self.assertGreaterEqual(elapsed, 0.05)
+        self.assertLess(elapsed, 0.1, "the check should take a single round trip")
+
+
+@unittest.skipIf(lua51 is None, "running the Lua scripts requires the lupa package")
+class TestRedisBackendWithLua(TestRedisBackendWithFakeRedis):
+    """Runs the scripts of rate_limit/lua instead of their emulations."""
+
+    lua = True
+
+
+@unittest.skipUnless(REDIS_ADDRESS, "set RATE_LIMIT_TEST_REDIS=<host>:<port> to run the tests against redis")
+class TestRedisBackendWithRedis(RedisBackendTests, unittest.TestCase):
+    """Runs the tests against a real redis. Keys are prefixed per test and expire."""
+
+    def setUp(self):
+        super(TestRedisBackendWithRedis, self).setUp()
+        host, _, port = REDIS_ADDRESS.rpartition(':')
+        self.host, self.port = host, int(port)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import common
+from rate_limit.fallback import LocalRateLimiter
+from rate_limit.fallback import WindowState
+
+
+class TestLocalRateLimiter(unittest.TestCase):
+
+    def test_rate_limit(self):
+        limiter = LocalRateLimiter()
+        now = 1000 * 60.0
+
+        # 2r/m without suspending requests.
+        results = [limiter.rate_limit('key', 60, 2, 0, now=now + i) for i in range(3)]
+        self.assertEqual(results[0], (2, -1))
+        self.assertEqual(results[1], (1, -1))
+        self.assertEqual(results[2], (0, 0))
+
+        # Half of the previous window still counts after 30 seconds.
+        self.assertEqual(limiter.rate_limit('key', 60, 2, 0, now=now + 90)[0], 1)
+
+    def test_suspend_request(self):
+        limiter = LocalRateLimiter()
+        now = 1000 * 60.0
+        limiter.rate_limit('key', 60, 1, 20, now=now)
+
+        remaining, retry_after = limiter.rate_limit('key', 60, 1, 120, now=now + 10)
+        self.assertEqual(remaining, -1)
+        self.assertEqual(retry_after, 110, "the request should be suspended until it fits the window")
+
+        remaining, retry_after = limiter.rate_limit('key', 60, 1, 20, now=now + 10)
+        self.assertEqual(remaining, 0)
+        self.assertEqual(retry_after, 40, "the request should be rejected")
+
+    def test_divide_by_replica_count(self):
+        limiter = LocalRateLimiter(replica_count=5)
+        results = [limiter.rate_limit('key', 60, 10, 0, now=0)[0] for _ in range(3)]
+        self.assertEqual(results, [2, 1, 0])
+
+    def test_lru_eviction(self):
+        limiter = LocalRateLimiter(max_keys=2)
+        limiter.rate_limit('a', 60, 1, 0, now=0)
+        limiter.rate_limit('b', 60, 1, 0, now=0)
+        # Touch 'a' so that 'b' is the least recently used key.
+        limiter.rate_limit('a', 60, 1, 0, now=0)
+        limiter.rate_limit('c', 60, 1, 0, now=0)
+
+        self.assertEqual(len(limiter), 2)
+        self.assertEqual(limiter.rate_limit('a', 60, 1, 0, now=0)[0], 0, "key 'a' should still be tracked")
+        self.assertEqual(limiter.rate_limit('b', 60, 1, 0, now=0)[0], 1, "key 'b' should have been evicted")
+
+    def test_cost(self):
+        limiter = LocalRateLimiter()
+        self.assertEqual(limiter.rate_limit('key', 60, 10, 0, now=0, cost=4), (7, -1))
+        self.assertEqual(limiter.rate_limit('key', 60, 10, 0, now=0, cost=4), (3, -1))
+        self.assertEqual(limiter.rate_limit('key', 60, 10, 0, now=0, cost=4)[0], 0, "the request should not fit")
+        self.assertEqual(limiter.rate_limit('key', 60, 10, 0, now=0, cost=2), (1, -1), "cheaper requests still fit")
+
+    def test_window_state_has_no_dict(self):
+        self.assertFalse(hasattr(WindowState(0), '__dict__'))
+
+    def test_sliding_window_counter(self):
+        stimuli = [
+            {
+                'in': dict(previous=0, current=0, elapsed_seconds=0),
+                'expected': (True, 10, -1)
+            },
+            {
+                'in': dict(previous=10, current=0, elapsed_seconds=30),
+                'expected': (True, 5, -1)
+            },
+            {
+                'in': dict(previous=10, current=5, elapsed_seconds=30),
+                'expected': (True, -1, 6)
+            },
+            {
+                'in': dict(previous=0, current=10, elapsed_seconds=0),
+                'expected': (False, 0, 60)
+            },
+            {
+                # A request costing more than the limit consumes the whole window.
+                'in': dict(previous=0, current=0, elapsed_seconds=0, cost=25),
+                'expected': (True, 1, -1)
+            },
+        ]
+
+        for stim in stimuli:
+            actual = common.sliding_window_counter(window_seconds=60, max_calls=10, max_sleep_time_seconds=30, **stim['in'])
+            self.assertEqual(
+                actual,
+                stim['expected'],
+                "input was '{0}'. expected '{1}' but got '{2}'".format(stim['in'], stim['expected'], actual)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import pyredis
+import unittest
+
+from rate_limit.backend import Backend, RedisBackend
+from rate_limit.circuit import CircuitBreaker
+from rate_limit.response import RateLimitExceededResponse
+from . import fake
+
+
+class FlakyBackend(Backend):
+    def __init__(self, results):
+        super(FlakyBackend, self).__init__(host=None, port=None, rate_limit_response=RateLimitExceededResponse())
+        self.results = results
+        self.checks = 0
+
+    def is_available(self):
+        result = self.results[min(self.checks, len(self.results) - 1)]
+        self.checks += 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class TestHealthCheck(unittest.TestCase):
+
+    def test_health_check(self):
+        backend = FlakyBackend([(False, 'down'), Exception('boom'), (True, '')])
+        self.assertIsNone(backend.is_healthy, "the health should be unknown until the first check completed")
+
+        backend.start_health_check(interval_seconds=0.01)
+        self.assertEqual(backend.checks, 0, "starting the health check must not block")
+
+        eventlet.sleep(0)
+        self.assertFalse(backend.is_healthy)
+        eventlet.sleep(0.015)
+        self.assertFalse(backend.is_healthy)
+        eventlet.sleep(0.015)
+        self.assertTrue(backend.is_healthy)
+
+        backend.stop_health_check()
+        checks = backend.checks
+        eventlet.sleep(0.03)
+        self.assertEqual(backend.checks, checks)
+
+    def test_redis_health_check(self):
+        stimuli = [
+            {
+                'info': '# Server\r\nredis_version:6.2.7\r\nredis_mode:standalone\r\n',
+                'expected': True,
+            },
+            {
+                'info': '# Server\r\nredis_version:4.0.14\r\n',
+                'expected': False,
+            },
+            {
+                'info': pyredis.PyRedisConnError('connection refused'),
+                'expected': False,
+            },
+        ]
+
+        for stim in stimuli:
+            backend = RedisBackend(
+                host='127.0.0.1',
+                port=6379,
+                rate_limit_response=RateLimitExceededResponse(),
+                max_sleep_time_seconds=0,
+                log_sleep_time_seconds=0,
+                circuit_breaker_enabled=True,
+            )
+            client = fake.FakeRedisClient(replies={'INFO': stim['info']})
+            backend._RedisBackend__redis = fake.FakeRedisPool(client)
+
+            is_available, _ = backend.check_health()
+            self.assertEqual(is_available, stim['expected'], "unexpected health for {0}".format(stim))
+
+            # The result is shared with the circuit breaker.
+            expected_state = CircuitBreaker.CLOSED if stim['expected'] else CircuitBreaker.OPEN
+            self.assertEqual(backend._RedisBackend__circuit_breaker.state, expected_state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import subprocess
+import sys
+import unittest
+
+from rate_limit import utils
+
+WORKDIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestImports(unittest.TestCase):
+
+    def test_optional_dependencies_not_imported(self):
+        # Only imported on demand, if Limes, metrics or logging are used.
+        optional_modules = ['keystoneclient', 'keystoneauth1', 'requests', 'datadog', 'oslo_log', 'oslo_config']
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'import sys, rate_limit.rate_limit; print(",".join(sorted(sys.modules)))'],
+            cwd=os.path.join(WORKDIR, '..', '..')
+        ).decode('utf-8')
+        imported = set(output.strip().split(','))
+        for module in optional_modules:
+            self.assertNotIn(
+                module, imported,
+                "module '{0}' must not be imported with the middleware".format(module)
+            )
+
+    def test_parse_version(self):
+        stimuli = [
+            {'version': '5.0.0', 'expected': (5, 0, 0)},
+            {'version': '4.0.11', 'expected': (4, 0, 11)},
+            {'version': '6.2', 'expected': (6, 2, 0)},
+            {'version': '7.0.0-rc1', 'expected': (7, 0, 0)},
+        ]
+        for stim in stimuli:
+            self.assertEqual(
+                utils.parse_version(stim['version']), stim['expected'],
+                "version '{0}' should be parsed as {1}".format(stim['version'], stim['expected'])
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
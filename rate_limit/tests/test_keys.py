@@ -0,0 +1,101 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import common
+from rate_limit.backend import Backend
+
+
+class TestCompactKeys(unittest.TestCase):
+
+    def test_base62_encode(self):
+        stimuli = [
+            {'number': 0, 'expected': '0'},
+            {'number': 61, 'expected': 'z'},
+            {'number': 62, 'expected': '10'},
+            {'number': 62 ** 3 - 1, 'expected': 'zzz'},
+        ]
+
+        for stim in stimuli:
+            self.assertEqual(common.base62_encode(stim['number']), stim['expected'])
+
+    def test_compact_scope(self):
+        stimuli = [
+            {
+                'scope': None,
+                'expected': '*',
+            },
+            {
+                'scope': '00000000000000000000000000000001',
+                'expected': '0000000000000000000001',
+            },
+            {
+                # UUIDs with and without dashes are encoded the same way.
+                'scope': '3b5d5c37-1295-5042-212b-173e8c5f4cd6',
+                'expected': common.compact_scope('3b5d5c3712955042212b173e8c5f4cd6'),
+            },
+            {
+                'scope': '10.0.0.1',
+                'expected': '=10.0.0.1',
+            },
+            {
+                # Not a hex UUID.
+                'scope': 'domain/project-name-with-32-chars',
+                'expected': '=domain/project-name-with-32-chars',
+            },
+        ]
+
+        for stim in stimuli:
+            self.assertEqual(
+                common.compact_scope(stim['scope']),
+                stim['expected'],
+                "scope '{0}' should be encoded as '{1}'".format(stim['scope'], stim['expected'])
+            )
+
+    def test_compact_key_func(self):
+        scope = '3b5d5c3712955042212b173e8c5f4cd6'
+        key = common.compact_key_func(scope, 'update', 'account/container')
+        self.assertEqual(key, common.compact_key_func(scope, 'update', 'account/container'), "keys must be stable")
+        self.assertLess(len(key), len(common.key_func(scope, 'update', 'account/container')) * 0.6)
+
+        prefix, rule_id, compact_scope = key.split(':')
+        self.assertEqual(prefix, 'rl')
+        self.assertLessEqual(len(rule_id), 9)
+        self.assertEqual(len(compact_scope), 22)
+
+        keys = set(
+            common.compact_key_func(s, action, target_type_uri)
+            for s in (None, scope, '10.0.0.1')
+            for action in ('create', 'update', 'read')
+            for target_type_uri in ('account/container', 'account/container/object')
+        )
+        self.assertEqual(len(keys), 18, "keys of different rules and scopes must not collide")
+
+    def test_backend_key(self):
+        scope = '3b5d5c3712955042212b173e8c5f4cd6'
+        stimuli = [
+            {'compact_encoding': False, 'expected': common.key_func(scope, 'upload', 'bandwidth')},
+            {'compact_encoding': True, 'expected': common.compact_key_func(scope, 'upload', 'bandwidth')},
+        ]
+        for stim in stimuli:
+            backend = Backend(None, None, None, compact_encoding=stim['compact_encoding'])
+            self.assertEqual(
+                backend.key(scope, 'upload', 'bandwidth'), stim['expected'],
+                "keys should be encoded like the rate limit keys of the backend"
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import log
+
+
+class FormatCounter(object):
+    """Counts how often it was formatted."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __format__(self, format_spec):
+        self.count += 1
+        return 'formatted'
+
+
+class TestLog(unittest.TestCase):
+
+    def tearDown(self):
+        log.refresh()
+
+    def test_debug_formats_lazily(self):
+        logger = log.Logger(__name__)
+        arg = FormatCounter()
+
+        log._debug_enabled = False
+        self.assertFalse(logger.is_debug_enabled, "debug logging should be disabled")
+        logger.debug("value: {0}", arg)
+        self.assertEqual(arg.count, 0, "disabled debug logs must not be formatted")
+
+        log._debug_enabled = True
+        logger.debug("value: {0}", arg)
+        self.assertEqual(arg.count, 1, "enabled debug logs should be formatted once")
+
+    def test_log_sampler(self):
+        sampler = log.LogSampler(interval_seconds=10)
+        stimuli = [
+            {'key': 'a', 'now': 0, 'expected': 0},
+            {'key': 'a', 'now': 1, 'expected': None},
+            {'key': 'b', 'now': 2, 'expected': 0},
+            {'key': 'a', 'now': 5, 'expected': None},
+            # The next log of the key reports the number of suppressed logs.
+            {'key': 'a', 'now': 10, 'expected': 2},
+            {'key': 'a', 'now': 11, 'expected': None},
+            {'key': 'b', 'now': 12, 'expected': 0},
+        ]
+        for stim in stimuli:
+            self.assertEqual(
+                sampler.sample(stim['key'], now=stim['now']), stim['expected'],
+                "log of key '{0}' at {1} should return {2}".format(stim['key'], stim['now'], stim['expected'])
+            )
+
+    def test_log_sampler_disabled(self):
+        sampler = log.LogSampler(interval_seconds=0)
+        for now in range(3):
+            self.assertEqual(sampler.sample('a', now=now), 0, "sampling disabled. every log should be emitted")
+
+    def test_log_sampler_max_keys(self):
+        sampler = log.LogSampler(interval_seconds=10, max_keys=2)
+        sampler.sample('a', now=0)
+        sampler.sample('b', now=0)
+        # Exceeding the max. number of keys forgets all keys.
+        self.assertEqual(sampler.sample('c', now=1), 0)
+        self.assertEqual(sampler.sample('a', now=1), 0, "key 'a' should have been forgotten")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import common
+from rate_limit import errors
+from rate_limit.backend import MemcachedBackend
+from rate_limit.response import RateLimitExceededResponse
+from . import fake
+
+
+class TestMemcachedBackend(unittest.TestCase):
+
+    def _backend(self, strategy, client=None):
+        return MemcachedBackend(
+            host='127.0.0.1',
+            port=11211,
+            rate_limit_response=RateLimitExceededResponse(),
+            max_sleep_time_seconds=0,
+            log_sleep_time_seconds=0,
+            strategy=strategy,
+            memcache_client=client or fake.FakeMemcache(),
+        )
+
+    def test_rate_limit(self):
+        for strategy in (common.Constants.strategy_fixed_window, common.Constants.strategy_sliding_window):
+            backend = self._backend(strategy)
+
+            results = [backend.rate_limit('project', 'update', 'account/container', '2r/h') for _ in range(3)]
+            self.assertIsNone(results[0], "strategy {0}: 1st request should not be rate limited".format(strategy))
+            self.assertIsNone(results[1], "strategy {0}: 2nd request should not be rate limited".format(strategy))
+            self.assertIsInstance(
+                results[2], RateLimitExceededResponse, "strategy {0}: 3rd request should be rate limited".format(strategy)
+            )
+
+            # Other scopes are counted separately.
+            self.assertIsNone(backend.rate_limit('other', 'update', 'account/container', '2r/h'))
+
+    def test_rejected_requests_are_not_counted(self):
+        client = fake.FakeMemcache()
+        backend = self._backend(common.Constants.strategy_fixed_window, client)
+        for _ in range(5):
+            backend.rate_limit('project', 'update', 'account/container', '2r/h')
+
+        counters = [v for k, v in client.store.items() if k.startswith('ratelimit_project_update')]
+        self.assertEqual(counters, [2])
+
+    def test_cost(self):
+        for strategy in (common.Constants.strategy_fixed_window, common.Constants.strategy_sliding_window):
+            backend = self._backend(strategy)
+
+            self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '5r/h', cost=3))
+            self.assertIsInstance(
+                backend.rate_limit('project', 'update', 'account/container', '5r/h', cost=3), RateLimitExceededResponse,
+                "strategy {0}: the 2nd request should exceed the rate limit".format(strategy)
+            )
+            self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '5r/h', cost=2))
+
+    def test_retry_after(self):
+        stimuli = [
+            # Until the next window starts.
+            {'strategy': common.Constants.strategy_fixed_window, 'max': 60},
+            # Until the counter of the current window decayed as previous window.
+            {'strategy': common.Constants.strategy_sliding_window, 'max': 120},
+        ]
+        for stim in stimuli:
+            backend = self._backend(stim['strategy'])
+            for _ in range(2):
+                backend.rate_limit('project', 'update', 'account/container', '2r/m')
+            response = backend.rate_limit('project', 'update', 'account/container', '2r/m')
+            retry_after = int(response.headers[common.Constants.header_ratelimit_retry_after])
+            self.assertTrue(
+                0 < retry_after <= stim['max'],
+                "strategy {0}: expected a retry after of at most {1}s but got {2}s".format(
+                    stim['strategy'], stim['max'], retry_after
+                )
+            )
+
+    def test_unknown_strategy(self):
+        self.assertRaises(errors.ConfigError, self._backend, 'leaky_bucket')
+
+
+if __name__ == '__main__':
+    unittest.main()
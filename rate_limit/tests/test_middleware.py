@@ -12,14 +12,20 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import eventlet
+import mock
 import os
+import shutil
+import tempfile
 import time
 import unittest
 
+from rate_limit import reload
 from rate_limit.rate_limit import OpenStackRateLimitMiddleware
 from rate_limit.response import BlacklistResponse
 from rate_limit.response import RateLimitExceededResponse
 from . import fake
+from .fake_redis import FakeRedisServer
 
 WORKDIR = os.path.dirname(os.path.realpath(__file__))
 SWIFTCONFIGPATH = WORKDIR + '/fixtures/swift.yaml'
@@ -33,10 +39,16 @@ class TestOpenStackRateLimitMiddleware(unittest.TestCase):
         if self.is_setup:
             return
 
+        # Stand-in for redis running the rate limit scripts.
+        self.redis = FakeRedisServer().start()
+        self.addCleanup(self.redis.stop)
+
         self.app = OpenStackRateLimitMiddleware(
             app=fake.FakeApp(),
             config_file=SWIFTCONFIGPATH,
-            max_sleep_time_seconds=20
+            max_sleep_time_seconds=20,
+            backend_host=self.redis.host,
+            backend_port=self.redis.port,
         )
         self.is_setup = True
 
@@ -138,6 +150,117 @@ class TestOpenStackRateLimitMiddleware(unittest.TestCase):
                 "rate limit for '{0} {1}' should be '{2}' but got '{3}'".format(action, target_type_uri, expected_ratelimit, rate_limit)
             )
 
+    def test_get_rate_limit_levels(self):
+        # Additionally counted per domain and per user.
+        self.app.ratelimit_provider.local_ratelimits['account/container'].append(
+            {'action': 'delete', 'limit': '10r/m', 'scopes': {'domain': '100r/m', 'user': '3r/m'}}
+        )
+        stimuli = [
+            {
+                'action': 'update',
+                'domain_name': 'Default',
+                'username': 'alice',
+                'expected': [(None, '123456', '2r/m')],
+                'help': 'the scope level should only be reported if additional levels are configured',
+            },
+            {
+                'action': 'delete',
+                'domain_name': 'Default',
+                'username': 'alice',
+                'expected': [
+                    ('domain', 'domain:Default', '100r/m'),
+                    ('initiator_project_id', '123456', '10r/m'),
+                    ('user', 'user:Default/alice', '3r/m'),
+                ],
+                'help': 'the levels should be ordered from the broadest to the narrowest',
+            },
+            {
+                'action': 'delete',
+                'domain_name': None,
+                'username': None,
+                'expected': [('initiator_project_id', '123456', '10r/m')],
+                'help': 'levels should be skipped if the domain or user is unknown',
+            },
+        ]
+
+        for stim in stimuli:
+            local_rate_limit = self.app.ratelimit_provider.get_local_rate_limits(
+                '123456', stim['action'], 'account/container'
+            )
+            levels = self.app._get_rate_limit_levels(
+                '123456', local_rate_limit, stim['action'], 'account/container',
+                domain_name=stim['domain_name'], username=stim['username']
+            )
+            self.assertEqual(levels, stim['expected'], stim['help'])
+
+    def test_reload_config(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config_file = os.path.join(tmpdir, 'swift.yaml')
+        shutil.copy(SWIFTCONFIGPATH, config_file)
+        app = OpenStackRateLimitMiddleware(app=fake.FakeApp(), config_file=config_file)
+        self.assertFalse(app.is_scope_blacklisted('newproject'))
+
+        with open(config_file, 'a') as f:
+            f.write('\nblacklist_users:\n  - newuser\n')
+        self.assertTrue(app.reload_config(), "the valid configuration should be applied")
+        self.assertTrue(app.is_user_blacklisted('newuser'))
+        self.assertEqual(app.config_generation, 2)
+
+        with open(config_file, 'w') as f:
+            f.write('rates:\n  global:\n    account/container:\n      - action: update\n        limit: xr/m\n')
+        self.assertFalse(app.reload_config(), "the invalid configuration should be rejected")
+        self.assertTrue(app.is_user_blacklisted('newuser'), "the previous configuration should be kept")
+        self.assertEqual(app.config_generation, 2)
+        self.assertEqual(app.ratelimit_provider.get_global_rate_limits('update', 'account/container'), '2r/m')
+
+    def test_reload_off_request_path(self):
+        app = OpenStackRateLimitMiddleware(app=fake.FakeApp(), config_file=SWIFTCONFIGPATH)
+        load_and_validate_config = reload.load_and_validate_config
+
+        def slow_load_and_validate_config(config_file):
+            # Parsing a large configuration blocks the thread.
+            time.sleep(0.3)
+            return load_and_validate_config(config_file)
+
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(time.time())
+                eventlet.sleep(0.01)
+
+        ticker = eventlet.spawn(tick)
+        with mock.patch.object(reload, 'load_and_validate_config', side_effect=slow_load_and_validate_config):
+            self.assertTrue(app.reload_config())
+        ticker.kill()
+        self.assertGreater(len(ticks), 10, "other greenthreads should be served while the configuration is parsed")
+
+    def test_adaptive_limits(self):
+        app = OpenStackRateLimitMiddleware(
+            app=fake.FakeApp(), config_file=SWIFTCONFIGPATH, backend_host=self.redis.host, backend_port=self.redis.port,
+            adaptive_limits_enabled='true', adaptive_decrease_percent='30', adaptive_min_samples='1'
+        )
+        limiter = app.adaptive_limiter
+        limiter.observe(2.0, False, now=time.time() + 10)
+        self.assertAlmostEqual(limiter.factor, 0.7, msg="a decrease by 30% should scale the limits to 70%")
+
+        app._set_service_type_and_name({'WATCHER.SERVICE_TYPE': 'object-store'})
+        self.assertEqual(
+            limiter.key, 'ratelimit_adaptive_object-store', "the key should contain the service type of the request"
+        )
+
+    def test_replica_registry_key(self):
+        app = OpenStackRateLimitMiddleware(
+            app=fake.FakeApp(), config_file=SWIFTCONFIGPATH, backend_host=self.redis.host, backend_port=self.redis.port,
+            backend_fallback_enabled='true'
+        )
+        app._set_service_type_and_name({'WATCHER.SERVICE_TYPE': 'object-store'})
+        self.assertEqual(
+            app.backend.replica_registry_key, 'ratelimit_replicas_object-store',
+            "the key should contain the service type of the request"
+        )
+
     def test_is_ratelimited_swift_local_container_update(self):
         scope = '123456'
         action = 'update'
@@ -0,0 +1,96 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import overrides
+from rate_limit.overrides import OverrideIndex
+from rate_limit.provider import ConfigurationRateLimitProvider
+
+PREMIUM = {'account/container': [{'action': 'update', 'limit': '100r/m', 'concurrency': 20}]}
+WILDCARD = {'account/container/*': [{'action': 'read', 'limit': '1000r/m'}]}
+
+CONFIG = {
+    'rates': {
+        'default': {
+            'account/container': [{'action': 'update', 'limit': '10r/m'}, {'action': 'read', 'limit': '20r/m'}],
+        },
+        'projects': {
+            'premium1': PREMIUM,
+            'premium2': PREMIUM,
+            'reader': WILDCARD,
+        },
+    },
+}
+
+
+class TestOverrides(unittest.TestCase):
+
+    def test_index(self):
+        projects = dict(('project{0}'.format(i), PREMIUM if i % 2 else WILDCARD) for i in range(1000))
+        buf = OverrideIndex.pack(projects)
+        index = OverrideIndex(buf)
+
+        self.assertEqual(len(index), 1000)
+        for scope, rules in projects.items():
+            self.assertEqual(index.get(scope), rules, "the overrides of '{0}' should be found".format(scope))
+        self.assertIsNone(index.get('unknown'))
+        self.assertIsNone(index.get(None))
+        # 2048 slots of 12 bytes, the header and two rule sets.
+        self.assertLess(len(buf), 2048 * 12 + 1024, "identical rule sets should be stored once")
+
+    def test_empty_index(self):
+        index = overrides.to_index({})
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.get('premium1'))
+
+    def test_provider(self):
+        provider = ConfigurationRateLimitProvider(service_type='object-store')
+        provider.load_rate_limits(CONFIG)
+        stimuli = [
+            {'scope': 'premium1', 'action': 'update', 'target_type_uri': 'account/container', 'expected': '100r/m',
+             'help': 'the override should take precedence over the default'},
+            {'scope': 'premium1', 'action': 'read', 'target_type_uri': 'account/container', 'expected': '20r/m',
+             'help': 'actions without override should fall back to the default'},
+            {'scope': 'reader', 'action': 'read', 'target_type_uri': 'account/container/object', 'expected': '1000r/m',
+             'help': 'overrides should support wildcards'},
+            {'scope': 'other', 'action': 'update', 'target_type_uri': 'account/container', 'expected': '10r/m',
+             'help': 'scopes without override should get the default'},
+        ]
+        for stim in stimuli:
+            self.assertEqual(
+                provider.get_local_rate_limits(stim['scope'], stim['action'], stim['target_type_uri']),
+                stim['expected'], stim['help']
+            )
+        self.assertEqual(provider.get_local_concurrency_limit('premium2', 'update', 'account/container'), 20)
+        self.assertEqual(provider.get_local_concurrency_limit('other', 'update', 'account/container'), -1)
+
+    def test_has_concurrency_limits(self):
+        stimuli = [
+            {'rates': {}, 'expected': False, 'help': 'no rules should have no concurrency limits'},
+            {'rates': {'default': WILDCARD, 'projects': {'reader': WILDCARD}}, 'expected': False,
+             'help': 'rules without concurrency limit should have no concurrency limits'},
+            {'rates': {'global': PREMIUM}, 'expected': True, 'help': 'a global concurrency limit should be found'},
+            {'rates': {'default': PREMIUM}, 'expected': True, 'help': 'a local concurrency limit should be found'},
+            {'rates': {'projects': {'premium1': PREMIUM}}, 'expected': True,
+             'help': 'a concurrency limit of an override should be found'},
+        ]
+        provider = ConfigurationRateLimitProvider(service_type='object-store')
+        for stim in stimuli:
+            provider.load_rate_limits({'rates': stim['rates']})
+            self.assertEqual(provider.has_concurrency_limits(), stim['expected'], stim['help'])
+
+
+if __name__ == '__main__':
+    unittest.main()
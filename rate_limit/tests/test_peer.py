@@ -0,0 +1,233 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from rate_limit import common
+from rate_limit import errors
+from rate_limit import peer
+from rate_limit.backend import PeerBackend
+from rate_limit.response import RateLimitExceededResponse
+
+
+def _free_address():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return '127.0.0.1:{0}'.format(port)
+
+
+def _new_backend(peers, self_address, **kwargs):
+    return PeerBackend(
+        rate_limit_response=RateLimitExceededResponse(),
+        max_sleep_time_seconds=0,
+        log_sleep_time_seconds=0,
+        peers=','.join(peers),
+        self_address=self_address,
+        **kwargs
+    )
+
+
+def _count_admitted(backend, scopes, n):
+    pool = eventlet.GreenPool()
+    results = pool.imap(
+        lambda i: backend.rate_limit(scopes[i % len(scopes)], 'update', 'account/container', '30r/m'), range(n)
+    )
+    return sum(1 for result in results if result is None)
+
+
+def _run_peer(peers, self_address, ready, start, done, queue):
+    backend = _new_backend(peers, self_address)
+    ready.set()
+    while not start.is_set():
+        eventlet.sleep(0.01)
+    queue.put(_count_admitted(backend, ['project_a', 'project_b'], 50))
+    # Keep serving until all peers are done.
+    while not done.is_set():
+        eventlet.sleep(0.01)
+    backend.stop()
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_get_node(self):
+        peers = ['10.0.0.1:7946', '10.0.0.2:7946', '10.0.0.3:7946']
+        ring = peer.HashRing(peers)
+        owners = [ring.get_node('key_{0}'.format(i)) for i in range(300)]
+
+        self.assertEqual(owners, [peer.HashRing(reversed(peers)).get_node('key_{0}'.format(i)) for i in range(300)],
+                         "the owner of a key must not depend on the order of the peers")
+        for p in peers:
+            self.assertGreater(owners.count(p), 50, "keys should be distributed across all peers")
+
+        # Removing a peer only moves its own keys.
+        smaller_ring = peer.HashRing(peers[:2])
+        for i, owner in enumerate(owners):
+            if owner != peers[2]:
+                self.assertEqual(smaller_ring.get_node('key_{0}'.format(i)), owner)
+
+        self.assertIsNone(peer.HashRing([]).get_node('key'))
+
+
+class TestLoadPeers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_peers(self):
+        path = os.path.join(self.tmpdir, 'peers')
+        with open(path, 'w') as f:
+            f.write('# peers\n10.0.0.2:7946\n\n10.0.0.3:7946\n')
+
+        stimuli = [
+            {
+                'peers': '10.0.0.1:7946, 10.0.0.2:7946',
+                'expected': ['10.0.0.1:7946', '10.0.0.2:7946'],
+            },
+            {
+                'peers_file': path,
+                'expected': ['10.0.0.2:7946', '10.0.0.3:7946'],
+            },
+            {
+                'peers': '10.0.0.1:7946,10.0.0.2:7946',
+                'peers_file': path,
+                'expected': ['10.0.0.1:7946', '10.0.0.2:7946', '10.0.0.3:7946'],
+            },
+            {
+                'expected': [],
+            },
+        ]
+
+        for stim in stimuli:
+            self.assertEqual(
+                peer.load_peers(stim.get('peers'), stim.get('peers_file')),
+                stim['expected'],
+                "peers should be loaded correctly"
+            )
+
+        self.assertRaises(errors.ConfigError, peer.load_peers, None, os.path.join(self.tmpdir, 'missing'))
+
+
+class TestPeerBackend(unittest.TestCase):
+
+    def test_requires_self_in_peers(self):
+        self.assertRaises(errors.ConfigError, _new_backend, ['127.0.0.1:1'], '127.0.0.1:2')
+
+    def test_rate_limit_across_peers(self):
+        peers = [_free_address() for _ in range(3)]
+        backends = [_new_backend(peers, address) for address in peers]
+        try:
+            scopes = ['project_{0}'.format(i) for i in range(4)]
+            admitted = sum(_count_admitted(backend, scopes, 100) for backend in backends)
+            self.assertEqual(admitted, 4 * 30, "exactly the limit should be admitted across all peers")
+        finally:
+            for backend in backends:
+                backend.stop()
+
+    def test_unreachable_owner(self):
+        peers = [_free_address() for _ in range(2)]
+        # Only one of the two peers is running. Checks for keys owned by the other one are limited locally.
+        backend = _new_backend(peers, peers[0])
+        try:
+            scopes = ['project_{0}'.format(i) for i in range(10)]
+            ring = peer.HashRing(peers)
+            expected = sum(
+                30 if ring.get_node(common.key_func(scope, 'update', 'account/container')) == peers[0] else 15
+                for scope in scopes
+            )
+            self.assertEqual(_count_admitted(backend, scopes, 400), expected,
+                             "keys of the unreachable peer should be limited to their share")
+        finally:
+            backend.stop()
+
+    def test_serve_exclusively(self):
+        address = _free_address()
+        host, port = peer.split_address(address)
+        server = peer.PeerServer(host, port, lambda *args, **kwargs: (1, 0))
+        try:
+            self.assertRaises(socket.error, peer.PeerServer, host, port, lambda *args, **kwargs: (1, 0))
+        finally:
+            server.stop()
+
+    def test_processes_on_same_host(self):
+        address = _free_address()
+        # Both workers use the same peer address. Only the first one serves it, the second forwards its checks.
+        backends = [_new_backend([address], address) for _ in range(2)]
+        try:
+            admitted = sum(
+                1 for i in range(8)
+                if backends[i % 2].rate_limit('project', 'update', 'account/container', '2r/m') is None
+            )
+            self.assertEqual(admitted, 2, "the limit should be counted once for all workers of the host")
+        finally:
+            for backend in backends:
+                backend.stop()
+
+    def test_secret(self):
+        host, port = peer.split_address(_free_address())
+        server = peer.PeerServer(host, port, lambda *args, **kwargs: (1, 0), secret='secret')
+        stimuli = [
+            {'secret': 'secret', 'valid': True, 'help': 'checks signed with the secret should be served'},
+            {'secret': 'other', 'valid': False, 'help': 'checks signed with another secret should be rejected'},
+            {'secret': None, 'valid': False, 'help': 'unsigned checks should be rejected'},
+        ]
+        try:
+            for stim in stimuli:
+                client = peer.PeerClient('{0}:{1}'.format(host, port), secret=stim['secret'])
+                try:
+                    if stim['valid']:
+                        self.assertEqual(client.execute_batch([['key', 60, 10, 0, 1]]), [[1, 0]], stim['help'])
+                    else:
+                        self.assertRaises(Exception, client.execute_batch, [['key', 60, 10, 0, 1]])
+                finally:
+                    client.close()
+        finally:
+            server.stop()
+
+    def test_rate_limit_across_processes(self):
+        peers = [_free_address() for _ in range(3)]
+        ready = [multiprocessing.Event() for _ in peers]
+        start, done = multiprocessing.Event(), multiprocessing.Event()
+        queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=_run_peer, args=(peers, address, evt, start, done, queue))
+            for address, evt in zip(peers, ready)
+        ]
+        for w in workers:
+            w.start()
+        try:
+            for evt in ready:
+                self.assertTrue(evt.wait(timeout=10))
+            start.set()
+            admitted = sum(queue.get(timeout=10) for _ in workers)
+        finally:
+            done.set()
+            for w in workers:
+                w.join()
+
+        self.assertEqual(admitted, 2 * 30, "exactly the limit should be admitted across all processes")
+
+
+if __name__ == '__main__':
+    unittest.main()
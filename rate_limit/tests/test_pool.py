@@ -0,0 +1,195 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import eventlet
+import os
+import pyredis
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import unittest
+
+from rate_limit import common
+from rate_limit import pool
+from . import fake
+
+
+class PongHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                break
+            # Each command is sent as array '*<n>'. The tests don't use '*' in arguments.
+            for command in data.split(b'*')[1:]:
+                self.request.sendall(b'+PONG\r\n' if b'PING' in command else b'+OK\r\n')
+
+
+class PongServer(object):
+    """
+    Minimal server replying +PONG to every PING and +OK to any other command. Counts the accepted connections.
+    Runs in a thread as pyredis uses blocking sockets.
+    """
+
+    def __init__(self, address, server_class=socketserver.ThreadingTCPServer):
+        self.server = server_class(address, PongHandler)
+        self.server.daemon_threads = True
+        self.server.connections = 0
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = PongServer(('127.0.0.1', 0))
+        self.port = self.server.server.server_address[1]
+        self.metrics = fake.FakeMetricsClient()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def new_pool(self, **kwargs):
+        return pool.ConnectionPool(
+            host='127.0.0.1', port=self.port, conn_timeout=0.2, read_timeout=0.2, encoding='utf-8',
+            metrics_client=self.metrics, **kwargs
+        )
+
+    def test_parse_address(self):
+        stimuli = [
+            {
+                'host': '127.0.0.1',
+                'port': 6379,
+                'expected': ('127.0.0.1', 6379, None),
+            },
+            {
+                'host': 'unix:///var/run/redis/redis.sock',
+                'port': 6379,
+                'expected': (None, None, '/var/run/redis/redis.sock'),
+            },
+        ]
+
+        for stim in stimuli:
+            self.assertEqual(
+                pool.parse_address(stim['host'], stim['port']),
+                stim['expected'],
+                "the address should be parsed correctly"
+            )
+
+    def test_unix_socket(self):
+        path = os.path.join(self.tmpdir, 'redis.sock')
+        server = PongServer(path, server_class=socketserver.ThreadingUnixStreamServer)
+        try:
+            host, port, unix_sock = pool.parse_address('unix://' + path, 6379)
+            p = pool.ConnectionPool(host=host, port=port, unix_sock=unix_sock, conn_timeout=0.2, encoding='utf-8')
+            self.assertEqual(p.execute('PING'), b'PONG')
+        finally:
+            server.stop()
+
+    def test_socket_options(self):
+        p = self.new_pool(tcp_keepalive_idle_seconds=30)
+        conn = p.acquire()
+        self.assertEqual(conn.execute('PING'), b'PONG')
+        sock = conn._conn._sock
+        self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE))
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.assertEqual(sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE), 30)
+        p.release(conn)
+
+    def test_wait_for_free_connection(self):
+        p = self.new_pool(pool_size=1)
+        conn = p.acquire()
+        self.assertEqual(p.in_use, 1)
+        self.assertRaises(pyredis.PyRedisError, p.acquire)
+
+        eventlet.spawn_after(0.05, p.release, conn)
+        self.assertIs(p.acquire(), conn, "the released connection should be handed to the waiting greenthread")
+        self.assertGreaterEqual(max(self.metrics.get(common.Constants.metric_backend_pool_wait_seconds)), 0.04)
+        self.assertEqual(self.metrics.get(common.Constants.metric_backend_pool_connections_in_use)[-1], 1)
+
+    def test_warm_up(self):
+        p = self.new_pool(warm_up_connections=3)
+        self.assertEqual(p.warm_up(), 3)
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(p.in_use, 0)
+
+        # Executing commands doesn't open new connections.
+        for _ in range(3):
+            p.execute('PING')
+        self.assertEqual(self.server.connections, 3)
+
+    def test_after_fork(self):
+        p = self.new_pool(warm_up_connections=2)
+        p.warm_up()
+        inherited = p.acquire()
+
+        # Pretend the pool was created by the parent process.
+        p._ConnectionPool__pid = -1
+        conn = p.acquire()
+        self.assertIsNot(conn, inherited)
+        self.assertTrue(inherited.closed, "connections inherited from the parent should be discarded")
+        self.assertEqual(conn.execute('PING'), b'PONG')
+        # The request waited for the warm-up and reused one of its connections.
+        self.assertEqual(self.server.connections, 2 + 2)
+
+        # Releasing a connection of the parent doesn't free a slot in the pool of the child.
+        p.release(inherited)
+        self.assertEqual(p.in_use, 1)
+        p.release(conn)
+        self.assertEqual(p.in_use, 0)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), "requires fork hooks")
+    def test_warm_up_in_child(self):
+        p = self.new_pool(warm_up_connections=2)
+        p.warm_up()
+        original_connect = p._connect
+        connected_by = []
+
+        def connect():
+            connected_by.append(eventlet.getcurrent())
+            return original_connect()
+
+        p._connect = connect
+        pid = os.fork()
+        if pid == 0:
+            # The pool is warmed up before the first request, which doesn't establish a connection on its own.
+            try:
+                eventlet.sleep(0.1)
+                warmed_up = len(connected_by) == 2
+                ok = warmed_up and p.execute('PING') == b'PONG' and len(connected_by) == 2
+            except BaseException:
+                ok = False
+            os._exit(0 if ok else 1)
+
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.WEXITSTATUS(status), 0, "first request in the child should reuse a warmed up connection")
+        self.assertEqual(self.server.connections, 2 + 2)
+
+if __name__ == '__main__':
+    unittest.main()
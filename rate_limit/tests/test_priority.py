@@ -0,0 +1,111 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from rate_limit import errors
+from rate_limit.priority import PriorityMatcher
+
+
+PRIORITIES = [
+    {'name': 'operator', 'reserved': 20, 'roles': ['cloud_admin'], 'users': ['Default/admin', 'c0ffee']},
+    {'name': 'service', 'reserved': 30, 'projects': ['Default/service'], 'service_roles': ['service'],
+     'headers': {'X-Service-Project-Name': 'service'}},
+]
+
+
+class TestPriority(unittest.TestCase):
+
+    def test_match(self):
+        matcher = PriorityMatcher(PRIORITIES)
+        stimuli = [
+            {
+                'environ': {},
+                'expected': ('default', 0.5),
+                'help': 'requests matching no class should get the remainder of the global limits',
+            },
+            {
+                'environ': {'HTTP_X_USER_DOMAIN_NAME': 'Default'}, 'username': 'admin',
+                'expected': ('operator', 1.0),
+                'help': 'the highest class should get all of the global limits',
+            },
+            {
+                'environ': {'HTTP_X_USER_DOMAIN_NAME': 'customer'}, 'username': 'admin',
+                'expected': ('default', 0.5),
+                'help': 'a user of the same name in another domain should not match',
+            },
+            {
+                'environ': {}, 'username': 'admin',
+                'expected': ('default', 0.5),
+                'help': 'a user of unknown domain should not match',
+            },
+            {
+                'environ': {'HTTP_X_USER_ID': 'c0ffee'},
+                'expected': ('operator', 1.0),
+                'help': 'the class should be matched by user id',
+            },
+            {
+                'environ': {'HTTP_X_ROLES': 'member, Cloud_Admin'},
+                'expected': ('operator', 1.0),
+                'help': 'the class should be matched by role',
+            },
+            {
+                'environ': {}, 'scope_name_key': 'Default/service',
+                'expected': ('service', 0.8),
+                'help': 'the class should be matched by project',
+            },
+            {
+                'environ': {'HTTP_X_SERVICE_ROLES': 'reader,service'},
+                'expected': ('service', 0.8),
+                'help': 'the class should be matched by service role',
+            },
+            {
+                'environ': {'HTTP_X_SERVICE_PROJECT_NAME': 'service'},
+                'expected': ('service', 0.8),
+                'help': 'the class should be matched by a header set by the keystonemiddleware',
+            },
+            {
+                'environ': {'HTTP_X_PRIORITY': 'service', 'HTTP_X_ROLES': 'service'},
+                'expected': ('default', 0.5),
+                'help': 'headers set by the client should be ignored',
+            },
+            {
+                'environ': {'HTTP_X_SERVICE_ROLES': 'service', 'HTTP_X_USER_DOMAIN_NAME': 'Default'}, 'username': 'admin',
+                'expected': ('operator', 1.0),
+                'help': 'the highest matching class should win',
+            },
+        ]
+        for stim in stimuli:
+            priority_class = matcher.match(
+                stim['environ'], scope='abcdef', scope_name_key=stim.get('scope_name_key'),
+                username=stim.get('username')
+            )
+            self.assertEqual(priority_class.name, stim['expected'][0], stim['help'])
+            self.assertAlmostEqual(priority_class.share, stim['expected'][1], msg=stim['help'])
+
+    def test_invalid(self):
+        stimuli = [
+            {'config': {'name': 'operator'}, 'help': 'priorities should be a list'},
+            {'config': [{'reserved': 10}], 'help': 'a class should have a name'},
+            {'config': [{'name': 'a', 'reserved': 60}, {'name': 'b', 'reserved': 40}],
+             'help': 'the classes should not reserve all of the global limits'},
+            {'config': [{'name': 'service', 'reserved': 10, 'headers': {'X-Priority': 'service'}}],
+             'help': 'a class should not match headers set by the client'},
+        ]
+        for stim in stimuli:
+            self.assertRaises(errors.ConfigError, PriorityMatcher, stim['config'])
+
+
+if __name__ == '__main__':
+    unittest.main()
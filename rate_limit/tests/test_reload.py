@@ -0,0 +1,103 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rate_limit import errors
+from rate_limit import reload
+from rate_limit.reload import ConfigWatcher
+
+WORKDIR = os.path.dirname(os.path.realpath(__file__))
+SWIFTCONFIGPATH = WORKDIR + '/fixtures/swift.yaml'
+
+
+class TestReload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.config_file = os.path.join(self.tmpdir, 'config.yaml')
+
+    def write_config(self, content):
+        with open(self.config_file, 'w') as f:
+            f.write(content)
+
+    def test_load_and_validate_config(self):
+        config = reload.load_and_validate_config(SWIFTCONFIGPATH)
+        self.assertIn('rates', config, "the example configuration should be valid")
+
+        stimuli = [
+            {'content': 'rates: [', 'help': 'invalid yaml should be rejected'},
+            {'content': '- a\n- b\n', 'help': 'the configuration should be a mapping'},
+            {'content': 'rates:\n  global: []\n', 'help': 'the rates should be a mapping'},
+            {'content': 'rates:\n  global:\n    servers:\n      - limit: 1r/m\n', 'help': 'a rule needs an action'},
+            {'content': 'rates:\n  global:\n    servers:\n      - action: read\n        limit: xr/m\n',
+             'help': 'invalid limits should be rejected'},
+            {'content': 'rates:\n  global:\n    servers:\n      - action: read\n        limit: [1r/s, 1r/]\n',
+             'help': 'every window should be validated'},
+            {'content': 'rates:\n  default:\n    servers:\n      - action: read\n        scopes:\n          user: xr/m\n',
+             'help': 'invalid limits of scope levels should be rejected'},
+            {'content': 'rates:\n  default:\n    servers:\n      - action: read\n        scopes:\n          group: 1r/m\n',
+             'help': 'unknown scope levels should be rejected'},
+            {'content': 'rates:\n  default:\n    servers:\n      - action: read\n        scopes: [1r/m]\n',
+             'help': 'scopes should be a mapping'},
+            {'content': 'rates:\n  default:\n    servers:\n      - action: read\n        cost: {query: limit, per: 0}\n',
+             'help': 'invalid cost expressions should be rejected'},
+            {'content': 'rates:\n  default:\n    servers:\n      - action: read\n        cost: {path: true}\n',
+             'help': 'unknown cost expressions should be rejected'},
+            {'content': 'rates:\n  global:\n    servers:\n      - action: read\n        concurrency: many\n',
+             'help': 'invalid concurrency limits should be rejected'},
+            {'content': 'rates:\n  projects:\n    abc:\n      servers:\n        - action: read\n          concurrency: 0\n',
+             'help': 'concurrency limits of overrides should be validated'},
+            {'content': 'priorities:\n  - name: operator\n    reserved: lots\n',
+             'help': 'invalid priority classes should be rejected'},
+            {'content': 'priorities:\n  - name: operator\n    reserved: 10\n    users: admin\n',
+             'help': 'the users of a priority class should be a list'},
+        ]
+        for stim in stimuli:
+            self.write_config(stim['content'])
+            self.assertRaises(errors.ConfigError, reload.load_and_validate_config, self.config_file)
+
+        self.assertRaises(errors.ConfigError, reload.load_and_validate_config, os.path.join(self.tmpdir, 'missing'))
+
+    def test_valid_rules(self):
+        self.write_config(
+            'rates:\n  default:\n    servers:\n      - action: read\n        limit: 10r/m\n        concurrency: 5\n'
+            '        cost: {header: X-Count, per: 10, max: 100}\n        scopes:\n          domain: 100r/m\n'
+            '          user: 5r/m\n      - action: update\n        concurrency: -1\n'
+            'priorities:\n  - name: operator\n    reserved: 20\n    users: [Default/admin]\n'
+        )
+        config = reload.load_and_validate_config(self.config_file)
+        self.assertEqual(len(config['rates']['default']['servers']), 2, "the valid rules should be accepted")
+
+    def test_config_watcher(self):
+        self.write_config('rates: {}\n')
+        changes = []
+        watcher = ConfigWatcher(self.config_file, lambda: changes.append(True))
+
+        self.assertFalse(watcher.check(), "the unchanged file should not be reloaded")
+        self.write_config('rates:\n  global: {}\n')
+        self.assertTrue(watcher.check(), "the changed file should be reloaded")
+        self.assertFalse(watcher.check(), "the file should be reloaded once")
+        self.assertEqual(len(changes), 1)
+
+        os.remove(self.config_file)
+        self.assertFalse(watcher.check(), "a missing file should not be reloaded")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from rate_limit import errors
+from rate_limit.backend import SharedMemoryBackend
+from rate_limit.response import RateLimitExceededResponse
+from rate_limit.shm import SharedCounterTable
+
+
+def _count_admitted(path, n, queue):
+    table = SharedCounterTable(path, slots=64, stripes=4)
+    admitted = 0
+    for _ in range(n):
+        remaining, _ = table.rate_limit('key', 60, 100, 0, time.time())
+        if remaining > 0:
+            admitted += 1
+    queue.put(admitted)
+
+
+class TestSharedMemoryBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'ratelimit')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_rate_limit(self):
+        backend = SharedMemoryBackend(
+            rate_limit_response=RateLimitExceededResponse(),
+            max_sleep_time_seconds=0,
+            log_sleep_time_seconds=0,
+            path=self.path,
+            slots=64,
+            stripes=4,
+        )
+
+        self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '2r/m'))
+        self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', '2r/m'))
+        result = backend.rate_limit('project', 'update', 'account/container', '2r/m')
+        self.assertIsInstance(result, RateLimitExceededResponse)
+        self.assertEqual(result.headers.get('X-RateLimit-Limit'), '2r/m')
+
+        # Other scopes and the global scope are counted separately.
+        self.assertIsNone(backend.rate_limit('other', 'update', 'account/container', '2r/m'))
+        self.assertIsNone(backend.rate_limit(None, 'update', 'account/container', '2r/m'))
+
+    def test_multiple_windows(self):
+        backend = SharedMemoryBackend(
+            rate_limit_response=RateLimitExceededResponse(),
+            max_sleep_time_seconds=0,
+            log_sleep_time_seconds=0,
+            path=self.path,
+            slots=64,
+            stripes=4,
+        )
+
+        for _ in range(3):
+            self.assertIsNone(backend.rate_limit('project', 'update', 'account/container', ['5r/m', '3r/h']))
+        result = backend.rate_limit('project', 'update', 'account/container', ['5r/m', '3r/h'])
+        self.assertIsInstance(result, RateLimitExceededResponse)
+        self.assertEqual(result.headers.get('X-RateLimit-Limit'), '3r/h', "the tightest window should be reported")
+
+    def test_shared_across_processes(self):
+        SharedCounterTable(self.path, slots=64, stripes=4)
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_count_admitted, args=(self.path, 50, queue)) for _ in range(4)]
+        for w in workers:
+            w.start()
+        admitted = sum(queue.get(timeout=10) for _ in workers)
+        for w in workers:
+            w.join()
+
+        self.assertEqual(admitted, 100, "exactly the limit should be admitted across all processes")
+
+    def test_full_stripe_fails_open(self):
+        table = SharedCounterTable(self.path, slots=4, stripes=4)
+        now = time.time()
+        results = [table.rate_limit('key_{0}'.format(i), 60, 1, 0, now) for i in range(20)]
+        self.assertTrue(all(remaining > 0 for remaining, _ in results))
+
+    def test_different_dimensions(self):
+        SharedCounterTable(self.path, slots=64, stripes=4)
+        self.assertRaises(errors.ConfigError, SharedCounterTable, self.path, 128, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
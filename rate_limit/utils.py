@@ -51,3 +51,23 @@ def parse_info(response):
                 # if the line isn't splittable, append it to the "__raw__" key
                 info.setdefault('__raw__', []).append(line)
     return info
+
+
+def parse_version(version):
+    """
+    Parse a version string like '5.0.7' into a comparable tuple of integers.
+
+    :param version: the version string
+    :return: tuple of at least 3 integers, e.g. (5, 0, 7). Non-numeric parts are 0
+    """
+    parts = []
+    for part in str(version).split('.'):
+        digits = ''
+        for char in part:
+            if not char.isdigit():
+                break
+            digits += char
+        parts.append(int(digits or 0))
+    while len(parts) < 3:
+        parts.append(0)
+    return tuple(parts)
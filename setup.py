@@ -18,6 +18,13 @@ setuptools.setup(
     setup_requires=['pbr'],
     pbr=True,
     data_files=[
-        ('lua', ['rate_limit/lua/redis_sliding_window.lua'])
+        ('lua', [
+            'rate_limit/lua/redis_sliding_window.lua',
+            'rate_limit/lua/redis_sliding_window_server_time.lua',
+            'rate_limit/lua/redis_sliding_window_multi.lua',
+            'rate_limit/lua/redis_token_bucket.lua',
+            'rate_limit/lua/redis_concurrency.lua',
+            'rate_limit/lua/redis_adaptive_limit.lua',
+        ])
     ]
 )
@@ -0,0 +1,321 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Microbenchmarks of the decision path of the middleware.
+
+Each benchmark is calibrated to run for at least --min-time seconds per round. The best of --rounds is reported
+as operations per second. The memory allocated per operation is measured separately via tracemalloc as the
+peak of the traced memory while running a single operation, so that it doesn't distort the timings.
+The backend is an in-process backend admitting every request and metrics are disabled, so that only the
+middleware itself is measured.
+
+Results are compared against a baseline. Baselines depend on the machine, so record one before changing the code:
+    python tools/benchmark.py --save-baseline tools/benchmark_baseline.json
+    python tools/benchmark.py --baseline tools/benchmark_baseline.json --max-regression 20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rate_limit import backend  # noqa: E402
+from rate_limit import provider  # noqa: E402
+from rate_limit import response  # noqa: E402
+from rate_limit.rate_limit import OpenStackRateLimitMiddleware  # noqa: E402
+from rate_limit.units import Units  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SWIFTCONFIGPATH = os.path.join(ROOT, 'rate_limit', 'tests', 'fixtures', 'swift.yaml')
+DEFAULT_BASELINE = os.path.join(ROOT, 'tools', 'benchmark_baseline.json')
+
+
+class App(object):
+    """The wrapped app returning an empty response."""
+
+    def __call__(self, environ, start_response):
+        start_response('204 No Content', [])
+        return [b'']
+
+
+class AdmitBackend(backend.Backend):
+    """In-process backend admitting every request."""
+
+    def __init__(self, rate_limit_response):
+        super(AdmitBackend, self).__init__(host=None, port=None, rate_limit_response=rate_limit_response)
+
+
+class RejectBackend(backend.Backend):
+    """In-process backend rejecting every request with the configured response."""
+
+    def __init__(self, rate_limit_response):
+        super(RejectBackend, self).__init__(host=None, port=None, rate_limit_response=rate_limit_response)
+
+    def rate_limit_levels(self, levels, action, target_type_uri, cost=1):
+        self._rate_limit_response.set_headers(ratelimit=levels[-1][2], remaining=0, retry_after=30)
+        return self._rate_limit_response
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def new_environ(project_id='benchmarkproject', action='update', target_type_uri='account/container/object'):
+    return {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/v1/AUTH_{0}/container/object'.format(project_id),
+        'WATCHER.ACTION': action,
+        'WATCHER.TARGET_TYPE_URI': target_type_uri,
+        'WATCHER.INITIATOR_PROJECT_ID': project_id,
+        'WATCHER.INITIATOR_PROJECT_NAME': 'project',
+        'WATCHER.INITIATOR_DOMAIN_NAME': 'domain',
+        'WATCHER.INITIATOR_USER_NAME': 'user',
+    }
+
+
+def huge_config(target_type_uris=5000, projects=100000, list_entries=10000, groups=50):
+    """Generate a configuration with many rules, overrides, list entries and groups."""
+    rules = [{'action': 'read', 'limit': '100r/m'}, {'action': 'update', 'limit': '10r/m'}]
+    default = dict(('service/resource{0}'.format(idx), rules) for idx in range(target_type_uris))
+    default['account/container/*'] = rules
+    return {
+        'whitelist': ['whitelisted{0}'.format(idx) for idx in range(list_entries)],
+        'blacklist': ['blacklisted{0}'.format(idx) for idx in range(list_entries)],
+        'whitelist_users': ['user{0}'.format(idx) for idx in range(list_entries)],
+        'groups': dict(
+            ('group{0}'.format(idx), ['action{0}/*'.format(idx), 'other{0}'.format(idx)]) for idx in range(groups)
+        ),
+        'rates': {
+            'global': {'account/container/object': rules},
+            'default': default,
+            'projects': dict(
+                ('project{0}'.format(idx), {'account/container/object': rules[:1]}) for idx in range(projects)
+            ),
+        },
+    }
+
+
+def new_middleware(config_file, backend_class=AdmitBackend):
+    middleware = OpenStackRateLimitMiddleware(app=App(), config_file=config_file, metrics_enabled='false')
+    middleware.backend = backend_class(middleware.ratelimit_response)
+    return middleware
+
+
+def new_provider(config):
+    ratelimit_provider = provider.ConfigurationRateLimitProvider(service_type='object-store')
+    ratelimit_provider.load_rate_limits(config)
+    return ratelimit_provider
+
+
+def call(middleware, environ):
+    """Send a request through the middleware and consume the response like a WSGI server."""
+    def benchmark():
+        app_iter = middleware(dict(environ), start_response)
+        for _ in app_iter:
+            pass
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return benchmark
+
+
+def render(rate_limit_response):
+    environ = new_environ()
+
+    def benchmark():
+        rate_limit_response.set_headers(ratelimit='10r/m', remaining=0, retry_after=30, scope_level='project')
+        for _ in rate_limit_response(dict(environ), start_response):
+            pass
+    return benchmark
+
+
+def build_benchmarks(tmpdir):
+    """
+    Build the benchmarks.
+
+    :param tmpdir: directory for generated configuration files
+    :return: list of tuples (name, callable)
+    """
+    config = huge_config()
+    huge_config_file = os.path.join(tmpdir, 'huge.yaml')
+    with open(huge_config_file, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    small = new_middleware(SWIFTCONFIGPATH)
+    huge = new_middleware(huge_config_file)
+    rejecting = new_middleware(SWIFTCONFIGPATH, backend_class=RejectBackend)
+    with open(SWIFTCONFIGPATH, 'r') as f:
+        small_provider = new_provider(yaml.safe_load(f))
+    huge_provider = new_provider(config)
+
+    return [
+        ('middleware_call_admitted', call(small, new_environ())),
+        ('middleware_call_rejected', call(rejecting, new_environ())),
+        ('middleware_call_whitelisted', call(small, new_environ(project_id='1233456789abcdef'))),
+        ('middleware_call_unclassified', call(small, new_environ(action='unknown'))),
+        ('middleware_call_huge_config', call(huge, new_environ(project_id='project42', action='read'))),
+        ('provider_local_small', lambda: small_provider.get_local_rate_limits(
+            'project', 'update', 'account/container')),
+        ('provider_local_small_wildcard', lambda: small_provider.get_local_rate_limits(
+            'project', 'read', 'account/container/object')),
+        ('provider_global_small', lambda: small_provider.get_global_rate_limits('update', 'account/container')),
+        ('provider_local_huge', lambda: huge_provider.get_local_rate_limits(
+            'project', 'read', 'service/resource4999')),
+        ('provider_local_huge_wildcard', lambda: huge_provider.get_local_rate_limits(
+            'project', 'read', 'account/container/object')),
+        ('provider_local_huge_override', lambda: huge_provider.get_local_rate_limits(
+            'project99999', 'read', 'account/container/object')),
+        ('units_parse', lambda: Units.parse('30m')),
+        ('units_parse_sliding_window_rate_limit', lambda: Units.parse_sliding_window_rate_limit('100r/30m')),
+        ('lists_scope_small', lambda: small.is_scope_whitelisted('project') or small.is_scope_blacklisted('project')),
+        ('lists_scope_huge', lambda: huge.is_scope_whitelisted('project') or huge.is_scope_blacklisted('project')),
+        ('lists_user_huge', lambda: huge.is_user_whitelisted('User9999') or huge.is_user_blacklisted('user')),
+        ('groups_small', lambda: small.get_action_from_rate_limit_groups('update')),
+        ('groups_huge', lambda: huge.get_action_from_rate_limit_groups('action49/foo')),
+        ('response_render_ratelimit', render(response.RateLimitExceededResponse())),
+        ('response_render_configured', render(small.ratelimit_response)),
+    ]
+
+
+def measure_ops_per_sec(func, min_time_seconds, rounds):
+    """
+    Get the number of operations per second. The best round is reported as it's the least disturbed.
+
+    :param func: the benchmark
+    :param min_time_seconds: the min. duration of a round
+    :param rounds: the number of rounds
+    :return: the operations per second
+    """
+    # Calibrate the number of operations per round.
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        duration = time.perf_counter() - start
+        if duration >= min_time_seconds / 10.0:
+            break
+        iterations *= 10
+    iterations = max(1, int(iterations * min_time_seconds / max(duration, 1e-9)))
+
+    best = 0.0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        best = max(best, iterations / (time.perf_counter() - start))
+    return best
+
+
+def measure_allocated_bytes(func, operations=20):
+    """
+    Get the memory allocated by an operation.
+
+    :param func: the benchmark
+    :param operations: the number of operations to average
+    :return: the average peak of the memory traced while running an operation in bytes
+    """
+    # Warm up caches, so that only the memory allocated per operation is traced.
+    func()
+    total = 0
+    for _ in range(operations):
+        # Tracing is restarted per operation, which resets the peak.
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        total += peak
+    return total // operations
+
+
+def compare(results, baseline, max_regression_percent):
+    """
+    Print the results and the change against the baseline.
+
+    :param results: dictionary of benchmark name and result
+    :param baseline: dictionary of benchmark name and result of the baseline
+    :param max_regression_percent: the max. accepted decrease of operations per second
+    :return: list of names of benchmarks that regressed
+    """
+    regressed = []
+    print("{0:<40}{1:>14}{2:>10}{3:>14}{4:>10}".format('benchmark', 'ops/sec', 'change', 'alloc bytes', 'change'))
+    for name, result in results.items():
+        ops_change = alloc_change = ''
+        base = baseline.get(name, None)
+        if base:
+            ops_percent = (result['ops_per_sec'] / base['ops_per_sec'] - 1) * 100
+            ops_change = '{0:+.1f}%'.format(ops_percent)
+            alloc_change = '{0:+d}'.format(result['allocated_bytes'] - base['allocated_bytes'])
+            if -ops_percent > max_regression_percent:
+                regressed.append(name)
+        print("{0:<40}{1:>14,.0f}{2:>10}{3:>14,d}{4:>10}".format(
+            name, result['ops_per_sec'], ops_change, result['allocated_bytes'], alloc_change
+        ))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', default='', help='only run benchmarks containing this string')
+    parser.add_argument('--min-time', type=float, default=0.2, help='min. duration of a round in seconds')
+    parser.add_argument('--rounds', type=int, default=5, help='number of rounds per benchmark')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='the baseline to compare against')
+    parser.add_argument('--save-baseline', default=None, help='save the results as baseline to this file')
+    parser.add_argument('--max-regression', type=float, default=None,
+                        help='fail if the ops/sec of a benchmark decreased by more than this percentage')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        benchmarks = build_benchmarks(tmpdir)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    results = {}
+    for name, func in benchmarks:
+        if args.filter not in name:
+            continue
+        results[name] = {
+            'ops_per_sec': round(measure_ops_per_sec(func, args.min_time, args.rounds), 1),
+            'allocated_bytes': measure_allocated_bytes(func),
+        }
+
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f).get('benchmarks', {})
+    regressed = compare(results, baseline, args.max_regression if args.max_regression is not None else 100)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'benchmarks': results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if regressed and args.max_regression is not None:
+        print("regressed by more than {0}%: {1}".format(args.max_regression, ', '.join(regressed)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
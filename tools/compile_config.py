@@ -0,0 +1,62 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Validate a rate limit configuration file and compile it into an artifact the middleware memory-maps at startup.
+
+Black- and whitelists are compiled into sorted string tables looked up in place. Everything else is stored as JSON.
+Point the `config_file` of the middleware to the artifact. The artifact is replaced atomically.
+
+Usage:
+    python tools/compile_config.py etc/swift.yaml --output /etc/rate-limit/swift.rlc
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rate_limit import compiled  # noqa: E402
+from rate_limit import errors  # noqa: E402
+from rate_limit import priority  # noqa: E402
+from rate_limit import reload  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('config', help='rate limit configuration file')
+    parser.add_argument('--output', help='path of the artifact. defaults to the configuration file with suffix .rlc')
+    args = parser.parse_args()
+    output = args.output or os.path.splitext(args.config)[0] + '.rlc'
+
+    start = time.time()
+    try:
+        config = reload.load_and_validate_config(args.config)
+        if config.get('priorities', None):
+            priority.PriorityMatcher(config.get('priorities'))
+    except errors.ConfigError as e:
+        parser.exit(1, "invalid configuration: {0}\n".format(str(e)))
+    parse_seconds = time.time() - start
+
+    size = compiled.compile_config(config, output)
+    start = time.time()
+    compiled.load(output)
+    print("compiled {0} to {1} ({2} bytes)".format(args.config, output, size))
+    print("parsing yaml: {0:.3f}s, loading the artifact: {1:.3f}s".format(parse_seconds, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Report the time it takes to import the package using `python -X importtime`.
+
+The import runs in fresh interpreters. The median of the runs is reported per module.
+Optional dependencies, e.g. keystoneclient for Limes or datadog for metrics, must not be imported with the package.
+
+Usage:
+    python tools/import_time_report.py --runs 5 --top 15
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Dependencies imported on demand, only if the feature is configured.
+OPTIONAL_MODULES = ['keystoneclient', 'keystoneauth1', 'requests', 'datadog', 'oslo_log', 'oslo_config']
+
+
+def import_times(module):
+    """
+    Import the module in a fresh interpreter.
+
+    :param module: the name of the module
+    :return: dictionary of imported module and cumulative import time in microseconds
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)],
+        stderr=subprocess.STDOUT, cwd=ROOT
+    ).decode('utf-8')
+    result = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split(':', 1)[1].split('|')
+        result[name.strip()] = int(cumulative)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='rate_limit', help='the module to import')
+    parser.add_argument('--runs', type=int, default=5, help='number of imports')
+    parser.add_argument('--top', type=int, default=15, help='number of modules to report')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(max(1, args.runs))]
+    medians = {}
+    for name in runs[0]:
+        values = sorted(run.get(name, 0) for run in runs)
+        medians[name] = values[len(values) // 2]
+
+    print("{0:<50}{1:>15}".format('module', 'cumulative (ms)'))
+    for name, cumulative in sorted(medians.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print("{0:<50}{1:>15.1f}".format(name, cumulative / 1000.0))
+
+    imported = [name for name in OPTIONAL_MODULES if name in medians]
+    if imported:
+        print("optional dependencies imported with {0}: {1}".format(args.module, ', '.join(imported)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+Report the redis memory saved by compact keys and members on a sample dataset.
+
+The sample consists of a number of random project IDs, each with a counter per rule.
+Rules are read from a rate limit configuration file or default to a small set of swift rules.
+The memory is estimated from the redis data structures: dict entries, key objects, expiry entries
+and listpack encoded sorted sets, rounded to jemalloc size classes.
+
+Usage:
+    python tools/key_memory_report.py --projects 200000 --members 10 [--config etc/swift.yaml]
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rate_limit import common  # noqa: E402
+
+# Sizes of the redis structures per key on 64 bit systems:
+# dict entry of the keyspace, value object, dict entry of the expires dict.
+KEY_OVERHEAD_BYTES = 24 + 16 + 24
+# Header of the sds string holding the key name including the terminating null byte.
+SDS_HEADER_BYTES = 4
+# Listpack header and end byte.
+LISTPACK_HEADER_BYTES = 7
+# Integer scores of a listpack are stored using up to 9 bytes plus the back length.
+LISTPACK_SCORE_BYTES = 10
+
+DEFAULT_RULES = [
+    ('create', 'account/container'),
+    ('update', 'account/container'),
+    ('delete', 'account/container'),
+    ('read/list', 'account/container'),
+    ('create', 'account/container/object'),
+    ('read', 'account/container/object'),
+    ('update', 'account/container/object'),
+    ('delete', 'account/container/object'),
+]
+
+
+def jemalloc_size(size):
+    """Round the size of an allocation up to the jemalloc size class."""
+    if size <= 8:
+        return 8
+    if size <= 128:
+        return (size + 15) // 16 * 16
+    # Four size classes per doubling above 128 bytes.
+    step = 1 << (size - 1).bit_length() - 3
+    return (size + step - 1) // step * step
+
+
+def listpack_string_bytes(value):
+    """Bytes of a string entry in a listpack: encoding, data, back length."""
+    length = len(value)
+    encoding = 1 if length < 64 else 2
+    return encoding + length + (1 if encoding + length < 128 else 2)
+
+
+def estimate_key_bytes(key, members):
+    """Estimate the memory used by a sorted set stored as listpack with the given members."""
+    listpack = LISTPACK_HEADER_BYTES + sum(listpack_string_bytes(m) + LISTPACK_SCORE_BYTES for m in members)
+    return KEY_OVERHEAD_BYTES + jemalloc_size(SDS_HEADER_BYTES + len(key)) + jemalloc_size(listpack)
+
+
+def load_rules(config_path):
+    """Load the tuples of action and target type URI from a rate limit configuration file."""
+    config = common.load_config(config_path)
+    rules = []
+    for level in ('global', 'default'):
+        for target_type_uri, rate_limits in config.get('rates', {}).get(level, {}).items():
+            for rl in rate_limits:
+                rules.append((rl.get('action'), target_type_uri))
+    return rules
+
+
+def sample_members(count, compact):
+    """Members as written by the rate limit script using nanosecond accuracy."""
+    now = int(time.time() * 1e9)
+    if compact:
+        return [common.base62_encode(now + i) for i in range(count)]
+    # Redis formats the timestamps passed as numbers using %.17g.
+    return ['{0:.17g}'.format(float(now + i)) for i in range(count)]
+
+
+def report(projects, members, rules):
+    scopes = [uuid.uuid4().hex for _ in range(projects)]
+    result = {}
+    for name, key_func, compact in (
+            ('default', common.key_func, False),
+            ('compact', common.compact_key_func, True)):
+        member_list = sample_members(members, compact)
+        key_bytes = total = 0
+        for scope in scopes:
+            for action, target_type_uri in rules:
+                key = key_func(scope, action, target_type_uri)
+                key_bytes += len(key)
+                total += estimate_key_bytes(key, member_list)
+        result[name] = (key_bytes, total)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=10000, help='number of projects in the sample')
+    parser.add_argument('--members', type=int, default=10, help='number of counted requests per key')
+    parser.add_argument('--config', help='rate limit configuration file to read the rules from')
+    args = parser.parse_args()
+
+    rules = load_rules(args.config) if args.config else DEFAULT_RULES
+    if not rules:
+        parser.error("no rules found in {0}".format(args.config))
+    result = report(args.projects, args.members, rules)
+
+    keys = args.projects * len(rules)
+    print("sample: {0} projects x {1} rules = {2} keys with {3} members each".format(
+        args.projects, len(rules), keys, args.members))
+    print("{0:<10}{1:>20}{2:>20}".format('scheme', 'key names (MiB)', 'estimated (MiB)'))
+    for name in ('default', 'compact'):
+        key_bytes, total = result[name]
+        print("{0:<10}{1:>20.1f}{2:>20.1f}".format(name, key_bytes / 2.0 ** 20, total / 2.0 ** 20))
+    saved = result['default'][1] - result['compact'][1]
+    print("saved: {0:.1f} MiB ({1:.0%})".format(saved / 2.0 ** 20, saved / float(result['default'][1])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,494 @@
+# Copyright 2019 SAP SE
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+End-to-end load test of the middleware running in multiple WSGI worker processes.
+
+Starts --workers eventlet WSGI processes sharing a listening socket, each running the middleware in front of a
+fake app, and drives them from --clients processes with --concurrency connections each. Requests are classified
+via headers, which a stand-in for the openstack-watcher-middleware maps to the WATCHER.* attributes.
+Scopes follow a Zipf distribution and the arrival rate can burst periodically.
+Redis is the pure-Python stand-in unless --redis-host is given.
+
+Reported:
+  - throughput and the share of rejected requests
+  - latency added by the middleware (p50/p99/p999), excluding the time spent in the app
+  - redis commands per request
+  - accuracy of the rejections versus the configured local limits:
+    admitted requests exceeding a limit and requests rejected although the limit was not reached
+
+Usage:
+    python tools/load_test.py --workers 4 --clients 2 --concurrency 50 --duration 10 --rate 2000
+    python tools/load_test.py --redis-host 127.0.0.1 --option backend_batch_enabled=true --burst-factor 5
+"""
+
+import argparse
+import bisect
+import collections
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rate_limit import provider  # noqa: E402
+from rate_limit import utils  # noqa: E402
+from rate_limit.units import Units  # noqa: E402
+
+# Local rate limits used unless a configuration is given.
+DEFAULT_CONFIG = {
+    'rates': {
+        'default': {
+            'account/container': [
+                {'action': 'create', 'limit': '2r/s'},
+                {'action': 'read/list', 'limit': '10r/s'},
+            ],
+            'account/container/object': [
+                {'action': 'read', 'limit': ['20r/s', '600r/m']},
+                {'action': 'update', 'limit': '5r/s'},
+            ],
+        },
+    },
+}
+
+# Weighted mix of requests as tuples of (action, target type URI, weight).
+DEFAULT_MIX = [
+    ('read', 'account/container/object', 6),
+    ('update', 'account/container/object', 2),
+    ('read/list', 'account/container', 1),
+    ('create', 'account/container', 1),
+]
+
+# Header carrying the time the middleware added to the request.
+HEADER_ADDED_LATENCY = 'X-Load-Added-Latency-Us'
+# Header carrying the time the middleware admitted or rejected the request.
+HEADER_DECIDED_AT = 'X-Load-Decided-At'
+
+
+class FakeApp(object):
+    """The wrapped app. Responds after the configured latency."""
+
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+
+    def __call__(self, environ, start_response):
+        import eventlet
+        start = time.time()
+        # The middleware admitted the request.
+        environ['loadtest.decided_at'] = start
+        if self.latency_seconds > 0:
+            eventlet.sleep(self.latency_seconds)
+        environ['loadtest.app_seconds'] = time.time() - start
+        start_response('200 OK', [('Content-Length', '0')])
+        return [b'']
+
+
+class Classifier(object):
+    """
+    Stand-in for the openstack-watcher-middleware in front of the middleware.
+    Maps the headers of the load generator to the WATCHER.* attributes and reports the time added by the middleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        start = time.time()
+        environ['WATCHER.INITIATOR_PROJECT_ID'] = environ.get('HTTP_X_LOAD_SCOPE')
+        environ['WATCHER.ACTION'] = environ.get('HTTP_X_LOAD_ACTION')
+        environ['WATCHER.TARGET_TYPE_URI'] = environ.get('HTTP_X_LOAD_TARGET_TYPE_URI')
+
+        def timed_start_response(status, headers, exc_info=None):
+            now = time.time()
+            added_seconds = now - start - environ.get('loadtest.app_seconds', 0.0)
+            headers = list(headers) + [
+                (HEADER_ADDED_LATENCY, str(int(added_seconds * 1e6))),
+                (HEADER_DECIDED_AT, repr(environ.get('loadtest.decided_at', now))),
+            ]
+            return start_response(status, headers, exc_info)
+
+        return self.app(environ, timed_start_response)
+
+
+def run_worker(sock, conf, app_latency_seconds):
+    """Serve the middleware on the shared socket. Runs in a forked process."""
+    # Keep stdout for the report.
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    import eventlet
+    eventlet.monkey_patch()
+    from eventlet import wsgi
+    from rate_limit.rate_limit import OpenStackRateLimitMiddleware
+
+    middleware = OpenStackRateLimitMiddleware(app=FakeApp(app_latency_seconds), **conf)
+    wsgi.server(sock, Classifier(middleware), log_output=False, max_size=10000)
+
+
+class ZipfSampler(object):
+    """Samples ranks 0..n-1 with a probability proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, n, s, rnd):
+        self.__rnd = rnd
+        self.__cumulative = []
+        total = 0.0
+        for rank in range(max(1, n)):
+            total += 1.0 / (rank + 1) ** s
+            self.__cumulative.append(total)
+
+    def sample(self):
+        return bisect.bisect_left(self.__cumulative, self.__rnd.random() * self.__cumulative[-1])
+
+
+def rate_multiplier(elapsed_seconds, burst_every_seconds, burst_seconds, burst_factor):
+    """Multiplier of the arrival rate. The rate is multiplied by the burst factor for burst_seconds periodically."""
+    if burst_every_seconds <= 0 or burst_factor <= 1:
+        return 1.0
+    if elapsed_seconds % burst_every_seconds < burst_seconds:
+        return burst_factor
+    return 1.0
+
+
+def run_client(client_id, args, mix, start_at, results):
+    """Drive the workers with the configured mix and report the results. Runs in a forked process."""
+    # Not monkey patched, so that the results can be passed back via the queue.
+    import eventlet
+    from eventlet.green.http import client as http_client
+
+    rnd = random.Random(args.seed + client_id)
+    scopes = ZipfSampler(args.scopes, args.zipf, rnd)
+    cumulative_weights, total = [], 0
+    for _, _, weight in mix:
+        total += weight
+        cumulative_weights.append(total)
+
+    # Each connection paces its requests to its share of the rate. 0 means as fast as possible.
+    connections = args.clients * args.concurrency
+    interval_seconds = float(connections) / args.rate if args.rate > 0 else 0.0
+    stop_at = start_at + args.duration
+    records = []
+
+    def drive():
+        conn = http_client.HTTPConnection('127.0.0.1', args.port, timeout=args.timeout)
+        next_at = start_at + rnd.random() * interval_seconds
+        while True:
+            now = time.time()
+            if now >= stop_at:
+                break
+            if next_at > now:
+                eventlet.sleep(next_at - now)
+            next_at += interval_seconds / rate_multiplier(
+                next_at - start_at, args.burst_every, args.burst_seconds, args.burst_factor
+            )
+
+            scope = 'project{0}'.format(scopes.sample())
+            action, target_type_uri, _ = mix[bisect.bisect_left(cumulative_weights, rnd.random() * total + 1e-9)]
+            sent_at = time.time()
+            try:
+                conn.request('GET', '/', headers={
+                    'X-Load-Scope': scope,
+                    'X-Load-Action': action,
+                    'X-Load-Target-Type-Uri': target_type_uri,
+                })
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+                added_us = int(resp.getheader(HEADER_ADDED_LATENCY, '0'))
+                limit = resp.getheader('X-RateLimit-Limit', '')
+                decided_at = float(resp.getheader(HEADER_DECIDED_AT, '0'))
+            except Exception:
+                conn.close()
+                conn = http_client.HTTPConnection('127.0.0.1', args.port, timeout=args.timeout)
+                status, added_us, limit, decided_at = 0, 0, '', 0
+            latency = time.time() - sent_at
+            records.append((decided_at, scope, action, target_type_uri, status, latency, added_us, limit))
+        conn.close()
+
+    wait = start_at - time.time()
+    if wait > 0:
+        eventlet.sleep(wait)
+    pool = eventlet.GreenPool(args.concurrency)
+    for _ in range(args.concurrency):
+        pool.spawn_n(drive)
+    pool.waitall()
+    results.put(records)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def redis_commands_processed(host, port):
+    """Get the number of commands processed by redis or None if unavailable."""
+    import pyredis
+    try:
+        client = pyredis.Client(host=host, port=port)
+        try:
+            return utils.parse_info(client.execute('INFO')).get('total_commands_processed', None)
+        finally:
+            client.close()
+    except Exception:
+        return None
+
+
+def check_accuracy(records, ratelimit_provider, tolerance_seconds):
+    """
+    Check the rejections against the configured local limits.
+
+    Requests are ordered by the time the middleware decided on them.
+    An admitted request exceeds a limit if more requests than allowed were admitted within the window before it.
+    A rejected request is wrongly rejected if all limits of its key had capacity left within the window.
+    Only rejections reporting one of the local limits of the key are checked, so that rejections by other limits,
+    e.g. global ones, are not counted.
+
+    :param records: the records of the requests
+    :param ratelimit_provider: the provider holding the configured rate limits
+    :param tolerance_seconds: requests decided within this time are considered concurrent. The middleware counts
+        a request at the time it calls the backend, which precedes the decision by the latency of the backend
+    :return: tuple of checked admissions, admissions exceeding a limit, checked rejections, wrong rejections
+    """
+    by_key = collections.defaultdict(lambda: ([], []))
+    for decided_at, scope, action, target_type_uri, status, _, _, limit in records:
+        admitted, rejected = by_key[(scope, action, target_type_uri)]
+        if status == 200:
+            admitted.append(decided_at)
+        elif status:
+            rejected.append((decided_at, limit))
+
+    checked_admitted = over_admitted = checked_rejected = wrongly_rejected = 0
+    for (scope, action, target_type_uri), (admitted, rejected) in by_key.items():
+        limit = ratelimit_provider.get_local_rate_limits(scope, action, target_type_uri)
+        if limit in (None, -1, '-1'):
+            continue
+        rate_strings = [str(rl) for rl in (limit if isinstance(limit, list) else [limit])]
+        limits = [Units.parse_sliding_window_rate_limit(rl) for rl in rate_strings]
+        admitted.sort()
+
+        def count_between(start, end):
+            return bisect.bisect_right(admitted, end) - bisect.bisect_right(admitted, start)
+
+        checked_admitted += len(admitted)
+        for decided_at in admitted:
+            for max_calls, window_seconds in limits:
+                if count_between(decided_at - window_seconds + tolerance_seconds, decided_at) > max_calls:
+                    over_admitted += 1
+                    break
+
+        for decided_at, rejected_limit in rejected:
+            if rejected_limit not in rate_strings:
+                continue
+            checked_rejected += 1
+            has_capacity = all(
+                count_between(decided_at - window_seconds - tolerance_seconds,
+                              decided_at + tolerance_seconds) < max_calls
+                for max_calls, window_seconds in limits
+            )
+            if has_capacity:
+                wrongly_rejected += 1
+    return checked_admitted, over_admitted, checked_rejected, wrongly_rejected
+
+
+def report(records, duration_seconds, redis_commands, ratelimit_provider, tolerance_seconds):
+    """
+    Summarize the records.
+
+    :return: the report as dictionary
+    """
+    total = len(records)
+    statuses = collections.Counter(r[4] for r in records)
+    added_ms = sorted(r[6] / 1000.0 for r in records if r[4])
+    total_ms = sorted(r[5] * 1000.0 for r in records if r[4])
+    checked_admitted, over_admitted, checked_rejected, wrongly_rejected = check_accuracy(
+        records, ratelimit_provider, tolerance_seconds
+    )
+    return {
+        'requests': total,
+        'throughput_per_second': round(total / duration_seconds, 1),
+        'statuses': dict((str(k), v) for k, v in sorted(statuses.items())),
+        'rejected_percent': round(100.0 * sum(v for k, v in statuses.items() if k and k != 200) / max(1, total), 2),
+        'errors': statuses.get(0, 0),
+        'added_latency_ms': {
+            'p50': round(percentile(added_ms, 0.5), 3),
+            'p99': round(percentile(added_ms, 0.99), 3),
+            'p999': round(percentile(added_ms, 0.999), 3),
+        },
+        'total_latency_ms': {
+            'p50': round(percentile(total_ms, 0.5), 3),
+            'p99': round(percentile(total_ms, 0.99), 3),
+            'p999': round(percentile(total_ms, 0.999), 3),
+        },
+        'redis_commands_per_request': round(redis_commands / float(max(1, total)), 2)
+        if redis_commands is not None else None,
+        'accuracy': {
+            'admitted_checked': checked_admitted,
+            'admitted_exceeding_limit': over_admitted,
+            'rejected_checked': checked_rejected,
+            'rejected_below_limit': wrongly_rejected,
+        },
+    }
+
+
+def parse_mix(values):
+    if not values:
+        return DEFAULT_MIX
+    mix = []
+    for value in values:
+        action, target_type_uri, weight = value.rsplit(':', 2)
+        mix.append((action, target_type_uri, float(weight)))
+    return mix
+
+
+def parse_options(values):
+    options = {}
+    for value in values or []:
+        key, option = value.split('=', 1)
+        options[key] = option
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='number of WSGI worker processes')
+    parser.add_argument('--clients', type=int, default=2, help='number of load generating processes')
+    parser.add_argument('--concurrency', type=int, default=50, help='number of connections per client')
+    parser.add_argument('--duration', type=float, default=10, help='duration of the test in seconds')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second across all clients. 0: unpaced')
+    parser.add_argument('--burst-every', type=float, default=0, help='seconds between two bursts. 0: no bursts')
+    parser.add_argument('--burst-seconds', type=float, default=1, help='duration of a burst in seconds')
+    parser.add_argument('--burst-factor', type=float, default=1, help='multiplier of the rate during a burst')
+    parser.add_argument('--scopes', type=int, default=1000, help='number of scopes, e.g. projects')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the Zipf distribution of the scopes')
+    parser.add_argument('--mix', action='append', help='weighted request, e.g. read:account/container/object:6')
+    parser.add_argument('--config', default=None, help='the rate limit configuration. defaults to local limits')
+    parser.add_argument('--option', action='append', help='WSGI option of the middleware, e.g. backend_batch_enabled=true')
+    parser.add_argument('--max-sleep-seconds', type=int, default=0, help='max. time requests are suspended')
+    parser.add_argument('--app-latency-ms', type=float, default=0, help='latency of the wrapped app')
+    parser.add_argument('--redis-host', default=None, help='host of redis. defaults to the pure-Python stand-in')
+    parser.add_argument('--redis-port', type=int, default=6379, help='port of redis')
+    parser.add_argument('--redis-latency-ms', type=float, default=0, help='latency added by the stand-in')
+    parser.add_argument('--port', type=int, default=0, help='port of the workers. 0 picks a free port')
+    parser.add_argument('--timeout', type=float, default=30, help='timeout of a request in seconds')
+    parser.add_argument('--seed', type=int, default=42, help='seed of the random request mix')
+    parser.add_argument('--accuracy-tolerance-ms', type=float, default=50,
+                        help='requests decided within this time are considered concurrent when checking the accuracy')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    import eventlet
+
+    tmpdir = tempfile.mkdtemp()
+    fake_redis = None
+    processes = []
+    try:
+        config_file = args.config
+        if not config_file:
+            config_file = os.path.join(tmpdir, 'ratelimit.yaml')
+            with open(config_file, 'w') as f:
+                yaml.safe_dump(DEFAULT_CONFIG, f)
+        with open(config_file, 'r') as f:
+            ratelimit_provider = provider.ConfigurationRateLimitProvider(service_type='object-store')
+            ratelimit_provider.load_rate_limits(yaml.safe_load(f) or {})
+
+        redis_host, redis_port = args.redis_host, args.redis_port
+        if not redis_host:
+            from rate_limit.tests.fake_redis import FakeRedisServer
+            fake_redis = FakeRedisServer().start()
+            fake_redis.latency_seconds = args.redis_latency_ms / 1000.0
+            redis_host, redis_port = fake_redis.host, fake_redis.port
+
+        conf = {
+            'config_file': config_file,
+            'backend_host': redis_host,
+            'backend_port': redis_port,
+            'max_sleep_time_seconds': args.max_sleep_seconds,
+            'metrics_enabled': 'false',
+        }
+        conf.update(parse_options(args.option))
+
+        sock = eventlet.listen(('127.0.0.1', args.port), backlog=4096)
+        args.port = sock.getsockname()[1]
+        # Fork explicitly. The workers inherit the listening socket.
+        ctx = multiprocessing.get_context('fork')
+        for _ in range(args.workers):
+            process = ctx.Process(target=run_worker, args=(sock, conf, args.app_latency_ms / 1000.0))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        commands_before = redis_commands_processed(redis_host, redis_port)
+        results = ctx.Queue()
+        mix = parse_mix(args.mix)
+        # Give the workers time to start before the clock of the test starts.
+        start_at = time.time() + 2
+        clients = []
+        for client_id in range(args.clients):
+            process = ctx.Process(target=run_client, args=(client_id, args, mix, start_at, results))
+            process.daemon = True
+            process.start()
+            clients.append(process)
+        processes.extend(clients)
+
+        records = []
+        for _ in clients:
+            records.extend(results.get(timeout=args.duration + args.timeout + 30))
+        commands_after = redis_commands_processed(redis_host, redis_port)
+        redis_commands = None
+        if commands_before is not None and commands_after is not None:
+            # Excluding the INFO command of this harness.
+            redis_commands = commands_after - commands_before - 1
+
+        result = report(
+            records, args.duration, redis_commands, ratelimit_provider, args.accuracy_tolerance_ms / 1000.0
+        )
+        if args.json:
+            print(json.dumps(result, indent=2, sort_keys=True))
+        else:
+            print_report(args, result)
+    finally:
+        for process in processes:
+            process.terminate()
+        if fake_redis:
+            fake_redis.stop()
+        shutil.rmtree(tmpdir)
+
+
+def print_report(args, result):
+    accuracy = result['accuracy']
+    print("workers: {0}, clients: {1} x {2} connections, duration: {3}s".format(
+        args.workers, args.clients, args.concurrency, args.duration
+    ))
+    print("requests:                   {0} ({1} req/s)".format(result['requests'], result['throughput_per_second']))
+    print("statuses:                   {0}".format(result['statuses']))
+    print("rejected:                   {0}%".format(result['rejected_percent']))
+    for name in ('added_latency_ms', 'total_latency_ms'):
+        latency = result[name]
+        print("{0:<28}p50 {1}, p99 {2}, p999 {3}".format(
+            name.replace('_ms', ' (ms)').replace('_', ' ') + ':', latency['p50'], latency['p99'], latency['p999']
+        ))
+    print("redis commands per request: {0}".format(result['redis_commands_per_request']))
+    print("admitted exceeding limit:   {0} of {1}".format(
+        accuracy['admitted_exceeding_limit'], accuracy['admitted_checked']
+    ))
+    print("rejected below limit:       {0} of {1}".format(accuracy['rejected_below_limit'], accuracy['rejected_checked']))
+
+
+if __name__ == '__main__':
+    main()